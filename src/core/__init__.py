@@ -14,9 +14,28 @@ import lib3d_mec_ginac_ext as _cython_ext
 
 # Module imports
 from .system import System, get_default_system, set_default_system
-from .integration import NumericIntegration
+from .integration import NumericIntegration, Integrator, RungeKutta4, DormandPrince
+from .integration import ImplicitIntegrator, BDF2, GeneralizedAlpha, AdamsBashforthMoulton
 from ..config import runtime_config
 from .assembly import AssemblyProblemSolver
+from .dynamics import DynamicProblemSolver
+from .kinematics import KinematicProblemSolver
+from .engine import SimulationEngine, Trajectory, run_simulation
+from .recorder import Recorder
+from .crossings import ZeroCrossing
+from .storage import TrajectoryWriter, TrajectoryReader
+from .sweep import ParameterSweep, parameter_grid, parameter_samples
+from .ensemble import Ensemble, BatchedNumericFunction
+from .inverse_dynamics import InverseDynamicsSolver
+from .linearization import Linearizer, linearize, linearize_trajectory
+from .equilibrium import EquilibriumSolver, solve_equilibrium
+from .worker import SimulationWorker
+from .scheduler import RealTimeScheduler
+from .checkpoint import Checkpointer, latest_checkpoint
+from .schedules import InputSchedules
+from .cosimulation import CoSimulationServer, CoSimulationClient
+from .asynchronous import AsyncSimulation
+from .monitor import SimulationMonitor
 
 try:
     from ..drawing.scene import Scene
@@ -73,7 +92,18 @@ __all__.extend(['e', 'E'])
 # Add classes & functions from core submodule
 __all__.extend([
     'System', 'get_default_system', 'set_default_system',
-    'NumericIntegration', 'AssemblyProblemSolver'
+    'NumericIntegration', 'Integrator', 'RungeKutta4', 'DormandPrince',
+    'ImplicitIntegrator', 'BDF2', 'GeneralizedAlpha', 'AdamsBashforthMoulton',
+    'AssemblyProblemSolver', 'DynamicProblemSolver', 'KinematicProblemSolver',
+    'SimulationEngine', 'Trajectory', 'run_simulation', 'Recorder', 'ZeroCrossing',
+    'TrajectoryWriter', 'TrajectoryReader',
+    'ParameterSweep', 'parameter_grid', 'parameter_samples',
+    'Ensemble', 'BatchedNumericFunction', 'InverseDynamicsSolver',
+    'Linearizer', 'linearize', 'linearize_trajectory',
+    'EquilibriumSolver', 'solve_equilibrium', 'SimulationWorker',
+    'RealTimeScheduler', 'Checkpointer', 'latest_checkpoint', 'InputSchedules',
+    'CoSimulationServer', 'CoSimulationClient', 'AsyncSimulation',
+    'SimulationMonitor'
 ])
 
 
@@ -93,7 +123,7 @@ for name in System.__dict__:
         [r'\w+_point_branch', r'rotation_\w+', r'position_\w+', r'angular_\w+',
         r'velocity_\w+', r'acceleration_\w+', 'twist', 'derivative', 'dt', 'jacobian',
         'diff', 'to_symbol', 'unatomize', r'\w+_wrench', r'export_\w+', r'compile_\w+',
-        'save_state', 'restore_previous_state', 'evaluate']
+        'save_state', 'restore_previous_state', 'evaluate', r'simulate_\w+']
     )):
         continue
 
@@ -116,6 +146,9 @@ if _gui_installed:
             name not in (
                 'start_simulation', 'stop_simulation',
                 'resume_simulation', 'pause_simulation', 'purge_drawings', 'record_simulation',
+                'play_trajectory', 'seek_playback', 'stop_playback', 'resume_playback', 'pause_playback',
+                'start_background_simulation', 'stop_background_simulation',
+                'resume_background_simulation', 'pause_background_simulation',
                 'toogle_drawings', 'show_grid', 'hide_grid',
                 'show_simulation_display_info', 'hide_simulation_display_info'
                 ):
@@ -134,7 +167,7 @@ if _gui_installed:
 
     for name in Simulation.__dict__:
         if not any(map(lambda pattern: fullmatch(pattern, name),
-            [r'\w*integration\w*', 'assembly_problem']
+            [r'\w*integration\w*', 'assembly_problem', 'dynamics', 'kinematics']
         )):
             continue
 
@@ -0,0 +1,145 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the class AsyncSimulation
+'''
+
+######## Import statements ########
+
+import asyncio
+
+
+
+######## class AsyncSimulation ########
+
+class AsyncSimulation:
+    '''
+    This class runs a simulation in an executor (a thread pool) so that it can be used from
+    asyncio code (notebooks, dashboards, local services) without blocking the event loop.
+
+    The simulation is performed in chunks of samples (see ``SimulationEngine.stream``). Each chunk
+    is computed in the executor while the event loop keeps running other tasks, and the control
+    returns to the event loop between chunks. Instances are created with ``SimulationEngine.stream_async``
+    or ``System.simulate_async`` and can be used in two ways:
+
+    - As an async iterator over the chunks. The same Trajectory instance is returned on each
+      iteration and overwritten with the next chunk (the next chunk is not computed until
+      it is requested, so the samples can be read safely):
+
+        >>> async for samples in system.simulate_async(3600, 0.001, chunk=4096):
+        ...     plot.update(samples.time, samples.q)
+
+    - Awaiting it runs the simulation until the end and returns the last chunk:
+
+        >>> samples = await system.simulate_async(10, 0.01)
+
+    The simulation is stopped when the task awaiting it is cancelled (or ``aclose`` is called). A chunk
+    which is being computed cannot be interrupted: the cancellation waits for it to finish, so that the
+    numeric values of the system are not modified afterwards.
+    '''
+    def __init__(self, iterator, executor=None):
+        '''
+        Constructor.
+
+        :param iterator: An iterator over the chunks of the simulation (see ``SimulationEngine.stream``)
+        :param executor: The executor where the chunks are computed. It must be a thread pool
+            executor. If not specified, the default executor of the event loop is used
+        '''
+        self._iterator = iterator
+        self._executor = executor
+        self._pending = None
+        self._num_chunks = 0
+        self._finished, self._cancelled = False, False
+
+
+
+    ######## Getters ########
+
+    def get_num_chunks(self):
+        '''get_num_chunks() -> int
+        Get the number of chunks computed so far
+        '''
+        return self._num_chunks
+
+
+    def is_finished(self):
+        '''is_finished() -> bool
+        Returns True if the simulation reached its final time or a terminal event, or it was cancelled
+        '''
+        return self._finished
+
+
+    def is_cancelled(self):
+        '''is_cancelled() -> bool
+        Returns True if the simulation was cancelled before it finished
+        '''
+        return self._cancelled
+
+
+
+    ######## Async iteration ########
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self):
+        if self._finished:
+            raise StopAsyncIteration
+        if self._pending is not None:
+            raise RuntimeError('The next chunk of the simulation is already being computed')
+
+        loop = asyncio.get_running_loop()
+        future = self._pending = loop.run_in_executor(self._executor, next, self._iterator, None)
+        try:
+            chunk = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Wait until the chunk is completed before stopping the simulation
+            await asyncio.wait([future])
+            self._pending = None
+            self._stop(cancelled=True)
+            raise
+        except:
+            self._pending = None
+            self._stop()
+            raise
+        self._pending = None
+
+        if chunk is None:
+            self._stop()
+            raise StopAsyncIteration
+        self._num_chunks += 1
+        return chunk
+
+
+
+    async def aclose(self):
+        '''aclose()
+        Stop the simulation (if a chunk is being computed, it waits until it is completed)
+        '''
+        if self._pending is not None:
+            await asyncio.wait([self._pending])
+        if not self._finished:
+            self._stop(cancelled=True)
+
+
+
+    def __await__(self):
+        return self._run().__await__()
+
+
+
+    ######## Helpers ########
+
+    async def _run(self):
+        # Compute all the chunks. Returns the last one
+        chunk = None
+        async for chunk in self:
+            pass
+        return chunk
+
+
+    def _stop(self, cancelled=False):
+        self._finished, self._cancelled = True, cancelled
+        close = getattr(self._iterator, 'close', None)
+        if close is not None:
+            close()
@@ -0,0 +1,303 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the functions save_checkpoint, load_checkpoint and
+latest_checkpoint and the class Checkpointer
+'''
+
+######## Import statements ########
+
+import json
+import os
+from os.path import join, exists
+from glob import glob
+from math import floor
+import numpy as np
+
+from .integration import Integrator
+from .storage import TrajectoryWriter, _write_atomically
+from .crossings import ZeroCrossing
+
+
+
+######## Constants ########
+
+_FORMAT_NAME = 'lib3d_mec_ginac.checkpoint'
+_FORMAT_VERSION = 1
+_FILENAME_PATTERN = 'checkpoint-{:06d}.npz'
+
+
+
+
+######## Helper functions ########
+
+def _encode(value, key, arrays):
+    # Converts a value of the history of an integrator to a JSON object (the arrays are
+    # stored separately with the given key)
+    if isinstance(value, np.ndarray):
+        arrays[key] = value
+        return {'array': key}
+    if isinstance(value, (tuple, list)):
+        return {type(value).__name__: [_encode(item, f'{key}/{i}', arrays) for i, item in enumerate(value)]}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _decode(value, arrays):
+    # Inverse of _encode
+    if isinstance(value, dict):
+        if 'array' in value:
+            return arrays[value['array']].copy()
+        if 'tuple' in value:
+            return tuple(_decode(item, arrays) for item in value['tuple'])
+        return [_decode(item, arrays) for item in value['list']]
+    return value
+
+
+
+
+
+######## Functions ########
+
+def save_checkpoint(engine, filename):
+    '''save_checkpoint(engine: SimulationEngine, filename: str)
+    Store the state of a simulation in a checkpoint file (a .npz file written atomically):
+
+    - The numeric values of all the symbols of the system and the time
+    - The history of the integrator (previous steps, step size estimations, internal buffers, ...)
+    - The samples and positions of the recorders attached to the engine (the trajectory writers are flushed
+      and the checkpoint waits until their files contain all the samples recorded until the checkpoint)
+    - The zero crossings of the event functions detected so far
+
+    The simulation can be resumed exactly at the same point with ``load_checkpoint``, in the same
+    process or in another one (the model must be defined again in the same way).
+
+    .. note::
+        The assembly problem solver doesnt keep information between steps: its iterations are warm
+        started from the numeric values of the coordinates & velocities, which are already stored
+    '''
+    system = engine.get_system()
+    arrays = {}
+    metadata = {
+        'format': _FORMAT_NAME,
+        'version': _FORMAT_VERSION,
+        'time': system._time_value,
+        'symbols': {},
+        'integrator': None,
+        'recorders': [],
+        'events': [[event.get_name(), event.get_time(), event.get_direction(), event.is_terminal()]
+            for event in engine.get_events()]
+    }
+
+    # Numeric values of the symbols
+    for kind, values in system._symbols_values.items():
+        metadata['symbols'][kind] = list(values.keys())
+        arrays[f'values/{kind}'] = values.as_array()
+
+    # History of the integrator
+    method = engine.get_integration_method()
+    if isinstance(method, Integrator):
+        history = dict((name, _encode(value, f'integrator/{name}', arrays)) for name, value in method.get_history().items())
+        metadata['integrator'] = {'class': method.__class__.__name__, 'history': history}
+
+    # Recorders
+    for k, recorder in enumerate(engine.get_recorders()):
+        entry = {
+            'class': recorder.__class__.__name__,
+            'num_records': recorder._num_records, 'num_calls': recorder._num_calls,
+            'last_time': recorder._last_time
+        }
+        if isinstance(recorder, TrajectoryWriter):
+            recorder._sync()
+        else:
+            arrays[f'recorders/{k}/time'] = recorder._time
+            arrays[f'recorders/{k}/values'] = recorder._values
+        metadata['recorders'].append(entry)
+
+    arrays['metadata'] = np.frombuffer(json.dumps(metadata).encode(), dtype=np.uint8)
+    _write_atomically(filename, lambda file: np.savez(file, **arrays))
+
+
+
+def load_checkpoint(engine, filename):
+    '''load_checkpoint(engine: SimulationEngine, filename: str) -> float
+    Restore the state of a simulation stored with ``save_checkpoint`` (the numeric values of the
+    symbols, the time, the history of the integrator, the recorders and the events detected).
+    The symbols are matched by their names, so the checkpoint can be loaded in a system created again
+    (e.g. in another process) to resume a simulation or fork it into different branches.
+
+    If the integration method is not the same as when the checkpoint was saved, the history of the
+    integrator is discarded instead (the integration restarts from the state restored).
+
+    The samples stored by the trajectory writers after the checkpoint are discarded (also from their
+    files), so the trajectory continues from the checkpoint. To resume recording in another process,
+    create the writer with ``append=True`` on the same directory.
+
+    :returns: The time of the checkpoint
+    :raises ValueError: If the file is not a checkpoint or its coordinates or recorders dont match
+        the ones of the simulation, or a trajectory writer has less samples than the checkpoint
+    '''
+    with np.load(filename) as data:
+        arrays = dict((key, data[key]) for key in data.files)
+    if 'metadata' not in arrays:
+        raise ValueError(f'"{filename}" is not a checkpoint file')
+    metadata = json.loads(arrays.pop('metadata').tobytes().decode())
+    if metadata.get('format') != _FORMAT_NAME:
+        raise ValueError(f'"{filename}" is not a checkpoint file')
+
+    system = engine.get_system()
+    symbols_values = system._symbols_values
+    if set(metadata['symbols'].get('coordinate', [])) != set(symbols_values['coordinate'].keys()):
+        raise ValueError('The coordinates of the checkpoint dont match the coordinates of the system')
+    recorders = engine.get_recorders()
+    if [entry['class'] for entry in metadata['recorders']] != [recorder.__class__.__name__ for recorder in recorders]:
+        raise ValueError('The recorders of the checkpoint dont match the recorders attached to the engine')
+    for k, recorder in enumerate(recorders):
+        key = f'recorders/{k}/values'
+        if key in arrays and arrays[key].shape != recorder._values.shape:
+            raise ValueError('The probes or capacity of the recorders dont match the ones of the checkpoint')
+
+    # Numeric values of the symbols (matched by name)
+    for kind, names in metadata['symbols'].items():
+        if kind not in symbols_values:
+            continue
+        values, saved = symbols_values[kind], arrays[f'values/{kind}']
+        array = values.as_array()
+        for i, name in enumerate(names):
+            if name in values:
+                array[values.index(name)] = saved[i]
+    system._time_value = metadata['time']
+
+    # Integrator
+    engine.reset()
+    method, entry = engine.get_integration_method(), metadata['integrator']
+    if isinstance(method, Integrator) and entry is not None and entry['class'] == method.__class__.__name__:
+        method.set_history(dict((name, _decode(value, arrays)) for name, value in entry['history'].items()))
+
+    # Recorders
+    for k, (recorder, entry) in enumerate(zip(recorders, metadata['recorders'])):
+        recorder._num_calls, recorder._last_time = entry['num_calls'], entry['last_time']
+        if isinstance(recorder, TrajectoryWriter):
+            recorder._truncate(entry['num_records'])
+            continue
+        recorder._num_records = entry['num_records']
+        recorder._time[:] = arrays[f'recorders/{k}/time']
+        recorder._values[:] = arrays[f'recorders/{k}/values']
+
+    # Events
+    crossings = engine._crossings
+    crossings.clear_events()
+    crossings._events.extend(ZeroCrossing(*event) for event in metadata['events'])
+    return metadata['time']
+
+
+
+def latest_checkpoint(path):
+    '''latest_checkpoint(path: str) -> str | None
+    Get the filename of the last checkpoint stored in the given directory by a ``Checkpointer``
+    (None if there are no checkpoints)
+    '''
+    filenames = sorted(glob(join(path, _FILENAME_PATTERN.replace('{:06d}', '[0-9]' * 6))))
+    return filenames[-1] if filenames else None
+
+
+
+
+
+######## class Checkpointer ########
+
+class Checkpointer:
+    '''
+    This class saves checkpoints of a simulation periodically (see ``save_checkpoint``). It is used by
+    ``SimulationEngine.enable_checkpoints``: the checkpoints are saved every ``interval`` units of
+    simulated time, before recording the samples of the step (the simulation is resumed with ``run`` or
+    ``stream``, which record the initial state again).
+
+    The checkpoints are stored in a directory as numbered files and only the last ``keep``
+    are preserved. Use ``latest_checkpoint`` to find the last one after a crash.
+    '''
+    def __init__(self, engine, path, interval, keep=2):
+        '''
+        Constructor.
+
+        :param engine: The simulation engine
+        :param path: The directory where the checkpoints are stored (created if it doesnt exist)
+        :param interval: The amount of simulated time between two checkpoints
+        :param keep: The number of checkpoints preserved (the older ones are removed)
+        '''
+        if not isinstance(path, str):
+            raise TypeError('path must be a string')
+        try:
+            interval = float(interval)
+            if interval <= 0:
+                raise TypeError
+        except (TypeError, ValueError):
+            raise TypeError('interval must be a number greater than zero')
+        if not isinstance(keep, int) or keep <= 0:
+            raise TypeError('keep must be an integer greater than zero')
+        os.makedirs(path, exist_ok=True)
+
+        self._engine, self._path = engine, path
+        self._interval, self._keep = interval, keep
+        self._next_time = None
+        last = latest_checkpoint(path)
+        self._index = int(last[-10:-4]) + 1 if last is not None else 0
+        self._filenames = sorted(glob(join(path, _FILENAME_PATTERN.replace('{:06d}', '[0-9]' * 6))))
+
+
+
+    ######## Getters ########
+
+    def get_path(self):
+        '''get_path() -> str
+        Get the directory where the checkpoints are stored
+        '''
+        return self._path
+
+
+    def get_interval(self):
+        '''get_interval() -> float
+        Get the amount of simulated time between two checkpoints
+        '''
+        return self._interval
+
+
+    def get_filenames(self):
+        '''get_filenames() -> List[str]
+        Get the filenames of the checkpoints preserved (from the oldest to the newest)
+        '''
+        return list(self._filenames)
+
+
+
+    ######## Checkpoints ########
+
+    def save(self):
+        '''save() -> str
+        Save a new checkpoint now (the oldest ones are removed). Returns its filename
+        '''
+        filename = join(self._path, _FILENAME_PATTERN.format(self._index))
+        save_checkpoint(self._engine, filename)
+        self._index += 1
+        self._filenames.append(filename)
+        while len(self._filenames) > self._keep:
+            old_filename = self._filenames.pop(0)
+            if exists(old_filename):
+                os.remove(old_filename)
+        return filename
+
+
+
+    def update(self):
+        '''update()
+        Save a new checkpoint if the simulated time reached the time of the next one
+        '''
+        t = self._engine.get_system()._time_value
+        interval = self._interval
+        if self._next_time is None or t < self._next_time - interval:
+            # First update (or the time went backwards)
+            self._next_time = (floor(t / interval + 1e-9) + 1) * interval
+            return
+        if t >= self._next_time - 1e-9 * max(1.0, abs(t)):
+            self.save()
+            self._next_time = (floor(t / interval + 1e-9) + 1) * interval
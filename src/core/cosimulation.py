@@ -0,0 +1,434 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the classes CoSimulationServer and CoSimulationClient
+'''
+
+######## Import statements ########
+
+from collections.abc import Mapping
+from time import perf_counter, sleep
+import numpy as np
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+    from multiprocessing import resource_tracker
+except ImportError:
+    # Python < 3.8
+    SharedMemory, resource_tracker = None, None
+
+from .recorder import _fuse_probes
+
+
+
+######## Constants ########
+
+# Layout of the shared memory block: a header with 8 integers (the number of inputs and outputs,
+# the request & reply counters, the command and the status of the last step) followed by
+# the time, the step size, the time reached by the last step, the inputs and the outputs (floats)
+_HEADER_SIZE = 8
+_NUM_INPUTS, _NUM_OUTPUTS, _REQUEST, _REPLY, _COMMAND, _STATUS = range(0, 6)
+_STEP, _STOP = 1, 2
+_RUNNING, _TERMINATED, _FAILED, _INVALID = 0, 1, 2, 3
+
+
+
+######## Helper functions ########
+
+def _map_block(block):
+    # Returns the numpy views of the header and the floats of a shared memory block
+    header = np.ndarray(_HEADER_SIZE, dtype=np.int64, buffer=block.buf)
+    num_items = 3 + int(header[_NUM_INPUTS]) + int(header[_NUM_OUTPUTS])
+    data = np.ndarray(num_items, dtype=np.float64, buffer=block.buf, offset=_HEADER_SIZE * 8)
+    return header, data
+
+
+def _attach_block(name):
+    # Attach to an existing shared memory block without registering it in the resource tracker
+    # (until Python 3.13, the tracker unlinks all the blocks registered when the process exits,
+    # even if they were created by another process)
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _wait_reply(header, request, timeout):
+    # Wait until the request with the given number is replied (busy waiting, yielding the cpu)
+    deadline = perf_counter() + timeout if timeout is not None else None
+    while header[_REPLY] != request:
+        if deadline is not None and perf_counter() > deadline:
+            raise RuntimeError('The co-simulation server didnt reply')
+        sleep(0)
+
+
+
+
+
+
+######## class CoSimulationServer ########
+
+class CoSimulationServer:
+    '''
+    This class exposes a simulation engine as a co-simulation slave which can be stepped by external
+    programs (e.g. controllers running in other processes) with ``do_step(t, dt)``, like a
+    FMI co-simulation unit.
+
+    The inputs (numeric values of input symbols) and the outputs (symbolic expressions compiled
+    together in a single numeric function) are exchanged through a shared memory block: the
+    client writes the inputs and the communication point directly in the block and reads the outputs
+    from it with numpy views (nothing is pickled or copied between processes). The requests are
+    signaled with counters stored in the same block.
+
+        :Example:
+
+        >>> server = CoSimulationServer(engine, ['torque'], {'angle': q1, 'speed': dq1})
+        >>> server.get_name()
+        'psm_1a2b3c4d'
+        >>> server.serve()
+
+        In the controller process:
+
+        >>> client = CoSimulationClient('psm_1a2b3c4d')
+        >>> inputs, outputs = client.get_inputs(), client.get_outputs()
+        >>> t = 0.0
+        >>> while t < 10:
+        ...     inputs[0] = -kp * outputs[0] - kd * outputs[1]
+        ...     client.do_step(t, 0.001)
+        ...     t += 0.001
+        >>> client.stop()
+
+    .. note::
+        The value of an input driven by the server is overwritten on each step. Inputs driven by a
+        schedule (see ``SimulationEngine.add_input_schedule``) cant be used
+    '''
+    def __init__(self, engine, inputs=(), outputs=None, name=None):
+        '''
+        Constructor.
+
+        :param engine: The simulation engine stepped by the server
+        :param inputs: The names of the input symbols whose values are set by the client
+        :param outputs: A mapping of names and symbolic expressions, matrices or vectors whose values
+            are sent to the client after each step
+        :param name: The name of the shared memory block. If not specified, a unique name is generated
+        :raises RuntimeError: If shared memory is not available
+        :raises IndexError: If there is no input symbol with some of the given names
+        '''
+        if SharedMemory is None:
+            raise RuntimeError('Shared memory is not available (Python 3.8 or greater is required)')
+        if outputs is None:
+            outputs = {}
+        if not isinstance(outputs, Mapping):
+            raise TypeError('outputs must be a mapping of names and symbolic expressions or matrices')
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        inputs = list(inputs)
+        if not all(isinstance(name, str) for name in inputs):
+            raise TypeError('inputs must be a list of names of input symbols')
+
+        system = engine.get_system()
+        values = system._symbols_values['input']
+        for input_name in inputs:
+            if input_name not in values:
+                raise IndexError(f'There is no input symbol called "{input_name}"')
+            if input_name in engine.get_input_schedules_names():
+                raise ValueError(f'The input "{input_name}" is driven by a schedule')
+        self._rows = np.array([values.index(input_name) for input_name in inputs], dtype=np.int64)
+
+        func, slices = _fuse_probes(system, list(outputs.values()))
+        self._outputs_func = func
+        num_outputs = slices[-1].stop if slices else 0
+
+        self._engine, self._system = engine, system
+        self._num_steps = 0
+        self._inputs_names, self._outputs_names = inputs, list(outputs.keys())
+        self._outputs_slices = dict(zip(self._outputs_names, slices))
+
+        size = (_HEADER_SIZE + 3 + len(inputs) + num_outputs) * 8
+        self._block = SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray(_HEADER_SIZE, dtype=np.int64, buffer=self._block.buf)
+        header[:] = 0
+        header[_NUM_INPUTS], header[_NUM_OUTPUTS] = len(inputs), num_outputs
+        self._header, self._data = _map_block(self._block)
+        self._data[:] = 0
+        self._inputs = self._data[3:3 + len(inputs)]
+        self._outputs = self._data[3 + len(inputs):]
+
+        # Initial values
+        self._inputs[:] = values.as_array()[self._rows, 0]
+        self._data[2] = system._time_value
+        self._evaluate_outputs()
+
+
+
+    ######## Getters ########
+
+    def get_name(self):
+        '''get_name() -> str
+        Get the name of the shared memory block (it must be passed to the clients)
+        '''
+        return self._block.name
+
+
+    def get_engine(self):
+        '''get_engine() -> SimulationEngine
+        Get the simulation engine stepped by this server
+        '''
+        return self._engine
+
+
+    def get_inputs_names(self):
+        '''get_inputs_names() -> List[str]
+        Get the names of the inputs (in the same order as in the inputs vector)
+        '''
+        return list(self._inputs_names)
+
+
+    def get_outputs_names(self):
+        '''get_outputs_names() -> List[str]
+        Get the names of the outputs
+        '''
+        return list(self._outputs_names)
+
+
+    def get_outputs_slices(self):
+        '''get_outputs_slices() -> Dict[str, slice]
+        Get the slice of the outputs vector where the values of each output are stored
+        '''
+        return dict(self._outputs_slices)
+
+
+    def get_inputs(self):
+        '''get_inputs() -> np.ndarray
+        Get the inputs vector (a view of the shared memory block)
+        '''
+        return self._inputs
+
+
+    def get_outputs(self):
+        '''get_outputs() -> np.ndarray
+        Get the outputs vector (a view of the shared memory block)
+        '''
+        return self._outputs
+
+
+    def get_num_steps(self):
+        '''get_num_steps() -> int
+        Get the number of steps performed so far
+        '''
+        return self._num_steps
+
+
+
+    ######## Stepping ########
+
+    def do_step(self, t, dt):
+        '''do_step(t: float, dt: float) -> bool
+        Advance the simulation from the communication point t to t + dt with the current
+        inputs, and update the outputs (this is what the server does when a client requests a step)
+
+        :returns: False if a terminal event stopped the simulation. True otherwise
+        :raises ValueError: If t is not the current time of the simulation or dt is not greater than zero
+        '''
+        self._check_step(t, dt)
+        return self._step(dt)
+
+
+
+    def serve(self, timeout=None):
+        '''serve([timeout: float])
+        Process the steps requested by the clients until a client calls ``stop`` or a terminal
+        event stops the simulation.
+
+        The invalid requests (a communication point which doesnt match the time of the simulation
+        or a step size not greater than zero) are rejected and reported to the client, and the server
+        keeps serving. If the engine raises an exception, it is reported to the client and raised again
+
+        :param timeout: If specified, the server also stops if no request arrives during
+            this amount of seconds
+        '''
+        header, data = self._header, self._data
+        last_request = perf_counter()
+        while True:
+            request = header[_REQUEST]
+            if request == header[_REPLY]:
+                if timeout is not None and perf_counter() - last_request > timeout:
+                    return
+                sleep(0)
+                continue
+            last_request = perf_counter()
+            if header[_COMMAND] == _STOP:
+                header[_REPLY] = request
+                return
+            t, dt = float(data[0]), float(data[1])
+            try:
+                self._check_step(t, dt)
+            except ValueError:
+                header[_STATUS] = _INVALID
+                header[_REPLY] = request
+                continue
+            try:
+                running = self._step(dt)
+            except:
+                header[_STATUS] = _FAILED
+                header[_REPLY] = request
+                raise
+            header[_STATUS] = _RUNNING if running else _TERMINATED
+            header[_REPLY] = request
+            if not running:
+                return
+
+
+
+    def close(self):
+        '''close()
+        Release the shared memory block (the clients must be closed first)
+        '''
+        if self._block is not None:
+            self._header = self._data = self._inputs = self._outputs = None
+            self._block.close()
+            self._block.unlink()
+            self._block = None
+
+
+
+    ######## Helpers ########
+
+    def _check_step(self, t, dt):
+        # Raises ValueError if a step cant be performed from the communication point t
+        system = self._system
+        if abs(t - system._time_value) > 1e-9 * max(1.0, abs(t)):
+            raise ValueError(f'The communication point {t} doesnt match the time of the simulation ({system._time_value})')
+        if not dt > 0:
+            raise ValueError('The step size must be greater than zero')
+
+
+    def _step(self, dt):
+        # Advance the simulation with the current inputs and update the outputs
+        system = self._system
+        system._symbols_values['input'].as_array()[self._rows, 0] = self._inputs
+        engine = self._engine
+        running = engine.advance(system._time_value, dt)
+        engine.record()
+        self._num_steps += 1
+        self._data[2] = system._time_value
+        self._evaluate_outputs()
+        return running
+
+
+    def _evaluate_outputs(self):
+        func = self._outputs_func
+        if func is not None:
+            self._outputs[:] = func.evaluate()[:, 0]
+
+
+
+
+
+
+######## class CoSimulationClient ########
+
+class CoSimulationClient:
+    '''
+    This class steps a co-simulation server running in another thread or process
+    (see ``CoSimulationServer``). The inputs and outputs vectors are numpy views of the shared
+    memory block of the server: write the inputs and read the outputs in place.
+    '''
+    def __init__(self, name, timeout=None):
+        '''
+        Constructor.
+
+        :param name: The name of the shared memory block of the server
+        :param timeout: The maximum amount of seconds to wait for the reply of each request
+            (by default, there is no limit)
+        :raises RuntimeError: If shared memory is not available
+        '''
+        if SharedMemory is None:
+            raise RuntimeError('Shared memory is not available (Python 3.8 or greater is required)')
+        if not isinstance(name, str):
+            raise TypeError('name must be a string')
+        self._block = _attach_block(name)
+        self._timeout = timeout
+        self._header, self._data = _map_block(self._block)
+        num_inputs = int(self._header[_NUM_INPUTS])
+        self._inputs = self._data[3:3 + num_inputs]
+        self._outputs = self._data[3 + num_inputs:]
+
+
+
+    ######## Getters ########
+
+    def get_inputs(self):
+        '''get_inputs() -> np.ndarray
+        Get the inputs vector (the values are sent to the server on the next step)
+        '''
+        return self._inputs
+
+
+    def get_outputs(self):
+        '''get_outputs() -> np.ndarray
+        Get the outputs vector (updated after each step)
+        '''
+        return self._outputs
+
+
+    def get_time(self):
+        '''get_time() -> float
+        Get the time of the simulation reached by the last step
+        '''
+        return float(self._data[2])
+
+
+
+    ######## Stepping ########
+
+    def do_step(self, t, dt):
+        '''do_step(t: float, dt: float) -> bool
+        Request the server to advance the simulation from the communication point t to t + dt
+        with the current inputs, and wait until the outputs are updated
+
+        :returns: False if a terminal event stopped the simulation. True otherwise
+        :raises ValueError: If the server rejected the step (t is not the time of the simulation or dt is
+            not greater than zero). The server keeps serving
+        :raises RuntimeError: If the step failed in the server or it didnt reply in time
+        '''
+        header, data = self._header, self._data
+        data[0], data[1] = t, dt
+        header[_COMMAND] = _STEP
+        request = header[_REQUEST] + 1
+        header[_REQUEST] = request
+        _wait_reply(header, request, self._timeout)
+        status = header[_STATUS]
+        if status == _FAILED:
+            raise RuntimeError('The co-simulation step failed in the server')
+        if status == _INVALID:
+            raise ValueError(f'The server rejected the step from {t} with size {dt} (the time of the simulation is {self.get_time()})')
+        return status == _RUNNING
+
+
+
+    def stop(self):
+        '''stop()
+        Request the server to stop serving
+        '''
+        header = self._header
+        header[_COMMAND] = _STOP
+        request = header[_REQUEST] + 1
+        header[_REQUEST] = request
+        _wait_reply(header, request, self._timeout)
+
+
+
+    def close(self):
+        '''close()
+        Detach from the shared memory block of the server
+        '''
+        if self._block is not None:
+            self._header = self._data = self._inputs = self._outputs = None
+            self._block.close()
+            self._block = None
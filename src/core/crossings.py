@@ -0,0 +1,348 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the classes ZeroCrossing and ZeroCrossingDetector
+'''
+
+######## Import statements ########
+
+import numpy as np
+
+from lib3d_mec_ginac_ext import Matrix
+
+
+
+######## class ZeroCrossing ########
+
+class ZeroCrossing:
+    '''
+    Instances of this class store the information of a zero crossing of an event function
+    detected during a simulation (see ``SimulationEngine.add_event_function``)
+    '''
+    def __init__(self, name, time, direction, terminal):
+        self._name, self._time = name, time
+        self._direction, self._terminal = direction, terminal
+
+
+    def get_name(self):
+        '''get_name() -> str
+        Get the name of the event function
+        '''
+        return self._name
+
+
+    def get_time(self):
+        '''get_time() -> float
+        Get the time of the crossing
+        '''
+        return self._time
+
+
+    def get_direction(self):
+        '''get_direction() -> int
+        Get the direction of the crossing: 1 if the event function changed from negative to
+        positive or -1 otherwise
+        '''
+        return self._direction
+
+
+    def is_terminal(self):
+        '''is_terminal() -> bool
+        Returns True if this event stopped the simulation
+        '''
+        return self._terminal
+
+
+    def __repr__(self):
+        return f'ZeroCrossing(name={self._name!r}, time={self._time}, direction={self._direction})'
+
+
+
+
+
+
+######## class ZeroCrossingDetector ########
+
+class ZeroCrossingDetector:
+    '''
+    This class checks the zero crossings of a set of event functions (symbolic expressions)
+    after each simulation step.
+
+    All the event functions are compiled together in a single numeric function, so only one
+    evaluation is needed per step to detect the sign changes. When a sign change is detected,
+    the time of the crossing is located with the Illinois method (a variant of the regula falsi)
+    over the interpolant of the step: the dense output of the integrator if it has one, or the cubic
+    Hermite polynomial defined by the states and derivatives at both ends of the step otherwise.
+    The size of the simulation steps doesnt need to be reduced to catch the events.
+    '''
+    def __init__(self, system, tol=1e-10):
+        '''
+        Constructor.
+
+        :param system: The system whose symbols are used by the event functions
+        :param tol: The tolerance of the time of the crossings (relative to the magnitude of the time)
+        '''
+        self._system = system
+        self._names, self._expressions = [], []
+        self._directions = np.zeros(0, dtype=np.int64)
+        self._terminal = np.zeros(0, dtype=np.bool_)
+        self._handlers = []
+        self._func = None
+        self._tol = tol
+        self._events = []
+
+        # Values of the event functions at the end of the last step
+        self._last_time, self._last_values = None, None
+        self._y0, self._dy0, self._dy1 = None, None, None
+
+
+
+    ######## Getters ########
+
+    def has_functions(self):
+        '''has_functions() -> bool
+        Returns True if at least one event function was added
+        '''
+        return len(self._names) > 0
+
+
+    def get_functions_names(self):
+        '''get_functions_names() -> List[str]
+        Get the names of the event functions
+        '''
+        return list(self._names)
+
+
+    def get_events(self):
+        '''get_events() -> List[ZeroCrossing]
+        Get the zero crossings detected (in chronological order)
+        '''
+        return list(self._events)
+
+
+    def get_tolerance(self):
+        '''get_tolerance() -> float
+        Get the tolerance of the time of the crossings
+        '''
+        return self._tol
+
+
+
+    ######## Setters ########
+
+    def set_tolerance(self, tol):
+        '''set_tolerance(tol: float)
+        Change the tolerance of the time of the crossings
+        '''
+        try:
+            tol = float(tol)
+        except (TypeError, ValueError):
+            raise TypeError('Input argument must be a number')
+        if tol <= 0:
+            raise ValueError('The tolerance must be greater than zero')
+        self._tol = tol
+
+
+
+    ######## Event functions ########
+
+    def add_function(self, name, expression, direction=0, terminal=False, handler=None):
+        '''add_function(name: str, expression: Expr[, direction: int, terminal: bool, handler: Callable])
+        Add a new event function. See ``SimulationEngine.add_event_function``
+        '''
+        if not isinstance(name, str):
+            raise TypeError('name must be a string')
+        if name in self._names:
+            raise ValueError(f'There is already an event function called "{name}"')
+        if isinstance(expression, Matrix):
+            if expression.get_shape() != (1, 1):
+                raise ValueError('The event function must be a scalar expression')
+            expression = expression.get_values()[0]
+        if direction not in (-1, 0, 1):
+            raise ValueError('direction must be -1, 0 or 1')
+        if not isinstance(terminal, bool):
+            raise TypeError('terminal must be a bool')
+        if handler is not None and not callable(handler):
+            raise TypeError('handler must be a callable object')
+
+        self._names.append(name)
+        self._expressions.append(expression)
+        self._directions = np.append(self._directions, direction)
+        self._terminal = np.append(self._terminal, terminal)
+        self._handlers.append(handler)
+        self._func = None
+        self.reset()
+
+
+
+    def remove_function(self, name):
+        '''remove_function(name: str)
+        Remove an event function
+
+        :raises IndexError: If there is no event function with the given name
+        '''
+        if name not in self._names:
+            raise IndexError(f'There is no event function called "{name}"')
+        index = self._names.index(name)
+        for items in (self._names, self._expressions, self._handlers):
+            del items[index]
+        self._directions = np.delete(self._directions, index)
+        self._terminal = np.delete(self._terminal, index)
+        self._func = None
+        self.reset()
+
+
+
+    def clear_events(self):
+        '''clear_events()
+        Discard the zero crossings detected so far
+        '''
+        self._events.clear()
+
+
+
+    def reset(self):
+        '''reset()
+        Discard the values of the event functions stored from the last step (they are evaluated
+        again at the beginning of the next one)
+        '''
+        self._last_time, self._last_values = None, None
+
+
+
+    ######## Detection ########
+
+    def evaluate(self):
+        '''evaluate() -> np.ndarray
+        Evaluate all the event functions at the current numeric values of the symbols of the system
+        '''
+        if self._func is None:
+            k = len(self._expressions)
+            self._func = self._system.compile_numeric_function(Matrix(self._expressions, shape=[k, 1]))
+        return self._func.evaluate()[:, 0].copy()
+
+
+
+    def begin_step(self, t, y):
+        '''begin_step(t: float, y: np.ndarray)
+        Must be called before integrating a step with the state vector at its beginning
+        '''
+        if self._y0 is None or self._y0.shape != y.shape:
+            self._y0, self._dy0, self._dy1 = (np.empty_like(y) for i in range(0, 3))
+        np.copyto(self._y0, y)
+        if self._last_time != t or self._last_values is None:
+            self._last_values = self.evaluate()
+        self._last_time = t
+
+
+
+    def end_step(self, t0, t1, y1, set_state, derivative, interpolate=None):
+        '''end_step(t0: float, t1: float, y1: np.ndarray, set_state: Callable, derivative: Callable[, interpolate: Callable]) -> List[ZeroCrossing]
+        Must be called after integrating a step (the numeric values of the symbols must be the ones
+        at the end of the step). If any event function crossed zero, the state at the time of the first
+        crossing is restored, the events are stored and their handlers are invoked.
+
+        :param y1: The state vector at the end of the step
+        :param set_state: A callable with the signature ``set_state(t, y)`` which sets the numeric
+            values of the time, coordinates & velocities of the system
+        :param derivative: A callable with the signature ``derivative(t, y, dy)`` which evaluates the
+            derivative of the state vector
+        :param interpolate: The dense output of the integrator (optional)
+        :returns: The zero crossings detected (an empty list if there are none)
+        '''
+        g0, g1 = self._last_values, self.evaluate()
+        crossed = self._crossed(g0, g1)
+        if not crossed.any():
+            self._last_time, self._last_values = t1, g1
+            return []
+
+        y0, dy0, dy1 = self._y0, self._dy0, self._dy1
+        y = np.empty_like(y1)
+        y1 = y1.copy()
+        derivative(t0, y0, dy0)
+        derivative(t1, y1, dy1)
+        h = t1 - t0
+
+        def evaluate(s):
+            # Evaluate the event functions at the state interpolated at the time s
+            try:
+                if interpolate is None:
+                    raise ValueError
+                interpolate(s, y)
+            except ValueError:
+                theta = (s - t0) / h
+                y[:] = (2 * theta ** 3 - 3 * theta ** 2 + 1) * y0 + (theta ** 3 - 2 * theta ** 2 + theta) * h * dy0 + \
+                    (3 * theta ** 2 - 2 * theta ** 3) * y1 + (theta ** 3 - theta ** 2) * h * dy1
+            set_state(s, y)
+            return self.evaluate()
+
+        # Locate the first crossing (the functions which didnt cross before the earliest crossing
+        # found so far are skipped)
+        t_event, g = t1, g1
+        for index in np.flatnonzero(crossed):
+            if t_event < t1 and not self._crossed(g0, g)[index]:
+                continue
+            t_event = self._locate(index, t0, g0[index], t_event, g[index], evaluate)
+            g = evaluate(t_event)
+
+        # Restore the state at the time of the crossing (and update the accelerations)
+        if t_event < t1:
+            g = evaluate(t_event)
+        else:
+            np.copyto(y, y1)
+            set_state(t1, y)
+            g = g1
+        derivative(t_event, y, dy1)
+        crossed = self._crossed(g0, g)
+        events = []
+        for index in np.flatnonzero(crossed):
+            event = ZeroCrossing(self._names[index], float(t_event), 1 if g[index] > g0[index] else -1, bool(self._terminal[index]))
+            self._events.append(event)
+            events.append(event)
+
+        # Invoke the handlers (they can modify the numeric values of the symbols)
+        for event, index in zip(events, np.flatnonzero(crossed)):
+            handler = self._handlers[index]
+            if handler is not None and handler(event):
+                event._terminal = True
+        self.reset()
+        return events
+
+
+
+    def _crossed(self, g0, g1):
+        # Returns a mask indicating which event functions crossed zero in the given direction
+        directions = self._directions
+        rising, falling = (g0 < 0) & (g1 >= 0), (g0 > 0) & (g1 <= 0)
+        return np.where(directions > 0, rising, np.where(directions < 0, falling, rising | falling))
+
+
+
+    def _locate(self, index, a, fa, b, fb, evaluate):
+        # Find the time when the given event function crosses zero in the interval [a, b] using
+        # the Illinois method. The returned time is always at the side of the interval where the function
+        # already crossed zero
+        sign = 1.0 if fa < 0 else -1.0
+        fa, fb = sign * fa, sign * fb
+        tol = self._tol * max(1.0, abs(b))
+        side = 0
+        for iteration in range(0, 200):
+            if b - a <= tol:
+                break
+            if iteration < 100 and fb != fa:
+                s = b - fb * (b - a) / (fb - fa)
+                if not a < s < b:
+                    s = (a + b) / 2
+            else:
+                s = (a + b) / 2
+            fs = sign * evaluate(s)[index]
+            if fs >= 0:
+                b, fb = s, fs
+                if side == -1:
+                    fa /= 2
+                side = -1
+            else:
+                a, fa = s, fs
+                if side == 1:
+                    fb /= 2
+                side = 1
+        return b
@@ -0,0 +1,249 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the class DynamicProblemSolver
+'''
+
+######## Import statements ########
+
+from lib3d_mec_ginac_ext import Matrix
+import numpy as np
+
+from .linalg import MatrixFactorization
+
+
+
+######## class DynamicProblemSolver ########
+
+class DynamicProblemSolver:
+    '''
+    This class can be used to solve the "dynamic problem" in order to compute the
+    numeric values of the accelerations ( and the lagrange multipliers of the constraints )
+    of a mechanical system given the current values of its coordinates & velocities.
+
+    Each time the method `solve` is invoked, the next augmented system is built and solved:
+
+        | M_qq   Phi_q^T | | ddq    |   | delta_q |
+        |                | |        | = |         |
+        | Phi_q     0    | | lambda |   | gamma   |
+
+    All the symbolic matrices are compiled only once (when the solver is created) and
+    the augmented matrix is stored in a preallocated buffer. The system is solved with the
+    LU factorization of the augmented matrix (with redundant constraints, the matrix is rank
+    deficient and the least squares solution with minimum norm is computed instead).
+
+    By default, the augmented matrix is evaluated and factorized on every call. If it varies
+    slowly (e.g. a constant mass matrix and linear constraints), the factorization can be reused
+    during several calls with the parameter ``refactorization_interval`` (only the right hand side
+    is evaluated in between).
+    '''
+    def __init__(self, system, M_qq, delta_q, Phi_q=None, gamma=None, c_optimized=False, refactorization_interval=1):
+        '''
+        Constructor.
+        You must pass the symbolic matrices M_qq and delta_q either as positional or
+        keyword arguments. Phi_q and gamma are optional (if the system has no constraints
+        they can be omitted).
+
+        :param c_optimized: If True, compile the numeric functions of the dynamic problem
+            as cython extensions.
+        :param refactorization_interval: The augmented matrix is evaluated and factorized once
+            every this number of calls to `solve` (1 by default). The last factorization is reused
+            in the rest of the calls
+        '''
+        if (Phi_q is None) != (gamma is None):
+            raise TypeError('Phi_q and gamma must be specified both or none of them')
+        if not isinstance(refactorization_interval, int) or refactorization_interval <= 0:
+            raise TypeError('refactorization_interval must be an integer greater than zero')
+
+        n = M_qq.get_num_rows()
+        if M_qq.get_shape() != (n, n) or delta_q.get_shape() != (n, 1):
+            raise ValueError('M_qq must be a square matrix and delta_q a column matrix with the same number of rows')
+
+        m = 0
+        if Phi_q is not None:
+            m = Phi_q.get_num_rows()
+            if Phi_q.get_shape() != (m, n) or gamma.get_shape() != (m, 1):
+                raise ValueError(f'Phi_q must be a matrix {m}x{n} and gamma a column matrix with {m} rows')
+
+        compile = system.compile_numeric_function
+        self._system = system
+        self.M_qq, self.delta_q, self.Phi_q, self.gamma = M_qq, delta_q, Phi_q, gamma
+        self._M_qq_func, self._delta_q_func = compile(M_qq, c_optimized), compile(delta_q, c_optimized)
+        if m > 0:
+            self._Phi_q_func, self._gamma_func = compile(Phi_q, c_optimized), compile(gamma, c_optimized)
+
+        # Preallocate the augmented matrix, the right hand side vector and the solution vector
+        self._n, self._m = n, m
+        self._c_optimized = c_optimized
+        self._A = np.zeros((n + m, n + m), dtype=np.float64)
+        self._b = np.zeros((n + m, 1), dtype=np.float64)
+        self._x = np.zeros((n + m, 1), dtype=np.float64)
+
+        # Numeric functions to compute the jacobian of the right hand side (compiled on demand)
+        self._rhs_q_func, self._rhs_dq_func = None, None
+        self._rhs_jacobian = np.zeros((n + m, 2 * n), dtype=np.float64)
+
+        # These fields are used to reuse the factorization of the augmented matrix
+        self._refactorization_interval = refactorization_interval
+        self._factorization, self._num_reuses = None, 0
+
+
+
+    ######## Getters ########
+
+
+    def get_num_coordinates(self):
+        '''get_num_coordinates() -> int
+        Get the number of accelerations solved by this instance (the number of rows of M_qq)
+        '''
+        return self._n
+
+
+    def get_num_constraints(self):
+        '''get_num_constraints() -> int
+        Get the number of constraints (the number of rows of Phi_q) and therefore the
+        number of lagrange multipliers computed by this instance
+        '''
+        return self._m
+
+
+    def get_refactorization_interval(self):
+        '''get_refactorization_interval() -> int
+        Get the number of calls to `solve` between two factorizations of the augmented matrix
+        '''
+        return self._refactorization_interval
+
+
+    def is_rank_deficient(self):
+        '''is_rank_deficient() -> bool
+        Returns True if the last augmented matrix factorized was rank deficient (redundant constraints)
+        '''
+        return self._factorization is not None and self._factorization.is_rank_deficient()
+
+
+    def get_lagrange_multipliers(self):
+        '''get_lagrange_multipliers() -> np.ndarray
+        Get the lagrange multipliers computed in the last call to `solve`
+        '''
+        return self._x[self._n:]
+
+
+
+    ######## Solve ########
+
+
+    def solve(self, ddq_values, unknowns_values=None):
+        '''solve(ddq_values[, unknowns_values])
+
+        Solve the dynamic problem at the current numeric values of the symbols of the system.
+
+        :param ddq_values: Numpy array where the accelerations will be stored
+        :param unknowns_values: Optional numpy array where the lagrange multipliers
+            will be stored ( usually the numeric values of the joint unknowns )
+        :returns: The solution of the augmented system (accelerations followed by
+            the lagrange multipliers). The returned array is overwritten on the next call.
+        '''
+        n, m = self._n, self._m
+        A, b, x = self._A, self._b, self._x
+
+        # Build the right hand side of the augmented system
+        b[:n] = self._delta_q_func.evaluate()
+        if m > 0:
+            b[n:] = self._gamma_func.evaluate()
+
+        # Build and factorize the augmented matrix (unless the last factorization is reused)
+        if self._factorization is None or self._num_reuses >= self._refactorization_interval - 1:
+            A[:n, :n] = self._M_qq_func.evaluate()
+            if m > 0:
+                Phi_q_num = self._Phi_q_func.evaluate()
+                A[n:, :n] = Phi_q_num
+                A[:n, n:] = Phi_q_num.T
+            self._factorization, self._num_reuses = MatrixFactorization(A), 0
+        else:
+            self._num_reuses += 1
+
+        x[:] = self._factorization.solve(b)
+
+        ddq_values[:] = x[:n]
+        if unknowns_values is not None:
+            unknowns_values[:] = x[n:]
+        return x
+
+
+
+    def refactorize(self):
+        '''refactorize()
+        Force the evaluation and factorization of the augmented matrix on the next call to `solve`
+        (e.g. after the coordinates were modified when its factorization is reused)
+        '''
+        self._factorization = None
+
+
+
+    def derivative(self, t, y, dy):
+        '''derivative(t: float, y: np.ndarray, dy: np.ndarray)
+
+        Evaluate the time derivative of the packed state vector ``y = [q; dq]`` solving
+        the dynamic problem. This method can be used as the derivative callback of
+        an ``Integrator``
+
+        The numeric values of the coordinates, velocities and time of the system are
+        updated with the given state. Then the accelerations ( and the joint unknowns
+        if their number matches the number of constraints ) are computed.
+
+        :param t: Time of the state
+        :param y: The state vector
+        :param dy: Numpy array where the derivative of the state vector ``[dq; ddq]`` will be stored
+        '''
+        # The numeric values are fetched on each call because they are reallocated when
+        # new symbols are created
+        n, system = self._n, self._system
+        q_values, dq_values = system.get_coords_values(), system.get_velocities_values()
+        ddq_values = system.get_accelerations_values()
+        unknowns_values = system.get_joint_unknowns_values()
+        if unknowns_values.shape[0] != self._m:
+            unknowns_values = None
+
+        q_values[:], dq_values[:] = y[:n], y[n:]
+        system._time_value = t
+        self.solve(ddq_values, unknowns_values)
+
+        dy[:n], dy[n:] = dq_values, ddq_values
+
+
+
+    def jacobian(self, t, y, J):
+        '''jacobian(t: float, y: np.ndarray, J: np.ndarray)
+
+        Evaluate the jacobian of the derivative of the packed state vector ``y = [q; dq]``
+        ( see the method `derivative` ). This method can be used as the jacobian callback
+        of an ``ImplicitIntegrator``
+
+        The jacobians of delta_q and gamma with respect the coordinates and velocities are
+        computed symbolically and compiled the first time this method is called.
+        The variation of the augmented matrix with respect the state is neglected (which is
+        enough for the simplified newton iterations of the implicit integrators).
+
+        :param t: Time of the state
+        :param y: The state vector
+        :param J: Numpy array where the jacobian matrix (2n x 2n) will be stored
+        '''
+        n, m = self._n, self._m
+        if self._rhs_q_func is None:
+            # Compile the jacobian of the right hand side of the augmented system
+            system = self._system
+            rhs = self.delta_q if m == 0 else Matrix.block(2, 1, self.delta_q, self.gamma)
+            compile = system.compile_numeric_function
+            self._rhs_q_func = compile(system.jacobian(rhs.transpose(), system.get_coords_matrix()), self._c_optimized)
+            self._rhs_dq_func = compile(system.jacobian(rhs.transpose(), system.get_velocities_matrix()), self._c_optimized)
+
+        # Update the augmented matrix and its factorization at the given state
+        self.derivative(t, y, J[:, 0:1])
+
+        rhs_jacobian = self._rhs_jacobian
+        rhs_jacobian[:, :n] = self._rhs_q_func.evaluate()
+        rhs_jacobian[:, n:] = self._rhs_dq_func.evaluate()
+
+        # d[dq]/dq = 0, d[dq]/d[dq] = I, d[ddq; lambda]/d[q; dq] = A^-1 * d[delta_q; gamma]/d[q; dq]
+        J[:n, :n] = 0
+        J[:n, n:] = np.eye(n)
+        J[n:] = self._factorization.solve(rhs_jacobian)[:n]
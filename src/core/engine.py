@@ -0,0 +1,1147 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the classes SimulationEngine, Trajectory and the
+function run_simulation
+'''
+
+######## Import statements ########
+
+from functools import partial
+from collections.abc import Mapping
+from inspect import isclass
+from math import ceil
+import numpy as np
+
+from .integration import NumericIntegration, Integrator, ImplicitIntegrator
+from .assembly import AssemblyProblemSolver
+from .dynamics import DynamicProblemSolver
+from .kinematics import KinematicProblemSolver
+from .recorder import Recorder, _fuse_probes
+from .monitor import SimulationMonitor
+from .crossings import ZeroCrossingDetector
+from .checkpoint import save_checkpoint, load_checkpoint, Checkpointer
+from .schedules import InputSchedules
+from .asynchronous import AsyncSimulation
+
+
+
+######## class Trajectory ########
+
+class Trajectory:
+    '''
+    Stores the numeric values of the time, coordinates, velocities, accelerations and
+    probes (additional outputs) of a mechanical system sampled during a simulation.
+
+    The values are stored in numpy arrays preallocated when the trajectory is created
+    (one row per sample). The properties ``time``, ``q``, ``dq`` and ``ddq`` return views of
+    the samples stored (arrays with the shapes (N,) and (N, n) where n is the number of
+    coordinates)
+    '''
+    def __init__(self, system, num_samples, probes=None):
+        '''
+        Constructor.
+
+        :param system: The system whose coordinates will be stored
+        :param num_samples: Number of samples to allocate
+        :param probes: A mapping with the names of the probes and their number of outputs (optional)
+        '''
+        if not isinstance(num_samples, int) or num_samples < 0:
+            raise TypeError('num_samples must be an integer greater or equal than zero')
+        if probes is None:
+            probes = {}
+        if not isinstance(probes, Mapping) or not all(isinstance(size, int) and size > 0 for size in probes.values()):
+            raise TypeError('probes must be a mapping of names and number of outputs')
+
+        symbols_values = system._symbols_values
+        self._coords_names = tuple(symbols_values['coordinate'])
+        self._velocities_names = tuple(symbols_values['velocity'])
+        self._accelerations_names = tuple(symbols_values['acceleration'])
+
+        n = len(self._coords_names)
+        self._time = np.zeros(num_samples, dtype=np.float64)
+        self._q, self._dq, self._ddq = (np.zeros((num_samples, n), dtype=np.float64) for i in range(0, 3))
+        self._probes = dict((name, np.zeros((num_samples, size), dtype=np.float64)) for name, size in probes.items())
+        self._num_samples = 0
+
+
+
+    ######## Getters ########
+
+    def get_num_samples(self):
+        '''get_num_samples() -> int
+        Get the number of samples stored
+        '''
+        return self._num_samples
+
+
+    def get_capacity(self):
+        '''get_capacity() -> int
+        Get the number of samples preallocated
+        '''
+        return self._time.shape[0]
+
+
+    def is_full(self):
+        '''is_full() -> bool
+        Returns True if there is no space left to store more samples
+        '''
+        return self._num_samples >= self._time.shape[0]
+
+
+    def get_coords_names(self):
+        '''get_coords_names() -> Tuple[str]
+        Get the names of the coordinates (in the same order as the columns of the arrays
+        q, dq and ddq)
+        '''
+        return self._coords_names
+
+
+    def get_probes_names(self):
+        '''get_probes_names() -> Tuple[str]
+        Get the names of the probes stored
+        '''
+        return tuple(self._probes.keys())
+
+
+    def get_time_values(self):
+        '''get_time_values() -> np.ndarray
+        Get the samples of the time
+        '''
+        return self._time[:self._num_samples]
+
+
+    def get_coords_values(self):
+        '''get_coords_values() -> np.ndarray
+        Get the samples of the coordinates
+        '''
+        return self._q[:self._num_samples]
+
+
+    def get_velocities_values(self):
+        '''get_velocities_values() -> np.ndarray
+        Get the samples of the velocities
+        '''
+        return self._dq[:self._num_samples]
+
+
+    def get_accelerations_values(self):
+        '''get_accelerations_values() -> np.ndarray
+        Get the samples of the accelerations
+        '''
+        return self._ddq[:self._num_samples]
+
+
+    def get_probe_values(self, name):
+        '''get_probe_values(name: str) -> np.ndarray
+        Get the samples of the probe with the given name (an array with one column
+        per output of the probe)
+
+        :raises IndexError: If there is no probe with that name
+        '''
+        try:
+            return self._probes[name][:self._num_samples]
+        except KeyError:
+            raise IndexError(f'There is no probe called "{name}"')
+
+
+    def get_values(self, name):
+        '''get_values(name: str) -> np.ndarray
+        Get the samples of the time ('t'), or the coordinate, velocity, acceleration or probe
+        with the given name
+
+        :raises TypeError: If the input argument is not a string
+        :raises IndexError: If there is no coordinate, velocity, acceleration or probe with that name
+        '''
+        if not isinstance(name, str):
+            raise TypeError('Input argument must be a string')
+        if name == 't':
+            return self.get_time_values()
+        if name in self._probes:
+            return self.get_probe_values(name)
+        for names, values in zip(
+            (self._coords_names, self._velocities_names, self._accelerations_names),
+            (self._q, self._dq, self._ddq)):
+            if name in names:
+                return values[:self._num_samples, names.index(name)]
+        raise IndexError(f'There is no coordinate, velocity, acceleration or probe called "{name}"')
+
+
+
+    ######## Recording ########
+
+    def clear(self):
+        '''clear()
+        Remove all the samples stored (the arrays are not deallocated)
+        '''
+        self._num_samples = 0
+
+
+    def record(self, t, q_values, dq_values, ddq_values, probes_values=()):
+        '''record(t: float, q_values: np.ndarray, dq_values: np.ndarray, ddq_values: np.ndarray[, probes_values])
+        Store a new sample
+
+        :param probes_values: The outputs of the probes (in the same order as the names
+            returned by ``get_probes_names``)
+        :raises RuntimeError: If there is no space left in the preallocated arrays
+        '''
+        k = self._num_samples
+        if k >= self._time.shape[0]:
+            raise RuntimeError('The trajectory is full')
+        self._time[k] = t
+        self._q[k], self._dq[k], self._ddq[k] = q_values[:, 0], dq_values[:, 0], ddq_values[:, 0]
+        for values, probe in zip(probes_values, self._probes.values()):
+            probe[k] = values
+        self._num_samples = k + 1
+
+
+
+    ######## Properties ########
+
+    @property
+    def time(self):
+        return self.get_time_values()
+
+    @property
+    def q(self):
+        return self.get_coords_values()
+
+    @property
+    def dq(self):
+        return self.get_velocities_values()
+
+    @property
+    def ddq(self):
+        return self.get_accelerations_values()
+
+
+
+
+
+
+######## class SimulationEngine ########
+
+class SimulationEngine:
+    '''
+    This class performs the simulation steps of a mechanical system: the dynamic problem,
+    the numerical integration and the assembly problem.
+
+    It has no dependencies with the graphical environment and no events are fired while
+    stepping: the numeric values of the symbols of the system (including the time) are
+    updated in place.
+    '''
+    def __init__(self, system):
+        '''
+        Constructor.
+
+        :param system: The system to be simulated
+        '''
+        self._system = system
+        self._assembly_problem_solver = None
+        self._dynamic_problem_solver = None
+        self._kinematic_problem_solver = None
+        self._assembly_problem_init = lambda *args, **kwargs: None
+        self._assembly_problem_step = lambda *args, **kwargs: None
+        self._dynamic_problem_step = lambda *args, **kwargs: None
+        self._state = np.zeros((0, 1), dtype=np.float64)
+        self._recorders = []
+        self._monitors = []
+        self._compiled_probes = None
+        self._crossings = ZeroCrossingDetector(system)
+        self._checkpointer = None
+        self._schedules = InputSchedules(system)
+        self.set_integration_method('euler')
+
+
+
+    ######## Getters ########
+
+    def get_system(self):
+        '''get_system() -> System
+        Get the system simulated by this engine
+        '''
+        return self._system
+
+
+    def get_integration_method(self):
+        '''get_integration_method() -> Callable | Integrator
+        Get the current integration method
+        '''
+        return self._integration_method
+
+
+    def get_integration_method_name(self):
+        '''get_integration_method_name() -> str
+        Get the name of the current integration method
+        '''
+        method = self._integration_method
+        if isinstance(method, Integrator):
+            return method.name or method.__class__.__name__
+        if isinstance(method, partial):
+            return method.func.__name__
+        return method.__name__
+
+
+    def get_assembly_problem_solver(self):
+        '''get_assembly_problem_solver() -> AssemblyProblemSolver | None
+        Get the assembly problem solver (None if the assembly problem was not configured)
+        '''
+        return self._assembly_problem_solver
+
+
+    def get_dynamic_problem_solver(self):
+        '''get_dynamic_problem_solver() -> DynamicProblemSolver | None
+        Get the dynamic problem solver (None if the dynamic problem was not configured)
+        '''
+        return self._dynamic_problem_solver
+
+
+    def get_kinematic_problem_solver(self):
+        '''get_kinematic_problem_solver() -> KinematicProblemSolver | None
+        Get the kinematic problem solver (None if the kinematic mode is disabled)
+        '''
+        return self._kinematic_problem_solver
+
+
+    def is_kinematic(self):
+        '''is_kinematic() -> bool
+        Returns True if the kinematic mode is enabled (see ``kinematics``)
+        '''
+        return self._kinematic_problem_solver is not None
+
+
+    def get_recorders(self):
+        '''get_recorders() -> List[Recorder]
+        Get the recorders attached to this engine
+        '''
+        return list(self._recorders)
+
+
+    def get_monitors(self):
+        '''get_monitors() -> List[SimulationMonitor]
+        Get the monitors attached to this engine
+        '''
+        return list(self._monitors)
+
+
+    def get_event_functions_names(self):
+        '''get_event_functions_names() -> List[str]
+        Get the names of the event functions added to this engine
+        '''
+        return self._crossings.get_functions_names()
+
+
+    def get_events(self):
+        '''get_events() -> List[ZeroCrossing]
+        Get the zero crossings of the event functions detected since the simulation started
+        (in chronological order)
+        '''
+        return self._crossings.get_events()
+
+
+    def get_checkpointer(self):
+        '''get_checkpointer() -> Checkpointer | None
+        Get the object which saves the checkpoints periodically (None if they are disabled)
+        '''
+        return self._checkpointer
+
+
+    def get_input_schedules_names(self):
+        '''get_input_schedules_names() -> List[str]
+        Get the names of the inputs driven by a schedule
+        '''
+        return self._schedules.get_names()
+
+
+
+    ######## Setup ########
+
+    def set_integration_method(self, method, *args, **kwargs):
+        '''set_integration_method(method: IntegrationMethod, ...)
+        Change integration method to adjust system's symbol values on each step
+
+        :param method: Must be a callable for a custom integration method, an
+            Integrator instance (or subclass) or the name of a predefined integrator like
+            'euler', 'rk4', 'dopri5'
+        :param args: Additional positional arguments to create the integrator (only if
+            method is a name or an Integrator subclass)
+        :param kwargs: Additional keyword arguments to create the integrator (only if
+            method is a name or an Integrator subclass) e.g: ``set_integration_method('dopri5', rtol=1e-8)``
+        '''
+        if not isinstance(method, (str, Integrator)) and not callable(method):
+            raise TypeError('Integration method must be a callable, an integrator or a string')
+
+        if isinstance(method, str):
+            method = NumericIntegration.get_method(method, *args, **kwargs)
+        elif isclass(method) and issubclass(method, Integrator):
+            method = method(*args, **kwargs)
+        elif args or kwargs:
+            raise TypeError('Additional arguments are only valid to create a new integrator')
+
+        if isinstance(method, Integrator):
+            # The integrator evaluates the derivative of the state vector by itself
+            self._bind_integrator(method)
+            self._integration_method = method
+            return
+
+        # Integration methods which operate directly over the symbol values (the numeric
+        # arrays are fetched on each step because they are reallocated when new symbols are created)
+        self._integration_method = method
+
+
+
+    def assembly_problem(self, *args, **kwargs):
+        '''assembly_problem(...) -> AssemblyProblemSolver
+        Setup assembly problem constraints and parameters
+
+        You must pass first the next constraints as positional arguments:
+        Phi, Phi_q, beta, Phi_init, Phi_init_q, beta_init, dPhi_dq, dPhi_init_dq
+
+        and then you can specify additional parameters (this is optional):
+        geom_eq_tol, geom_eq_relax, geom_eq_init_tol, geom_eq_init_relax
+
+        An AssemblyProblemSolver instance can also be passed as the only argument
+        '''
+        if len(args) == 1 and not kwargs and isinstance(args[0], AssemblyProblemSolver):
+            solver = args[0]
+        else:
+            solver = AssemblyProblemSolver(self._system, *args, **kwargs)
+        # The numeric values are fetched on each call because they are reallocated when
+        # new symbols are created
+        system = self._system
+        def init():
+            solver.init(system.get_coords_values(), system.get_velocities_values(), system.get_accelerations_values())
+        def step(delta_t):
+            solver.step(system.get_coords_values(), system.get_velocities_values(), system.get_accelerations_values(), delta_t)
+        self._assembly_problem_init, self._assembly_problem_step = init, step
+        self._assembly_problem_solver = solver
+        return solver
+
+
+
+    def dynamics(self, *args, **kwargs):
+        '''dynamics(...) -> DynamicProblemSolver
+        Setup the dynamic problem. When configured, the accelerations are computed on each
+        step solving the augmented system built with the next matrices:
+
+        | M_qq   Phi_q^T | | ddq    |   | delta_q |
+        | Phi_q     0    | | lambda | = | gamma   |
+
+        You must pass first the matrices M_qq, delta_q and optionally Phi_q and gamma as
+        positional or keyword arguments. The additional parameters c_optimized and
+        refactorization_interval can also be specified. A DynamicProblemSolver instance can also be passed as the only argument.
+
+        If the number of joint unknowns of the system matches the number of constraints,
+        the lagrange multipliers are stored as their numeric values.
+        '''
+        if len(args) == 1 and not kwargs and isinstance(args[0], DynamicProblemSolver):
+            solver = args[0]
+        else:
+            solver = DynamicProblemSolver(self._system, *args, **kwargs)
+        # The numeric values are fetched on each call because they are reallocated when
+        # new symbols are created
+        system = self._system
+        num_constraints = solver.get_num_constraints()
+        def step():
+            unknowns_values = system.get_joint_unknowns_values()
+            if unknowns_values.shape[0] != num_constraints:
+                unknowns_values = None
+            solver.solve(system.get_accelerations_values(), unknowns_values)
+        self._dynamic_problem_step = step
+        self._dynamic_problem_solver = solver
+
+        method = self._integration_method
+        if isinstance(method, Integrator):
+            self._bind_integrator(method)
+        return solver
+
+
+
+    def kinematics(self, *args, **kwargs):
+        '''kinematics(...) -> KinematicProblemSolver | None
+        Enable the kinematic mode: some coordinates are driven by functions of the time and the rest
+        are computed from the constraints on each step solving the position, velocity & acceleration
+        problems. The dynamic problem, the numerical integration and the assembly problem step
+        are skipped.
+
+            :Example:
+
+            >>> engine.kinematics(Phi, Phi_q, beta, gamma, drivers={'theta': 2 * pi * t})
+
+        You must pass first the matrices Phi, Phi_q, beta, gamma and the mapping of driven coordinates
+        and time functions as positional or keyword arguments. The additional parameters tol, max_iterations
+        and c_optimized can also be specified. A KinematicProblemSolver instance can also be passed as the
+        only argument, or None to disable the kinematic mode.
+        '''
+        if len(args) == 1 and not kwargs and (args[0] is None or isinstance(args[0], KinematicProblemSolver)):
+            solver = args[0]
+        else:
+            solver = KinematicProblemSolver(self._system, *args, **kwargs)
+        self._kinematic_problem_solver = solver
+        return solver
+
+
+
+    def add_recorder(self, recorder):
+        '''add_recorder(recorder: Recorder)
+        Attach a recorder to this engine. Its method ``record`` will be invoked after each
+        simulation step (and with the initial state when the simulation starts)
+        '''
+        if not isinstance(recorder, Recorder):
+            raise TypeError('Input argument must be a Recorder instance')
+        if recorder not in self._recorders:
+            self._recorders.append(recorder)
+
+
+
+    def remove_recorder(self, recorder):
+        '''remove_recorder(recorder: Recorder)
+        Detach a recorder from this engine
+
+        :raises IndexError: If the recorder is not attached to this engine
+        '''
+        if recorder not in self._recorders:
+            raise IndexError('The recorder is not attached to this engine')
+        self._recorders.remove(recorder)
+
+
+
+    def add_monitor(self, monitor):
+        '''add_monitor(monitor: SimulationMonitor)
+        Attach a monitor to this engine. It is updated after each simulation step (and with the
+        initial state when the simulation starts) and reset by ``init``
+        '''
+        if not isinstance(monitor, SimulationMonitor):
+            raise TypeError('Input argument must be a SimulationMonitor instance')
+        if monitor not in self._monitors:
+            self._monitors.append(monitor)
+
+
+
+    def remove_monitor(self, monitor):
+        '''remove_monitor(monitor: SimulationMonitor)
+        Detach a monitor from this engine
+
+        :raises IndexError: If the monitor is not attached to this engine
+        '''
+        if monitor not in self._monitors:
+            raise IndexError('The monitor is not attached to this engine')
+        self._monitors.remove(monitor)
+
+
+
+    def add_event_function(self, name, expression, direction=0, terminal=False, handler=None):
+        '''add_event_function(name: str, expression: Expr[, direction: int, terminal: bool, handler: Callable])
+        Add an event function. Its zero crossings are checked after each simulation step and
+        their exact times are located over the interpolant of the step (the size of the steps is
+        not modified). All the event functions are compiled together in a single numeric function.
+
+            :Example:
+
+            >>> engine.add_event_function('contact', y - r, direction=-1, handler=bounce)
+
+        :param name: The name of the event function
+        :param expression: A symbolic expression which depends on the time, coordinates, velocities
+            or parameters of the system
+        :param direction: 1 to detect only the crossings from negative to positive values, -1 to detect
+            only the crossings from positive to negative values or 0 (default) for both
+        :param terminal: If True, the simulation stops at the time of the crossing
+        :param handler: A callable invoked with the ``ZeroCrossing`` instance when the event occurs. The
+            numeric values of the symbols are the ones at the time of the crossing and can be modified
+            (e.g. to switch the behaviour of the system). If it returns True, the simulation stops
+        :raises ValueError: If there is already an event function with the same name
+        '''
+        self._crossings.add_function(name, expression, direction, terminal, handler)
+
+
+
+    def remove_event_function(self, name):
+        '''remove_event_function(name: str)
+        Remove an event function
+
+        :raises IndexError: If there is no event function with the given name
+        '''
+        self._crossings.remove_function(name)
+
+
+
+    def clear_events(self):
+        '''clear_events()
+        Discard the zero crossings detected so far
+        '''
+        self._crossings.clear_events()
+
+
+
+    ######## Input schedules ########
+
+    def add_input_schedule(self, name, times, values, interpolation='linear'):
+        '''add_input_schedule(name: str, times: np.ndarray, values: np.ndarray[, interpolation: str])
+        Drive the numeric value of an input symbol with a time series. The schedule is evaluated at
+        every stage time of the integrator and at the end of every step, and the value is written
+        directly (the event 'symbol_value_changed' is not fired and no python callbacks are invoked).
+        The input keeps the first and last values of the series outside of its time range.
+
+            :Example:
+
+            >>> engine.add_input_schedule('torque', [0, 1, 2], [0, 10, 0])
+
+        :param interpolation: 'linear' (default), 'previous' or 'cubic' (see ``InputSchedules.add_time_series``)
+        :raises IndexError: If there is no input symbol with the given name
+        '''
+        self._schedules.add_time_series(name, times, values, interpolation)
+        self._update_schedules()
+
+
+
+    def add_input_polynomial(self, name, breaks, coefficients):
+        '''add_input_polynomial(name: str, breaks: np.ndarray, coefficients: np.ndarray)
+        Drive the numeric value of an input symbol with a piecewise polynomial: in the interval
+        ``[breaks[i], breaks[i+1])``, the value is ``sum(coefficients[i, j] * (t - breaks[i]) ** (k - 1 - j))``
+        (see ``add_input_schedule`` and ``InputSchedules.add_piecewise_polynomial``)
+
+        :raises IndexError: If there is no input symbol with the given name
+        '''
+        self._schedules.add_piecewise_polynomial(name, breaks, coefficients)
+        self._update_schedules()
+
+
+
+    def remove_input_schedule(self, name):
+        '''remove_input_schedule(name: str)
+        Stop driving the given input with a schedule (its current numeric value is preserved)
+
+        :raises IndexError: If the input has no schedule
+        '''
+        self._schedules.remove(name)
+        self._update_schedules()
+
+
+
+    ######## Checkpoints ########
+
+    def save_checkpoint(self, filename):
+        '''save_checkpoint(filename: str)
+        Store the state of the simulation in a checkpoint file: the numeric values of the symbols,
+        the time, the history of the integrator, the recorders and the events detected (see ``save_checkpoint``)
+        '''
+        save_checkpoint(self, filename)
+
+
+
+    def load_checkpoint(self, filename):
+        '''load_checkpoint(filename: str) -> float
+        Restore the state of the simulation stored in a checkpoint file, so that it can be resumed
+        exactly at the same point. The model must be defined in the same way as when the checkpoint was
+        saved, but it can be loaded in another process or in several engines to fork the simulation
+        (see ``load_checkpoint``)
+
+        :returns: The time of the checkpoint
+        '''
+        return load_checkpoint(self, filename)
+
+
+
+    def enable_checkpoints(self, path, interval, keep=2):
+        '''enable_checkpoints(path: str, interval: float[, keep: int])
+        Save checkpoints automatically every ``interval`` units of simulated time (before recording
+        the samples of the step) in the given directory. Only the last ``keep`` checkpoints are preserved.
+
+            :Example:
+
+            >>> engine.enable_checkpoints('checkpoints', 60)
+            >>> engine.run(3600, 0.001)
+            >>> # After a crash...
+            >>> engine.load_checkpoint(latest_checkpoint('checkpoints'))
+            >>> engine.run(3600, 0.001)
+        '''
+        self._checkpointer = Checkpointer(self, path, interval, keep)
+
+
+
+    def disable_checkpoints(self):
+        '''disable_checkpoints()
+        Stop saving checkpoints automatically
+        '''
+        self._checkpointer = None
+
+
+
+    ######## Simulation steps ########
+
+    def init(self):
+        '''init()
+        Solve the assembly problem initialization (if configured) or the kinematic problem (in
+        kinematic mode) at the current time, discard the
+        information stored by the integrator from previous steps and reset the monitors
+        '''
+        schedules = self._schedules
+        if schedules.has_schedules():
+            schedules.apply(self._system._time_value)
+        self._assembly_problem_init()
+        if self._kinematic_problem_solver is not None:
+            self._kinematic_problem_solver.solve()
+        self._crossings.clear_events()
+        for monitor in self._monitors:
+            monitor.reset()
+        self.reset()
+
+
+
+    def reset(self):
+        '''reset()
+        Discard the information stored by the integrator from previous steps
+        '''
+        method = self._integration_method
+        if isinstance(method, Integrator):
+            method.reset()
+        self._crossings.reset()
+
+
+
+    def integrate(self, t, delta_t):
+        '''integrate(t: float, delta_t: float)
+        Integrate the coordinates & velocities from the time t to t + delta_t (the
+        numeric value of the time is not modified)
+        '''
+        method = self._integration_method
+        if not isinstance(method, Integrator):
+            # Integration methods which operate directly over the symbol values
+            system = self._system
+            if self._schedules.has_schedules():
+                self._schedules.apply(t)
+            self._dynamic_problem_step()
+            method(system.get_coords_values(), system.get_velocities_values(), system.get_accelerations_values(), delta_t)
+            return
+
+        # Pack the coordinates & velocities into the state vector
+        system = self._system
+        q_values, dq_values = system.get_coords_values(), system.get_velocities_values()
+        n = q_values.shape[0]
+        y = self._state
+        if y.shape[0] != 2 * n:
+            y = self._state = np.zeros((2 * n, 1), dtype=np.float64)
+        y[:n], y[n:] = q_values, dq_values
+
+        method.step(t, y, delta_t)
+
+        # Unpack the state vector
+        q_values[:], dq_values[:] = y[:n], y[n:]
+
+
+
+    def assemble(self, delta_t):
+        '''assemble(delta_t: float)
+        Solve the assembly problem step (if configured)
+        '''
+        self._assembly_problem_step(delta_t)
+
+
+
+    def advance(self, t, delta_t):
+        '''advance(t: float, delta_t: float) -> bool
+        Integrate the coordinates & velocities from the time t to t + delta_t, update the time and
+        solve the assembly problem.
+
+        If event functions were added, the zero crossings during the step are located and
+        their handlers invoked (the integration is restarted from the time of the crossing).
+
+        In kinematic mode (see ``kinematics``), the kinematic problem is solved at t + delta_t instead.
+
+        :returns: False if a terminal event stopped the step before reaching t + delta_t (the time
+            of the system is the time of the crossing). True otherwise
+        '''
+        if self._kinematic_problem_solver is not None:
+            return self._advance_kinematics(t, delta_t)
+        system = self._system
+        crossings = self._crossings
+        apply_schedules = self._schedules.apply if self._schedules.has_schedules() else None
+        t_end = t + delta_t
+        if not crossings.has_functions():
+            self.integrate(t, delta_t)
+            system._time_value = t_end
+            if apply_schedules is not None:
+                apply_schedules(t_end)
+            self._assembly_problem_step(delta_t)
+            return True
+
+        method = self._integration_method
+        interpolate = getattr(method, 'interpolate', None) if isinstance(method, Integrator) else None
+        q_values, dq_values = system.get_coords_values(), system.get_velocities_values()
+        eps = 1e-12 * max(1.0, abs(t_end))
+        while True:
+            crossings.begin_step(t, np.concatenate([q_values, dq_values]))
+            h = t_end - t
+            self.integrate(t, h)
+            system._time_value = t_end
+            if apply_schedules is not None:
+                apply_schedules(t_end)
+            self._assembly_problem_step(h)
+            events = crossings.end_step(t, t_end, np.concatenate([q_values, dq_values]),
+                self._set_state, self._state_derivative, interpolate)
+            if not events:
+                return True
+
+            # Restart the integration from the time of the crossing
+            t = system._time_value
+            self.reset()
+            if any(event.is_terminal() for event in events):
+                return False
+            if t_end - t <= eps:
+                system._time_value = t_end
+                if apply_schedules is not None:
+                    apply_schedules(t_end)
+                return True
+
+
+
+    def step(self, delta_t):
+        '''step(delta_t: float) -> bool
+        Perform one simulation step: integrate the coordinates & velocities, advance the
+        time and solve the assembly problem (see ``advance``)
+
+        :returns: False if a terminal event stopped the simulation. True otherwise
+        '''
+        running = self.advance(self._system._time_value, delta_t)
+        self.record()
+        return running
+
+
+
+    def record(self):
+        '''record()
+        Store a new sample in the recorders attached to this engine and update its monitors
+        (with the current numeric values of the symbols of the system)
+        '''
+        if self._checkpointer is not None:
+            # (the checkpoints are saved before recording the sample because run and stream
+            # record the initial state when the simulation is resumed)
+            self._checkpointer.update()
+        for recorder in self._recorders:
+            recorder.record()
+        for monitor in self._monitors:
+            monitor.update()
+
+
+
+    def run(self, t_end, delta_t, trajectory=None, probes=None):
+        '''run(t_end: float, delta_t: float[, trajectory: Trajectory, probes: Mapping]) -> Trajectory
+        Simulate the system from its current time until the time ``t_end`` with steps of
+        size ``delta_t`` (the last step is shortened to reach ``t_end`` exactly).
+
+        :param trajectory: The trajectory where the samples will be stored (one sample
+            for the initial state and one after each step). If not specified, a new one
+            is allocated.
+        :param probes: Additional outputs to be stored on each sample. It must be a mapping
+            of names and symbolic matrices, expressions or callables with no arguments which
+            return the outputs as numpy arrays. If a trajectory is given, it must have been
+            created with the same probes.
+        :returns: The trajectory with the samples of the simulation
+
+        .. note::
+            The accelerations stored on each sample are the ones computed in the last
+            evaluation of the dynamics during the step. If a terminal event function crosses zero
+            (see ``add_event_function``), the simulation stops and the last sample is the state at the
+            time of the crossing
+        '''
+        t_end, delta_t, num_steps = self._parse_time_interval(t_end, delta_t)
+        probes = self._compile_probes(probes)
+
+        if trajectory is None:
+            trajectory = Trajectory(self._system, num_steps + 1, dict((name, size) for name, source, size in probes[1]))
+        elif trajectory.get_capacity() - trajectory.get_num_samples() < num_steps + 1:
+            raise ValueError(f'The trajectory has not enough space to store {num_steps + 1} samples')
+
+        for chunk in self._simulate(t_end, delta_t, num_steps, trajectory, probes):
+            pass
+        return trajectory
+
+
+
+    def stream(self, t_end, delta_t, chunk=4096, probes=None):
+        '''stream(t_end: float, delta_t: float[, chunk: int, probes: Mapping]) -> Iterator[Trajectory]
+        Simulate the system from its current time until the time ``t_end`` with steps of
+        size ``delta_t`` (the last step is shortened to reach ``t_end`` exactly) and return
+        an iterator over the samples of the simulation grouped in chunks.
+
+        The memory used is constant regardless of the simulated time: The same Trajectory instance
+        is returned on each iteration, and its arrays are overwritten when the iterator advances
+        (copy them if they must be kept). All the chunks have ``chunk`` samples except the last one.
+
+            :Example:
+
+            >>> for samples in engine.stream(3600, 0.001, chunk=4096):
+            ...     print(samples.time[-1], samples.q.mean(axis=0))
+
+        :param chunk: The number of samples of each chunk
+        :param probes: Additional outputs to be stored on each sample (see ``run``)
+        '''
+        if not isinstance(chunk, int) or chunk <= 0:
+            raise TypeError('chunk must be an integer greater than zero')
+        t_end, delta_t, num_steps = self._parse_time_interval(t_end, delta_t)
+        probes = self._compile_probes(probes)
+        trajectory = Trajectory(self._system, chunk, dict((name, size) for name, source, size in probes[1]))
+        return self._simulate(t_end, delta_t, num_steps, trajectory, probes)
+
+
+
+    def stream_async(self, t_end, delta_t, chunk=4096, probes=None, executor=None):
+        '''stream_async(t_end: float, delta_t: float[, chunk: int, probes: Mapping, executor: Executor]) -> AsyncSimulation
+        Same as ``stream``, but the chunks are computed in an executor and the result can be used
+        from asyncio code: as an async iterator over the chunks or awaiting it to run the whole
+        simulation (see ``AsyncSimulation``).
+
+            :Example:
+
+            >>> async for samples in engine.stream_async(3600, 0.001, chunk=4096):
+            ...     print(samples.time[-1])
+            >>> await engine.stream_async(3600, 0.001)
+
+        :param executor: A thread pool executor where the chunks are computed. If not specified,
+            the default executor of the event loop is used
+        '''
+        return AsyncSimulation(self.stream(t_end, delta_t, chunk, probes), executor)
+
+
+
+    def _parse_time_interval(self, t_end, delta_t):
+        # Validate the final time & step size and compute the number of steps
+        try:
+            t_end, delta_t = float(t_end), float(delta_t)
+            if delta_t <= 0:
+                raise TypeError
+        except (TypeError, ValueError):
+            raise TypeError('t_end must be a number and delta_t a number greater than zero')
+        num_steps = max(ceil((t_end - self._system._time_value) / delta_t - 1e-9), 0)
+        return t_end, delta_t, num_steps
+
+
+
+    def _compile_probes(self, probes):
+        # Returns the numeric function which evaluates all the symbolic probes together and
+        # a list of tuples with the name, the source and the number of outputs of each probe.
+        # The source is the slice of the outputs of the numeric function for symbolic probes
+        # and the callable itself for the rest
+        if probes is None:
+            return None, []
+        if not isinstance(probes, Mapping):
+            raise TypeError('probes must be a mapping of names and matrices, expressions or callables')
+        if not all(isinstance(name, str) for name in probes.keys()):
+            raise TypeError('The names of the probes must be strings')
+
+        # Reuse the numeric function if the probes didnt change since the last call
+        key = tuple((name, id(probe)) for name, probe in probes.items())
+        if self._compiled_probes is not None and self._compiled_probes[0] == key:
+            return self._compiled_probes[2]
+
+        symbolic = [name for name, probe in probes.items() if not callable(probe)]
+        func, slices = _fuse_probes(self._system, [probes[name] for name in symbolic])
+        sources = dict(zip(symbolic, slices))
+
+        result = []
+        for name, probe in probes.items():
+            if name in sources:
+                source = sources[name]
+                result.append((name, source, source.stop - source.start))
+            else:
+                result.append((name, probe, np.asarray(probe()).size))
+        # (the probes are also stored so that their ids are not reused)
+        self._compiled_probes = key, dict(probes), (func, result)
+        return func, result
+
+
+
+    def _simulate(self, t_end, delta_t, num_steps, trajectory, probes):
+        # Perform the simulation steps storing the samples in the given trajectory. This
+        # generator yields the trajectory each time it gets full (and after the last step)
+        system = self._system
+        q_values, dq_values = system.get_coords_values(), system.get_velocities_values()
+        ddq_values = system.get_accelerations_values()
+        advance, record = self.advance, self.record
+        func, probes = probes
+        sources = [source for name, source, size in probes]
+
+        t_start = t = system._time_value
+        running = True
+        for k in range(0, num_steps + 1):
+            if k > 0:
+                t_next = t_end if k == num_steps else t_start + k * delta_t
+                running = advance(t, t_next - t)
+                t = system._time_value
+            if trajectory.is_full():
+                yield trajectory
+                trajectory.clear()
+            outputs = func.evaluate() if func is not None else None
+            trajectory.record(t, q_values, dq_values, ddq_values,
+                [outputs[source, 0] if isinstance(source, slice) else np.ravel(source()) for source in sources])
+            record()
+            if not running:
+                # A terminal event stopped the simulation
+                break
+        if trajectory.get_num_samples() > 0:
+            yield trajectory
+
+
+
+    def _advance_kinematics(self, t, delta_t):
+        # Same as advance, but solving the kinematic problem instead of integrating
+        system = self._system
+        crossings = self._crossings
+        solve = self._kinematic_problem_solver.solve
+        apply_schedules = self._schedules.apply if self._schedules.has_schedules() else None
+        t_end = t + delta_t
+        if not crossings.has_functions():
+            system._time_value = t_end
+            if apply_schedules is not None:
+                apply_schedules(t_end)
+            solve(delta_t)
+            return True
+
+        q_values, dq_values = system.get_coords_values(), system.get_velocities_values()
+        eps = 1e-12 * max(1.0, abs(t_end))
+        while True:
+            crossings.begin_step(t, np.concatenate([q_values, dq_values]))
+            system._time_value = t_end
+            if apply_schedules is not None:
+                apply_schedules(t_end)
+            solve(t_end - t)
+            events = crossings.end_step(t, t_end, np.concatenate([q_values, dq_values]),
+                self._set_kinematic_state, self._kinematic_derivative)
+            if not events:
+                return True
+
+            t = system._time_value
+            if any(event.is_terminal() for event in events):
+                return False
+            if t_end - t <= eps:
+                system._time_value = t_end
+                solve()
+                return True
+
+
+
+    def _set_kinematic_state(self, t, y):
+        # Set the time and solve the kinematic problem (the state vector is not needed because
+        # the state is determined by the time)
+        system = self._system
+        system._time_value = t
+        if self._schedules.has_schedules():
+            self._schedules.apply(t)
+        self._kinematic_problem_solver.solve()
+
+
+
+    def _kinematic_derivative(self, t, y, dy):
+        # Derivative of the state vector in kinematic mode
+        self._set_kinematic_state(t, y)
+        system = self._system
+        n = y.shape[0] // 2
+        dy[:n] = system.get_velocities_values()
+        dy[n:] = system.get_accelerations_values()
+
+
+
+    def _set_state(self, t, y):
+        # Set the numeric values of the time, coordinates & velocities from a state vector
+        system = self._system
+        q_values, dq_values = system.get_coords_values(), system.get_velocities_values()
+        n = q_values.shape[0]
+        q_values[:], dq_values[:] = y[:n], y[n:]
+        system._time_value = t
+        if self._schedules.has_schedules():
+            self._schedules.apply(t)
+
+
+
+    def _state_derivative(self, t, y, dy):
+        # Evaluate the derivative of the state vector solving the dynamic problem (if configured)
+        self._set_state(t, y)
+        system = self._system
+        n = y.shape[0] // 2
+        self._dynamic_problem_step()
+        dy[:n] = system.get_velocities_values()
+        dy[n:] = system.get_accelerations_values()
+
+
+
+    def _derivative(self, t, y, dy):
+        # Derivative of the state vector used when the dynamic problem is not configured
+        # (the current accelerations are taken as constants)
+        n = y.shape[0] // 2
+        dy[:n] = y[n:]
+        dy[n:] = self._system.get_accelerations_values()
+
+
+
+    def _bind_integrator(self, method):
+        # Set the callbacks used by the integrator to evaluate the derivative of the state
+        # vector (and its jacobian for implicit integrators). If some inputs are driven by
+        # schedules, they are evaluated at the time of each stage before the callbacks
+        solver = self._dynamic_problem_solver
+        schedules = self._schedules
+        derivative = self._derivative if solver is None else solver.derivative
+        jacobian = None if solver is None else solver.jacobian
+        if schedules.has_schedules():
+            derivative = schedules.wrap(derivative)
+            jacobian = schedules.wrap(jacobian) if jacobian is not None else None
+        method.set_derivative(derivative)
+        if isinstance(method, ImplicitIntegrator):
+            method.set_jacobian(jacobian)
+
+
+
+    def _update_schedules(self):
+        # Called when the input schedules change: the inputs are updated to the current time
+        # and the callbacks of the integrator are bound again
+        schedules = self._schedules
+        if schedules.has_schedules():
+            schedules.apply(self._system._time_value)
+        method = self._integration_method
+        if isinstance(method, Integrator):
+            self._bind_integrator(method)
+
+
+
+
+
+
+######## Functions ########
+
+def run_simulation(system, t_end, delta_t, integration_method='euler', dynamics=None, assembly_problem=None, probes=None, kinematics=None):
+    '''run_simulation(system: System, t_end: float, delta_t: float, ...) -> Trajectory
+    Simulate a mechanical system from the time 0 until the time ``t_end`` without the graphical
+    environment. The numeric values of the symbols are not restored when the simulation ends.
+
+        :Example:
+
+        >>> trajectory = run_simulation(get_default_system(), 10, 0.01, 'rk4', dynamics=(M_qq, delta_q, Phi_q, gamma))
+        >>> trajectory.q.shape
+        (1001, 3)
+
+    :param system: The system to simulate
+    :param t_end: Final time of the simulation
+    :param delta_t: Size of the simulation steps
+    :param integration_method: The integration method (see ``SimulationEngine.set_integration_method``)
+    :param dynamics: A DynamicProblemSolver or a tuple/dict with the arguments to create it
+        (if not specified, the accelerations remain constant)
+    :param assembly_problem: An AssemblyProblemSolver or a tuple/dict with the arguments to
+        create it (optional)
+    :param probes: Additional outputs to be stored on each sample (see ``SimulationEngine.run``)
+    :param kinematics: A KinematicProblemSolver or a tuple/dict with the arguments to create it. If
+        specified, the simulation is kinematic (see ``SimulationEngine.kinematics``)
+    :returns: The trajectory of the coordinates, velocities, accelerations and probes
+    '''
+    engine = SimulationEngine(system)
+    engine.set_integration_method(integration_method)
+    for setup, args in ((engine.dynamics, dynamics), (engine.assembly_problem, assembly_problem), (engine.kinematics, kinematics)):
+        if args is None:
+            continue
+        if isinstance(args, dict):
+            setup(**args)
+        elif isinstance(args, (tuple, list)):
+            setup(*args)
+        else:
+            setup(args)
+
+    system._time_value = 0.0
+    engine.init()
+    return engine.run(t_end, delta_t, probes=probes)
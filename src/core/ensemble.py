@@ -0,0 +1,459 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the classes Ensemble and BatchedNumericFunction
+'''
+
+######## Import statements ########
+
+from math import ceil
+from inspect import isclass
+import numpy as np
+from numpy.linalg import solve, pinv, LinAlgError
+
+from .integration import NumericIntegration, Integrator, ImplicitIntegrator
+from .dynamics import DynamicProblemSolver
+
+
+
+######## class BatchedNumericFunction ########
+
+class BatchedNumericFunction:
+    '''
+    Evaluates a numeric function (see ``NumericFunction``) for many different values of the
+    symbols at once.
+
+    The atoms and outputs of the numeric function are compiled again replacing the scalar
+    operations by numpy operations over arrays with one item per member of an ensemble:
+    the output of ``evaluate`` is an array with the shape (rows, columns, N)
+
+    A batched function can also be created from another one to evaluate it on a different
+    ensemble (of the same system). In such case, the compiled code is shared.
+    '''
+    def __init__(self, func, ensemble):
+        '''
+        Constructor.
+
+        :param func: The numeric function to evaluate (returned by ``System.compile_numeric_function``)
+            or a batched function already compiled for another ensemble
+        :param ensemble: The ensemble which stores the values of the symbols of each member
+        '''
+        if isinstance(func, BatchedNumericFunction):
+            (rows, cols), code = func.get_shape(), func._code
+        else:
+            atoms, outputs = func.get_atoms(), np.asarray(func.get_outputs())
+            rows, cols = outputs.shape
+
+            lines = [f'{name} = {value}' for name, value in atoms.items()]
+            for i in range(0, rows):
+                for j in range(0, cols):
+                    lines.append(f'__output__[{i}, {j}] = {outputs[i, j]}')
+            code = compile('\n'.join(lines), '<string>', 'exec', optimize=2)
+
+        self._ensemble = ensemble
+        self._output = np.zeros((rows, cols, ensemble.get_size()), dtype=np.float64)
+        self._globals = dict(ensemble._values, sin=np.sin, cos=np.cos, tan=np.tan,
+            euler=np.e, tau=2 * np.pi, pi=np.pi, __output__=self._output)
+        self._code = code
+
+
+
+    def get_shape(self):
+        '''get_shape() -> Tuple[int, int]
+        Get the number of rows and columns of the outputs of the function
+        '''
+        return self._output.shape[:2]
+
+
+    def evaluate(self):
+        '''evaluate() -> np.ndarray
+        Evaluate the function for all the members of the ensemble. The returned array (with
+        the shape (rows, columns, N)) is overwritten on the next call
+        '''
+        self._globals['t'] = self._ensemble._time
+        exec(self._code, None, self._globals)
+        return self._output
+
+
+
+
+
+
+######## class Ensemble ########
+
+class Ensemble:
+    '''
+    This class can be used to simulate N copies of the same model (with different values of
+    their symbols) in lock-step.
+
+    The numeric values of the symbols of each type are stored in arrays with one column
+    per member, and the compiled numeric functions of the dynamic problem are evaluated for
+    all the members at once. The augmented systems of the dynamic problem of all the members
+    are solved together with a batched LU factorization.
+
+    The members whose state is not finite (or exceeds the divergence threshold) are masked:
+    their state is frozen and they are excluded from the linear solves.
+
+        :Example:
+
+        >>> ensemble = Ensemble(get_default_system(), 1000)
+        >>> ensemble.set_value('l', np.random.uniform(1, 2, 1000))
+        >>> ensemble.dynamics(M_qq, delta_q, Phi_q, gamma)
+        >>> ensemble.set_integration_method('rk4')
+        >>> t, q, dq = ensemble.run(10, 0.001, sample_interval=0.01)
+        >>> q.shape
+        (1001, 1000, 3)
+    '''
+    def __init__(self, system, size, divergence_threshold=1e10):
+        '''
+        Constructor. The initial values of the symbols of all the members are the current
+        numeric values of the symbols of the system.
+
+        :param system: The system which defines the model (all its symbols must be created
+            before the ensemble)
+        :param size: The number of members
+        :param divergence_threshold: Members whose coordinates or velocities exceed this value
+            (in absolute value) are considered diverged
+        '''
+        if not isinstance(size, int) or size <= 0:
+            raise TypeError('size must be an integer greater than zero')
+        try:
+            divergence_threshold = float(divergence_threshold)
+        except (TypeError, ValueError):
+            raise TypeError('divergence_threshold must be a number')
+
+        self._system = system
+        self._size = size
+        self._divergence_threshold = divergence_threshold
+        self._time = system._time_value
+        self._values = dict(
+            (kind, np.repeat(values.as_array()[:, :, np.newaxis], size, axis=2))
+            for kind, values in system._symbols_values.items())
+        self._names = dict((kind, list(values.keys())) for kind, values in system._symbols_values.items())
+        self._active = np.ones(size, dtype=np.bool_)
+        self._M_qq_func, self._delta_q_func = None, None
+        self._Phi_q_func, self._gamma_func = None, None
+        self._n = self._values['coordinate'].shape[0]
+        self._state = np.zeros((2 * self._n, size), dtype=np.float64)
+        self._previous_state = np.zeros((2 * self._n, size), dtype=np.float64)
+        self.set_integration_method('rk4')
+
+
+
+    ######## Getters ########
+
+    def get_system(self):
+        '''get_system() -> System
+        Get the system which defines the model of the ensemble
+        '''
+        return self._system
+
+
+    def get_size(self):
+        '''get_size() -> int
+        Get the number of members of the ensemble
+        '''
+        return self._size
+
+
+    def get_time(self):
+        '''get_time() -> float
+        Get the current time of the ensemble
+        '''
+        return self._time
+
+
+    def get_symbols_values(self, kind):
+        '''get_symbols_values(kind: str) -> np.ndarray
+        Get the numeric values of the symbols of the given type of all the members (a view
+        with the shape (N, n) where n is the number of symbols of that type)
+        '''
+        try:
+            return self._values[kind][:, 0, :].T
+        except KeyError:
+            raise ValueError(f'Invalid symbol type "{kind}"')
+
+
+    def get_coords_values(self):
+        return self.get_symbols_values('coordinate')
+
+    def get_velocities_values(self):
+        return self.get_symbols_values('velocity')
+
+    def get_accelerations_values(self):
+        return self.get_symbols_values('acceleration')
+
+
+    def get_value(self, name):
+        '''get_value(name: str) -> np.ndarray
+        Get the numeric values of the symbol with the given name of all the members
+
+        :raises IndexError: If there is no symbol with that name
+        '''
+        kind, index = self._locate(name)
+        return self._values[kind][index, 0]
+
+
+    def get_active_mask(self):
+        '''get_active_mask() -> np.ndarray
+        Get a boolean array which indicates which members are being simulated (False for
+        the diverged or disabled members)
+        '''
+        return self._active
+
+
+    def get_num_active(self):
+        '''get_num_active() -> int
+        Get the number of members being simulated
+        '''
+        return int(np.count_nonzero(self._active))
+
+
+    def get_integration_method(self):
+        '''get_integration_method() -> Integrator
+        Get the integrator used to advance the state of the members
+        '''
+        return self._integrator
+
+
+
+    def _locate(self, name):
+        # Get the type and the index of the symbol with the given name
+        if not isinstance(name, str):
+            raise TypeError('Input argument must be a string')
+        for kind, names in self._names.items():
+            if name in names:
+                return kind, names.index(name)
+        raise IndexError(f'There is no symbol called "{name}"')
+
+
+
+    ######## Setters ########
+
+    def set_value(self, name, values):
+        '''set_value(name: str, values: float | np.ndarray)
+        Change the numeric value of the symbol with the given name of all the members
+
+        :param values: A number (the same value for all the members) or an array with one
+            item per member
+        :raises IndexError: If there is no symbol with that name
+        '''
+        kind, index = self._locate(name)
+        self._values[kind][index, 0] = values
+
+
+    def set_time(self, t):
+        '''set_time(t: float)
+        Change the current time of the ensemble
+        '''
+        self._time = float(t)
+
+
+    def set_active_mask(self, mask):
+        '''set_active_mask(mask: np.ndarray)
+        Enable or disable the simulation of each member
+
+        :param mask: A boolean array with one item per member
+        '''
+        mask = np.asarray(mask, dtype=np.bool_)
+        if mask.shape != (self._size,):
+            raise ValueError(f'The mask must be an array with {self._size} items')
+        self._active[:] = mask
+
+
+    def set_integration_method(self, method, *args, **kwargs):
+        '''set_integration_method(method: str | Integrator, ...)
+        Change the integration method. Only the explicit integrators are supported (their
+        operations are vectorized over the members). The adaptive integrators choose the same
+        step size for all the members
+
+        :param method: The name of a predefined integrator like 'rk4', 'dopri5' or 'abm', an
+            Integrator instance or an Integrator subclass
+        :param args: Additional positional arguments to create the integrator
+        :param kwargs: Additional keyword arguments to create the integrator
+        '''
+        if isinstance(method, str):
+            method = NumericIntegration.get_method(method, *args, **kwargs)
+        elif isclass(method) and issubclass(method, Integrator):
+            method = method(*args, **kwargs)
+        if not isinstance(method, Integrator):
+            raise TypeError('Integration method must be an integrator or the name of an integrator')
+        if isinstance(method, ImplicitIntegrator):
+            raise TypeError('Implicit integrators are not supported by ensembles')
+        method.set_derivative(self._derivative)
+        self._integrator = method
+
+
+
+    ######## Compilation ########
+
+    def compile_numeric_function(self, x, c_optimized=False):
+        '''compile_numeric_function(x: Matrix | Expr | NumericFunction | BatchedNumericFunction) -> BatchedNumericFunction
+        Compile a symbolic matrix or expression (or a numeric function already compiled) to be
+        evaluated for all the members of the ensemble at once. If x is a batched function of another
+        ensemble, its compiled code is reused
+        '''
+        if not isinstance(x, BatchedNumericFunction) and not hasattr(x, 'get_atoms'):
+            x = self._system.compile_numeric_function(x)
+        return BatchedNumericFunction(x, self)
+
+
+
+    def dynamics(self, *args, **kwargs):
+        '''dynamics(...)
+        Setup the dynamic problem. The accelerations of all the members are computed on each
+        evaluation solving their augmented systems:
+
+        | M_qq   Phi_q^T | | ddq    |   | delta_q |
+        | Phi_q     0    | | lambda | = | gamma   |
+
+        You must pass the matrices M_qq, delta_q and optionally Phi_q and gamma as positional
+        or keyword arguments, or a DynamicProblemSolver instance as the only argument.
+        Another ensemble of the same system can also be passed as the only argument to reuse
+        its dynamic problem (the numeric functions are not compiled again).
+        '''
+        if len(args) == 1 and not kwargs and isinstance(args[0], Ensemble):
+            source = args[0]
+            if source._M_qq_func is None:
+                raise RuntimeError('The dynamic problem of the ensemble is not setup yet')
+            n = source._n
+            m = source._A.shape[1] - n
+        else:
+            if len(args) == 1 and not kwargs and isinstance(args[0], DynamicProblemSolver):
+                source = args[0]
+            else:
+                source = DynamicProblemSolver(self._system, *args, **kwargs)
+            n, m = source.get_num_coordinates(), source.get_num_constraints()
+        compile = self.compile_numeric_function
+        self._M_qq_func, self._delta_q_func = compile(source._M_qq_func), compile(source._delta_q_func)
+        if m > 0:
+            self._Phi_q_func, self._gamma_func = compile(source._Phi_q_func), compile(source._gamma_func)
+        else:
+            self._Phi_q_func, self._gamma_func = None, None
+
+        self._A = np.zeros((self._size, n + m, n + m), dtype=np.float64)
+        self._b = np.zeros((self._size, n + m, 1), dtype=np.float64)
+        self._unknowns_values = self._values['joint_unknown'][:, 0]
+        if self._unknowns_values.shape[0] != m:
+            self._unknowns_values = None
+
+
+
+    ######## Simulation ########
+
+    def solve_dynamics(self):
+        '''solve_dynamics()
+        Compute the accelerations of the active members at their current state solving the
+        augmented systems of the dynamic problem (with a batched LU factorization). If the number
+        of joint unknowns matches the number of constraints, the lagrange multipliers are stored
+        as their numeric values.
+        '''
+        if self._M_qq_func is None:
+            return
+        n = self._n
+        m = self._A.shape[1] - n
+        active = np.flatnonzero(self._active)
+        if active.shape[0] == 0:
+            return
+
+        # Build the augmented systems of all the members (one matrix per member)
+        A, b = self._A, self._b
+        A[:, :n, :n] = self._M_qq_func.evaluate().transpose(2, 0, 1)
+        b[:, :n, 0] = self._delta_q_func.evaluate()[:, 0].T
+        if m > 0:
+            Phi_q = self._Phi_q_func.evaluate().transpose(2, 0, 1)
+            A[:, n:, :n] = Phi_q
+            A[:, :n, n:] = Phi_q.transpose(0, 2, 1)
+            b[:, n:, 0] = self._gamma_func.evaluate()[:, 0].T
+
+        A_active, b_active = A[active], b[active]
+        try:
+            x = solve(A_active, b_active)
+        except LinAlgError:
+            # Singular matrices (redundant constraints)
+            x = np.matmul(pinv(A_active), b_active)
+
+        self._values['acceleration'][:n, 0, active] = x[:, :n, 0].T
+        if self._unknowns_values is not None:
+            self._unknowns_values[:, active] = x[:, n:, 0].T
+
+
+
+    def step(self, delta_t):
+        '''step(delta_t: float)
+        Advance the coordinates, velocities and time of all the active members. The members
+        whose state diverges are masked (their state is restored to the one before the step)
+        '''
+        n, y, y_prev, t = self._n, self._state, self._previous_state, self._time
+        q_values, dq_values = self._values['coordinate'][:, 0], self._values['velocity'][:, 0]
+        y[:n], y[n:] = q_values, dq_values
+        np.copyto(y_prev, y)
+
+        with np.errstate(all='ignore'):
+            self._integrator.step(t, y, delta_t)
+            diverged = ~np.all(np.isfinite(y) & (np.abs(y) <= self._divergence_threshold), axis=0)
+
+        inactive = ~self._active
+        if np.any(diverged):
+            self._active &= ~diverged
+            inactive |= diverged
+        y[:, inactive] = y_prev[:, inactive]
+        q_values[:], dq_values[:] = y[:n], y[n:]
+        self._time = t + delta_t
+
+
+
+    def run(self, t_end, delta_t, sample_interval=None):
+        '''run(t_end: float, delta_t: float[, sample_interval: float]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]
+        Simulate all the members from the current time until ``t_end`` with steps of size ``delta_t``
+        (the last step is shortened to reach ``t_end`` exactly)
+
+        :param sample_interval: Minimum time between two consecutive samples stored (by default,
+            all the steps are stored)
+        :returns: The time of the samples (K,), and the coordinates and velocities of the members
+            on each sample (arrays with the shape (K, N, n))
+        '''
+        try:
+            t_end, delta_t = float(t_end), float(delta_t)
+            if delta_t <= 0:
+                raise TypeError
+        except (TypeError, ValueError):
+            raise TypeError('t_end must be a number and delta_t a number greater than zero')
+        num_steps = max(ceil((t_end - self._time) / delta_t - 1e-9), 0)
+        stride = 1 if sample_interval is None else max(int(round(float(sample_interval) / delta_t)), 1)
+        num_samples = num_steps // stride + 1 + (1 if num_steps % stride else 0)
+
+        N, n = self._size, self._n
+        time = np.zeros(num_samples, dtype=np.float64)
+        q, dq = np.zeros((num_samples, N, n), dtype=np.float64), np.zeros((num_samples, N, n), dtype=np.float64)
+
+        self._integrator.reset()
+        t_start, k = self._time, 0
+        for step in range(0, num_steps + 1):
+            if step > 0:
+                t_next = t_end if step == num_steps else t_start + step * delta_t
+                self.step(t_next - self._time)
+                self._time = t_next
+            if step % stride == 0 or step == num_steps:
+                time[k] = self._time
+                q[k], dq[k] = self.get_coords_values(), self.get_velocities_values()
+                k += 1
+        return time, q, dq
+
+
+
+    def _derivative(self, t, y, dy):
+        # Derivative of the state vectors of all the members (one column per member)
+        n = self._n
+        self._values['coordinate'][:, 0] = y[:n]
+        self._values['velocity'][:, 0] = y[n:]
+        self._time = t
+        self.solve_dynamics()
+        dy[:n] = y[n:]
+        dy[n:] = self._values['acceleration'][:n, 0]
+
+        # Mask the members whose derivative is not finite (so that they dont affect the
+        # step size control of the adaptive integrators)
+        diverged = ~np.all(np.isfinite(dy), axis=0)
+        if np.any(diverged):
+            self._active &= ~diverged
+        dy[:, ~self._active] = 0
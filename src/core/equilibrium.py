@@ -0,0 +1,304 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the class EquilibriumSolver and the function solve_equilibrium
+'''
+
+######## Import statements ########
+
+from collections.abc import Mapping
+import numpy as np
+from numpy.linalg import solve, pinv, LinAlgError
+
+from lib3d_mec_ginac_ext import Matrix
+from .ensemble import Ensemble
+
+
+
+######## class EquilibriumSolver ########
+
+class EquilibriumSolver:
+    '''
+    This class can be used to find the static equilibrium configurations of a mechanical
+    system (the velocities and accelerations are zero):
+
+        | delta_q - Phi_q^T * lambda |
+        |                            | = 0
+        | Phi                        |
+
+    The unknowns are the coordinates and the lagrange multipliers of the constraints (the
+    joint unknowns of the system). The residual and its jacobian are built symbolically and
+    compiled only once when the solver is created (also their batched versions, which are bound
+    to one ensemble per number of load cases).
+
+    The nonlinear equations are solved with a Levenberg-Marquardt iteration (a damped Newton
+    method whose damping acts as a trust region): the damping of each solution is decreased
+    when a step reduces the residual and increased (and the step rejected) otherwise.
+    Many load cases (different values of the parameters or inputs) can be solved together:
+    they are evaluated as the members of an ``Ensemble`` and their linear systems are solved
+    with a single batched factorization.
+
+        :Example:
+
+        >>> solver = EquilibriumSolver(get_default_system(), delta_q, Phi)
+        >>> solver.solve()
+        >>> q, lambdas, converged = solver.solve_batch({'m': np.linspace(1, 10, 100)})
+    '''
+    def __init__(self, system, delta_q, Phi=None, Phi_q=None, tol=1e-10, max_iterations=100, c_optimized=False):
+        '''
+        Constructor.
+
+        :param system: The system whose equilibrium configurations will be computed
+        :param delta_q: The column matrix delta_q of the dynamic problem
+        :param Phi: The geometric constraints (optional)
+        :param Phi_q: The jacobian of the constraints with respect the coordinates. It is computed if
+            not specified
+        :param tol: The tolerance of the norm of the residual
+        :param max_iterations: The maximum number of iterations
+        :param c_optimized: If True, the residual and its jacobian are compiled as cython extensions
+        '''
+        if not isinstance(delta_q, Matrix) or (Phi is not None and not isinstance(Phi, Matrix)):
+            raise TypeError('delta_q and Phi must be Matrix objects')
+        if Phi is None and Phi_q is not None:
+            raise TypeError('Phi_q cant be specified without Phi')
+        try:
+            tol = float(tol)
+        except (TypeError, ValueError):
+            raise TypeError('tol must be a number')
+        if tol <= 0:
+            raise ValueError('tol must be greater than zero')
+        if not isinstance(max_iterations, int) or max_iterations <= 0:
+            raise TypeError('max_iterations must be an integer greater than zero')
+
+        q = system.get_coords_matrix()
+        n = q.get_num_rows()
+        if delta_q.get_shape() != (n, 1):
+            raise ValueError(f'delta_q must be a column matrix with {n} rows')
+
+        m = 0
+        residual, variables = delta_q, q
+        if Phi is not None:
+            if Phi.get_num_cols() != 1:
+                Phi = Phi.transpose()
+            m = Phi.get_num_rows()
+            if Phi_q is None:
+                Phi_q = system.jacobian(Phi.transpose(), q)
+            if Phi_q.get_shape() != (m, n):
+                raise ValueError(f'Phi_q must be a matrix {m}x{n}')
+            lambdas = system.get_joint_unknowns_matrix()
+            if lambdas.get_num_rows() != m:
+                raise ValueError('The number of joint unknowns must match the number of constraints')
+            residual = Matrix.block(2, 1, delta_q - Phi_q.transpose() * lambdas, Phi)
+            variables = Matrix.block(2, 1, q, lambdas)
+
+        compile = system.compile_numeric_function
+        self._system = system
+        self._n, self._m = n, m
+        self._tol, self._max_iterations = tol, max_iterations
+        self._residual_func = compile(residual, c_optimized)
+        self._jacobian_func = compile(system.jacobian(residual.transpose(), variables), c_optimized)
+        self._num_iterations = 0
+
+        # Compile the batched functions (they are bound to the ensemble of each batch size later)
+        prototype = Ensemble(system, 1)
+        self._batched_residual_func = prototype.compile_numeric_function(self._residual_func)
+        self._batched_jacobian_func = prototype.compile_numeric_function(self._jacobian_func)
+        self._ensembles = {}
+
+
+
+    ######## Getters ########
+
+    def get_num_coordinates(self):
+        '''get_num_coordinates() -> int
+        Get the number of coordinates
+        '''
+        return self._n
+
+
+    def get_num_constraints(self):
+        '''get_num_constraints() -> int
+        Get the number of constraints (the number of lagrange multipliers computed)
+        '''
+        return self._m
+
+
+    def get_num_iterations(self):
+        '''get_num_iterations() -> int
+        Get the number of iterations performed in the last call to ``solve`` or ``solve_batch``
+        '''
+        return self._num_iterations
+
+
+
+    ######## Solve ########
+
+    def solve(self):
+        '''solve()
+        Compute the equilibrium configuration closest to the current values of the coordinates.
+        The numeric values of the coordinates and joint unknowns of the system are updated with the solution,
+        and the velocities and accelerations are set to zero.
+
+        :raises RuntimeError: If the iteration doesnt converge
+        '''
+        q, lambdas, converged = self.solve_batch(size=1)
+        if not converged[0]:
+            raise RuntimeError(f'Equilibrium not found after {self._num_iterations} iterations')
+        system = self._system
+        system.get_coords_values()[:, 0] = q[0]
+        system.get_velocities_values()[:] = 0
+        system.get_accelerations_values()[:] = 0
+        if self._m > 0:
+            system.get_joint_unknowns_values()[:, 0] = lambdas[0]
+
+
+
+    def solve_batch(self, parameters=None, q=None, size=None):
+        '''solve_batch([parameters: Mapping[str, np.ndarray], q: np.ndarray, size: int]) -> Tuple[np.ndarray]
+        Compute the equilibrium configurations of many load cases at once. The numeric values of the
+        symbols of the system are not modified.
+
+        :param parameters: A mapping with the names of the symbols (parameters or inputs) whose values
+            change between the load cases and arrays with their values (one per load case)
+        :param q: The initial guess of the coordinates (an array with the shape (n,) or (N, n)).
+            By default, the current values of the coordinates
+        :param size: The number of load cases. Only needed if parameters and q are not specified
+        :returns: The coordinates (an array with the shape (N, n)), the lagrange multipliers (N, m)
+            and a boolean mask indicating which load cases converged (N,)
+        '''
+        if parameters is None:
+            parameters = {}
+        if not isinstance(parameters, Mapping):
+            raise TypeError('parameters must be a mapping of symbol names and values')
+        parameters = dict((name, np.asarray(values, dtype=np.float64).reshape(-1)) for name, values in parameters.items())
+        sizes = set(values.shape[0] for values in parameters.values())
+        if q is not None:
+            q = np.asarray(q, dtype=np.float64)
+            if q.ndim == 2:
+                sizes.add(q.shape[0])
+        if size is not None:
+            sizes.add(size)
+        if len(sizes) > 1:
+            raise ValueError('All the parameters and initial guesses must have the same number of load cases')
+        size = sizes.pop() if sizes else 1
+
+        n, m = self._n, self._m
+        ensemble, residual_func, jacobian_func = self._get_ensemble(size)
+        for name, values in parameters.items():
+            ensemble.set_value(name, values)
+        values = ensemble._values
+        values['velocity'][:] = 0
+        values['acceleration'][:] = 0
+        if q is not None:
+            values['coordinate'][:, 0] = np.broadcast_to(q, (size, n)).T
+        if m > 0:
+            values['joint_unknown'][:, 0] = 0
+
+        # The unknowns of all the load cases (one column per load case)
+        z = np.concatenate([values['coordinate'][:, 0], values['joint_unknown'][:, 0]]) if m > 0 else values['coordinate'][:, 0]
+        z = z.copy()
+
+        def set_unknowns(z):
+            values['coordinate'][:, 0] = z[:n]
+            if m > 0:
+                values['joint_unknown'][:, 0] = z[n:]
+
+        r = residual_func.evaluate()[:, 0].copy()
+        error = np.linalg.norm(r, axis=0)
+        converged = error <= self._tol
+        damping = np.full(size, np.nan)
+        identity = np.eye(n + m)
+
+        num_iterations = 0
+        while num_iterations < self._max_iterations and not converged.all():
+            num_iterations += 1
+            active = np.flatnonzero(~converged)
+
+            # Damped newton step: (J^T J + mu * I) dz = -J^T r
+            J = jacobian_func.evaluate().transpose(2, 0, 1)[active]
+            JT = J.transpose(0, 2, 1)
+            JTJ = np.matmul(JT, J)
+            uninitialized = np.isnan(damping[active])
+            if uninitialized.any():
+                # Initial damping relative to the scale of the jacobian
+                scale = np.diagonal(JTJ[uninitialized], axis1=1, axis2=2).max(axis=1)
+                damping[active[uninitialized]] = 1e-3 * np.maximum(scale, 1.0)
+            A = JTJ + damping[active, np.newaxis, np.newaxis] * identity
+            b = -np.matmul(JT, r[:, active].T[:, :, np.newaxis])
+            try:
+                dz = solve(A, b)[:, :, 0].T
+            except LinAlgError:
+                dz = np.matmul(pinv(A), b)[:, :, 0].T
+
+            # Evaluate the residual at the trial points
+            z_trial = z.copy()
+            z_trial[:, active] += dz
+            set_unknowns(z_trial)
+            r_trial = residual_func.evaluate()[:, 0]
+            error_trial = np.linalg.norm(r_trial, axis=0)
+
+            # Accept the steps which reduce the residual (increase the damping of the others)
+            accepted = np.zeros(size, dtype=np.bool_)
+            accepted[active] = np.isfinite(error_trial[active]) & (error_trial[active] < error[active])
+            z[:, accepted] = z_trial[:, accepted]
+            r[:, accepted] = r_trial[:, accepted]
+            error[accepted] = error_trial[accepted]
+            damping[accepted] = np.maximum(damping[accepted] / 3, 1e-12)
+            rejected = np.setdiff1d(active, np.flatnonzero(accepted))
+            damping[rejected] *= 4
+            set_unknowns(z)
+            converged = error <= self._tol
+
+        self._num_iterations = num_iterations
+        return z[:n].T.copy(), z[n:].T.copy(), converged
+
+
+
+    def _get_ensemble(self, size):
+        # Get the ensemble used to solve the given number of load cases and the batched residual
+        # and jacobian bound to it. The members start with the current numeric values of the symbols
+        # of the system
+        system = self._system
+        if size in self._ensembles:
+            ensemble = self._ensembles[size][0]
+            for kind, values in system._symbols_values.items():
+                ensemble._values[kind][...] = values.as_array()[:, :, np.newaxis]
+            ensemble._time = system._time_value
+            return self._ensembles[size]
+
+        ensemble = Ensemble(system, size)
+        compile = ensemble.compile_numeric_function
+        self._ensembles[size] = ensemble, compile(self._batched_residual_func), compile(self._batched_jacobian_func)
+        return self._ensembles[size]
+
+
+
+######## Functions ########
+
+def solve_equilibrium(system, delta_q, Phi=None, Phi_q=None, parameters=None, q=None, **kwargs):
+    '''solve_equilibrium(system: System, delta_q: Matrix[, Phi: Matrix, Phi_q: Matrix, parameters: Mapping, q: np.ndarray])
+    Find the static equilibrium configuration of a mechanical system (see ``EquilibriumSolver``).
+
+    If ``parameters`` is not specified, the numeric values of the coordinates and joint unknowns of
+    the system are updated with the solution (the coordinates are initialized with ``q`` if it is given).
+    Otherwise, or if ``q`` has one initial guess per row, the equilibrium configurations of all the load
+    cases are computed and returned (see ``EquilibriumSolver.solve_batch``)
+
+        :Example:
+
+        >>> solve_equilibrium(get_default_system(), delta_q, Phi)
+        >>> solve_equilibrium(get_default_system(), delta_q, Phi, q=[0.1, 0.2, 0])
+        >>> q, lambdas, converged = solve_equilibrium(get_default_system(), delta_q, Phi, parameters={'F': [0, 1, 2]})
+
+    :param kwargs: Additional arguments passed to the constructor of ``EquilibriumSolver``
+    '''
+    solver = EquilibriumSolver(system, delta_q, Phi, Phi_q, **kwargs)
+    if q is not None:
+        q = np.asarray(q, dtype=np.float64)
+    if parameters is None and (q is None or q.ndim < 2):
+        if q is not None:
+            n = solver.get_num_coordinates()
+            if q.size != n:
+                raise ValueError(f'q must be an array with {n} items')
+            system.get_coords_values()[:, 0] = q.reshape(-1)
+        return solver.solve()
+    return solver.solve_batch(parameters, q)
@@ -1,15 +1,1092 @@
 '''
 Author: Víctor Ruiz Gómez
-Description: This script defines the class IntegrationMethod and its subclasses
+Description: This script defines the class NumericIntegration, the class Integrator
+and its subclasses
 '''
 
 
 ######## Import statements ########
 
+import numpy as np
+from inspect import isclass
+from math import sqrt
 
+from .linalg import MatrixFactorization
 
 
-######## class IntegrationMethod ########
+
+
+######## Helper functions ########
+
+def _is_history_value(value):
+    # Returns True if the given value is part of the history of an integrator (see Integrator.get_history)
+    if value is None or isinstance(value, (bool, int, float, str, np.generic, np.ndarray)):
+        return True
+    if isinstance(value, (tuple, list)):
+        return all(map(_is_history_value, value))
+    return False
+
+
+def _copy_history_value(value):
+    # Deep copy of a value of the history of an integrator
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, (tuple, list)):
+        return type(value)(map(_copy_history_value, value))
+    return value
+
+
+
+
+
+######## class Integrator ########
+
+class Integrator:
+    '''
+    Base class for all the integration methods that operate over a packed state vector.
+
+    The state vector ``y`` is a numpy column array which contains the numeric values of the
+    coordinates followed by the values of the velocities ( ``y = [q; dq]`` ).
+
+    Integrators evaluate the time derivative of the state by invoking a callback with
+    the signature ``derivative(t, y, dy)``. It must store the derivative of ``y`` at time ``t``
+    ( the velocities followed by the accelerations, ``dy = [dq; ddq]`` ) in the array ``dy``.
+    The callback can be invoked several times on each step with intermediate states.
+
+    Internal buffers are preallocated the first time the integrator is used with a
+    state vector (and reallocated only when its shape changes).
+    '''
+
+    # Name of the integration method
+    name = None
+
+    # Order of accuracy of the integration method
+    order = None
+
+    # Fields which are not part of the history of the integrator (see get_history)
+    _volatile_fields = ('_derivative', '_jacobian')
+
+
+    def __init__(self, derivative=None):
+        '''
+        Constructor.
+
+        :param derivative: The derivative callback (it can also be set later with
+            ``set_derivative``)
+        '''
+        self._derivative = None
+        self._shape = None
+        self._num_evaluations = 0
+        if derivative is not None:
+            self.set_derivative(derivative)
+
+
+
+    ######## Getters ########
+
+    def get_derivative(self):
+        '''get_derivative() -> Callable
+        Get the callback used to evaluate the time derivative of the state vector
+        '''
+        return self._derivative
+
+
+    def get_num_evaluations(self):
+        '''get_num_evaluations() -> int
+        Get the number of times the derivative callback was invoked by this integrator
+        '''
+        return self._num_evaluations
+
+
+
+    ######## Setters ########
+
+    def set_derivative(self, derivative):
+        '''set_derivative(derivative: Callable)
+        Change the callback used to evaluate the time derivative of the state vector.
+        Any information stored from previous steps is discarded.
+        '''
+        if not callable(derivative):
+            raise TypeError('The derivative must be a callable object')
+        self._derivative = derivative
+        self.reset()
+
+
+
+    ######## History ########
+
+    def get_history(self):
+        '''get_history() -> Dict[str, Any]
+        Get a copy of the information stored from previous steps (including the internal buffers
+        and counters), so that the integration can be resumed later exactly at the same point
+        (see ``set_history``). Its values are numbers, strings, None, numpy arrays or tuples
+        and lists of them
+        '''
+        return dict((name, _copy_history_value(value)) for name, value in vars(self).items()
+            if name not in self._volatile_fields and _is_history_value(value))
+
+
+
+    def set_history(self, history):
+        '''set_history(history: Dict[str, Any])
+        Restore the information stored from previous steps returned by ``get_history``
+        (it must have been taken from an integrator of the same class)
+        '''
+        shape = history.get('_shape')
+        if shape is not None and shape != self._shape:
+            # Preallocate the buffers which are not part of the history
+            self._allocate(np.zeros(shape, dtype=np.float64))
+        for name, value in history.items():
+            if name in self._volatile_fields:
+                continue
+            setattr(self, name, _copy_history_value(value))
+
+
+
+    ######## Integration ########
+
+    def reset(self):
+        '''reset()
+        Discard any information stored from previous steps. This must be called when the
+        state vector is modified externally in a discontinuous way (e.g. when the simulation
+        is restarted).
+        '''
+        pass
+
+
+
+    def step(self, t, y, delta_t):
+        '''step(t: float, y: np.ndarray, delta_t: float)
+        Advance the given state vector (in place) from the time ``t`` to ``t + delta_t``
+
+        :param t: The time of the current state
+        :param y: The state vector (it will be modified)
+        :param delta_t: The amount of time to integrate
+        '''
+        if self._derivative is None:
+            raise RuntimeError('The derivative callback of the integrator was not set')
+        if y.shape != self._shape:
+            self._shape = y.shape
+            self._allocate(y)
+            self.reset()
+        self._step(t, y, delta_t)
+
+
+
+    def _evaluate(self, t, y, dy):
+        # Evaluate the derivative of the state vector
+        self._num_evaluations += 1
+        self._derivative(t, y, dy)
+
+
+    def _allocate(self, y):
+        # Subclasses should override this method to preallocate their internal buffers
+        pass
+
+
+    def _step(self, t, y, delta_t):
+        # Subclasses must implement the integration step here
+        raise NotImplementedError
+
+
+
+
+
+
+######## class RungeKutta4 ########
+
+class RungeKutta4(Integrator):
+    '''
+    Classic Runge-Kutta method of order 4. The derivative is evaluated four times
+    on each step ( at the current state, twice at the midpoint and at the end of the step ).
+    '''
+    name = 'rk4'
+    order = 4
+
+
+    def _allocate(self, y):
+        self._k1, self._k2, self._k3, self._k4 = (np.empty_like(y) for i in range(0, 4))
+        self._y_stage = np.empty_like(y)
+
+
+    def _step(self, t, y, delta_t):
+        f, h = self._evaluate, delta_t
+        k1, k2, k3, k4, y_stage = self._k1, self._k2, self._k3, self._k4, self._y_stage
+
+        f(t, y, k1)
+
+        np.multiply(k1, 0.5 * h, out=y_stage)
+        y_stage += y
+        f(t + 0.5 * h, y_stage, k2)
+
+        np.multiply(k2, 0.5 * h, out=y_stage)
+        y_stage += y
+        f(t + 0.5 * h, y_stage, k3)
+
+        np.multiply(k3, h, out=y_stage)
+        y_stage += y
+        f(t + h, y_stage, k4)
+
+        k2 += k3
+        k2 *= 2
+        k2 += k1
+        k2 += k4
+        k2 *= h / 6
+        y += k2
+
+
+
+
+
+######## class DormandPrince ########
+
+class DormandPrince(Integrator):
+    '''
+    Embedded Runge-Kutta method of Dormand & Prince of order 5(4) with adaptive step size.
+
+    Each call to ``step`` takes as many internal steps as needed to keep the local error estimate
+    below the given tolerances (rejecting the steps which fail). The size of the internal steps
+    is independent of the amount of time requested: the state at the requested time is obtained
+    with the dense output ( continuous extension of order 4 ) of the last internal step.
+
+    If the state vector is not modified externally between two consecutive calls, the integrator
+    continues from its internal state (so one internal step can produce several outputs without
+    evaluating the derivative again). Otherwise, it restarts from the given state keeping the
+    step size estimation.
+    '''
+    name = 'dopri5'
+    order = 5
+
+    # Butcher tableau
+    _c = (0, 1/5, 3/10, 4/5, 8/9, 1, 1)
+    _a = (
+        (),
+        (1/5,),
+        (3/40, 9/40),
+        (44/45, -56/15, 32/9),
+        (19372/6561, -25360/2187, 64448/6561, -212/729),
+        (9017/3168, -355/33, 46732/5247, 49/176, -5103/18656),
+        (35/384, 0, 500/1113, 125/192, -2187/6784, 11/84)
+    )
+    # Coefficients of the local error estimation
+    _e = (71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40)
+    # Coefficients of the dense output
+    _d = (-12715105075/11282082432, 0, 87487479700/32700410799, -10690763975/1880347072,
+        701980252875/199316789632, -1453857185/822651844, 69997945/29380423)
+
+
+    def __init__(self, derivative=None, rtol=1e-6, atol=1e-9, max_step=None, min_step=1e-12, safety=0.9):
+        '''
+        Constructor.
+
+        :param rtol: Relative tolerance of the local error
+        :param atol: Absolute tolerance of the local error
+        :param max_step: Maximum size of the internal steps (None for no limit)
+        :param min_step: Minimum size of the internal steps. If the error control requires
+            a smaller step, a RuntimeError is raised.
+        :param safety: Safety factor used to compute the size of the next step
+        '''
+        try:
+            rtol, atol, min_step, safety = float(rtol), float(atol), float(min_step), float(safety)
+            if max_step is not None:
+                max_step = float(max_step)
+                if max_step <= 0:
+                    raise TypeError
+            if rtol < 0 or atol < 0 or rtol + atol <= 0 or min_step < 0 or not 0 < safety <= 1:
+                raise TypeError
+        except (TypeError, ValueError):
+            raise TypeError('Invalid tolerances or step size limits')
+
+        self._rtol, self._atol = rtol, atol
+        self._max_step, self._min_step, self._safety = max_step, min_step, safety
+        self._num_steps, self._num_rejected_steps = 0, 0
+        super().__init__(derivative)
+
+
+
+    ######## Getters ########
+
+    def get_tolerances(self):
+        '''get_tolerances() -> Tuple[float, float]
+        Get the relative & absolute tolerances of the local error
+        '''
+        return self._rtol, self._atol
+
+
+    def get_step_size(self):
+        '''get_step_size() -> float | None
+        Get the size estimated for the next internal step (None if no step was
+        performed yet)
+        '''
+        return self._h
+
+
+    def get_num_steps(self):
+        '''get_num_steps() -> int
+        Get the number of internal steps accepted
+        '''
+        return self._num_steps
+
+
+    def get_num_rejected_steps(self):
+        '''get_num_rejected_steps() -> int
+        Get the number of internal steps rejected by the error control
+        '''
+        return self._num_rejected_steps
+
+
+
+    ######## Integration ########
+
+    def reset(self):
+        self._h = None
+        self._t_old, self._t_int, self._t_out = None, None, None
+        self._k1_valid = False
+
+
+
+    def _allocate(self, y):
+        self._k = [np.empty_like(y) for i in range(0, 7)]
+        self._y_old, self._y_int, self._y_new, self._y_out = (np.empty_like(y) for i in range(0, 4))
+        self._y_stage, self._err, self._scale = (np.empty_like(y) for i in range(0, 3))
+        self._rcont = [np.empty_like(y) for i in range(0, 5)]
+
+
+
+    def _step(self, t, y, delta_t):
+        t_end = t + delta_t
+        if self._t_out != t or not np.array_equal(y, self._y_out):
+            # The state vector was modified externally (restart the integration)
+            self._t_old = self._t_int = t
+            np.copyto(self._y_int, y)
+            self._k1_valid = False
+            if self._h is None:
+                self._h = self._initial_step_size(t, y, delta_t)
+
+        # Take internal steps until the requested time is reached
+        eps = 1e-12 * max(1.0, abs(t_end))
+        while t_end - self._t_int > eps:
+            self._internal_step()
+
+        if abs(self._t_int - t_end) <= eps:
+            np.copyto(y, self._y_int)
+        else:
+            self.interpolate(t_end, y)
+
+        self._t_out = t_end
+        np.copyto(self._y_out, y)
+
+
+
+    def interpolate(self, t, out):
+        '''interpolate(t: float, out: np.ndarray)
+        Evaluate the dense output of the last internal step at the given time and store
+        the result in the array ``out``
+
+        :raises ValueError: If the time is not within the last internal step
+        '''
+        t_old, t_int = self._t_old, self._t_int
+        if t_old is None or t_old == t_int:
+            raise ValueError('No internal step was performed yet')
+        if not t_old - 1e-12 <= t <= t_int + 1e-12:
+            raise ValueError(f'Time must be in the range of the last internal step [{t_old}, {t_int}]')
+
+        theta = (t - t_old) / (t_int - t_old)
+        r1, r2, r3, r4, r5 = self._rcont
+        # out = r1 + theta * (r2 + (1 - theta) * (r3 + theta * (r4 + (1 - theta) * r5)))
+        np.multiply(r5, 1 - theta, out=out)
+        out += r4
+        out *= theta
+        out += r3
+        out *= 1 - theta
+        out += r2
+        out *= theta
+        out += r1
+
+
+
+    def _error_norm(self, y_old, y_new, err):
+        # Compute the RMS norm of the local error scaled with the tolerances
+        scale = self._scale
+        np.maximum(np.abs(y_old), np.abs(y_new), out=scale)
+        scale *= self._rtol
+        scale += self._atol
+        np.divide(err, scale, out=scale)
+        return sqrt(np.mean(np.square(scale)))
+
+
+
+    def _initial_step_size(self, t, y, delta_t):
+        # Estimate the size of the first step (algorithm from Hairer, Norsett & Wanner)
+        f0, f1, y1 = self._k[0], self._k[1], self._y_stage
+        self._evaluate(t, y, f0)
+        self._k1_valid = True
+
+        scale = np.abs(y) * self._rtol + self._atol
+        d0, d1 = sqrt(np.mean(np.square(y / scale))), sqrt(np.mean(np.square(f0 / scale)))
+        h0 = 1e-6 if d0 < 1e-5 or d1 < 1e-5 else 0.01 * d0 / d1
+        h0 = min(h0, delta_t) if delta_t > 0 else h0
+
+        np.multiply(f0, h0, out=y1)
+        y1 += y
+        self._evaluate(t + h0, y1, f1)
+        d2 = sqrt(np.mean(np.square((f1 - f0) / scale))) / h0
+
+        if max(d1, d2) <= 1e-15:
+            h1 = max(1e-6, h0 * 1e-3)
+        else:
+            h1 = (0.01 / max(d1, d2)) ** (1 / 5)
+        h = min(100 * h0, h1)
+        if self._max_step is not None:
+            h = min(h, self._max_step)
+        return h
+
+
+
+    def _internal_step(self):
+        # Perform one internal step (with error control) from the internal state
+        f, a, c, e = self._evaluate, self._a, self._c, self._e
+        k, y_stage, y_new, err = self._k, self._y_stage, self._y_new, self._err
+        t, y = self._t_int, self._y_int
+
+        if not self._k1_valid:
+            f(t, y, k[0])
+            self._k1_valid = True
+
+        h, rejected = self._h, False
+        while True:
+            if self._max_step is not None:
+                h = min(h, self._max_step)
+            if h < self._min_step:
+                raise RuntimeError(f'Integration step size too small (h = {h}) at t = {t}')
+
+            # Compute the stages
+            for i in range(1, 7):
+                np.copyto(y_stage, y)
+                for j, a_ij in enumerate(a[i]):
+                    if a_ij != 0:
+                        y_stage += (h * a_ij) * k[j]
+                if i < 6:
+                    f(t + c[i] * h, y_stage, k[i])
+            np.copyto(y_new, y_stage)
+            f(t + h, y_new, k[6])
+
+            # Estimate the local error
+            err.fill(0)
+            for e_i, k_i in zip(e, k):
+                if e_i != 0:
+                    err += (h * e_i) * k_i
+            error = self._error_norm(y, y_new, err)
+
+            if error <= 1:
+                break
+
+            # Step rejected
+            self._num_rejected_steps += 1
+            rejected = True
+            h *= max(0.2, self._safety * error ** (-1 / 5))
+
+        # Step accepted. Compute the dense output coefficients
+        r1, r2, r3, r4, r5 = self._rcont
+        np.copyto(r1, y)
+        np.subtract(y_new, y, out=r2)
+        np.multiply(k[0], h, out=r3)
+        r3 -= r2
+        np.multiply(k[6], -h, out=r4)
+        r4 += r2
+        r4 -= r3
+        r5.fill(0)
+        for d_i, k_i in zip(self._d, k):
+            if d_i != 0:
+                r5 += (h * d_i) * k_i
+
+        # Update the internal state (k1 of the next step is k7 of this one)
+        self._num_steps += 1
+        self._t_old, self._t_int = t, t + h
+        self._y_int, self._y_new = y_new, y
+        k[0], k[6] = k[6], k[0]
+
+        # Estimate the size of the next step
+        factor = 10.0 if not rejected else 1.0
+        if error > 0:
+            factor = min(factor, self._safety * error ** (-1 / 5))
+        self._h = h * max(0.2, factor)
+
+
+
+
+######## class ImplicitIntegrator ########
+
+class ImplicitIntegrator(Integrator):
+    '''
+    Base class for the implicit integration methods. The nonlinear equations of each step
+    are solved with a (simplified) Newton iteration which requires the jacobian matrix of the
+    derivative of the state vector with respect the state vector ``J = d(dy)/dy``
+
+    The jacobian can be provided by a callback with the signature ``jacobian(t, y, J)``
+    (it must store the jacobian matrix in the array J). Otherwise it is approximated with
+    finite differences.
+
+    The jacobian and the factorization of the newton iteration matrix are reused between
+    steps while the iteration converges quickly and the step size does not change.
+    '''
+
+    def __init__(self, derivative=None, jacobian=None, rtol=1e-6, atol=1e-9, max_iterations=10):
+        '''
+        Constructor.
+
+        :param jacobian: The jacobian callback (optional)
+        :param rtol: Relative tolerance of the newton iteration
+        :param atol: Absolute tolerance of the newton iteration
+        :param max_iterations: Maximum number of iterations of the newton method
+        '''
+        try:
+            rtol, atol = float(rtol), float(atol)
+            if rtol < 0 or atol < 0 or rtol + atol <= 0:
+                raise TypeError
+            if not isinstance(max_iterations, int) or max_iterations <= 0:
+                raise TypeError
+        except (TypeError, ValueError):
+            raise TypeError('Invalid tolerances or maximum number of iterations')
+
+        self._rtol, self._atol, self._max_iterations = rtol, atol, max_iterations
+        self._jacobian = None
+        self._num_jacobian_evaluations, self._num_factorizations = 0, 0
+        self._W_factorization, self._W_coef = None, None
+        self._jacobian_valid, self._jacobian_fresh = False, False
+        super().__init__(derivative)
+        self.set_jacobian(jacobian)
+
+
+
+    ######## Getters ########
+
+    def get_jacobian(self):
+        '''get_jacobian() -> Callable | None
+        Get the callback used to evaluate the jacobian of the derivative of the state vector
+        (None if it is approximated with finite differences)
+        '''
+        return self._jacobian
+
+
+    def get_num_jacobian_evaluations(self):
+        '''get_num_jacobian_evaluations() -> int
+        Get the number of times the jacobian matrix was computed
+        '''
+        return self._num_jacobian_evaluations
+
+
+    def get_num_factorizations(self):
+        '''get_num_factorizations() -> int
+        Get the number of times the newton iteration matrix was factorized
+        '''
+        return self._num_factorizations
+
+
+
+    ######## Setters ########
+
+    def set_jacobian(self, jacobian):
+        '''set_jacobian(jacobian: Callable | None)
+        Change the callback used to evaluate the jacobian of the derivative of the state vector.
+        If None, the jacobian is approximated with finite differences
+        '''
+        if jacobian is not None and not callable(jacobian):
+            raise TypeError('The jacobian must be a callable object or None')
+        self._jacobian = jacobian
+        self._W_factorization, self._jacobian_valid = None, False
+
+
+
+    ######## Integration ########
+
+    def _allocate(self, y):
+        size = y.size
+        self._J = np.zeros((size, size), dtype=np.float64)
+        self._W = np.zeros((size, size), dtype=np.float64)
+        self._W_factorization, self._jacobian_valid = None, False
+        self._delta, self._scale = np.empty_like(y), np.empty_like(y)
+        self._f_fd, self._y_fd = np.empty_like(y), np.empty_like(y)
+
+
+
+    def _evaluate_jacobian(self, t, y):
+        # Compute the jacobian matrix at the given state
+        self._num_jacobian_evaluations += 1
+        J = self._J
+        if self._jacobian is not None:
+            self._jacobian(t, y, J)
+            return
+
+        # Approximate the jacobian with finite differences
+        f0, f1, y1 = self._f_fd, self._delta, self._y_fd
+        self._evaluate(t, y, f0)
+        np.copyto(y1, y)
+        y_flat, y1_flat = y.reshape(-1), y1.reshape(-1)
+        for j in range(0, y.size):
+            increment = sqrt(np.finfo(np.float64).eps) * max(1.0, abs(y_flat[j]))
+            y1_flat[j] += increment
+            self._evaluate(t, y1, f1)
+            y1_flat[j] = y_flat[j]
+            J[:, j] = ((f1 - f0) / increment).reshape(-1)
+
+
+
+    def _factorize(self, coef):
+        # Compute the LU factorization of the newton iteration matrix W = I - coef * J
+        self._num_factorizations += 1
+        W = self._W
+        np.multiply(self._J, -coef, out=W)
+        W[np.diag_indices_from(W)] += 1
+        factorization = MatrixFactorization(W)
+        if factorization.is_rank_deficient():
+            raise RuntimeError('Singular newton iteration matrix')
+        self._W_factorization, self._W_coef = factorization, coef
+
+
+
+    def _newton(self, t, y, coef, residual, update, norm_factor=1.0):
+        # Solve the nonlinear equations of the step (which starts at the state y and time t)
+        # with the simplified newton method.
+        # residual(R) must store minus the residual of the equations (scaled to match the
+        # iteration matrix W = I - coef * J) in R and update(delta) must apply the correction
+        # to the unknowns. norm_factor converts the corrections to state vector units.
+        # Returns True on success, None if the iteration must be restarted with an updated
+        # jacobian and False if it failed.
+        delta, scale = self._delta, self._scale
+
+        if self._W_factorization is None or self._W_coef != coef:
+            if not self._jacobian_valid:
+                self._evaluate_jacobian(t, y)
+                self._jacobian_valid, self._jacobian_fresh = True, True
+            self._factorize(coef)
+
+        np.abs(y, out=scale)
+        scale *= self._rtol
+        scale += self._atol
+        scale /= abs(norm_factor)
+
+        prev_norm = None
+        for iteration in range(0, self._max_iterations):
+            residual(delta)
+            column = delta.reshape(-1, 1)
+            column[:] = self._W_factorization.solve(column)
+            update(delta)
+
+            norm = sqrt(np.mean(np.square(delta / scale)))
+            if norm <= 1:
+                if iteration > 2:
+                    # Slow convergence. Update the jacobian on the next step
+                    self._W_factorization, self._jacobian_valid = None, False
+                return True
+            if prev_norm is not None and norm > 0.9 * prev_norm:
+                # The iteration is diverging
+                break
+            prev_norm = norm
+
+        if self._jacobian_fresh:
+            # The iteration failed even with an updated jacobian
+            return False
+        self._W_factorization, self._jacobian_valid = None, False
+        return None
+
+
+
+    def _step(self, t, y, delta_t, depth=0):
+        # Perform the step. If the newton iteration fails (even after updating the jacobian),
+        # split the step in two halves
+        self._jacobian_fresh = False
+        result = self._implicit_step(t, y, delta_t)
+        if result is None:
+            result = self._implicit_step(t, y, delta_t)
+        if result:
+            return
+
+        if depth >= 10:
+            raise RuntimeError(f'Newton iteration did not converge at t = {t}')
+        self._step(t, y, delta_t / 2, depth + 1)
+        self._step(t + delta_t / 2, y, delta_t / 2, depth + 1)
+
+
+
+    def _implicit_step(self, t, y, delta_t):
+        # Subclasses must implement the implicit step here. It must update y only
+        # on success and return the result of the newton iteration
+        raise NotImplementedError
+
+
+
+
+
+
+######## class BDF2 ########
+
+class BDF2(ImplicitIntegrator):
+    '''
+    Backward differentiation formula of order 2 (with variable step size). The first step
+    after a reset is performed with the backward euler method.
+    It is A-stable and damps high frequency modes, so it is suitable for stiff mechanisms.
+    '''
+    name = 'bdf2'
+    order = 2
+
+
+    def reset(self):
+        self._t_out, self._h_prev = None, None
+
+
+    def _allocate(self, y):
+        super()._allocate(y)
+        self._y_prev, self._y0, self._y1, self._f1 = (np.empty_like(y) for i in range(0, 4))
+
+
+    def _implicit_step(self, t, y, delta_t):
+        h = delta_t
+        if h == 0:
+            return True
+        y0, y1, f1, y_prev = self._y0, self._y1, self._f1, self._y_prev
+
+        if self._h_prev is not None and self._t_out == t:
+            # BDF2 with variable step size
+            w = h / self._h_prev
+            a1, a2, b = (1 + w) ** 2 / (1 + 2 * w), -w ** 2 / (1 + 2 * w), (1 + w) / (1 + 2 * w)
+            # Predictor (linear extrapolation)
+            np.subtract(y, y_prev, out=y1)
+            y1 *= w
+            y1 += y
+        else:
+            # Backward euler
+            a1, a2, b = 1.0, 0.0, 1.0
+            np.copyto(y1, y)
+        np.copyto(y0, y)
+
+        def residual(R):
+            # R = y1 - a1 * y0 - a2 * y_prev - b * h * f(t + h, y1)
+            self._evaluate(t + h, y1, f1)
+            np.multiply(f1, -b * h, out=R)
+            R += y1
+            R -= a1 * y0
+            if a2 != 0:
+                R -= a2 * y_prev
+            R *= -1
+
+        def update(delta):
+            np.add(y1, delta, out=y1)
+
+        result = self._newton(t, y0, b * h, residual, update)
+        if not result:
+            return result
+
+        np.copyto(y_prev, y0)
+        np.copyto(y, y1)
+        self._h_prev, self._t_out = h, t + h
+        return True
+
+
+
+
+
+
+######## class GeneralizedAlpha ########
+
+class GeneralizedAlpha(ImplicitIntegrator):
+    '''
+    Generalized-alpha method for first order systems (Jansen, Whiting & Hulbert).
+    It is second order accurate and unconditionally stable. The numerical damping
+    of the high frequencies is controlled by the spectral radius at infinity ``rho_inf``
+    (1 means no damping, 0 means maximum damping).
+
+    The derivative of the state vector at the end of each step is stored and reused
+    in the next one (it is discarded when the integrator is reset).
+    '''
+    name = 'generalized_alpha'
+    order = 2
+
+
+    def __init__(self, derivative=None, jacobian=None, rho_inf=0.5, **kwargs):
+        '''
+        Constructor.
+
+        :param rho_inf: Spectral radius at infinity (a number in the range [0, 1])
+        :param kwargs: Additional parameters for the newton iteration (see :class:`ImplicitIntegrator`)
+        '''
+        try:
+            rho_inf = float(rho_inf)
+            if not 0 <= rho_inf <= 1:
+                raise TypeError
+        except (TypeError, ValueError):
+            raise TypeError('rho_inf must be a number in the range [0, 1]')
+
+        self._rho_inf = rho_inf
+        self._alpha_m = (3 - rho_inf) / (2 * (1 + rho_inf))
+        self._alpha_f = 1 / (1 + rho_inf)
+        self._gamma = 0.5 + self._alpha_m - self._alpha_f
+        super().__init__(derivative, jacobian, **kwargs)
+
+
+    def get_spectral_radius(self):
+        '''get_spectral_radius() -> float
+        Get the spectral radius at infinity of this integrator
+        '''
+        return self._rho_inf
+
+
+    def reset(self):
+        self._t_out = None
+
+
+    def _allocate(self, y):
+        super()._allocate(y)
+        self._dy0, self._dy1, self._y_af, self._f_af = (np.empty_like(y) for i in range(0, 4))
+
+
+    def _implicit_step(self, t, y, delta_t):
+        h = delta_t
+        if h == 0:
+            return True
+        alpha_m, alpha_f, gamma = self._alpha_m, self._alpha_f, self._gamma
+        dy0, dy1, y_af, f_af = self._dy0, self._dy1, self._y_af, self._f_af
+
+        if self._t_out != t:
+            # Initialize the derivative of the state vector
+            self._evaluate(t, y, dy0)
+        np.copyto(dy1, dy0)
+
+        def residual(R):
+            # y_af = y + alpha_f * (h * dy0 + h * gamma * (dy1 - dy0))
+            np.subtract(dy1, dy0, out=y_af)
+            np.multiply(y_af, h * gamma, out=y_af)
+            np.add(y_af, h * dy0, out=y_af)
+            np.multiply(y_af, alpha_f, out=y_af)
+            np.add(y_af, y, out=y_af)
+            self._evaluate(t + alpha_f * h, y_af, f_af)
+            # R = dy0 + alpha_m * (dy1 - dy0) - f(t_af, y_af)
+            np.subtract(dy1, dy0, out=R)
+            R *= alpha_m
+            R += dy0
+            R -= f_af
+            R *= -1 / alpha_m
+
+        def update(delta):
+            np.add(dy1, delta, out=dy1)
+
+        # dR/d(dy1) = alpha_m * (I - (alpha_f * gamma * h / alpha_m) * J)
+        result = self._newton(t, y, alpha_f * gamma * h / alpha_m, residual, update, h * gamma)
+        if not result:
+            return result
+
+        # y = y + h * dy0 + h * gamma * (dy1 - dy0)
+        np.subtract(dy1, dy0, out=y_af)
+        y_af *= h * gamma
+        y_af += h * dy0
+        y += y_af
+        np.copyto(dy0, dy1)
+        self._t_out = t + h
+        return True
+
+
+
+
+######## class AdamsBashforthMoulton ########
+
+class AdamsBashforthMoulton(Integrator):
+    '''
+    Adams-Bashforth-Moulton predictor-corrector method (PECE mode) of variable order.
+    The derivative is evaluated only twice per step: at the current state and at the predicted
+    state at the end of the step.
+
+    The derivatives of the previous steps are stored in a ring buffer. The first steps after a
+    reset are performed with the classic Runge-Kutta method while the ring buffer is filled.
+    The coefficients of the Adams formulas are computed from the sizes of the previous steps, so
+    the step size can change between consecutive calls without discarding the history.
+    After each step, the local errors of the formulas of the neighbouring orders are estimated
+    and the order with the smallest error is used in the next step.
+
+    The newest derivative is always evaluated at the given state, so small corrections of
+    the state between steps (e.g. the projections done by the assembly problem) are taken
+    into account. If the state was modified externally by a larger amount than the local error
+    estimate of the last step, the history is discarded.
+    The history must also be discarded calling ``reset`` when the simulation is restarted.
+    '''
+    name = 'abm'
+    order = 4
+
+    # Error constants of the Adams-Bashforth and Adams-Moulton formulas of each order
+    _ab_error = (1/2, 5/12, 3/8, 251/720, 95/288)
+    _am_error = (1/2, 1/12, 1/24, 19/720, 3/160)
+
+    # External modifications of the state larger than the local error estimate multiplied
+    # by this factor discard the history
+    _restart_factor = 10.0
+
+
+    def __init__(self, derivative=None, max_order=4):
+        '''
+        Constructor.
+
+        :param max_order: Maximum order of the Adams formulas (an integer in the range [1, 5])
+        '''
+        if not isinstance(max_order, int) or not 1 <= max_order <= 5:
+            raise TypeError('max_order must be an integer in the range [1, 5]')
+        self._max_order = max_order
+        super().__init__(derivative)
+
+
+
+    ######## Getters ########
+
+    def get_max_order(self):
+        '''get_max_order() -> int
+        Get the maximum order of the Adams formulas used by this integrator
+        '''
+        return self._max_order
+
+
+    def get_order(self):
+        '''get_order() -> int
+        Get the order of the Adams formulas used in the last step (0 if no step was
+        performed since the last reset or if it was performed with the Runge-Kutta method)
+        '''
+        return self._order
+
+
+    def get_error_estimate(self):
+        '''get_error_estimate() -> float
+        Get the estimation of the local error of the last step (the maximum absolute error
+        of the components of the state vector). It is infinite if the last step was
+        performed with the Runge-Kutta method.
+        '''
+        return self._error
+
+
+
+    ######## Integration ########
+
+    def reset(self):
+        self._head, self._count = -1, 0
+        self._order, self._next_order = 0, self._max_order
+        self._error = float('inf')
+        self._time = 0.0
+
+
+    def _allocate(self, y):
+        size = self._max_order
+        self._history = np.empty((size,) + y.shape, dtype=np.float64)
+        self._times = np.zeros(size, dtype=np.float64)
+        self._y_out, self._y_pred, self._f_pred, self._acc = (np.empty_like(y) for i in range(0, 4))
+        self._weights_cache = {}
+
+
+    def _weights(self, x, corrector):
+        # Compute the weights w of the quadrature formula integral(f, 0, 1) = sum(w * f(x))
+        # which is exact for polynomials of degree len(x) - 1. The weights are reused while
+        # the nodes do not change (constant step size)
+        key = (corrector, x.shape[0])
+        cache = self._weights_cache.get(key)
+        if cache is not None and np.allclose(cache[0], x, rtol=0, atol=1e-9):
+            return cache[1]
+        k = x.shape[0]
+        w = np.linalg.solve(np.vander(x, k, increasing=True).T, 1 / np.arange(1, k + 1))
+        self._weights_cache[key] = (x.copy(), w)
+        return w
+
+
+    def _step(self, t, y, delta_t):
+        h = delta_t
+        if h == 0:
+            return
+
+        if self._count > 0:
+            # Discard the history if the state was modified externally
+            acc = self._acc
+            np.subtract(y, self._y_out, out=acc)
+            np.abs(acc, out=acc)
+            if acc.max() > self._restart_factor * self._error:
+                self.reset()
+
+        # Store the derivative at the current state in the ring buffer
+        size = self._max_order
+        head = self._head = (self._head + 1) % size
+        self._evaluate(t, y, self._history[head])
+        self._times[head] = self._time
+        self._count = min(self._count + 1, size)
+
+        if self._count < size:
+            self._runge_kutta_step(t, y, h)
+        else:
+            self._adams_step(t, y, h)
+
+        np.copyto(self._y_out, y)
+        self._time += h
+
+
+
+    def _runge_kutta_step(self, t, y, h):
+        # Runge-Kutta step of order 4 (the first stage is the newest derivative of the history)
+        f, k1 = self._evaluate, self._history[self._head]
+        y_stage, k, acc = self._y_pred, self._f_pred, self._acc
+
+        np.copyto(acc, k1)
+        np.multiply(k1, 0.5 * h, out=y_stage)
+        y_stage += y
+        f(t + 0.5 * h, y_stage, k)
+        acc += 2 * k
+        np.multiply(k, 0.5 * h, out=y_stage)
+        y_stage += y
+        f(t + 0.5 * h, y_stage, k)
+        acc += 2 * k
+        np.multiply(k, h, out=y_stage)
+        y_stage += y
+        f(t + h, y_stage, k)
+        acc += k
+        acc *= h / 6
+        y += acc
+        self._order, self._error = 0, float('inf')
+
+
+
+    def _adams_step(self, t, y, h):
+        size, history = self._max_order, self._history
+        y_pred, f_pred, acc = self._y_pred, self._f_pred, self._acc
+        k = self._next_order
+
+        # Nodes of the derivatives stored (relative to the current time and step size)
+        slots = [(self._head - j) % size for j in range(0, size)]
+        x = (self._times[slots] - self._time) / h
+
+        # Predictor (Adams-Bashforth of order k)
+        w = self._weights(x[:k], False)
+        np.copyto(y_pred, y)
+        for wj, slot in zip(w, slots):
+            y_pred += (h * wj) * history[slot]
+        self._evaluate(t + h, y_pred, f_pred)
+
+        # Corrector (Adams-Moulton of order k) & local error estimation for the formulas
+        # of orders k - 1, k and k + 1 (Milne's device)
+        errors = {}
+        for order in (k, k - 1, k + 1):
+            if not 1 <= order <= size:
+                continue
+            # acc = corrected state - predicted state
+            w_pred, w_corr = self._weights(x[:order], False), self._weights(np.concatenate(([1.0], x[:order - 1])), True)
+            np.multiply(f_pred, h * w_corr[0], out=acc)
+            for j, slot in enumerate(slots[:order]):
+                coef = -w_pred[j] if j == order - 1 else w_corr[j + 1] - w_pred[j]
+                acc += (h * coef) * history[slot]
+            c_ab, c_am = self._ab_error[order - 1], self._am_error[order - 1]
+            errors[order] = c_am / (c_ab + c_am) * float(np.abs(acc).max())
+            if order == k:
+                np.add(y_pred, acc, out=y)
+
+        self._order, self._error = k, errors[k]
+        self._next_order = min(errors, key=errors.get)
+
+
+
+
+
+
+######## class NumericIntegration ########
 
 class NumericIntegration:
     @staticmethod
@@ -23,24 +1100,32 @@ class NumericIntegration:
         dq_values += delta_t * ddq_values
 
 
-    @staticmethod
-    def rk4(q_values, dq_values, ddq_values, delta_t):
-        '''
-        This function performs the integration of the numeric values of the
-        given coordinate variables ( and its derivatives ) using the
-        Range Kutta Order 4 algorithm
-        '''
-        # To be developed ( for now its just the euler method )
-        return NumericIntegration.euler(q_values, dq_values, ddq_values, delta_t)
+    # Runge Kutta Order 4 algorithm
+    rk4 = RungeKutta4
+
+    # Dormand Prince 5(4) algorithm (adaptive step size)
+    dopri5 = DormandPrince
+
+    # Implicit algorithms (for stiff mechanisms)
+    bdf2 = BDF2
+    generalized_alpha = GeneralizedAlpha
+
+    # Adams-Bashforth-Moulton predictor-corrector algorithm (variable order)
+    abm = AdamsBashforthMoulton
 
 
 
     @staticmethod
-    def get_method(name):
+    def get_method(name, *args, **kwargs):
         '''
         This function returns a integration function given its name.
+        Integration methods which operate over a packed state vector are returned as
+        new ``Integrator`` instances
 
         :param name: Name of the integration method to return
+        :param args: Additional positional arguments passed to the constructor of the integrator
+        :param kwargs: Additional keyword arguments passed to the constructor of the integrator
+            (e.g. the tolerances of an adaptive integrator)
         :returns: The integration method
         '''
         if not isinstance(name, str):
@@ -49,9 +1134,13 @@ class NumericIntegration:
             value = getattr(NumericIntegration, name.lower())
             if not callable(value):
                 raise Exception
-            return value
         except:
             raise IndexError(f'No integration method called "{name}"')
+        if isclass(value) and issubclass(value, Integrator):
+            return value(*args, **kwargs)
+        if args or kwargs:
+            raise TypeError(f'Integration method "{name}" does not accept additional parameters')
+        return value
 
 
     @classmethod
@@ -59,4 +1148,4 @@ class NumericIntegration:
         '''
         Returns a list of all the integration methods
         '''
-        return (cls.euler, cls.rk4)
+        return (cls.euler, cls.rk4, cls.dopri5, cls.bdf2, cls.generalized_alpha, cls.abm)
@@ -0,0 +1,220 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the class InverseDynamicsSolver
+'''
+
+######## Import statements ########
+
+from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from numpy.linalg import solve, pinv, LinAlgError
+
+from lib3d_mec_ginac_ext import Matrix
+from .ensemble import Ensemble
+
+
+
+######## class InverseDynamicsSolver ########
+
+class InverseDynamicsSolver:
+    '''
+    This class can be used to compute the inputs (forces, torques) and the joint unknowns
+    (reactions) required to follow given trajectories of the coordinates.
+
+    The dynamic equations must be linear with respect the unknowns:
+
+        equations(t, q, dq, ddq, unknowns) = J_u * unknowns + equations(t, q, dq, ddq, 0) = 0
+
+    The jacobian ``J_u`` of the equations with respect the unknowns is computed symbolically
+    once. Then the equations and the jacobian are evaluated for all the samples of a chunk of the
+    trajectory at once (see ``BatchedNumericFunction``) and the linear systems are solved together.
+
+    By default, the chunks are processed one after another. They can be processed by a pool of threads
+    (``num_threads``), but the batched functions are python code which holds the global interpreter
+    lock: only the time spent inside the numpy kernels (the vectorized operations over the samples
+    and the batched solutions of the linear systems) runs in parallel. Threads only pay off with large
+    chunks (thousands of samples) and expensive equations; use the benchmark
+    ``tests/benchmarks/inverse_dynamics_solve.py`` to check it for a given model.
+
+        :Example:
+
+        >>> solver = InverseDynamicsSolver(get_default_system(), dyn_eq)
+        >>> solver.get_unknowns_names()
+        ('F', 'lambda1', 'lambda2')
+        >>> solver.solve(q, dq, ddq, t).shape
+        (10001, 3)
+    '''
+    def __init__(self, system, equations, unknowns=None, chunk=1024, num_threads=1, c_optimized=False):
+        '''
+        Constructor.
+
+        :param system: The system where the equations are defined
+        :param equations: A column matrix with the dynamic equations (the residuals)
+        :param unknowns: The names (or symbols) of the unknowns. By default, all the inputs and joint
+            unknowns of the system
+        :param chunk: The number of samples evaluated together
+        :param num_threads: The number of threads which process the chunks (1 by default)
+        :param c_optimized: If True, the equations and the jacobian are compiled as cython
+            extensions before being vectorized
+        '''
+        if not isinstance(equations, Matrix):
+            raise TypeError('equations must be a Matrix')
+        if not isinstance(chunk, int) or chunk <= 0:
+            raise TypeError('chunk must be an integer greater than zero')
+        if not isinstance(num_threads, int) or num_threads <= 0:
+            raise TypeError('num_threads must be an integer greater than zero')
+
+        if unknowns is None:
+            unknowns = [system.get_symbol(name, kind)
+                for kind in ('input', 'joint_unknown') for name in system._symbols_values[kind].keys()]
+        else:
+            unknowns = [system.get_symbol(x) if isinstance(x, str) else x for x in unknowns]
+        if not unknowns:
+            raise ValueError('There are no unknowns to solve')
+
+        if equations.get_num_cols() != 1:
+            equations = equations.transpose()
+        k = len(unknowns)
+        unknowns_matrix = Matrix(unknowns, shape=[k, 1])
+
+        self._system = system
+        self._unknowns = unknowns
+        self._unknowns_names = tuple(x.get_name() for x in unknowns)
+        self._unknowns_locations = [(x.get_type(), system._symbols_values[x.get_type()].index(x.get_name())) for x in unknowns]
+        self._num_equations = equations.get_num_rows()
+        self._chunk = chunk
+        self._num_threads = num_threads
+        self._equations_func = system.compile_numeric_function(equations, c_optimized)
+        self._jacobian_func = system.compile_numeric_function(
+            system.jacobian(equations.transpose(), unknowns_matrix), c_optimized)
+        self._contexts = Queue()
+
+
+
+    ######## Getters ########
+
+    def get_unknowns_names(self):
+        '''get_unknowns_names() -> Tuple[str]
+        Get the names of the unknowns (in the same order as the columns of the solutions)
+        '''
+        return self._unknowns_names
+
+
+    def get_num_equations(self):
+        '''get_num_equations() -> int
+        Get the number of dynamic equations
+        '''
+        return self._num_equations
+
+
+    def get_num_threads(self):
+        '''get_num_threads() -> int
+        Get the number of threads used to evaluate the samples
+        '''
+        return self._num_threads
+
+
+
+    ######## Solve ########
+
+    def solve(self, q, dq, ddq, t=None):
+        '''solve(q: np.ndarray, dq: np.ndarray, ddq: np.ndarray[, t: np.ndarray]) -> np.ndarray
+        Compute the unknowns at each sample of the given trajectory.
+
+        The values of the rest of symbols (parameters, auxiliar coordinates, ...) are the current
+        numeric values of the system. If there are more equations than unknowns, the least
+        squares solution is computed.
+
+        :param q: The coordinates (an array with the shape (N, n))
+        :param dq: The velocities (an array with the shape (N, n))
+        :param ddq: The accelerations (an array with the shape (N, n))
+        :param t: The time of the samples (an array with the shape (N,)). By default, the current
+            time of the system is used on all the samples
+        :returns: An array with the shape (N, k) with the values of the unknowns
+        '''
+        system = self._system
+        n = system.get_coords_values().shape[0]
+        q, dq, ddq = (np.asarray(x, dtype=np.float64) for x in (q, dq, ddq))
+        if q.ndim == 1:
+            q, dq, ddq = q.reshape(-1, 1), dq.reshape(-1, 1), ddq.reshape(-1, 1)
+        num_samples = q.shape[0]
+        if q.shape != (num_samples, n) or dq.shape != q.shape or ddq.shape != q.shape:
+            raise ValueError(f'q, dq and ddq must be arrays with the shape (N, {n})')
+        if t is None:
+            t = np.full(num_samples, system._time_value, dtype=np.float64)
+        t = np.asarray(t, dtype=np.float64).reshape(-1)
+        if t.shape[0] != num_samples:
+            raise ValueError('t must have one item per sample')
+
+        solution = np.zeros((num_samples, len(self._unknowns)), dtype=np.float64)
+        chunk = self._chunk
+        ranges = [(start, min(start + chunk, num_samples)) for start in range(0, num_samples, chunk)]
+
+        def solve_chunk(start, stop):
+            context = self._acquire_context()
+            try:
+                self._solve_chunk(context, t[start:stop], q[start:stop], dq[start:stop], ddq[start:stop], solution[start:stop])
+            finally:
+                self._contexts.put(context)
+
+        if len(ranges) <= 1 or self._num_threads == 1:
+            for start, stop in ranges:
+                solve_chunk(start, stop)
+        else:
+            with ThreadPoolExecutor(min(self._num_threads, len(ranges))) as executor:
+                for future in [executor.submit(solve_chunk, start, stop) for start, stop in ranges]:
+                    future.result()
+        return solution
+
+
+
+    def solve_trajectory(self, trajectory):
+        '''solve_trajectory(trajectory: Trajectory) -> np.ndarray
+        Compute the unknowns at each sample of a trajectory returned by a simulation
+        (see ``SimulationEngine.run``)
+        '''
+        return self.solve(trajectory.q, trajectory.dq, trajectory.ddq, trajectory.time)
+
+
+
+    def _acquire_context(self):
+        # Get the buffers & vectorized functions used to evaluate a chunk of samples (each
+        # thread uses its own context)
+        if self._contexts.empty():
+            ensemble = Ensemble(self._system, self._chunk)
+            compile = ensemble.compile_numeric_function
+            return ensemble, compile(self._equations_func), compile(self._jacobian_func)
+        return self._contexts.get()
+
+
+
+    def _solve_chunk(self, context, t, q, dq, ddq, out):
+        # Solve the unknowns of a chunk of samples
+        ensemble, equations_func, jacobian_func = context
+        m = t.shape[0]
+        values = ensemble._values
+        # The contexts are reused: the rest of symbols take the current numeric values of the system
+        for kind, system_values in self._system._symbols_values.items():
+            values[kind][...] = system_values.as_array()[:, :, np.newaxis]
+        for kind, index in self._unknowns_locations:
+            values[kind][index, 0] = 0
+        values['coordinate'][:, 0, :m] = q.T
+        values['velocity'][:, 0, :m] = dq.T
+        values['acceleration'][:, 0, :m] = ddq.T
+        time = np.empty(ensemble.get_size(), dtype=np.float64)
+        time[:m], time[m:] = t, t[-1]
+        ensemble._time = time
+
+        # Residuals with the unknowns equal to zero & jacobian
+        b = -equations_func.evaluate()[:, 0, :m].T[:, :, np.newaxis]
+        J = jacobian_func.evaluate()[:, :, :m].transpose(2, 0, 1)
+
+        if J.shape[1] == J.shape[2]:
+            try:
+                out[:] = solve(J, b)[:, :, 0]
+                return
+            except LinAlgError:
+                pass
+        # Least squares solutions (non square or singular systems)
+        out[:] = np.matmul(pinv(J), b)[:, :, 0]
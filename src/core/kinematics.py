@@ -0,0 +1,163 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the class KinematicProblemSolver
+'''
+
+######## Import statements ########
+
+from collections.abc import Mapping
+import numpy as np
+from numpy.linalg import norm, pinv, lstsq
+
+from lib3d_mec_ginac_ext import Matrix, SymbolNumeric
+from .recorder import _fuse_probes
+
+
+
+######## class KinematicProblemSolver ########
+
+class KinematicProblemSolver:
+    '''
+    This class can be used to solve the "kinematic problem" of a mechanical system whose motion
+    is prescribed: some coordinates (the driven coordinates) are known functions of the time and
+    the rest (the dependent coordinates) are computed from the constraints.
+
+    Each time the method `solve` is invoked, the driven coordinates, velocities & accelerations are
+    evaluated at the current time and the next problems are solved for the dependent ones (u):
+
+    - Position problem: ``Phi(q, t) = 0`` (Newton iterations warm started from the previous solution)
+    - Velocity problem: ``Phi_q[:, u] dq[u] = beta - Phi_q[:, d] dq[d]``
+    - Acceleration problem: ``Phi_q[:, u] ddq[u] = gamma - Phi_q[:, d] ddq[d]``
+
+    The time functions of the driven coordinates and their first and second time derivatives are
+    compiled together in a single numeric function. Phi, Phi_q, beta and gamma are compiled once
+    when the solver is created. No dynamics or numerical integration is needed, so the solution has no
+    integration drift.
+    '''
+    def __init__(self, system, Phi, Phi_q, beta, gamma, drivers, tol=1e-10, max_iterations=50, c_optimized=False):
+        '''
+        Constructor.
+        You must pass the symbolic matrices Phi, Phi_q, beta and gamma and the time functions of
+        the driven coordinates, either as positional or keyword arguments.
+
+        :param Phi: The constraints (a column matrix with m rows)
+        :param Phi_q: The jacobian of the constraints with respect the coordinates (a m x n matrix)
+        :param beta: The right hand side of the velocity problem ``Phi_q dq = beta``
+        :param gamma: The right hand side of the acceleration problem ``Phi_q ddq = gamma``
+        :param drivers: A mapping of coordinates (names or symbols) and expressions which depend only on
+            the time and the parameters of the system
+        :param tol: The tolerance of the norm of Phi in the position problem
+        :param max_iterations: The maximum number of iterations of the position problem
+        :param c_optimized: If True, compile the numeric functions as cython extensions.
+        '''
+        if not isinstance(drivers, Mapping) or len(drivers) == 0:
+            raise TypeError('drivers must be a non empty mapping of coordinates and expressions')
+        if not isinstance(max_iterations, int) or max_iterations <= 0:
+            raise TypeError('max_iterations must be an integer greater than zero')
+
+        coords_names = list(system._symbols_values['coordinate'].keys())
+        n = len(coords_names)
+        m = Phi.get_num_rows()
+        if Phi.get_shape() != (m, 1) or Phi_q.get_shape() != (m, n):
+            raise ValueError(f'Phi must be a column matrix and Phi_q a matrix {m}x{n}')
+        if beta.get_shape() != (m, 1) or gamma.get_shape() != (m, 1):
+            raise ValueError(f'beta and gamma must be column matrices with {m} rows')
+
+        driven = []
+        for coord in drivers.keys():
+            name = coord.get_name() if isinstance(coord, SymbolNumeric) else coord
+            if name not in coords_names:
+                raise IndexError(f'There is no coordinate called "{name}"')
+            driven.append(coords_names.index(name))
+        if len(set(driven)) != len(driven):
+            raise ValueError('Each coordinate can only be driven once')
+
+        # Time functions of the driven coordinates and their derivatives
+        f = Matrix(list(drivers.values()), shape=[len(driven), 1])
+        df = system.derivative(f)
+        ddf = system.derivative(df)
+        self._drivers_func = _fuse_probes(system, [f, df, ddf], c_optimized)[0]
+
+        compile = system.compile_numeric_function
+        self._system = system
+        self.Phi, self.Phi_q, self.beta, self.gamma = Phi, Phi_q, beta, gamma
+        self._Phi_func, self._Phi_q_func = compile(Phi, c_optimized), compile(Phi_q, c_optimized)
+        self._beta_func, self._gamma_func = compile(beta, c_optimized), compile(gamma, c_optimized)
+        self._tol, self._max_iterations = tol, max_iterations
+
+        self._driven = np.array(driven, dtype=np.int64)
+        self._dependent = np.array([i for i in range(0, n) if i not in driven], dtype=np.int64)
+        self._num_iterations = 0
+
+
+
+    ######## Getters ########
+
+    def get_driven_coordinates(self):
+        '''get_driven_coordinates() -> List[str]
+        Get the names of the coordinates driven by time functions
+        '''
+        names = list(self._system._symbols_values['coordinate'].keys())
+        return [names[i] for i in self._driven]
+
+
+    def get_dependent_coordinates(self):
+        '''get_dependent_coordinates() -> List[str]
+        Get the names of the coordinates computed from the constraints
+        '''
+        names = list(self._system._symbols_values['coordinate'].keys())
+        return [names[i] for i in self._dependent]
+
+
+    def get_num_iterations(self):
+        '''get_num_iterations() -> int
+        Get the number of iterations of the position problem in the last call to `solve`
+        '''
+        return self._num_iterations
+
+
+
+    ######## Solve ########
+
+    def solve(self, delta_t=None):
+        '''solve([delta_t: float])
+
+        Solve the position, velocity & acceleration problems at the current numeric value
+        of the time. The results are stored as the numeric values of the coordinates, velocities
+        and accelerations of the system.
+
+        :param delta_t: The time elapsed since the last solution. If specified, the initial guess
+            of the dependent coordinates is extrapolated with their velocities & accelerations
+        :raises RuntimeError: If the position problem doesnt converge
+        '''
+        system = self._system
+        q_values = system.get_coords_values()
+        dq_values, ddq_values = system.get_velocities_values(), system.get_accelerations_values()
+        d, u = self._driven, self._dependent
+        k = d.shape[0]
+
+        # Driven coordinates
+        values = self._drivers_func.evaluate()[:, 0]
+        q_values[d, 0], dq_values[d, 0], ddq_values[d, 0] = values[:k], values[k:2 * k], values[2 * k:]
+        if u.shape[0] == 0:
+            self._num_iterations = 0
+            return
+        if delta_t is not None:
+            q_values[u] += delta_t * dq_values[u] + (delta_t ** 2 / 2) * ddq_values[u]
+
+        # Position problem
+        Phi_func, Phi_q_func = self._Phi_func, self._Phi_q_func
+        for iteration in range(0, self._max_iterations + 1):
+            Phi_num = Phi_func.evaluate()
+            if norm(Phi_num) <= self._tol:
+                break
+            if iteration == self._max_iterations:
+                raise RuntimeError(f'The position problem didnt converge after {iteration} iterations (norm of Phi is {norm(Phi_num)})')
+            q_values[u] -= lstsq(Phi_q_func.evaluate()[:, u], Phi_num, rcond=None)[0]
+        self._num_iterations = iteration
+
+        # Velocity & acceleration problems (the same matrix is used for both)
+        Phi_q_num = Phi_q_func.evaluate()
+        A_inv = pinv(Phi_q_num[:, u])
+        dq_values[u] = A_inv @ (self._beta_func.evaluate() - Phi_q_num[:, d] @ dq_values[d])
+        ddq_values[u] = A_inv @ (self._gamma_func.evaluate() - Phi_q_num[:, d] @ ddq_values[d])
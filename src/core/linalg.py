@@ -0,0 +1,94 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the class MatrixFactorization
+'''
+
+######## Import statements ########
+
+import warnings
+import numpy as np
+from numpy.linalg import pinv, svd
+
+try:
+    from scipy.linalg import lu_factor, lu_solve
+except ImportError:
+    # No problem, a singular value decomposition is used instead (computed with numpy)
+    lu_factor, lu_solve = None, None
+
+
+
+######## class MatrixFactorization ########
+
+class MatrixFactorization:
+    '''
+    Factorization of a square matrix which can be used to solve several linear systems with the
+    same matrix without computing its inverse explicitly. If scipy is installed, the LU factorization
+    with partial pivoting is used (``scipy.linalg.lu_factor``). Otherwise, the singular value
+    decomposition is computed with numpy.
+
+    The matrix is rank deficient if its smallest pivot (or singular value) is negligible with respect the
+    largest one (e.g. the augmented matrix of the dynamic problem with redundant constraints). In that
+    case, ``solve`` returns the least squares solutions with minimum norm (pseudo-inverse).
+    '''
+    def __init__(self, A, rtol=None):
+        '''
+        Constructor.
+
+        :param A: The square matrix to factorize
+        :param rtol: The relative tolerance of the pivots (or singular values) used to detect rank
+            deficiency. By default, ``n * eps * 1000`` where n is the number of rows of the matrix
+        '''
+        A = np.asarray(A, dtype=np.float64)
+        if A.ndim != 2 or A.shape[0] != A.shape[1]:
+            raise ValueError('The matrix to factorize must be square')
+        n = A.shape[0]
+        if rtol is None:
+            rtol = max(n, 1) * np.finfo(np.float64).eps * 1000
+        self._lu, self._pinv, self._svd = None, None, None
+
+        if n == 0:
+            self._rank_deficient = False
+            self._pinv = A
+            return
+
+        if lu_factor is not None:
+            with warnings.catch_warnings():
+                # Singular matrices are handled below
+                warnings.simplefilter('ignore')
+                lu = lu_factor(A, check_finite=False)
+            pivots = np.abs(np.diagonal(lu[0]))
+            self._rank_deficient = not np.isfinite(pivots).all() or pivots.min() <= rtol * pivots.max()
+            if self._rank_deficient:
+                self._pinv = pinv(A)
+            else:
+                self._lu = lu
+            return
+
+        U, s, Vt = svd(A)
+        self._rank_deficient = not np.isfinite(s).all() or s[-1] <= rtol * s[0]
+        if self._rank_deficient:
+            self._pinv = pinv(A)
+        else:
+            self._svd = U.T, 1 / s, Vt.T
+
+
+
+    def is_rank_deficient(self):
+        '''is_rank_deficient() -> bool
+        Returns True if the matrix is rank deficient (the systems are solved with the pseudo-inverse)
+        '''
+        return self._rank_deficient
+
+
+    def solve(self, b):
+        '''solve(b: np.ndarray) -> np.ndarray
+        Solve the linear system ``A x = b`` (b can have several columns). Returns a new array
+        '''
+        if self._lu is not None:
+            return lu_solve(self._lu, b, check_finite=False)
+        if self._svd is not None:
+            Ut, s_inv, V = self._svd
+            y = Ut @ b
+            y *= s_inv if y.ndim == 1 else s_inv[:, np.newaxis]
+            return V @ y
+        return self._pinv @ b
@@ -0,0 +1,386 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the class Linearizer and the functions linearize and
+linearize_trajectory
+'''
+
+######## Import statements ########
+
+import re
+from collections.abc import Mapping
+import numpy as np
+from numpy.linalg import solve, pinv, LinAlgError
+
+from lib3d_mec_ginac_ext import Matrix
+from .dynamics import DynamicProblemSolver
+from .engine import SimulationEngine, Trajectory
+from .ensemble import Ensemble
+
+
+
+######## Helper functions ########
+
+def _depends_on(func, kind):
+    # Returns True if the given numeric function reads the numeric values of the symbols
+    # of the given type
+    pattern = re.compile(r'\b' + kind + r'\[')
+    return any(pattern.search(expr) for expr in func.get_atoms().values()) or \
+        any(pattern.search(str(expr)) for expr in np.asarray(func.get_outputs()).flat)
+
+
+
+def _batched_solve(A, b):
+    # Solve a stack of linear systems (with a least squares fallback for singular matrices)
+    try:
+        return solve(A, b)
+    except LinAlgError:
+        return np.matmul(pinv(A), b)
+
+
+
+######## class Linearizer ########
+
+class Linearizer:
+    '''
+    This class computes the matrices of the linear state-space model of a mechanical system
+    around one or many operating points:
+
+        d[x]/dt = A * x + B * u
+        y = C * x + D * u
+
+    where ``x = [q; dq]`` is the state vector, ``u`` the inputs and ``y`` the outputs (optional).
+
+    The columns of the jacobians are computed with the cheapest exact method available:
+
+    - Symbolic jacobians of delta_q and gamma (and the outputs) are compiled for the groups of
+      variables (coordinates, velocities or inputs) which are not read by M_qq and Phi_q. In such case,
+      d[ddq]/dx = [M_qq, Phi_q^T; Phi_q, 0]^-1 * d[delta_q; gamma]/dx exactly (usually, the velocities
+      and inputs).
+
+    - Central finite differences for the rest (usually the coordinates). All the perturbed states
+      of all the operating points are evaluated together as the members of an ``Ensemble``
+
+    All the numeric functions (and their batched versions) are compiled only once, when the
+    linearizer is created. One ensemble is kept for each batch size, so the same instance can be
+    reused to linearize the system at many operating points (see ``linearize_trajectory``).
+
+        :Example:
+
+        >>> linearizer = Linearizer(get_default_system(), (M_qq, delta_q, Phi_q, gamma))
+        >>> A, B = linearizer.linearize(at={'x': 0.1})
+        >>> A.shape, B.shape
+        ((6, 6), (6, 1))
+    '''
+    def __init__(self, system, dynamics, inputs=None, outputs=None, method='auto', step=1e-6, chunk=256):
+        '''
+        Constructor.
+
+        :param system: The system to linearize
+        :param dynamics: A DynamicProblemSolver, a SimulationEngine with the dynamic problem
+            already setup, or a tuple/dict with the arguments to create the solver
+        :param inputs: The names of the inputs (or the symbols). By default, all the inputs of
+            the system
+        :param outputs: A column matrix with the outputs (optional). If specified, the matrices C and D
+            are also computed
+        :param method: 'auto' (default), 'symbolic' (the variation of M_qq and Phi_q is neglected as
+            in ``DynamicProblemSolver.jacobian``) or 'finite_differences'
+        :param step: The relative step used by the finite differences
+        :param chunk: Maximum number of operating points evaluated together
+        '''
+        if isinstance(dynamics, SimulationEngine):
+            dynamics = dynamics.get_dynamic_problem_solver()
+            if dynamics is None:
+                raise RuntimeError('The dynamic problem of the simulation engine is not setup yet')
+        elif isinstance(dynamics, dict):
+            dynamics = DynamicProblemSolver(system, **dynamics)
+        elif isinstance(dynamics, (tuple, list)):
+            dynamics = DynamicProblemSolver(system, *dynamics)
+        elif not isinstance(dynamics, DynamicProblemSolver):
+            raise TypeError('dynamics must be a DynamicProblemSolver, a SimulationEngine or a tuple/dict of matrices')
+        if outputs is not None and not isinstance(outputs, Matrix):
+            raise TypeError('outputs must be a Matrix')
+        if method not in ('auto', 'symbolic', 'finite_differences'):
+            raise ValueError('method must be "auto", "symbolic" or "finite_differences"')
+        try:
+            step = float(step)
+        except (TypeError, ValueError):
+            raise TypeError('step must be a number')
+        if step <= 0:
+            raise ValueError('step must be greater than zero')
+        if not isinstance(chunk, int) or chunk <= 0:
+            raise TypeError('chunk must be an integer greater than zero')
+
+        symbols_values = system._symbols_values
+        if inputs is None:
+            inputs = list(symbols_values['input'].keys())
+        inputs = [x if isinstance(x, str) else x.get_name() for x in inputs]
+        for name in inputs:
+            if name not in symbols_values['input']:
+                raise IndexError(f'There is no input called "{name}"')
+        if outputs is not None and outputs.get_num_cols() != 1:
+            outputs = outputs.transpose()
+
+        n, m, k = dynamics.get_num_coordinates(), dynamics.get_num_constraints(), len(inputs)
+        self._system, self._solver = system, dynamics
+        self._n, self._m = n, m
+        self._inputs = tuple(inputs)
+        self._inputs_indices = np.array([symbols_values['input'].index(name) for name in inputs], dtype=np.int64)
+        self._step, self._chunk = step, chunk
+
+        compile = system.compile_numeric_function
+        self._outputs_func = compile(outputs) if outputs is not None else None
+        self._num_outputs = outputs.get_num_rows() if outputs is not None else 0
+
+        # Groups of columns of the jacobians: (kind, first column, indices of the symbols)
+        groups = [
+            ('coordinate', 0, np.arange(n)),
+            ('velocity', n, np.arange(n)),
+            ('input', 2 * n, self._inputs_indices)]
+        groups = [group for group in groups if group[2].shape[0] > 0]
+
+        # Choose the method for each group
+        augmented_funcs = [dynamics._M_qq_func] + ([dynamics._Phi_q_func] if m > 0 else [])
+        outputs_implicit = self._outputs_func is not None and any(
+            _depends_on(self._outputs_func, kind) for kind in ('acceleration', 'joint_unknown'))
+        symbolic_groups, numeric_groups = [], []
+        for group in groups:
+            kind = group[0]
+            if method == 'finite_differences' or (method == 'auto' and (outputs_implicit or \
+                any(_depends_on(func, kind) for func in augmented_funcs))):
+                numeric_groups.append(group)
+            else:
+                symbolic_groups.append(group)
+        self._numeric_groups = numeric_groups
+
+        # Compile the symbolic jacobians of the right hand side of the augmented system (and the outputs)
+        self._symbolic_funcs = []
+        if symbolic_groups:
+            rhs = dynamics.delta_q if m == 0 else Matrix.block(2, 1, dynamics.delta_q, dynamics.gamma)
+            for kind, offset, indices in symbolic_groups:
+                if kind == 'input':
+                    variables = Matrix([system.get_symbol(name, 'input') for name in inputs], shape=[k, 1])
+                else:
+                    variables = system.get_symbols_matrix(kind)
+                rhs_func = compile(system.jacobian(rhs.transpose(), variables))
+                outputs_func = compile(system.jacobian(outputs.transpose(), variables)) if outputs is not None else None
+                self._symbolic_funcs.append((offset, indices.shape[0], rhs_func, outputs_func))
+
+        # Compile the batched functions (they are bound to the ensemble of each batch size later)
+        prototype = Ensemble(system, 1)
+        prototype.dynamics(dynamics)
+        batched = prototype.compile_numeric_function
+        self._prototype = prototype
+        self._batched_outputs_func = batched(self._outputs_func) if self._outputs_func is not None else None
+        self._batched_symbolic_funcs = [
+            (offset, num_cols, batched(rhs_func), batched(outputs_func) if outputs_func is not None else None)
+            for offset, num_cols, rhs_func, outputs_func in self._symbolic_funcs]
+        self._ensembles = {}
+
+
+
+    ######## Getters ########
+
+    def get_inputs_names(self):
+        '''get_inputs_names() -> Tuple[str]
+        Get the names of the inputs (in the same order as the columns of the matrices B and D)
+        '''
+        return self._inputs
+
+
+    def get_num_states(self):
+        '''get_num_states() -> int
+        Get the number of states (twice the number of coordinates)
+        '''
+        return 2 * self._n
+
+
+    def get_num_outputs(self):
+        '''get_num_outputs() -> int
+        Get the number of outputs (0 if they were not specified)
+        '''
+        return self._num_outputs
+
+
+    def get_numeric_columns(self):
+        '''get_numeric_columns() -> Tuple[str]
+        Get the types of variables whose columns are computed using finite differences
+        '''
+        return tuple(kind for kind, offset, indices in self._numeric_groups)
+
+
+
+    ######## Linearization ########
+
+    def linearize(self, at=None, t=None):
+        '''linearize([at: Mapping[str, float], t: float]) -> Tuple[np.ndarray]
+        Compute the matrices of the linear model at a single operating point
+
+        :param at: A mapping with the values of the coordinates, velocities or inputs at the operating
+            point. The symbols not specified take their current numeric values
+        :param t: The time of the operating point. By default, the current time of the system
+        :returns: The matrices A and B (and C and D if the outputs were specified)
+        '''
+        symbols_values = self._system._symbols_values
+        values = dict((kind, symbols_values[kind].as_array()[:, 0].copy()) for kind in ('coordinate', 'velocity', 'input'))
+        if at is not None:
+            if not isinstance(at, Mapping):
+                raise TypeError('at must be a mapping of symbol names and values')
+            for name, value in at.items():
+                for kind, array in values.items():
+                    if name in symbols_values[kind]:
+                        array[symbols_values[kind].index(name)] = value
+                        break
+                else:
+                    raise IndexError(f'There is no coordinate, velocity or input called "{name}"')
+        q, dq, u = values['coordinate'], values['velocity'], values['input'][self._inputs_indices]
+        return tuple(x[0] for x in self.linearize_trajectory(q[np.newaxis], dq[np.newaxis], t, u[np.newaxis]))
+
+
+
+    def linearize_trajectory(self, q, dq=None, t=None, u=None):
+        '''linearize_trajectory(q: np.ndarray | Trajectory[, dq: np.ndarray, t: np.ndarray, u: np.ndarray]) -> Tuple[np.ndarray]
+        Compute the matrices of the linear model at many operating points (e.g. for gain scheduling)
+
+        :param q: The coordinates of the operating points (an array with the shape (N, n)) or a
+            trajectory returned by a simulation
+        :param dq: The velocities of the operating points (an array with the shape (N, n))
+        :param t: The time of the operating points (an array with the shape (N,) or a number)
+        :param u: The values of the inputs (an array with the shape (N, k)). By default,
+            their current numeric values
+        :returns: The matrices A (N x 2n x 2n) and B (N x 2n x k) (and C (N x r x 2n) and D (N x r x k)
+            if the outputs were specified)
+        '''
+        if isinstance(q, Trajectory):
+            q, dq, t = q.q, q.dq, q.time if t is None else t
+        elif dq is None:
+            raise TypeError('dq must be specified')
+        n, k, r = self._n, self._inputs_indices.shape[0], self._num_outputs
+        q, dq = np.asarray(q, dtype=np.float64), np.asarray(dq, dtype=np.float64)
+        num_points = q.shape[0]
+        if q.shape != (num_points, n) or dq.shape != q.shape:
+            raise ValueError(f'q and dq must be arrays with the shape (N, {n})')
+        if u is None:
+            u = np.tile(self._system._symbols_values['input'].as_array()[self._inputs_indices, 0], (num_points, 1))
+        u = np.asarray(u, dtype=np.float64)
+        if u.shape != (num_points, k):
+            raise ValueError(f'u must be an array with the shape (N, {k})')
+        t = np.broadcast_to(np.asarray(self._system._time_value if t is None else t, dtype=np.float64), (num_points,))
+
+        # d[dq]/dq = 0, d[dq]/d[dq] = I, d[dq]/du = 0
+        J = np.zeros((num_points, 2 * n, 2 * n + k), dtype=np.float64)
+        J[:, :n, n:2 * n] = np.eye(n)
+        H = np.zeros((num_points, r, 2 * n + k), dtype=np.float64)
+        z = np.concatenate([q, dq, u], axis=1)
+
+        for start in range(0, num_points, self._chunk):
+            stop = min(start + self._chunk, num_points)
+            self._linearize_chunk(z[start:stop], t[start:stop], J[start:stop], H[start:stop])
+
+        A, B = J[:, :, :2 * n], J[:, :, 2 * n:]
+        if self._outputs_func is None:
+            return A, B
+        return A, B, H[:, :, :2 * n], H[:, :, 2 * n:]
+
+
+
+    def _get_ensemble(self, size, columns):
+        # Get the ensemble used to evaluate batches of the given size (to compute the 'symbolic' or
+        # 'numeric' columns) and the batched functions bound to it. The members start with the current
+        # numeric values of the symbols of the system
+        key = size, columns
+        if key in self._ensembles:
+            ensemble = self._ensembles[key][0]
+            for kind, values in self._system._symbols_values.items():
+                ensemble._values[kind][...] = values.as_array()[:, :, np.newaxis]
+            return self._ensembles[key]
+
+        ensemble = Ensemble(self._system, size)
+        ensemble.dynamics(self._prototype)
+        compile = ensemble.compile_numeric_function
+        outputs_func = compile(self._batched_outputs_func) if self._batched_outputs_func is not None else None
+        symbolic_funcs = []
+        if columns == 'symbolic':
+            symbolic_funcs = [
+                (offset, num_cols, compile(rhs_func), compile(outputs_jacobian) if outputs_jacobian is not None else None)
+                for offset, num_cols, rhs_func, outputs_jacobian in self._batched_symbolic_funcs]
+        self._ensembles[key] = ensemble, outputs_func, symbolic_funcs
+        return self._ensembles[key]
+
+
+
+    def _set_values(self, ensemble, z, t, repeats):
+        # Set the state & inputs of the members of the ensemble (each operating point is repeated
+        # the given number of times)
+        n = self._n
+        values = ensemble._values
+        z = np.repeat(z, repeats, axis=0)
+        values['coordinate'][:n, 0] = z[:, :n].T
+        values['velocity'][:n, 0] = z[:, n:2 * n].T
+        values['input'][self._inputs_indices, 0] = z[:, 2 * n:].T
+        ensemble._time = np.repeat(t, repeats)
+
+
+
+    def _linearize_chunk(self, z, t, J, H):
+        # Compute the jacobians of a chunk of operating points
+        n, m = self._n, self._m
+        size = z.shape[0]
+
+        if self._symbolic_funcs:
+            # Solve the dynamic problem at the operating points and evaluate the symbolic jacobians
+            ensemble, outputs_func, symbolic_funcs = self._get_ensemble(size, 'symbolic')
+            self._set_values(ensemble, z, t, 1)
+            ensemble.solve_dynamics()
+            A = ensemble._A
+            for offset, num_cols, rhs_func, outputs_jacobian in symbolic_funcs:
+                rhs_jacobian = rhs_func.evaluate().transpose(2, 0, 1)
+                J[:, n:, offset:offset + num_cols] = _batched_solve(A, rhs_jacobian)[:, :n]
+                if outputs_jacobian is not None:
+                    H[:, :, offset:offset + num_cols] = outputs_jacobian.evaluate().transpose(2, 0, 1)
+
+        if self._numeric_groups:
+            # Perturb each variable forwards & backwards at each operating point
+            columns = np.concatenate([offset + np.arange(indices.shape[0]) for kind, offset, indices in self._numeric_groups])
+            num_cols = columns.shape[0]
+            ensemble, outputs_func, symbolic_funcs = self._get_ensemble(size * num_cols * 2, 'numeric')
+            h = self._step * np.maximum(1.0, np.abs(z[:, columns]))
+            perturbed = np.repeat(z, num_cols * 2, axis=0).reshape(size, num_cols, 2, -1)
+            perturbed[:, np.arange(num_cols), 0, columns] += h
+            perturbed[:, np.arange(num_cols), 1, columns] -= h
+            self._set_values(ensemble, perturbed.reshape(size * num_cols * 2, -1), np.repeat(t, num_cols * 2), 1)
+            ensemble.solve_dynamics()
+
+            ddq = ensemble._values['acceleration'][:n, 0].reshape(n, size, num_cols, 2)
+            J[:, n:, columns] = ((ddq[..., 0] - ddq[..., 1]) / (2 * h)).transpose(1, 0, 2)
+            if outputs_func is not None:
+                y = outputs_func.evaluate()[:, 0]
+                y = y.reshape(-1, size, num_cols, 2)
+                H[:, :, columns] = ((y[..., 0] - y[..., 1]) / (2 * h)).transpose(1, 0, 2)
+
+
+
+######## Functions ########
+
+def linearize(system, dynamics, at=None, t=None, inputs=None, outputs=None, method='auto', step=1e-6):
+    '''linearize(system: System, dynamics, [at: Mapping[str, float], ...]) -> Tuple[np.ndarray]
+    Compute the matrices of the linear state-space model of a mechanical system at an operating point
+    (see ``Linearizer``)
+
+        :Example:
+
+        >>> A, B, C, D = linearize(get_default_system(), (M_qq, delta_q), at={'x': 0, 'F': 1}, outputs=Matrix([x], shape=[1, 1]))
+
+    :returns: The matrices A and B (and C and D if the outputs were specified)
+    '''
+    return Linearizer(system, dynamics, inputs, outputs, method, step).linearize(at, t)
+
+
+
+def linearize_trajectory(system, dynamics, q, dq=None, t=None, u=None, inputs=None, outputs=None, method='auto', step=1e-6):
+    '''linearize_trajectory(system: System, dynamics, q: np.ndarray | Trajectory, ...) -> Tuple[np.ndarray]
+    Compute the matrices of the linear state-space model of a mechanical system at many operating points
+    (see ``Linearizer.linearize_trajectory``)
+
+    :returns: The matrices A and B (and C and D if the outputs were specified) stacked along the first axis
+    '''
+    return Linearizer(system, dynamics, inputs, outputs, method, step).linearize_trajectory(q, dq, t, u)
@@ -0,0 +1,270 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the class SimulationMonitor
+'''
+
+######## Import statements ########
+
+import warnings
+import numpy as np
+
+from lib3d_mec_ginac_ext import Matrix
+from .recorder import _fuse_probes
+
+
+
+######## class SimulationMonitor ########
+
+class SimulationMonitor:
+    '''
+    This class monitors the mechanical energy and the drift of the constraints of a system
+    during a simulation, to validate the step size or the tolerances of the integrator.
+
+    The next quantities are computed on each update:
+
+    - 'kinetic_energy': The sum of ``1/2 m v_G · v_G + 1/2 w · (I w)`` for all the solids, where
+      w and the velocity of the origin of the solid are taken from its twist (the inertia tensors
+      must be referred to the centers of mass)
+    - 'potential_energy': The potential energy of the gravity wrenches of the solids (plus an
+      additional expression, e.g. for springs)
+    - 'energy': The sum of the kinetic and potential energies
+    - 'energy_drift': The difference between the energy and its value in the first update
+      (it only remains zero for conservative systems)
+    - 'Phi_norm', 'dPhi_norm': The norms of the residuals of the geometric and kinematic
+      constraints (only if they are given)
+
+    All the expressions are compiled once in a single numeric function. On each update, the values
+    are accumulated in running statistics (mean, standard deviation, minimum and maximum) and compared
+    with the thresholds.
+
+        :Example:
+
+        >>> monitor = SimulationMonitor(system, Phi=Phi, dPhi=dPhi)
+        >>> monitor.set_threshold('energy_drift', 1e-3)
+        >>> monitor.set_threshold('Phi_norm', 1e-6, action='raise')
+        >>> engine.add_monitor(monitor)
+        >>> engine.run(10, 0.001)
+        >>> monitor.get_statistics()['energy_drift']['max']
+    '''
+    def __init__(self, system, solids=None, Phi=None, dPhi=None, potential_energy=None, gravity=True, c_optimized=False):
+        '''
+        Constructor.
+
+        :param system: The system being simulated
+        :param solids: The solids (objects or names) whose energies are computed. By default, all the
+            solids of the system
+        :param Phi: The geometric constraints (a symbolic matrix). Optional
+        :param dPhi: The kinematic constraints, usually ``derivative(Phi)`` (a symbolic matrix). Optional
+        :param potential_energy: An expression added to the potential energy (e.g. the energy stored
+            by springs). Optional
+        :param gravity: If False, the potential energy of the gravity wrenches is not included
+        :param c_optimized: If True, the numeric function is C optimized
+        '''
+        if solids is None:
+            solids = list(system.get_solids().values())
+        solids = [system.get_solid(solid) if isinstance(solid, str) else solid for solid in solids]
+
+        kinetic, potential = 0, 0 if potential_energy is None else potential_energy
+        for solid in solids:
+            mass, twist = solid.get_mass(), system.twist(solid)
+            w = twist.get_force()
+            v_G = twist.get_moment() + (w ^ solid.get_CM())
+            kinetic = kinetic + mass * (v_G * v_G) / 2 + (w * (solid.get_IT() * w)) / 2
+            if gravity:
+                wrench = system.gravity_wrench(solid)
+                potential = potential - wrench.get_force() * system.position_vector('O', wrench.get_point())
+
+        outputs = [Matrix([kinetic, potential], shape=[2, 1])]
+        names = ['kinetic_energy', 'potential_energy', 'energy', 'energy_drift']
+        for name, constraints in (('Phi_norm', Phi), ('dPhi_norm', dPhi)):
+            if constraints is not None:
+                outputs.append(constraints)
+                names.append(name)
+        func, slices = _fuse_probes(system, outputs, c_optimized)
+        self._setup(func, slices[1:], names)
+
+
+
+    ######## Getters ########
+
+    def get_names(self):
+        '''get_names() -> List[str]
+        Get the names of the quantities monitored
+        '''
+        return list(self._names)
+
+
+    def get_num_updates(self):
+        '''get_num_updates() -> int
+        Get the number of updates since the monitor was created or reset
+        '''
+        return self._num_updates
+
+
+    def get_value(self, name):
+        '''get_value(name: str) -> float
+        Get the value of a quantity in the last update
+
+        :raises IndexError: If there is no quantity with the given name
+        '''
+        return float(self._values[self._index(name)])
+
+
+    def get_values(self):
+        '''get_values() -> Dict[str, float]
+        Get the values of all the quantities in the last update
+        '''
+        return dict(zip(self._names, self._values.tolist()))
+
+
+    def get_initial_energy(self):
+        '''get_initial_energy() -> float | None
+        Get the energy in the first update (None if the monitor was not updated yet)
+        '''
+        return self._initial_energy
+
+
+    def get_statistics(self):
+        '''get_statistics() -> Dict[str, Dict[str, float]]
+        Get the running statistics of all the quantities since the monitor was created or reset: for
+        each one, a dictionary with the keys 'last', 'mean', 'std', 'min', 'max' and 'num_violations'
+        (the number of updates where its absolute value exceeded the threshold)
+        '''
+        n = self._num_updates
+        std = np.sqrt(self._m2 / n) if n > 0 else np.zeros_like(self._m2)
+        return dict(
+            (name, {
+                'last': float(self._values[k]), 'mean': float(self._mean[k]), 'std': float(std[k]),
+                'min': float(self._min[k]), 'max': float(self._max[k]),
+                'num_violations': int(self._num_violations[k])
+            })
+            for k, name in enumerate(self._names)
+        )
+
+
+    def get_threshold(self, name):
+        '''get_threshold(name: str) -> Tuple[float, str | Callable] | None
+        Get the threshold of a quantity and the action performed when it is exceeded (None
+        if it has no threshold)
+        '''
+        k = self._index(name)
+        return self._thresholds[k] if k in self._thresholds else None
+
+
+
+    ######## Setters ########
+
+    def set_threshold(self, name, value, action='warn'):
+        '''set_threshold(name: str, value: float[, action: str | Callable])
+        Set the maximum absolute value of a quantity. When it is exceeded in an update,
+        the given action is performed:
+
+        - 'warn': A RuntimeWarning is emitted (only the first time, until the monitor is reset)
+        - 'raise': A RuntimeError is raised (the simulation is interrupted)
+        - A callable, invoked with the monitor, the name of the quantity and its value (e.g. to
+          reduce the step size or the tolerances of the integrator)
+
+        :raises IndexError: If there is no quantity with the given name
+        '''
+        k = self._index(name)
+        try:
+            value = float(value)
+            if value < 0:
+                raise TypeError
+        except (TypeError, ValueError):
+            raise TypeError('value must be a number greater or equal than zero')
+        if action not in ('warn', 'raise') and not callable(action):
+            raise TypeError('action must be "warn", "raise" or a callable object')
+        self._thresholds[k] = value, action
+        self._warned.discard(k)
+
+
+    def remove_threshold(self, name):
+        '''remove_threshold(name: str)
+        Remove the threshold of a quantity
+
+        :raises IndexError: If there is no quantity with the given name or it has no threshold
+        '''
+        k = self._index(name)
+        if k not in self._thresholds:
+            raise IndexError(f'The quantity "{name}" has no threshold')
+        del self._thresholds[k]
+
+
+
+    ######## Updates ########
+
+    def reset(self):
+        '''reset()
+        Discard the statistics and the initial energy
+        '''
+        num_values = len(self._names)
+        self._values = np.zeros(num_values, dtype=np.float64)
+        self._num_updates = 0
+        self._initial_energy = None
+        self._mean = np.zeros(num_values, dtype=np.float64)
+        self._m2 = np.zeros(num_values, dtype=np.float64)
+        self._min = np.full(num_values, np.inf)
+        self._max = np.full(num_values, -np.inf)
+        self._num_violations = np.zeros(num_values, dtype=np.int64)
+        self._warned = set()
+
+
+
+    def update(self):
+        '''update()
+        Evaluate all the quantities with the current numeric values of the symbols, update the
+        statistics and check the thresholds
+        '''
+        outputs = self._func.evaluate()[:, 0]
+        values = self._values
+        values[:2] = outputs[:2]
+        values[2] = values[0] + values[1]
+        if self._initial_energy is None:
+            self._initial_energy = float(values[2])
+        values[3] = values[2] - self._initial_energy
+        for k, constraints in enumerate(self._constraints_slices, 4):
+            values[k] = np.linalg.norm(outputs[constraints])
+
+        # Running statistics (Welford's algorithm)
+        self._num_updates += 1
+        delta = values - self._mean
+        self._mean += delta / self._num_updates
+        self._m2 += delta * (values - self._mean)
+        np.minimum(self._min, values, out=self._min)
+        np.maximum(self._max, values, out=self._max)
+
+        # Thresholds
+        for k, (threshold, action) in self._thresholds.items():
+            value = values[k]
+            if abs(value) <= threshold:
+                continue
+            self._num_violations[k] += 1
+            name = self._names[k]
+            if action == 'warn':
+                if k not in self._warned:
+                    self._warned.add(k)
+                    warnings.warn(f'The monitored quantity "{name}" exceeded its threshold ({value} > {threshold})', RuntimeWarning)
+            elif action == 'raise':
+                raise RuntimeError(f'The monitored quantity "{name}" exceeded its threshold ({value} > {threshold})')
+            else:
+                action(self, name, float(value))
+
+
+
+    ######## Helpers ########
+
+    def _setup(self, func, constraints_slices, names):
+        # Initialize the monitor with the numeric function which evaluates the kinetic & potential
+        # energies and the residuals of the constraints (at the given slices of its outputs)
+        self._func = func
+        self._constraints_slices = constraints_slices
+        self._names = names
+        self._thresholds = {}
+        self.reset()
+
+
+    def _index(self, name):
+        if name not in self._names:
+            raise IndexError(f'There is no monitored quantity called "{name}"')
+        return self._names.index(name)
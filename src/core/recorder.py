@@ -0,0 +1,287 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the class Recorder
+'''
+
+######## Import statements ########
+
+from collections import OrderedDict
+import numpy as np
+
+from lib3d_mec_ginac_ext import Matrix, Expr, SymbolNumeric, Wrench3D
+
+
+
+######## Helper functions ########
+
+def _probe_outputs(x):
+    # Get the list of symbolic expressions that will be evaluated for the given probe
+    if isinstance(x, Wrench3D):
+        return x.get_force().get_values() + x.get_moment().get_values()
+    if isinstance(x, Matrix):
+        return x.get_values()
+    return [x]
+
+
+def _fuse_probes(system, probes, c_optimized=False):
+    # Compile the outputs of all the given probes in a single numeric function (so that the
+    # atoms shared by the expressions are evaluated only once). Returns the numeric function
+    # and a list with the slice of the outputs of each probe
+    outputs, slices = [], []
+    for x in probes:
+        values = _probe_outputs(x)
+        slices.append(slice(len(outputs), len(outputs) + len(values)))
+        outputs.extend(values)
+    if not outputs:
+        return None, slices
+    func = system.compile_numeric_function(Matrix(outputs, shape=[len(outputs), 1]), c_optimized)
+    return func, slices
+
+
+
+
+
+
+######## class Recorder ########
+
+class Recorder:
+    '''
+    This class can be used to record the numeric values of symbolic expressions, matrices,
+    vectors or wrenches (probes) while the system is being simulated.
+
+    All the probes are compiled together in a single numeric function (the atoms shared
+    between them are evaluated only once), and the outputs of each sample are stored in a
+    preallocated ring buffer with one row per output (columnar layout): when the buffer is
+    full, the oldest samples are overwritten.
+
+    The recorder can be attached to a simulation engine (see ``SimulationEngine.add_recorder``)
+    so that ``record`` is invoked after each simulation step. The number of samples stored can be
+    reduced with the decimation options.
+
+        :Example:
+
+        >>> recorder = Recorder(get_default_system(), capacity=10000, decimation=10)
+        >>> recorder.add_probe('p', position_vector('O', 'B'))
+        >>> recorder.add_probe('F', gravity_wrench('Arm1'))
+        >>> get_simulation_engine().add_recorder(recorder)
+        >>> trajectory = run_simulation(...)
+        >>> recorder.get_probe_values('p').shape
+        (1001, 3)
+    '''
+    def __init__(self, system, capacity=4096, decimation=1, time_interval=None, c_optimized=False):
+        '''
+        Constructor.
+
+        :param system: The system where the probes are defined
+        :param capacity: Maximum number of samples stored
+        :param decimation: Only one sample is stored every ``decimation`` calls to ``record``
+        :param time_interval: If not None, the samples are stored only if at least this amount
+            of time elapsed since the last sample stored
+        :param c_optimized: If True, compile the probes as a cython extension
+        '''
+        if not isinstance(capacity, int) or capacity <= 0:
+            raise TypeError('capacity must be an integer greater than zero')
+
+        self._system = system
+        self._capacity = capacity
+        self._c_optimized = c_optimized
+        self._probes = OrderedDict()
+        self._func, self._slices = None, []
+        self._time = np.zeros(capacity, dtype=np.float64)
+        self._values = np.zeros((0, capacity), dtype=np.float64)
+        self.set_decimation(decimation, time_interval)
+        self.clear()
+
+
+
+    ######## Getters ########
+
+    def get_capacity(self):
+        '''get_capacity() -> int
+        Get the maximum number of samples stored
+        '''
+        return self._capacity
+
+
+    def get_decimation(self):
+        '''get_decimation() -> Tuple[int, float | None]
+        Get the decimation factor and the minimum time interval between samples
+        '''
+        return self._decimation, self._time_interval
+
+
+    def get_num_samples(self):
+        '''get_num_samples() -> int
+        Get the number of samples currently stored
+        '''
+        return min(self._num_records, self._capacity)
+
+
+    def get_num_records(self):
+        '''get_num_records() -> int
+        Get the total number of samples recorded since the last call to ``clear`` (including
+        the samples overwritten in the ring buffer)
+        '''
+        return self._num_records
+
+
+    def get_probes_names(self):
+        '''get_probes_names() -> Tuple[str]
+        Get the names of the probes registered
+        '''
+        return tuple(self._probes.keys())
+
+
+    def get_num_outputs(self):
+        '''get_num_outputs() -> int
+        Get the total number of outputs of all the probes registered
+        '''
+        return self._values.shape[0]
+
+
+    def get_time_values(self):
+        '''get_time_values() -> np.ndarray
+        Get the time of the samples stored (from the oldest to the newest)
+        '''
+        return self._ordered(self._time)
+
+
+    def get_probe_values(self, name):
+        '''get_probe_values(name: str) -> np.ndarray
+        Get the values of the probe with the given name (from the oldest to the newest sample)
+
+        :returns: An array with one row per sample and one column per output of the probe
+        :raises IndexError: If there is no probe with that name
+        '''
+        if name not in self._probes:
+            raise IndexError(f'There is no probe called "{name}"')
+        index = tuple(self._probes.keys()).index(name)
+        return self._ordered(self._values[self._slices[index]]).T
+
+
+
+    def _ordered(self, values):
+        # Returns the samples stored in the ring buffer in chronological order
+        k, capacity = self._num_records, self._capacity
+        if k <= capacity:
+            return values[..., :k]
+        head = k % capacity
+        return np.concatenate((values[..., head:], values[..., :head]), axis=-1)
+
+
+
+    ######## Setters ########
+
+    def set_decimation(self, decimation=1, time_interval=None):
+        '''set_decimation(decimation: int[, time_interval: float])
+        Change the decimation options
+
+        :param decimation: Only one sample is stored every ``decimation`` calls to ``record``
+        :param time_interval: If not None, the samples are stored only if at least this amount
+            of time elapsed since the last sample stored
+        '''
+        if not isinstance(decimation, int) or decimation <= 0:
+            raise TypeError('decimation must be an integer greater than zero')
+        if time_interval is not None:
+            try:
+                time_interval = float(time_interval)
+                if time_interval < 0:
+                    raise TypeError
+            except (TypeError, ValueError):
+                raise TypeError('time_interval must be a number greater or equal than zero or None')
+        self._decimation, self._time_interval = decimation, time_interval
+
+
+
+    ######## Probes ########
+
+    def add_probe(self, name, x):
+        '''add_probe(name: str, x: Expr | Matrix | Vector3D | Wrench3D)
+        Register a new probe. All the samples recorded are discarded.
+
+        :param name: Name of the probe
+        :param x: The expression to record. If it is a matrix or vector, all its items are
+            recorded (row by row). For wrenches, the components of the force and the moment are
+            recorded.
+        :raises TypeError: If the input arguments have incorrect types
+        :raises ValueError: If a probe with the same name already exists
+        '''
+        if not isinstance(name, str):
+            raise TypeError('The name of the probe must be a string')
+        if name in self._probes:
+            raise ValueError(f'There is already a probe called "{name}"')
+        if not isinstance(x, (Expr, SymbolNumeric, Matrix, Wrench3D)):
+            raise TypeError('The probe must be an expression, symbol, matrix, vector or wrench')
+        self._probes[name] = x
+        self._compile()
+
+
+    def remove_probe(self, name):
+        '''remove_probe(name: str)
+        Remove a probe. All the samples recorded are discarded.
+
+        :raises IndexError: If there is no probe with that name
+        '''
+        if name not in self._probes:
+            raise IndexError(f'There is no probe called "{name}"')
+        del self._probes[name]
+        self._compile()
+
+
+
+    def _compile(self):
+        # Compile all the probes together and reallocate the ring buffer
+        self._func, self._slices = _fuse_probes(self._system, self._probes.values(), self._c_optimized)
+        num_outputs = self._slices[-1].stop if self._slices else 0
+        self._values = np.zeros((num_outputs, self._capacity), dtype=np.float64)
+        self.clear()
+
+
+
+    ######## Recording ########
+
+    def clear(self):
+        '''clear()
+        Discard all the samples recorded
+        '''
+        self._num_records, self._num_calls = 0, 0
+        self._last_time = None
+
+
+    def record(self, t=None):
+        '''record([t: float]) -> bool
+        Evaluate the probes at the current numeric values of the symbols of the system and
+        store the outputs (unless the sample is discarded by the decimation options)
+
+        :param t: The time of the sample (by default, the numeric value of the time of the system)
+        :returns: True if the sample was stored, False if it was discarded
+        '''
+        if t is None:
+            t = self._system._time_value
+        if not self._accept(t):
+            return False
+        self._store(self._num_records % self._capacity, t)
+        self._num_records += 1
+        self._last_time = t
+        return True
+
+
+
+    def _accept(self, t):
+        # Returns False if the sample at the time t must be discarded (decimation options)
+        calls = self._num_calls
+        self._num_calls = calls + 1
+        if calls % self._decimation != 0:
+            return False
+        interval = self._time_interval
+        if interval is not None and self._last_time is not None and t - self._last_time < interval * (1 - 1e-9):
+            # (the tolerance avoids discarding samples due to rounding errors of the time)
+            return False
+        return True
+
+
+    def _store(self, index, t):
+        # Store the time and the outputs of the probes in the given column of the buffers
+        self._time[index] = t
+        if self._func is not None:
+            self._values[:, index] = self._func.evaluate()[:, 0]
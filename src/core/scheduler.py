@@ -0,0 +1,380 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the class RealTimeScheduler
+'''
+
+######## Import statements ########
+
+from time import perf_counter_ns
+from collections import deque
+import numpy as np
+
+
+
+######## class RealTimeScheduler ########
+
+class RealTimeScheduler:
+    '''
+    This class keeps a simulation advanced periodically (e.g. by the viewer) synchronized
+    with the wall clock.
+
+    The updates are expected at fixed deadlines (one every ``interval`` seconds) measured with a
+    monotonic high resolution clock. On each update, the scheduler measures its latency (how late
+    it started with respect its deadline), the deadlines missed, the execution time and whether the
+    update finished after the next deadline (an overrun).
+
+    The real time elapsed is accumulated and split in integration steps of a fixed size. When more
+    than ``max_substeps`` steps are needed in a single update, the policy decides what to do:
+
+    - 'slow_down': The time left is discarded (the simulation runs slower than the real time, but the
+      updates are never delayed)
+
+    - 'catch_up': The time left is integrated on the next updates (the simulation time catches up with
+      the real time when the load decreases)
+
+    - 'skip_frames': All the steps are performed in the same update (the simulation time never lags
+      behind the real time, but the frames of the deadlines missed are skipped)
+
+        :Example:
+
+        >>> scheduler = RealTimeScheduler(1 / 30, policy='catch_up')
+        >>> scheduler.start()
+        >>> scheduler.begin_update()
+        >>> for k in range(0, scheduler.get_num_substeps(0.001)):
+        ...     engine.step(0.001)
+        >>> scheduler.end_update(simulated_time)
+        >>> scheduler.get_real_time_factor()
+    '''
+    _POLICIES = ('slow_down', 'catch_up', 'skip_frames')
+
+    def __init__(self, interval=1/30, policy='slow_down', max_substeps=8, histogram_edges=None, clock=perf_counter_ns):
+        '''
+        Constructor.
+
+        :param interval: The time between two consecutive deadlines (in seconds)
+        :param policy: 'slow_down' (default), 'catch_up' or 'skip_frames'
+        :param max_substeps: The maximum number of integration steps per update (ignored if
+            the policy is 'skip_frames')
+        :param histogram_edges: The edges of the bins of the latency and execution time histograms (in seconds).
+            By default, 50 bins of 2 milliseconds. The values out of range are counted in the first or last bins
+        :param clock: A callable which returns a monotonic time in nanoseconds
+        '''
+        if histogram_edges is None:
+            histogram_edges = np.linspace(0, 0.1, 51)
+        histogram_edges = np.asarray(histogram_edges, dtype=np.float64)
+        if histogram_edges.ndim != 1 or histogram_edges.shape[0] < 2 or (np.diff(histogram_edges) <= 0).any():
+            raise ValueError('histogram_edges must be an increasing sequence with at least two values')
+        if not callable(clock):
+            raise TypeError('clock must be a callable object')
+
+        self._clock = clock
+        self._histogram_edges = histogram_edges
+        self.set_interval(interval)
+        self.set_policy(policy)
+        self.set_max_substeps(max_substeps)
+        self.reset()
+
+
+
+    ######## Getters ########
+
+    def get_interval(self):
+        '''get_interval() -> float
+        Get the time between two consecutive deadlines (in seconds)
+        '''
+        return self._interval
+
+
+    def get_policy(self):
+        '''get_policy() -> str
+        Get the policy applied when the simulation cannot keep up with the real time
+        '''
+        return self._policy
+
+
+    def get_max_substeps(self):
+        '''get_max_substeps() -> int
+        Get the maximum number of integration steps per update
+        '''
+        return self._max_substeps
+
+
+    def get_accumulated_time(self):
+        '''get_accumulated_time() -> float
+        Get the real time elapsed which was not integrated yet
+        '''
+        return self._accumulated_time
+
+
+    def get_num_updates(self):
+        '''get_num_updates() -> int
+        Get the number of updates since the scheduler started
+        '''
+        return self._num_updates
+
+
+    def get_num_overruns(self):
+        '''get_num_overruns() -> int
+        Get the number of updates which finished after the next deadline
+        '''
+        return self._num_overruns
+
+
+    def get_num_missed_deadlines(self):
+        '''get_num_missed_deadlines() -> int
+        Get the number of deadlines skipped because no update started before the following deadline
+        '''
+        return self._num_missed_deadlines
+
+
+    def get_elapsed_time(self):
+        '''get_elapsed_time() -> float
+        Get the real time elapsed since the scheduler started (the time while paused is excluded)
+        '''
+        return self._real_time
+
+
+    def get_simulated_time(self):
+        '''get_simulated_time() -> float
+        Get the amount of time simulated since the scheduler started
+        '''
+        return self._simulated_time
+
+
+    def get_real_time_factor(self, window=None):
+        '''get_real_time_factor([window: float]) -> float
+        Get the ratio between the simulated time and the real time elapsed
+
+        :param window: If specified, only the updates of the last ``window`` seconds are
+            considered. Otherwise, all the updates since the scheduler started
+        '''
+        if window is None:
+            real_time, simulated_time = self._real_time, self._simulated_time
+        else:
+            num_updates, real_time, simulated_time = self._window_sums(window)
+        return simulated_time / real_time if real_time > 0 else 0.0
+
+
+    def get_update_frequency(self, window=1.0):
+        '''get_update_frequency([window: float]) -> float
+        Get the number of updates per second measured during the last ``window`` seconds (1 by default)
+        '''
+        num_updates, real_time, simulated_time = self._window_sums(window)
+        return num_updates / real_time if real_time > 0 else 0.0
+
+
+    def get_latency_histogram(self):
+        '''get_latency_histogram() -> Tuple[np.ndarray, np.ndarray]
+        Get the histogram of the latencies of the updates (the time between their deadlines and
+        the moment they started). Returns the counts and the edges of the bins (in seconds)
+        '''
+        return self._latency_counts.copy(), self._histogram_edges.copy()
+
+
+    def get_execution_time_histogram(self):
+        '''get_execution_time_histogram() -> Tuple[np.ndarray, np.ndarray]
+        Get the histogram of the execution times of the updates. Returns the counts and the edges of
+        the bins (in seconds)
+        '''
+        return self._execution_counts.copy(), self._histogram_edges.copy()
+
+
+    def get_statistics(self):
+        '''get_statistics() -> Dict[str, float]
+        Get a summary of the timing statistics: the number of updates, overruns and missed
+        deadlines, the real time factor (overall and during the last second), the measured update frequency
+        and the mean and maximum latency and execution time (in seconds)
+        '''
+        def mean(values):
+            return values[1] / values[0] if values[0] > 0 else 0.0
+        return {
+            'num_updates': self._num_updates,
+            'num_overruns': self._num_overruns,
+            'num_missed_deadlines': self._num_missed_deadlines,
+            'real_time_factor': self.get_real_time_factor(),
+            'recent_real_time_factor': self.get_real_time_factor(1.0),
+            'update_frequency': self.get_update_frequency(),
+            'mean_latency': mean(self._latency_stats),
+            'max_latency': self._latency_stats[2],
+            'mean_execution_time': mean(self._execution_stats),
+            'max_execution_time': self._execution_stats[2]
+        }
+
+
+
+    ######## Setters ########
+
+    def set_interval(self, interval):
+        '''set_interval(interval: float)
+        Change the time between two consecutive deadlines (in seconds)
+        '''
+        try:
+            interval = float(interval)
+            if interval <= 0:
+                raise TypeError
+        except (TypeError, ValueError):
+            raise TypeError('interval must be a number greater than zero')
+        self._interval = interval
+        self._interval_ns = max(int(round(interval * 1e9)), 1)
+
+
+    def set_policy(self, policy):
+        '''set_policy(policy: str)
+        Change the policy applied when the simulation cannot keep up with the real time
+        ('slow_down', 'catch_up' or 'skip_frames')
+        '''
+        if policy not in self._POLICIES:
+            raise ValueError('policy must be "slow_down", "catch_up" or "skip_frames"')
+        self._policy = policy
+
+
+    def set_max_substeps(self, max_substeps):
+        '''set_max_substeps(max_substeps: int)
+        Change the maximum number of integration steps per update
+        '''
+        if not isinstance(max_substeps, int) or max_substeps <= 0:
+            raise TypeError('max_substeps must be an integer greater than zero')
+        self._max_substeps = max_substeps
+
+
+
+    ######## Controls ########
+
+    def reset(self):
+        '''reset()
+        Discard all the statistics and the time accumulated
+        '''
+        num_bins = self._histogram_edges.shape[0] - 1
+        self._deadline, self._last_time, self._update_start = None, None, None
+        self._accumulated_time = 0.0
+        self._num_updates, self._num_overruns, self._num_missed_deadlines = 0, 0, 0
+        self._real_time, self._simulated_time = 0.0, 0.0
+        self._latency_counts = np.zeros(num_bins, dtype=np.int64)
+        self._execution_counts = np.zeros(num_bins, dtype=np.int64)
+        # Number of samples, sum and maximum
+        self._latency_stats, self._execution_stats = [0, 0.0, 0.0], [0, 0.0, 0.0]
+        # Timestamp, real time and simulated time of the last updates
+        self._history = deque(maxlen=4096)
+        self._elapsed = 0.0
+
+
+    def start(self):
+        '''start()
+        Must be called when the simulation starts (the statistics are discarded)
+        '''
+        self.reset()
+
+
+
+    def resume(self):
+        '''resume()
+        Must be called when the simulation is resumed after a pause (the time while it was paused
+        is not taken into account)
+        '''
+        self._deadline, self._last_time = None, None
+
+
+
+    def begin_update(self, elapsed=None):
+        '''begin_update([elapsed: float]) -> float
+        Must be called at the beginning of each update. Returns the real time elapsed since the
+        previous update (0 on the first update after starting or resuming).
+
+        :param elapsed: If specified, it is used as the real time elapsed instead of measuring it (the
+            deadlines are not tracked, e.g. to record a video offline)
+        '''
+        now = self._clock()
+        self._update_start = now
+        if elapsed is None:
+            interval = self._interval_ns
+            if self._last_time is None:
+                elapsed = 0.0
+                self._deadline = now + interval
+            else:
+                elapsed = (now - self._last_time) / 1e9
+                latency = now - self._deadline
+                self._record(self._latency_counts, self._latency_stats, latency / 1e9)
+                # Skip the deadlines missed (the next deadline is always in the future)
+                missed = max(latency // interval, 0)
+                self._num_missed_deadlines += missed
+                self._deadline += (missed + 1) * interval
+            self._last_time = now
+        else:
+            try:
+                elapsed = float(elapsed)
+            except (TypeError, ValueError):
+                raise TypeError('elapsed must be a number')
+        self._elapsed = elapsed
+        self._accumulated_time += elapsed
+        return elapsed
+
+
+
+    def get_num_substeps(self, step):
+        '''get_num_substeps(step: float) -> int
+        Get the number of integration steps of the given size which must be performed in the current
+        update (according to the real time accumulated and the policy)
+        '''
+        num_substeps = int(self._accumulated_time / step + 1e-9)
+        if num_substeps > self._max_substeps and self._policy != 'skip_frames':
+            num_substeps = self._max_substeps
+            if self._policy == 'slow_down':
+                self._accumulated_time = num_substeps * step
+        self._accumulated_time = max(self._accumulated_time - num_substeps * step, 0.0)
+        return num_substeps
+
+
+
+    def discard_accumulated_time(self):
+        '''discard_accumulated_time()
+        Discard the real time accumulated which was not integrated yet
+        '''
+        self._accumulated_time = 0.0
+
+
+
+    def end_update(self, simulated_time):
+        '''end_update(simulated_time: float)
+        Must be called at the end of each update with the amount of time simulated on it
+        '''
+        if self._update_start is None:
+            raise RuntimeError('begin_update must be called first')
+        now = self._clock()
+        self._record(self._execution_counts, self._execution_stats, (now - self._update_start) / 1e9)
+        if self._deadline is not None and self._last_time is not None and now > self._deadline:
+            self._num_overruns += 1
+        self._num_updates += 1
+        self._real_time += self._elapsed
+        self._simulated_time += simulated_time
+        self._history.append((now, self._elapsed, simulated_time))
+        self._update_start = None
+
+
+
+    ######## Helpers ########
+
+    def _record(self, counts, stats, value):
+        # Add a new sample to a histogram and its statistics
+        index = int(np.searchsorted(self._histogram_edges, value, side='right')) - 1
+        counts[min(max(index, 0), counts.shape[0] - 1)] += 1
+        stats[0] += 1
+        stats[1] += value
+        stats[2] = max(stats[2], value)
+
+
+
+    def _window_sums(self, window):
+        # Number of updates (the first ones after starting or resuming are excluded), real time
+        # and simulated time during the last "window" seconds
+        history = self._history
+        num_updates, real_time, simulated_time = 0, 0.0, 0.0
+        if not history:
+            return num_updates, real_time, simulated_time
+        now = history[-1][0]
+        for timestamp, elapsed, simulated in reversed(history):
+            if now - timestamp >= window * 1e9:
+                break
+            num_updates += elapsed > 0
+            real_time += elapsed
+            simulated_time += simulated
+        return num_updates, real_time, simulated_time
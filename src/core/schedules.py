@@ -0,0 +1,242 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the class InputSchedules
+'''
+
+######## Import statements ########
+
+import numpy as np
+
+
+
+######## class InputSchedules ########
+
+class InputSchedules:
+    '''
+    This class drives the numeric values of input symbols of a system as functions of the time:
+    time series (interpolated) or piecewise polynomials.
+
+    All the schedules are converted to piecewise polynomials and packed together in a single table,
+    so that all of them are evaluated at once with a few vectorized operations (one binary search over
+    the breakpoints of all the schedules and the Horner scheme of the polynomials). The values are written
+    directly in the numeric values array of the inputs (no events are fired).
+
+    A simulation engine evaluates its schedules at the time of every evaluation of the derivative
+    of the state (the stage times of the integrator) and at the end of every step (see
+    ``SimulationEngine.add_input_schedule``). Before the first breakpoint and after the last one,
+    the values of the inputs are held constant.
+    '''
+    def __init__(self, system):
+        '''
+        Constructor.
+
+        :param system: The system whose inputs are driven by the schedules
+        '''
+        self._system = system
+        self._schedules = {}
+        self._table = None
+
+
+
+    ######## Getters ########
+
+    def has_schedules(self):
+        '''has_schedules() -> bool
+        Returns True if at least one schedule was added
+        '''
+        return len(self._schedules) > 0
+
+
+    def get_names(self):
+        '''get_names() -> List[str]
+        Get the names of the inputs driven by a schedule
+        '''
+        return list(self._schedules.keys())
+
+
+    def get_breakpoints(self, name):
+        '''get_breakpoints(name: str) -> np.ndarray
+        Get the breakpoints of the schedule of the given input
+
+        :raises IndexError: If the input has no schedule
+        '''
+        return self._get_schedule(name)[0].copy()
+
+
+    def get_coefficients(self, name):
+        '''get_coefficients(name: str) -> np.ndarray
+        Get the coefficients of the polynomials of the schedule of the given input (one row per
+        piece, highest powers first)
+
+        :raises IndexError: If the input has no schedule
+        '''
+        return self._get_schedule(name)[1].copy()
+
+
+
+    ######## Schedules ########
+
+    def add_time_series(self, name, times, values, interpolation='linear'):
+        '''add_time_series(name: str, times: np.ndarray, values: np.ndarray[, interpolation: str])
+        Drive the given input with a time series
+
+        :param name: The name of the input symbol
+        :param times: The times of the samples (strictly increasing)
+        :param values: The values of the input at the given times
+        :param interpolation: 'linear' (default), 'previous' (the value of the last sample is held until
+            the next one) or 'cubic' (cubic hermite polynomials whose slopes are estimated with finite differences)
+        '''
+        times = np.asarray(times, dtype=np.float64).reshape(-1)
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        if times.shape != values.shape:
+            raise ValueError('times and values must have the same number of items')
+        if times.shape[0] < 1:
+            raise ValueError('The time series must have at least one sample')
+        if interpolation not in ('linear', 'previous', 'cubic'):
+            raise ValueError('interpolation must be "linear", "previous" or "cubic"')
+
+        if times.shape[0] == 1:
+            breaks, coefficients = np.array([times[0], times[0] + 1.0]), values.reshape(1, 1)
+        elif interpolation == 'previous':
+            # An additional piece holds the value of the last sample
+            breaks = np.append(times, times[-1] + 1.0)
+            coefficients = values[:, np.newaxis].copy()
+        else:
+            h = np.diff(times)
+            slopes = np.diff(values) / h
+            breaks = times
+            if interpolation == 'linear':
+                coefficients = np.stack([slopes, values[:-1]], axis=1)
+            else:
+                # Hermite polynomials: p(x) = c0 x^3 + c1 x^2 + c2 x + c3
+                d = np.empty_like(values)
+                d[0], d[-1] = slopes[0], slopes[-1]
+                d[1:-1] = (slopes[:-1] * h[1:] + slopes[1:] * h[:-1]) / (h[:-1] + h[1:])
+                c0 = (d[:-1] + d[1:] - 2 * slopes) / h ** 2
+                c1 = (3 * slopes - 2 * d[:-1] - d[1:]) / h
+                coefficients = np.stack([c0, c1, d[:-1], values[:-1]], axis=1)
+        self.add_piecewise_polynomial(name, breaks, coefficients)
+
+
+
+    def add_piecewise_polynomial(self, name, breaks, coefficients):
+        '''add_piecewise_polynomial(name: str, breaks: np.ndarray, coefficients: np.ndarray)
+        Drive the given input with a piecewise polynomial. The value at the time t in the interval
+        ``[breaks[i], breaks[i+1])`` is ``sum(coefficients[i, j] * (t - breaks[i]) ** (k - 1 - j))``
+
+        :param name: The name of the input symbol
+        :param breaks: The breakpoints (strictly increasing). Its length must be the number of pieces + 1
+        :param coefficients: An array with the shape (number of pieces, k) with the coefficients of the
+            polynomials (in the local variable t - breaks[i], highest powers first)
+        :raises IndexError: If there is no input symbol with the given name
+        '''
+        if not isinstance(name, str):
+            raise TypeError('name must be a string')
+        inputs = self._system._symbols_values['input']
+        if name not in inputs:
+            raise IndexError(f'There is no input symbol called "{name}"')
+        breaks = np.asarray(breaks, dtype=np.float64).reshape(-1)
+        coefficients = np.asarray(coefficients, dtype=np.float64)
+        if coefficients.ndim == 1:
+            coefficients = coefficients[:, np.newaxis]
+        if coefficients.ndim != 2 or coefficients.shape[0] < 1 or coefficients.shape[1] < 1:
+            raise ValueError('coefficients must be an array with the shape (number of pieces, k)')
+        if breaks.shape[0] != coefficients.shape[0] + 1:
+            raise ValueError('The number of breakpoints must be the number of pieces + 1')
+        if not np.isfinite(breaks).all() or (np.diff(breaks) <= 0).any():
+            raise ValueError('The breakpoints must be finite and strictly increasing')
+
+        self._schedules[name] = breaks, coefficients
+        self._table = None
+
+
+
+    def remove(self, name):
+        '''remove(name: str)
+        Remove the schedule of the given input (its numeric value is not modified)
+
+        :raises IndexError: If the input has no schedule
+        '''
+        self._get_schedule(name)
+        del self._schedules[name]
+        self._table = None
+
+
+
+    ######## Evaluation ########
+
+    def evaluate(self, t):
+        '''evaluate(t: float) -> np.ndarray
+        Evaluate all the schedules at the given time (in the same order as ``get_names``)
+        '''
+        if self._table is None:
+            self._table = self._pack()
+        union, counts, breaks, coefficients, starts, ends, num_pieces, rows = self._table
+        rows_range = np.arange(rows.shape[0])
+
+        # Locate the piece of each schedule (and hold the values out of the breakpoints)
+        index = np.minimum(np.maximum(counts[:, np.searchsorted(union, t, side='right')] - 1, 0), num_pieces - 1)
+        x = np.minimum(np.maximum(t, starts), ends) - breaks[rows_range, index]
+        c = coefficients[rows_range, index]
+        values = c[:, 0].copy()
+        for j in range(1, c.shape[1]):
+            values *= x
+            values += c[:, j]
+        return values
+
+
+
+    def apply(self, t):
+        '''apply(t: float)
+        Evaluate all the schedules at the given time and store the results as the numeric values of
+        the inputs of the system
+        '''
+        if self._table is None:
+            self._table = self._pack()
+        self._system._symbols_values['input'].as_array()[self._table[-1], 0] = self.evaluate(t)
+
+
+
+    def wrap(self, callback):
+        '''wrap(callback: Callable) -> Callable
+        Returns a callable with the signature ``f(t, y, out)`` which updates the inputs at the time t
+        before invoking the given callback (e.g. the derivative of the state vector used by an integrator)
+        '''
+        apply = self.apply
+        def wrapper(t, y, out):
+            apply(t)
+            callback(t, y, out)
+        return wrapper
+
+
+
+    ######## Helpers ########
+
+    def _get_schedule(self, name):
+        if name not in self._schedules:
+            raise IndexError(f'The input "{name}" has no schedule')
+        return self._schedules[name]
+
+
+    def _pack(self):
+        # Pack all the schedules in a single table:
+        # - The sorted union of all the breakpoints and the number of breakpoints of each schedule
+        #   lower or equal than each item of the union (so that a single binary search is needed)
+        # - The breakpoints and the coefficients of all the schedules (padded)
+        schedules = list(self._schedules.values())
+        inputs = self._system._symbols_values['input']
+        rows = np.array([inputs.index(name) for name in self._schedules.keys()], dtype=np.int64)
+
+        num_pieces = np.array([coefficients.shape[0] for breaks, coefficients in schedules], dtype=np.int64)
+        order = max(coefficients.shape[1] for breaks, coefficients in schedules)
+        union = np.unique(np.concatenate([breaks for breaks, coefficients in schedules]))
+        counts = np.zeros((len(schedules), union.shape[0] + 1), dtype=np.int64)
+        breaks_table = np.zeros((len(schedules), num_pieces.max() + 1), dtype=np.float64)
+        coefficients_table = np.zeros((len(schedules), num_pieces.max(), order), dtype=np.float64)
+        for k, (breaks, coefficients) in enumerate(schedules):
+            counts[k, 1:] = np.searchsorted(breaks, union, side='right')
+            breaks_table[k, :breaks.shape[0]] = breaks
+            coefficients_table[k, :coefficients.shape[0], order - coefficients.shape[1]:] = coefficients
+        starts = np.array([breaks[0] for breaks, coefficients in schedules])
+        ends = np.array([breaks[-1] for breaks, coefficients in schedules])
+        return union, counts, breaks_table, coefficients_table, starts, ends, num_pieces, rows
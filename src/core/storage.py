@@ -0,0 +1,684 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the classes TrajectoryWriter and TrajectoryReader
+'''
+
+######## Import statements ########
+
+import json
+import os
+from os.path import join, exists
+from threading import Thread
+from queue import Queue
+import numpy as np
+
+from .recorder import Recorder
+
+
+
+######## Constants ########
+
+_METADATA_FILENAME = 'metadata.json'
+_FORMAT_NAME = 'lib3d_mec_ginac.trajectory'
+_FORMAT_VERSION = 1
+
+
+
+
+######## Helper functions ########
+
+def _write_atomically(filename, write):
+    # Writes a file using a temporary file which is renamed when the contents are complete
+    # (readers never see partially written files)
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as file:
+        write(file)
+    os.replace(tmp_filename, filename)
+
+
+
+
+
+
+######## class TrajectoryWriter ########
+
+class TrajectoryWriter(Recorder):
+    '''
+    This class can be used to store the samples of a simulation in disk.
+
+    Each sample (the time, the numeric values of the symbols of the selected types and the
+    outputs of the probes) is stored in a preallocated block with one row per output
+    (columnar layout). When the block is full, it is handed to a background thread which
+    writes it as a new chunk file (.npy or compressed .npz) while the simulation continues
+    filling another block: the integration loop never waits for the disk.
+
+    The data is stored in a directory with one file per chunk and a JSON sidecar file
+    (``metadata.json``) with the names of the symbols (taken from the symbol values mappings
+    of the system), the layout of the rows and the list of chunks written. All the files are
+    written atomically, so the trajectory can be read (see ``TrajectoryReader``) while the
+    simulation is still running.
+
+    The samples can also be appended to a trajectory stored previously (e.g. to resume a simulation
+    from a checkpoint in another process, see ``load_checkpoint``).
+
+        :Example:
+
+        >>> with TrajectoryWriter(get_default_system(), 'results', chunk=8192) as writer:
+        ...     writer.add_probe('p', position_vector('O', 'B'))
+        ...     get_simulation_engine().add_recorder(writer)
+        ...     run_simulation(...)
+        >>> TrajectoryReader('results').get_symbols_values('coordinate').shape
+        (100001, 3)
+    '''
+    def __init__(self, system, path, chunk=4096, compressed=False, symbol_types=None,
+        decimation=1, time_interval=None, c_optimized=False, overwrite=False, append=False):
+        '''
+        Constructor.
+
+        :param system: The system to record
+        :param path: The directory where the files will be stored (created if it doesnt exist)
+        :param chunk: Number of samples of each chunk file
+        :param compressed: If True, the chunks are stored as compressed .npz files. Otherwise, .npy
+            files are used (which can be memory mapped when they are read)
+        :param symbol_types: The types of the symbols whose values are stored (all the types by
+            default) e.g: ``('coordinate', 'velocity')``
+        :param decimation: Only one sample is stored every ``decimation`` calls to ``record``
+        :param time_interval: If not None, the samples are stored only if at least this amount
+            of time elapsed since the last sample stored
+        :param c_optimized: If True, compile the probes as a cython extension
+        :param overwrite: If False and the directory already contains a trajectory, an exception
+            is raised. Otherwise, the previous trajectory is removed
+        :param append: If True and the directory already contains a trajectory, the new samples are
+            appended to it (the symbols and probes stored must be the same)
+        :raises FileExistsError: If the directory contains a trajectory and overwrite and append are False
+        '''
+        if not isinstance(path, str):
+            raise TypeError('path must be a string')
+        if not isinstance(chunk, int) or chunk <= 0:
+            raise TypeError('chunk must be an integer greater than zero')
+        if symbol_types is None:
+            symbol_types = tuple(system._symbols_values.keys())
+        if isinstance(symbol_types, str):
+            symbol_types = (symbol_types,)
+        symbol_types = tuple(symbol_types)
+        for kind in symbol_types:
+            if kind not in system._symbols_values:
+                raise ValueError(f'Invalid symbol type "{kind}"')
+
+        # Prepare the output directory
+        os.makedirs(path, exist_ok=True)
+        metadata_filename = join(path, _METADATA_FILENAME)
+        if exists(metadata_filename) and not append:
+            if not overwrite:
+                raise FileExistsError(f'There is already a trajectory stored in "{path}"')
+            with open(metadata_filename) as file:
+                for entry in json.load(file).get('chunks', []):
+                    if exists(join(path, entry['file'])):
+                        os.remove(join(path, entry['file']))
+            os.remove(metadata_filename)
+
+        self._path = path
+        self._compressed = bool(compressed)
+        self._append = bool(append)
+        self._symbol_types = symbol_types
+        self._metadata = None
+        self._block, self._free_blocks = None, []
+        self._num_flushed = 0
+        self._queue, self._worker, self._error = Queue(), None, None
+        self._closed = False
+        super().__init__(system, chunk, decimation, time_interval, c_optimized)
+
+
+
+    ######## Getters ########
+
+    def get_path(self):
+        '''get_path() -> str
+        Get the directory where the trajectory is stored
+        '''
+        return self._path
+
+
+    def get_symbol_types(self):
+        '''get_symbol_types() -> Tuple[str]
+        Get the types of the symbols whose values are stored
+        '''
+        return self._symbol_types
+
+
+    def get_num_samples(self):
+        '''get_num_samples() -> int
+        Get the number of samples stored in memory which were not handed yet to the background
+        thread to be written
+        '''
+        return self._num_records - self._num_flushed
+
+
+    def is_closed(self):
+        '''is_closed() -> bool
+        Returns True if the writer was closed
+        '''
+        return self._closed
+
+
+
+    def _ordered(self, values):
+        # Returns the samples of the block that is being filled
+        return values[..., :self._num_records - self._num_flushed]
+
+
+
+    ######## Probes ########
+
+    def add_probe(self, name, x):
+        if self._metadata is not None:
+            raise RuntimeError('Probes cannot be added after the first sample is recorded')
+        super().add_probe(name, x)
+    add_probe.__doc__ = Recorder.add_probe.__doc__
+
+
+    def remove_probe(self, name):
+        if self._metadata is not None:
+            raise RuntimeError('Probes cannot be removed after the first sample is recorded')
+        super().remove_probe(name)
+    remove_probe.__doc__ = Recorder.remove_probe.__doc__
+
+
+
+    ######## Recording ########
+
+    def clear(self):
+        '''clear()
+        Discard all the samples recorded (only before the first sample is written)
+
+        :raises RuntimeError: If samples were already recorded
+        '''
+        if self._metadata is not None:
+            raise RuntimeError('The samples written to disk cannot be discarded')
+        super().clear()
+
+
+    def record(self, t=None):
+        '''record([t: float]) -> bool
+        Store the time, the numeric values of the symbols and the outputs of the probes (unless
+        the sample is discarded by the decimation options). When the block in memory is full,
+        it is handed to the background thread to be written (this method never waits for the disk)
+
+        :param t: The time of the sample (by default, the numeric value of the time of the system)
+        :returns: True if the sample was stored, False if it was discarded
+        :raises RuntimeError: If the writer is closed, the number of symbols changed since the first
+            sample or the background thread failed to write a chunk
+        '''
+        if self._closed:
+            raise RuntimeError('The trajectory writer is closed')
+        if t is None:
+            t = self._system._time_value
+        if not self._accept(t):
+            return False
+        if self._metadata is None:
+            self._open()
+
+        index = self._num_records - self._num_flushed
+        self._store(index, t)
+        block, symbols_values = self._block, self._system._symbols_values
+        for kind, rows in self._symbols_rows:
+            values = symbols_values[kind].as_array()
+            if values.shape[0] != rows.stop - rows.start:
+                raise RuntimeError(f'The number of symbols of type "{kind}" changed while recording')
+            block[rows, index] = values[:, 0]
+
+        self._num_records += 1
+        self._last_time = t
+        if index + 1 == self._capacity:
+            self.flush()
+        return True
+
+
+
+    def flush(self):
+        '''flush()
+        Hand the samples stored in memory to the background thread to be written as a new
+        chunk (even if the block is not full). This method doesnt wait until the chunk is written.
+
+        :raises RuntimeError: If the background thread failed to write a previous chunk
+        '''
+        self._check_error()
+        num_samples = self._num_records - self._num_flushed
+        if num_samples == 0:
+            return
+        self._queue.put((self._block, num_samples))
+        self._num_flushed = self._num_records
+
+        # Swap the block (a new one is allocated only if all of them are waiting to be written)
+        try:
+            self._set_block(self._free_blocks.pop())
+        except IndexError:
+            self._set_block(np.zeros(self._block.shape, dtype=np.float64))
+
+
+
+    def close(self):
+        '''close()
+        Write the remaining samples, wait until the background thread finishes and mark the
+        trajectory as complete in the metadata file. This method does nothing if the writer
+        was already closed.
+
+        :raises RuntimeError: If the background thread failed to write a chunk
+        '''
+        if self._closed:
+            return
+        if self._metadata is None:
+            self._open()
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join()
+        self._check_error()
+
+
+
+    def _open(self):
+        # Compute the layout of the rows, allocate the first block, write the initial
+        # metadata file and start the background thread
+        system = self._system
+        num_rows = 1
+        symbols_rows, symbols_metadata = [], {}
+        for kind in self._symbol_types:
+            names = list(system._symbols_values[kind].keys())
+            symbols_rows.append((kind, slice(num_rows, num_rows + len(names))))
+            symbols_metadata[kind] = {'offset': num_rows, 'names': names}
+            num_rows += len(names)
+
+        probes_metadata = {}
+        for name, rows in zip(self._probes.keys(), self._slices):
+            probes_metadata[name] = {'offset': num_rows + rows.start, 'size': rows.stop - rows.start}
+        self._probes_offset = num_rows
+        num_rows += self._values.shape[0]
+
+        self._symbols_rows = symbols_rows
+        self._set_block(np.zeros((num_rows, self._capacity), dtype=np.float64))
+        metadata = {
+            'format': _FORMAT_NAME,
+            'version': _FORMAT_VERSION,
+            'dtype': 'float64',
+            'compressed': self._compressed,
+            'chunk_size': self._capacity,
+            'num_rows': num_rows,
+            'time': {'offset': 0},
+            'symbols': symbols_metadata,
+            'probes': probes_metadata,
+            'chunks': [],
+            'num_samples': 0,
+            'complete': False
+        }
+        metadata_filename = join(self._path, _METADATA_FILENAME)
+        if self._append and exists(metadata_filename):
+            # Continue the trajectory stored
+            with open(metadata_filename) as file:
+                stored = json.load(file)
+            if stored.get('format') != _FORMAT_NAME or \
+                any(stored[key] != metadata[key] for key in ('compressed', 'num_rows', 'symbols', 'probes')):
+                raise ValueError(f'The trajectory stored in "{self._path}" doesnt have the same symbols, probes or format')
+            stored['complete'] = False
+            metadata = stored
+            self._num_records = self._num_flushed = metadata['num_samples']
+        self._metadata = metadata
+        self._write_metadata(self._metadata)
+
+        self._worker = Thread(target=self._run_worker)
+        self._worker.daemon = True
+        self._worker.start()
+
+
+    def _sync(self):
+        # Flush the samples stored in memory and wait until the background thread writes all
+        # the chunks
+        self.flush()
+        self._queue.join()
+        self._check_error()
+
+
+    def _truncate(self, num_samples):
+        # Discard the samples recorded after the first num_samples ones (in memory and in disk)
+        if self._closed:
+            raise RuntimeError('The trajectory writer is closed')
+        if self._metadata is None:
+            self._open()
+        self._num_records = self._num_flushed
+        self._queue.join()
+        self._check_error()
+
+        metadata = self._metadata
+        if metadata['num_samples'] < num_samples:
+            raise ValueError(f'The trajectory stored in "{self._path}" has less than {num_samples} samples')
+        chunks, offset = [], 0
+        for entry in metadata['chunks']:
+            filename = join(self._path, entry['file'])
+            if offset >= num_samples:
+                if exists(filename):
+                    os.remove(filename)
+                continue
+            if offset + entry['num_samples'] > num_samples:
+                # Keep only the first samples of the chunk
+                size = num_samples - offset
+                if metadata['compressed']:
+                    with np.load(filename) as data:
+                        data = data['data'][:, :size]
+                else:
+                    data = np.load(filename)[:, :size]
+                self._write_chunk(filename, data)
+                entry = dict(entry, num_samples=size, t_end=float(data[0, size - 1]))
+            chunks.append(entry)
+            offset += entry['num_samples']
+        metadata['chunks'], metadata['num_samples'] = chunks, num_samples
+        self._write_metadata(metadata)
+        self._num_records = self._num_flushed = num_samples
+
+
+    def _set_block(self, block):
+        # Change the block where the samples are stored (time & probes rows are views of it)
+        self._block = block
+        self._time = block[0]
+        self._values = block[self._probes_offset:]
+
+
+    def _check_error(self):
+        # Raise the exception thrown by the background thread (if any)
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f'Failed to write the trajectory: {error}') from error
+
+
+    def _write_chunk(self, filename, data):
+        # Write the samples of a chunk file atomically
+        if self._compressed:
+            write = lambda file: np.savez_compressed(file, data=data)
+        else:
+            write = lambda file: np.save(file, np.ascontiguousarray(data))
+        _write_atomically(filename, write)
+
+
+    def _write_metadata(self, metadata):
+        # Write the metadata file atomically
+        contents = json.dumps(metadata, indent=4).encode()
+        _write_atomically(join(self._path, _METADATA_FILENAME), lambda file: file.write(contents))
+
+
+
+    def _run_worker(self):
+        # Body of the background thread: writes the blocks received as new chunks and
+        # updates the metadata file after each one (the metadata is only modified by other
+        # threads while the queue is empty)
+        metadata = self._metadata
+        extension = 'npz' if self._compressed else 'npy'
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                if self._error is not None:
+                    # Discard the pending blocks after a failure
+                    continue
+                block, num_samples = item
+                try:
+                    filename = f'chunk_{len(metadata["chunks"]):06d}.{extension}'
+                    self._write_chunk(join(self._path, filename), block[:, :num_samples])
+
+                    metadata['chunks'].append({
+                        'file': filename,
+                        'num_samples': num_samples,
+                        't_start': float(block[0, 0]),
+                        't_end': float(block[0, num_samples - 1])
+                    })
+                    metadata['num_samples'] += num_samples
+                    self._write_metadata(metadata)
+                except Exception as e:
+                    self._error = e
+                finally:
+                    # The block can be filled again by the simulation
+                    self._free_blocks.append(block)
+            finally:
+                self._queue.task_done()
+
+        if self._error is None:
+            try:
+                metadata['complete'] = True
+                self._write_metadata(metadata)
+            except Exception as e:
+                self._error = e
+
+
+
+    ######## Context manager ########
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+
+
+
+
+######## class TrajectoryReader ########
+
+class TrajectoryReader:
+    '''
+    This class can be used to read the trajectories stored by ``TrajectoryWriter``.
+
+    The chunks stored as .npy files are memory mapped (only the pages accessed are
+    loaded from the disk). The trajectory can be read while it is still being written:
+    call ``refresh`` to see the new chunks.
+    '''
+    def __init__(self, path, mmap=True):
+        '''
+        Constructor.
+
+        :param path: The directory where the trajectory is stored
+        :param mmap: If True, the uncompressed chunks are memory mapped instead of loaded in memory
+        :raises FileNotFoundError: If the directory doesnt contain a trajectory
+        '''
+        if not isinstance(path, str):
+            raise TypeError('path must be a string')
+        if not exists(join(path, _METADATA_FILENAME)):
+            raise FileNotFoundError(f'There is no trajectory stored in "{path}"')
+        self._path, self._mmap = path, mmap
+        self._chunks = []
+        self.refresh()
+
+
+
+    ######## Getters ########
+
+    def get_path(self):
+        '''get_path() -> str
+        Get the directory where the trajectory is stored
+        '''
+        return self._path
+
+
+    def get_metadata(self):
+        '''get_metadata() -> dict
+        Get the contents of the metadata file
+        '''
+        return self._metadata
+
+
+    def is_complete(self):
+        '''is_complete() -> bool
+        Returns True if the writer was closed (no more samples will be added)
+        '''
+        return self._metadata['complete']
+
+
+    def get_num_samples(self):
+        '''get_num_samples() -> int
+        Get the number of samples stored
+        '''
+        return self._metadata['num_samples']
+
+
+    def get_num_chunks(self):
+        '''get_num_chunks() -> int
+        Get the number of chunks stored
+        '''
+        return len(self._metadata['chunks'])
+
+
+    def get_symbol_types(self):
+        '''get_symbol_types() -> Tuple[str]
+        Get the types of the symbols whose values are stored
+        '''
+        return tuple(self._metadata['symbols'].keys())
+
+
+    def get_symbols_names(self, kind):
+        '''get_symbols_names(kind: str) -> Tuple[str]
+        Get the names of the symbols of the given type stored (in the same order as the
+        columns of ``get_symbols_values``)
+
+        :raises IndexError: If the values of the symbols of that type are not stored
+        '''
+        try:
+            return tuple(self._metadata['symbols'][kind]['names'])
+        except KeyError:
+            raise IndexError(f'The values of the symbols of type "{kind}" are not stored')
+
+
+    def get_symbols_rows(self, kind):
+        '''get_symbols_rows(kind: str) -> slice
+        Get the rows of the chunks where the values of the symbols of the given type are stored
+
+        :raises IndexError: If the values of the symbols of that type are not stored
+        '''
+        names = self.get_symbols_names(kind)
+        offset = self._metadata['symbols'][kind]['offset']
+        return slice(offset, offset + len(names))
+
+
+    def get_probes_names(self):
+        '''get_probes_names() -> Tuple[str]
+        Get the names of the probes stored
+        '''
+        return tuple(self._metadata['probes'].keys())
+
+
+    def get_chunk(self, index):
+        '''get_chunk(index: int) -> np.ndarray
+        Get the data of the chunk with the given index (an array with one row per output
+        and one column per sample)
+        '''
+        chunk = self._chunks[index]
+        if chunk is None:
+            entry = self._metadata['chunks'][index]
+            filename = join(self._path, entry['file'])
+            if self._metadata['compressed']:
+                with np.load(filename) as data:
+                    chunk = data['data']
+            else:
+                chunk = np.load(filename, mmap_mode='r' if self._mmap else None)
+            self._chunks[index] = chunk
+        return chunk
+
+
+    def get_chunks_times(self):
+        '''get_chunks_times() -> np.ndarray
+        Get the time of the first and last samples of each chunk (an array with one row per chunk)
+        '''
+        return np.array([(entry['t_start'], entry['t_end']) for entry in self._metadata['chunks']],
+            dtype=np.float64).reshape(-1, 2)
+
+
+    def get_sample(self, index):
+        '''get_sample(index: int) -> np.ndarray
+        Get all the outputs of the sample with the given index (only the chunk where the
+        sample is stored is accessed)
+
+        :raises IndexError: If the index is out of range
+        '''
+        num_samples = self.get_num_samples()
+        if index < 0:
+            index += num_samples
+        if not 0 <= index < num_samples:
+            raise IndexError('Sample index out of range')
+        k = int(np.searchsorted(self._chunks_offsets, index, side='right')) - 1
+        return self.get_chunk(k)[:, index - self._chunks_offsets[k]]
+
+
+    def get_time_values(self):
+        '''get_time_values() -> np.ndarray
+        Get the time of all the samples
+        '''
+        return self._rows(0, 1)[0]
+
+
+    def get_symbols_values(self, kind):
+        '''get_symbols_values(kind: str) -> np.ndarray
+        Get the numeric values of the symbols of the given type (an array with one row per
+        sample and one column per symbol)
+
+        :raises IndexError: If the values of the symbols of that type are not stored
+        '''
+        rows = self.get_symbols_rows(kind)
+        return self._rows(rows.start, rows.stop - rows.start).T
+
+
+    def get_probe_values(self, name):
+        '''get_probe_values(name: str) -> np.ndarray
+        Get the values of the probe with the given name (an array with one row per sample
+        and one column per output of the probe)
+
+        :raises IndexError: If there is no probe with that name
+        '''
+        try:
+            probe = self._metadata['probes'][name]
+        except KeyError:
+            raise IndexError(f'There is no probe called "{name}"')
+        return self._rows(probe['offset'], probe['size']).T
+
+
+    def get_values(self, name):
+        '''get_values(name: str) -> np.ndarray
+        Get the samples of the time ('t'), a probe or a symbol with the given name
+
+        :raises TypeError: If the input argument is not a string
+        :raises IndexError: If there is no symbol or probe with that name
+        '''
+        if not isinstance(name, str):
+            raise TypeError('Input argument must be a string')
+        if name == 't':
+            return self.get_time_values()
+        if name in self._metadata['probes']:
+            return self.get_probe_values(name)
+        for symbols in self._metadata['symbols'].values():
+            if name in symbols['names']:
+                return self._rows(symbols['offset'] + symbols['names'].index(name), 1)[0]
+        raise IndexError(f'There is no symbol or probe called "{name}"')
+
+
+
+    def _rows(self, offset, size):
+        # Concatenate the given rows of all the chunks
+        num_chunks = self.get_num_chunks()
+        if num_chunks == 0:
+            return np.zeros((size, 0), dtype=np.float64)
+        return np.concatenate([self.get_chunk(k)[offset:offset+size] for k in range(0, num_chunks)], axis=1)
+
+
+
+    ######## Refresh ########
+
+    def refresh(self):
+        '''refresh()
+        Read again the metadata file to see the chunks written since the last call (if the
+        trajectory is still being written)
+        '''
+        with open(join(self._path, _METADATA_FILENAME)) as file:
+            metadata = json.load(file)
+        if metadata.get('format') != _FORMAT_NAME:
+            raise ValueError(f'"{self._path}" doesnt contain a valid trajectory')
+        self._metadata = metadata
+        self._chunks.extend([None] * (len(metadata['chunks']) - len(self._chunks)))
+        self._chunks_offsets = np.cumsum([0] + [entry['num_samples'] for entry in metadata['chunks']])
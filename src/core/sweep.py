@@ -0,0 +1,551 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the class ParameterSweep and the functions
+parameter_grid and parameter_samples
+'''
+
+######## Import statements ########
+
+import json
+import os
+import traceback
+from os.path import join, exists
+from collections import OrderedDict
+from collections.abc import Mapping
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:
+    # Python < 3.8 (results are shared using temporary memory mapped files)
+    SharedMemory = None
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from .system import System
+from .engine import SimulationEngine
+from .storage import TrajectoryWriter
+
+
+
+######## Constants ########
+
+# Status of each parameter set
+PENDING, COMPLETED, FAILED = 0, 1, 2
+
+_METADATA_FILENAME = 'sweep.json'
+_ERRORS_FILENAME = 'errors.json'
+
+
+
+
+######## Helper functions ########
+
+def parameter_grid(values):
+    '''parameter_grid(values: Mapping[str, Iterable[float]]) -> Dict[str, np.ndarray]
+    Build the cartesian product of the values of several symbols
+
+        :Example:
+
+        >>> parameter_grid({'l': [1, 2], 'm': [0.5, 1, 1.5]})['m']
+        array([0.5, 1. , 1.5, 0.5, 1. , 1.5])
+
+    :returns: A dictionary with the values of each symbol on each combination
+    '''
+    if not isinstance(values, Mapping):
+        raise TypeError('Input argument must be a mapping of names and values')
+    names = list(values.keys())
+    combinations = np.array(list(product(*[np.ravel(np.asarray(values[name], dtype=np.float64)) for name in names])), dtype=np.float64)
+    combinations = combinations.reshape(-1, len(names))
+    return OrderedDict((name, combinations[:, k]) for k, name in enumerate(names))
+
+
+
+def parameter_samples(num_samples, distributions, seed=None):
+    '''parameter_samples(num_samples: int, distributions: Mapping[str, ...][, seed: int]) -> Dict[str, np.ndarray]
+    Draw random values for several symbols (Monte-Carlo)
+
+        :Example:
+
+        >>> parameter_samples(1000, {'l': (1.5, 2.5), 'm': lambda rng, n: rng.normal(1, 0.1, n)}, seed=0)
+
+    :param num_samples: Number of parameter sets
+    :param distributions: A mapping of names and distributions. Each distribution can be a tuple
+        with the limits of an uniform distribution or a callable which receives a numpy random
+        generator and the number of samples and returns the values
+    :param seed: Seed of the random generator
+    :returns: A dictionary with the values of each symbol on each parameter set
+    '''
+    if not isinstance(num_samples, int) or num_samples <= 0:
+        raise TypeError('num_samples must be an integer greater than zero')
+    if not isinstance(distributions, Mapping):
+        raise TypeError('distributions must be a mapping of names and distributions')
+    rng = np.random.default_rng(seed)
+    samples = OrderedDict()
+    for name, distribution in distributions.items():
+        if callable(distribution):
+            values = distribution(rng, num_samples)
+        else:
+            low, high = distribution
+            values = rng.uniform(low, high, num_samples)
+        samples[name] = np.asarray(values, dtype=np.float64).reshape(num_samples)
+    return samples
+
+
+
+def _write_errors(path, errors):
+    # Store the tracebacks of the simulations which failed (resumable results)
+    with open(join(path, _ERRORS_FILENAME), 'w') as file:
+        json.dump(dict((str(index), error) for index, error in sorted(errors.items())), file, indent=4)
+
+
+
+
+######## Worker processes ########
+
+# State of each worker process (initialized once by _init_worker)
+_worker = None
+
+
+class _SweepWorker:
+    # Builds the model and runs the simulations of the parameter sets in a worker process
+    # (or in the main process if no workers are used)
+    def __init__(self, model, names, metrics, t_end, delta_t, storage, trajectories_path):
+        # The scene is not created (VTK must not be used by the worker processes)
+        system = System(scene=False)
+        result = model(system)
+        engine, probes = result if isinstance(result, tuple) else (result, None)
+        if not isinstance(engine, SimulationEngine):
+            raise TypeError('The model must return a SimulationEngine (and optionally the probes)')
+
+        # Locate the numeric values of the symbols of each parameter set
+        targets = []
+        for name in names:
+            for kind, values in system._symbols_values.items():
+                if name in values:
+                    targets.append((kind, values.index(name)))
+                    break
+            else:
+                raise IndexError(f'There is no symbol called "{name}"')
+
+        system.save_state()
+        self._system, self._engine, self._probes = system, engine, probes
+        self._targets, self._metrics = targets, metrics
+        self._t_end, self._delta_t = t_end, delta_t
+        self._trajectory = None
+        self._trajectories_path = trajectories_path
+        self._results, self._status = storage.open()
+
+
+    def run(self, indices, values):
+        # Simulate the given parameter sets and store the metrics in the shared arrays.
+        # Returns the number of sets simulated and the tracebacks of the exceptions raised
+        # by the sets which failed
+        system, engine = self._system, self._engine
+        results, status = self._results, self._status
+        errors = {}
+        for index, row in zip(indices, values):
+            try:
+                system.restore_previous_state()
+                symbols_values = system._symbols_values
+                for (kind, k), value in zip(self._targets, row):
+                    symbols_values[kind].as_array()[k, 0] = value
+                system._time_value = 0.0
+
+                writer = None
+                if self._trajectories_path is not None:
+                    writer = TrajectoryWriter(system, join(self._trajectories_path, f'run_{index:06d}'), overwrite=True)
+                    engine.add_recorder(writer)
+                try:
+                    engine.init()
+                    trajectory = self._trajectory
+                    if trajectory is not None:
+                        trajectory.clear()
+                    trajectory = self._trajectory = engine.run(self._t_end, self._delta_t, trajectory, self._probes)
+                finally:
+                    if writer is not None:
+                        engine.remove_recorder(writer)
+                        writer.close()
+
+                results[index] = [metric(trajectory) for metric in self._metrics]
+                status[index] = COMPLETED
+            except Exception:
+                results[index] = np.nan
+                status[index] = FAILED
+                errors[int(index)] = traceback.format_exc()
+        return len(indices), errors
+
+
+
+def _init_worker(*args):
+    global _worker
+    _worker = _SweepWorker(*args)
+
+
+def _run_worker(indices, values):
+    return _worker.run(indices, values)
+
+
+
+
+######## Shared results storage ########
+
+class _SharedStorage:
+    # Arrays with the metrics & status of each parameter set shared between the processes.
+    # They are stored in shared memory blocks or in memory mapped files (resumable results)
+    def __init__(self, path, shape):
+        self._path, self._shape = path, shape
+        self._temporary = False
+        self._names, self._blocks, self._attached = None, [], []
+
+
+    def create(self, resume):
+        num_sets, num_metrics = self._shape
+        path = self._path
+        if path is None:
+            if SharedMemory is None:
+                self._path = path = mkdtemp()
+                self._temporary = True
+            else:
+                self._blocks = [
+                    SharedMemory(create=True, size=max(num_sets * num_metrics * 8, 1)),
+                    SharedMemory(create=True, size=max(num_sets, 1))
+                ]
+                self._names = [block.name for block in self._blocks]
+                results, status = self._attach(self._blocks)
+                results[:], status[:] = np.nan, PENDING
+                return results, status
+        if resume:
+            return self._open_files(path, 'r+')
+        results = np.lib.format.open_memmap(join(path, 'results.npy'), 'w+', np.float64, (num_sets, num_metrics))
+        status = np.lib.format.open_memmap(join(path, 'status.npy'), 'w+', np.uint8, (num_sets,))
+        results[:], status[:] = np.nan, PENDING
+        return results, status
+
+
+    def open(self):
+        # Attach to the arrays (in the worker processes)
+        if self._names is not None:
+            self._attached = [SharedMemory(name=name) for name in self._names]
+            return self._attach(self._attached)
+        return self._open_files(self._path, 'r+')
+
+
+    def release(self):
+        # Free the shared memory blocks or temporary files (the arrays must not be referenced)
+        for block in self._attached:
+            block.close()
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks, self._attached = [], []
+        if self._temporary:
+            rmtree(self._path, ignore_errors=True)
+
+
+    def _attach(self, blocks):
+        num_sets, num_metrics = self._shape
+        results = np.ndarray((num_sets, num_metrics), dtype=np.float64, buffer=blocks[0].buf)
+        status = np.ndarray((num_sets,), dtype=np.uint8, buffer=blocks[1].buf)
+        return results, status
+
+
+    def _open_files(self, path, mode):
+        return np.load(join(path, 'results.npy'), mmap_mode=mode), np.load(join(path, 'status.npy'), mmap_mode=mode)
+
+
+    def __getstate__(self):
+        # Only the names of the shared memory blocks are sent to the worker processes
+        state = dict(self.__dict__)
+        state['_blocks'], state['_attached'], state['_temporary'] = [], [], False
+        return state
+
+
+
+
+
+
+######## class ParameterSweep ########
+
+class ParameterSweep:
+    '''
+    This class can be used to simulate a model with many different values of its symbols
+    (parameter sweeps & Monte-Carlo studies) distributing the simulations in a pool of processes.
+
+    The model is built only once in each worker process by calling ``model`` with a new system
+    (without a scene): it must create the symbols and return a SimulationEngine configured to simulate it (the
+    numeric functions are compiled only once per process). The metrics computed from the
+    trajectory of each simulation are written directly by the workers in arrays shared with
+    the main process.
+
+    If an exception is raised while simulating a parameter set or computing its metrics, the set
+    is marked as failed and the traceback is kept (see ``get_errors``) to tell apart a simulation
+    which diverged from a bug in a metric.
+
+    If a path is specified, the parameter sets, the metrics, the status of each simulation and
+    the errors are stored in that directory, and the sweep can be resumed later
+    (only the parameter sets not completed are simulated again).
+
+        :Example:
+
+        >>> def model(system):
+        ...     l, m = system.new_parameter('l', 1), system.new_parameter('m', 1)
+        ...     ...
+        ...     engine = SimulationEngine(system)
+        ...     engine.dynamics(M_qq, delta_q)
+        ...     return engine
+        >>> def max_angle(trajectory):
+        ...     return trajectory.get_values('theta').max()
+        >>> sweep = ParameterSweep(model, parameter_grid({'l': np.linspace(1, 2, 50), 'm': [1, 2]}),
+        ...     {'max_angle': max_angle}, t_end=10, delta_t=0.001, path='sweep')
+        >>> sweep.run(progress=lambda done, total: print(f'{done}/{total}'))
+        >>> sweep.get_metric_values('max_angle').shape
+        (100,)
+
+    .. note::
+        The model and the metrics are sent to the worker processes, so they must be picklable
+        (e.g. functions defined at the top level of a module)
+    '''
+    def __init__(self, model, parameters, metrics, t_end, delta_t, path=None,
+        num_workers=None, batch_size=None, trajectories_path=None):
+        '''
+        Constructor.
+
+        :param model: A callable which receives a system, defines the model on it and returns a
+            SimulationEngine (or a tuple with the engine and the probes to be stored in the trajectory)
+        :param parameters: A mapping with the names of the symbols to change (parameters,
+            or initial values of the coordinates, velocities, ...) and their values on each
+            parameter set (see ``parameter_grid`` and ``parameter_samples``)
+        :param metrics: A mapping with the names of the metrics and callables which receive
+            the trajectory of a simulation and return a number
+        :param t_end: Final time of the simulations
+        :param delta_t: Size of the simulation steps
+        :param path: Directory where the results are stored (optional)
+        :param num_workers: Number of worker processes. By default, the number of cpus. If 0,
+            the simulations are performed in the current process
+        :param batch_size: Number of parameter sets sent to a worker on each task
+        :param trajectories_path: If specified, the trajectory of each simulation is stored in
+            this directory (see ``TrajectoryWriter``)
+        '''
+        if not callable(model):
+            raise TypeError('model must be a callable object')
+        if not isinstance(parameters, Mapping) or not parameters:
+            raise TypeError('parameters must be a non empty mapping of names and values')
+        if not isinstance(metrics, Mapping) or not all(map(callable, metrics.values())):
+            raise TypeError('metrics must be a mapping of names and callables')
+        if num_workers is not None and (not isinstance(num_workers, int) or num_workers < 0):
+            raise TypeError('num_workers must be an integer greater or equal than zero')
+        if batch_size is not None and (not isinstance(batch_size, int) or batch_size <= 0):
+            raise TypeError('batch_size must be an integer greater than zero')
+        try:
+            t_end, delta_t = float(t_end), float(delta_t)
+            if delta_t <= 0:
+                raise TypeError
+        except (TypeError, ValueError):
+            raise TypeError('t_end must be a number and delta_t a number greater than zero')
+
+        names = list(parameters.keys())
+        values = np.stack([np.ravel(np.asarray(parameters[name], dtype=np.float64)) for name in names], axis=1)
+
+        self._model = model
+        self._parameters_names = names
+        self._parameters_values = values
+        self._metrics = OrderedDict(metrics)
+        self._t_end, self._delta_t = t_end, delta_t
+        self._path = path
+        self._num_workers = os.cpu_count() if num_workers is None else num_workers
+        self._batch_size = batch_size
+        self._trajectories_path = trajectories_path
+        self._results = np.full((values.shape[0], len(metrics)), np.nan, dtype=np.float64)
+        self._status = np.full(values.shape[0], PENDING, dtype=np.uint8)
+        self._errors = {}
+
+        if path is not None:
+            self._load()
+
+
+
+    ######## Getters ########
+
+    def get_parameters_names(self):
+        '''get_parameters_names() -> Tuple[str]
+        Get the names of the symbols changed on each parameter set
+        '''
+        return tuple(self._parameters_names)
+
+
+    def get_parameters_values(self):
+        '''get_parameters_values() -> np.ndarray
+        Get the values of the parameter sets (an array with one row per set and one column per symbol)
+        '''
+        return self._parameters_values
+
+
+    def get_metrics_names(self):
+        '''get_metrics_names() -> Tuple[str]
+        Get the names of the metrics
+        '''
+        return tuple(self._metrics.keys())
+
+
+    def get_num_sets(self):
+        '''get_num_sets() -> int
+        Get the number of parameter sets
+        '''
+        return self._parameters_values.shape[0]
+
+
+    def get_results(self):
+        '''get_results() -> np.ndarray
+        Get the metrics computed (an array with one row per parameter set and one column per
+        metric). The rows of the sets not simulated or whose simulation failed are filled with nan
+        '''
+        return self._results
+
+
+    def get_metric_values(self, name):
+        '''get_metric_values(name: str) -> np.ndarray
+        Get the values of the metric with the given name for all the parameter sets
+
+        :raises IndexError: If there is no metric with that name
+        '''
+        if name not in self._metrics:
+            raise IndexError(f'There is no metric called "{name}"')
+        return self._results[:, tuple(self._metrics.keys()).index(name)]
+
+
+    def get_status(self):
+        '''get_status() -> np.ndarray
+        Get the status of each parameter set: 0 (pending), 1 (completed) or 2 (failed)
+        '''
+        return self._status
+
+
+    def get_num_completed(self):
+        '''get_num_completed() -> int
+        Get the number of parameter sets simulated successfully
+        '''
+        return int(np.count_nonzero(self._status == COMPLETED))
+
+
+    def get_num_failed(self):
+        '''get_num_failed() -> int
+        Get the number of parameter sets whose simulation failed
+        '''
+        return int(np.count_nonzero(self._status == FAILED))
+
+
+    def get_errors(self):
+        '''get_errors() -> Dict[int, str]
+        Get the exceptions raised by the parameter sets that failed (while simulating or computing
+        the metrics): a dictionary with the indices of the parameter sets and the formatted tracebacks
+        '''
+        return dict(self._errors)
+
+
+
+    ######## Run ########
+
+    def run(self, progress=None, retry_failed=False):
+        '''run([progress: Callable[[int, int], None], retry_failed: bool]) -> np.ndarray
+        Simulate all the parameter sets which are not completed yet
+
+        :param progress: A callable which is invoked with the number of parameter sets
+            simulated and the total number of sets each time a batch of simulations finishes
+        :param retry_failed: If True, the parameter sets whose simulation failed are simulated again
+        :returns: The metrics computed (see ``get_results``)
+        '''
+        if progress is not None and not callable(progress):
+            raise TypeError('progress must be a callable object')
+
+        pending = self._status == PENDING
+        if retry_failed:
+            pending |= self._status == FAILED
+        indices = np.flatnonzero(pending)
+        total, done = self.get_num_sets(), self.get_num_sets() - indices.shape[0]
+        if indices.shape[0] == 0:
+            return self._results
+
+        storage = _SharedStorage(self._path, self._results.shape)
+        results, status = storage.create(resume=self._path is not None)
+        try:
+            if self._path is None:
+                results[:], status[:] = self._results, self._status
+            status[indices] = PENDING
+            for index in indices:
+                self._errors.pop(int(index), None)
+            args = (self._model, self._parameters_names, list(self._metrics.values()),
+                self._t_end, self._delta_t, storage, self._trajectories_path)
+
+            num_workers = self._num_workers
+            batch_size = self._batch_size or max(1, min(64, indices.shape[0] // (4 * max(num_workers, 1))))
+            batches = [indices[k:k+batch_size] for k in range(0, indices.shape[0], batch_size)]
+
+            if num_workers == 0:
+                # Run the simulations in the current process
+                worker = _SweepWorker(*args)
+                for batch in batches:
+                    num_done, errors = worker.run(batch, self._parameters_values[batch])
+                    done += num_done
+                    self._errors.update(errors)
+                    if progress is not None:
+                        progress(done, total)
+                del worker
+            else:
+                with ProcessPoolExecutor(num_workers, initializer=_init_worker, initargs=args) as executor:
+                    futures = [executor.submit(_run_worker, batch, self._parameters_values[batch]) for batch in batches]
+                    for future in as_completed(futures):
+                        num_done, errors = future.result()
+                        done += num_done
+                        self._errors.update(errors)
+                        if progress is not None:
+                            progress(done, total)
+
+            if self._path is None:
+                self._results[:], self._status[:] = results, status
+        finally:
+            del results, status
+            storage.release()
+            if self._path is not None:
+                _write_errors(self._path, self._errors)
+
+        if self._path is not None:
+            self._load()
+        return self._results
+
+
+
+    ######## Storage ########
+
+    def _load(self):
+        # Create or reopen the files where the results are stored
+        path = self._path
+        os.makedirs(path, exist_ok=True)
+        metadata = {
+            'parameters': self._parameters_names,
+            'metrics': list(self._metrics.keys()),
+            'num_sets': self.get_num_sets()
+        }
+        metadata_filename = join(path, _METADATA_FILENAME)
+        if exists(metadata_filename):
+            with open(metadata_filename) as file:
+                previous = json.load(file)
+            values = np.load(join(path, 'parameters.npy'))
+            if previous != metadata or not np.array_equal(values, self._parameters_values):
+                raise ValueError(f'The results stored in "{path}" belong to a different sweep')
+        else:
+            np.save(join(path, 'parameters.npy'), self._parameters_values)
+            storage = _SharedStorage(path, self._results.shape)
+            results, status = storage.create(resume=False)
+            del results, status
+            with open(metadata_filename, 'w') as file:
+                json.dump(metadata, file, indent=4)
+
+        self._results = np.load(join(path, 'results.npy'), mmap_mode='r')
+        self._status = np.load(join(path, 'status.npy'), mmap_mode='r')
+        errors_filename = join(path, _ERRORS_FILENAME)
+        if exists(errors_filename):
+            with open(errors_filename) as file:
+                self._errors = dict((int(index), error) for index, error in json.load(file).items())
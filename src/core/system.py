@@ -14,6 +14,7 @@ from lib3d_mec_ginac_ext import *
 
 # From other modules
 from ..utils.events import EventProducer
+from .engine import SimulationEngine
 
 # Standard imports
 import math
@@ -42,7 +43,13 @@ class System(_System, EventProducer):
     ######## Constructor ########
 
 
-    def __init__(self):
+    def __init__(self, scene=True):
+        '''
+        Constructor.
+
+        :param scene: If False, the scene is not created even if the graphical environment is
+            installed (e.g. for the systems built in background threads or processes)
+        '''
         _System.__init__(self)
         EventProducer.__init__(self)
 
@@ -52,6 +59,7 @@ class System(_System, EventProducer):
             symbols_values[symbol_type] = SymbolsValuesMapping()
         self._symbols_values = symbols_values
         self._time_value = self.get_time()._get_value()
+        self._simulation_engine = None
 
         # Initialize predefined symbol values
         for symbol in self._get_symbols():
@@ -63,13 +71,15 @@ class System(_System, EventProducer):
         # to restore them when the simulation is restarted.
         self._state = None
 
-        try:
-            from ..drawing.scene import Scene
-            # Create scene visualizer (to show drawings)
-            self._scene = Scene(self)
-        except ImportError as e:
-            # No problem, it means the GUI is not installed
-            self._scene = None
+        self._scene = None
+        if scene:
+            try:
+                from ..drawing.scene import Scene
+                # Create scene visualizer (to show drawings)
+                self._scene = Scene(self)
+            except ImportError as e:
+                # No problem, it means the GUI is not installed
+                pass
 
 
     ######## Get/Set symbol value ########
@@ -604,6 +614,20 @@ class System(_System, EventProducer):
 
 
 
+    def get_simulation_engine(self):
+        '''get_simulation_engine() -> SimulationEngine
+        Get the engine used to simulate this system ( it stores the integration method
+        and the dynamic & assembly problems configured ). The simulation of the 3D scene
+        also uses this engine.
+
+        :rtype: SimulationEngine
+        '''
+        if self._simulation_engine is None:
+            self._simulation_engine = SimulationEngine(self)
+        return self._simulation_engine
+
+
+
 
 
     ######## Constructors ########
@@ -1733,6 +1757,68 @@ class System(_System, EventProducer):
 
 
 
+    ######## Simulation ########
+
+
+    def simulate_stream(self, t_end, delta_t, chunk=4096, probes=None):
+        '''simulate_stream(t_end: float, delta_t: float[, chunk: int, probes: Mapping]) -> Iterator[Trajectory]
+        Simulate this system from the time 0 until the time ``t_end`` without the graphical
+        environment (using the integration method, dynamic & assembly problems configured in
+        the simulation engine) and iterate over the samples in chunks of fixed size.
+
+            :Example:
+
+            >>> probes = {'Phi': Phi}
+            >>> for samples in simulate_stream(3600, 0.001, chunk=4096, probes=probes):
+            ...     print(samples.time[-1], abs(samples.get_probe_values('Phi')).max())
+
+        :param t_end: Final time of the simulation
+        :param delta_t: Size of the simulation steps
+        :param chunk: Number of samples of each chunk
+        :param probes: A mapping of names and symbolic matrices, expressions or callables
+            which will be evaluated and stored on each sample
+        :returns: An iterator which yields the same Trajectory instance on each iteration: its
+            arrays are owned by the iterator and overwritten with the next chunk (copy them
+            if they must be kept)
+
+        .. seealso:: :func:`get_simulation_engine`
+        '''
+        engine = self.get_simulation_engine()
+        self._time_value = 0.0
+        engine.init()
+        return engine.stream(t_end, delta_t, chunk, probes)
+
+
+
+    def simulate_async(self, t_end, delta_t, chunk=4096, probes=None, executor=None):
+        '''simulate_async(t_end: float, delta_t: float[, chunk: int, probes: Mapping, executor: Executor]) -> AsyncSimulation
+        Simulate this system from the time 0 until the time ``t_end`` without blocking the
+        asyncio event loop: the steps are performed in an executor in chunks of ``chunk`` samples, and the
+        control returns to the event loop between chunks. The simulation stops if the task which awaits it is
+        cancelled.
+
+            :Example:
+
+            >>> samples = await simulate_async(10, 0.01)
+            >>> async for samples in simulate_async(3600, 0.001, chunk=4096):
+            ...     print(samples.time[-1])
+
+        :param executor: A thread pool executor where the chunks are computed. If not specified,
+            the default executor of the event loop is used
+        :returns: An AsyncSimulation instance. It is an async iterator over the chunks of samples
+            (see ``simulate_stream``) and awaiting it runs the simulation until the end and returns the last chunk
+
+        .. seealso:: :func:`get_simulation_engine`
+        '''
+        engine = self.get_simulation_engine()
+        self._time_value = 0.0
+        engine.init()
+        return engine.stream_async(t_end, delta_t, chunk, probes, executor)
+
+
+
+
+
     ######## Restoring/Saving state ########
 
 
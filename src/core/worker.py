@@ -0,0 +1,402 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This script defines the class SimulationWorker
+'''
+
+######## Import statements ########
+
+import multiprocessing
+import threading
+import queue
+import traceback
+from time import perf_counter, sleep
+import numpy as np
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:
+    # Python < 3.8 (only the thread mode is available)
+    SharedMemory = None
+
+from .system import System
+from .engine import SimulationEngine
+
+
+
+######## class _SnapshotBuffer ########
+
+class _SnapshotBuffer:
+    # Double buffer where the worker publishes the latest state ([t; q; dq]) of the simulation.
+    # The header stores the index of the last buffer written, a sequence counter for each buffer
+    # (odd while it is being written) and the number of snapshots published
+    _HEADER_SIZE = 4
+
+    def __init__(self, size, name=None, shared=True):
+        num_items = self._HEADER_SIZE + 2 * size
+        self._block = None
+        if shared:
+            if SharedMemory is None:
+                raise RuntimeError('Shared memory is not available (Python 3.8 or greater is required)')
+            self._block = SharedMemory(name=name, create=name is None, size=num_items * 8)
+            self._owner = name is None
+            data = np.ndarray(num_items, dtype=np.float64, buffer=self._block.buf)
+        else:
+            self._owner = True
+            data = np.zeros(num_items, dtype=np.float64)
+        if self._owner:
+            data[:] = 0
+        self._data = data
+        self._header = data[:self._HEADER_SIZE]
+        self._buffers = data[self._HEADER_SIZE:].reshape(2, size)
+
+
+    def get_name(self):
+        return self._block.name if self._block is not None else None
+
+
+    def get_num_snapshots(self):
+        return int(self._header[3])
+
+
+    def write(self, values):
+        header = self._header
+        index = 1 - int(header[0])
+        header[1 + index] += 1
+        self._buffers[index] = values
+        header[1 + index] += 1
+        header[0] = index
+        header[3] += 1
+
+
+    def read(self, out, max_retries=100):
+        # Copy the latest snapshot published. Returns False if it couldnt be read consistently
+        header = self._header
+        for i in range(0, max_retries):
+            index = int(header[0])
+            sequence = header[1 + index]
+            if sequence % 2 == 1:
+                continue
+            out[:] = self._buffers[index]
+            if header[1 + index] == sequence:
+                return True
+        return False
+
+
+    def release(self):
+        if self._block is not None:
+            # Drop the numpy views before closing the shared memory block
+            self._data = self._header = self._buffers = None
+            self._block.close()
+            if self._owner:
+                self._block.unlink()
+            self._block = None
+
+
+
+######## Worker ########
+
+def _run_worker(model, coords_names, initial_state, delta_t, real_time, speed, buffer, control, errors):
+    # Simulation loop executed in the worker thread or process
+    stop_event, pause_event = control
+    shared = isinstance(buffer, tuple)
+    try:
+        if shared:
+            buffer = _SnapshotBuffer(buffer[1], name=buffer[0])
+        # The scene is not created (VTK must only be used by the main thread and its state is
+        # not safe to reuse in a forked process)
+        system = System(scene=False)
+        engine = model(system)
+        if isinstance(engine, tuple):
+            engine = engine[0]
+        if not isinstance(engine, SimulationEngine):
+            raise TypeError('The model must return a SimulationEngine')
+        if tuple(system._symbols_values['coordinate'].keys()) != tuple(coords_names):
+            raise ValueError('The coordinates created by the model dont match the coordinates of the system')
+
+        # Start from the state of the system shown in the viewer
+        n = len(coords_names)
+        q_values, dq_values = system.get_coords_values(), system.get_velocities_values()
+        q_values[:, 0], dq_values[:, 0] = initial_state[1:n + 1], initial_state[n + 1:]
+        system._time_value = t = float(initial_state[0])
+        engine.init()
+
+        state = np.empty(2 * n + 1, dtype=np.float64)
+        def publish():
+            state[0] = system._time_value
+            state[1:n + 1], state[n + 1:] = q_values[:, 0], dq_values[:, 0]
+            buffer.write(state)
+        publish()
+
+        wall_start, sim_start = perf_counter(), t
+        while not stop_event.is_set():
+            if pause_event.is_set():
+                sleep(0.01)
+                wall_start, sim_start = perf_counter(), system._time_value
+                continue
+            t = system._time_value
+            if real_time and t - sim_start >= (perf_counter() - wall_start) * speed:
+                # The simulation is ahead of the real time
+                sleep(min(delta_t / speed, 0.005))
+                continue
+            running = engine.step(delta_t)
+            publish()
+            if running is False:
+                # A terminal event function crossed zero
+                break
+    except Exception:
+        errors.put(traceback.format_exc())
+    finally:
+        if shared and isinstance(buffer, _SnapshotBuffer):
+            buffer.release()
+
+
+
+######## class SimulationWorker ########
+
+class SimulationWorker:
+    '''
+    This class runs the simulation loop of a model in a background thread or process and
+    publishes its latest state (time, coordinates and velocities) in a double buffer
+    (shared memory in the process mode).
+
+    The model is a callable which receives a new system, defines it (symbols, matrices, ...) and
+    returns its ``SimulationEngine`` already configured (as with ``ParameterSweep``). In the process
+    mode it must be picklable (e.g. a function defined at module level). The system passed to the
+    model has no scene, so it cannot create drawings.
+
+    The consumer (usually the viewer) only reads the snapshots and copies them to the numeric values
+    of its own system (see ``update_system``), so the cost of the model never blocks it.
+
+        :Example:
+
+        >>> worker = SimulationWorker(get_default_system(), model, 0.001, mode='process')
+        >>> worker.start()
+        >>> worker.update_system()
+        >>> worker.stop()
+    '''
+    def __init__(self, system, model, delta_t, mode='process', real_time=True, speed=1.0):
+        '''
+        Constructor.
+
+        :param system: The system where the snapshots will be copied. It must have the same
+            coordinates as the system built by the model
+        :param model: A callable which defines the model in the given system and returns its simulation engine
+        :param delta_t: The size of the simulation steps
+        :param mode: 'process' (default) or 'thread'
+        :param real_time: If True (default), the worker waits so that the simulation time doesnt
+            run faster than the real time (multiplied by the speed). Otherwise, it simulates as fast as possible
+        :param speed: The amount of simulated time per second of real time
+        '''
+        if not callable(model):
+            raise TypeError('model must be a callable object')
+        try:
+            delta_t, speed = float(delta_t), float(speed)
+            if delta_t <= 0 or speed <= 0:
+                raise TypeError
+        except (TypeError, ValueError):
+            raise TypeError('delta_t and speed must be numbers greater than zero')
+        if mode not in ('process', 'thread'):
+            raise ValueError('mode must be "process" or "thread"')
+        if not isinstance(real_time, bool):
+            raise TypeError('real_time must be a bool')
+
+        self._system, self._model = system, model
+        self._delta_t, self._mode = delta_t, mode
+        self._real_time, self._speed = real_time, speed
+        self._worker, self._buffer = None, None
+        self._control, self._errors = None, None
+        self._error = None
+        self._snapshot = None
+        self._num_snapshots = 0
+
+
+
+    ######## Getters ########
+
+    def get_mode(self):
+        '''get_mode() -> str
+        Get the mode of the worker ('process' or 'thread')
+        '''
+        return self._mode
+
+
+    def get_delta_time(self):
+        '''get_delta_time() -> float
+        Get the size of the simulation steps
+        '''
+        return self._delta_t
+
+
+    def is_running(self):
+        '''is_running() -> bool
+        Returns True if the worker is alive and not paused
+        '''
+        return self.is_alive() and not self._control[1].is_set()
+
+
+    def is_paused(self):
+        '''is_paused() -> bool
+        Returns True if the worker is alive but paused
+        '''
+        return self.is_alive() and self._control[1].is_set()
+
+
+    def is_alive(self):
+        '''is_alive() -> bool
+        Returns True if the worker was started and didnt finish yet
+        '''
+        return self._worker is not None and self._worker.is_alive()
+
+
+    def get_error(self):
+        '''get_error() -> str | None
+        Get the traceback of the exception raised by the worker (if any)
+        '''
+        if self._error is None and self._errors is not None:
+            try:
+                self._error = self._errors.get_nowait()
+            except queue.Empty:
+                pass
+        return self._error
+
+
+    def get_num_snapshots(self):
+        '''get_num_snapshots() -> int
+        Get the number of snapshots published by the worker (one per simulation step)
+        '''
+        return self._buffer.get_num_snapshots() if self._buffer is not None else self._num_snapshots
+
+
+
+    ######## Controls ########
+
+    def start(self):
+        '''start()
+        Start the simulation loop in the background (from the current state of the system)
+
+        :raises RuntimeError: If the worker already started
+        '''
+        if self._worker is not None:
+            raise RuntimeError('The worker already started')
+        system = self._system
+        coords_names = tuple(system._symbols_values['coordinate'].keys())
+        n = len(coords_names)
+        initial_state = np.concatenate([[system._time_value],
+            system.get_coords_values()[:, 0], system.get_velocities_values()[:, 0]])
+
+        self._error = None
+        self._snapshot = initial_state.copy()
+        self._num_snapshots = 0
+        if self._mode == 'process':
+            context = multiprocessing.get_context()
+            self._buffer = _SnapshotBuffer(2 * n + 1)
+            buffer = (self._buffer.get_name(), 2 * n + 1)
+            self._control = context.Event(), context.Event()
+            self._errors = context.Queue()
+            worker_class = context.Process
+        else:
+            self._buffer = buffer = _SnapshotBuffer(2 * n + 1, shared=False)
+            self._control = threading.Event(), threading.Event()
+            self._errors = queue.Queue()
+            worker_class = threading.Thread
+
+        self._worker = worker_class(target=_run_worker, daemon=True, args=(self._model, coords_names, initial_state,
+            self._delta_t, self._real_time, self._speed, buffer, self._control, self._errors))
+        self._worker.start()
+
+
+
+    def pause(self):
+        '''pause()
+        Pause the simulation loop
+
+        :raises RuntimeError: If the worker is not running
+        '''
+        if not self.is_running():
+            raise RuntimeError('The worker is not running')
+        self._control[1].set()
+
+
+
+    def resume(self):
+        '''resume()
+        Resume the simulation loop
+
+        :raises RuntimeError: If the worker is not paused
+        '''
+        if not self.is_paused():
+            raise RuntimeError('The worker is not paused')
+        self._control[1].clear()
+
+
+
+    def join(self, timeout=None):
+        '''join([timeout: float]) -> bool
+        Wait until the simulation loop finishes by itself (a terminal event or an error). The
+        shared memory is not released (``stop`` must be called anyway)
+
+        :param timeout: The maximum time to wait in seconds. By default, it waits indefinitely
+        :returns: True if the simulation loop finished
+        :raises RuntimeError: If the worker was not started
+        '''
+        if self._worker is None:
+            raise RuntimeError('The worker was not started')
+        self._worker.join(timeout)
+        return not self._worker.is_alive()
+
+
+
+    def stop(self, timeout=5):
+        '''stop([timeout: float])
+        Stop the simulation loop and release the shared memory
+
+        :raises RuntimeError: If the worker was not started
+        '''
+        if self._worker is None:
+            raise RuntimeError('The worker was not started')
+        self._control[0].set()
+        self._worker.join(timeout)
+        if self._mode == 'process' and self._worker.is_alive():
+            self._worker.terminate()
+            self._worker.join()
+        self.get_error()
+        self._num_snapshots = self._buffer.get_num_snapshots()
+        self._buffer.release()
+        self._worker, self._buffer = None, None
+
+
+
+    ######## Snapshots ########
+
+    def get_snapshot(self):
+        '''get_snapshot() -> Tuple[float, np.ndarray, np.ndarray]
+        Get a copy of the latest state published by the worker: the time, the coordinates
+        and the velocities
+        '''
+        if self._buffer is not None:
+            self._buffer.read(self._snapshot)
+        snapshot = self._snapshot
+        if snapshot is None:
+            raise RuntimeError('The worker was not started')
+        n = (snapshot.shape[0] - 1) // 2
+        return float(snapshot[0]), snapshot[1:n + 1].copy(), snapshot[n + 1:].copy()
+
+
+
+    def update_system(self):
+        '''update_system() -> bool
+        Copy the latest state published by the worker to the numeric values of the time,
+        coordinates and velocities of the system
+
+        :returns: True if a new snapshot was published since the last call
+        '''
+        num_snapshots = self.get_num_snapshots()
+        if num_snapshots == self._num_snapshots and self._buffer is not None:
+            return False
+        self._num_snapshots = num_snapshots
+        t, q, dq = self.get_snapshot()
+        system = self._system
+        system.get_coords_values()[:, 0] = q
+        system.get_velocities_values()[:, 0] = dq
+        system._time_value = t
+        return True
@@ -0,0 +1,164 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This file defines the class BackgroundSimulation
+'''
+
+######## Import statements ########
+
+# Standard imports
+from time import perf_counter_ns
+
+# Imports from other modules
+from ..utils.events import EventProducer
+from ..core.worker import SimulationWorker
+from .timer import Timer
+
+
+
+######## class BackgroundSimulation ########
+
+class BackgroundSimulation(EventProducer):
+    '''
+    This class shows in the scene a simulation which is executed by a background worker
+    (see ``SimulationWorker``).
+
+    The worker steps the model in another thread or process and publishes its latest state
+    in a double buffer. On each update, this class only copies the latest snapshot to the numeric
+    values of the symbols of the system, so that the drawings can be updated. The rate of the
+    simulation is independent of the rendering rate of the viewer.
+    '''
+
+    ######## Constructor ########
+
+    def __init__(self, scene, system):
+        super().__init__()
+
+        # Initialize internal fields
+        self._scene, self._system = scene, system
+        self._worker = None
+        self._saved_time = 0.0
+        self._last_update_time, self._last_num_snapshots = None, 0
+        self._real_steps_frequency = 0.0
+
+        self._timer = Timer(1 / 30)
+        self.add_event_handler(self._on_timer_tick, 'tick')
+        self.add_child(self._timer)
+
+
+
+    ######## Controls ########
+
+    def start(self, model, delta_t=0.01, mode='process', real_time=True, speed=1.0):
+        '''start(model: Callable[, delta_t: float, mode: str, real_time: bool, speed: float])
+        Start simulating the given model in a background worker (from the current state
+        of the system). See ``SimulationWorker``
+
+        :raises RuntimeError: If the background simulation already started
+        '''
+        if not self.is_stopped():
+            raise RuntimeError('Background simulation already started')
+        worker = SimulationWorker(self._system, model, delta_t, mode, real_time, speed)
+
+        self._system.save_state()
+        self._saved_time = self._system._time_value
+        worker.start()
+        self._worker = worker
+        self._last_update_time, self._last_num_snapshots = None, 0
+        self._real_steps_frequency = 0.0
+        self._timer.start(resumed=True)
+        self.fire_event('background_simulation_started')
+
+
+
+    def resume(self):
+        if not self.is_paused():
+            raise RuntimeError('Background simulation is not paused')
+        if not self._worker.is_alive():
+            raise RuntimeError('The background worker already finished')
+
+        self._worker.resume()
+        self._last_update_time = None
+        self._timer.resume()
+        self.fire_event('background_simulation_resumed')
+
+
+
+    def pause(self):
+        if not self.is_running():
+            raise RuntimeError('Background simulation is not running')
+
+        if self._worker.is_running():
+            self._worker.pause()
+        self._timer.pause()
+        self.fire_event('background_simulation_paused')
+
+
+
+    def stop(self):
+        if self.is_stopped():
+            raise RuntimeError('Background simulation has not started yet')
+
+        worker, self._worker = self._worker, None
+        worker.stop()
+        self._system.restore_previous_state()
+        self._system._time_value = self._saved_time
+
+        self._timer.stop()
+        self.fire_event('background_simulation_stopped')
+
+
+
+    ######## Getters ########
+
+    def is_running(self):
+        return self._timer.is_running()
+
+
+    def is_paused(self):
+        return self._timer.is_paused()
+
+
+    def is_stopped(self):
+        return self._timer.is_stopped()
+
+
+    def get_worker(self):
+        '''get_worker() -> SimulationWorker | None
+        Get the worker which executes the simulation (None if the background simulation is stopped)
+        '''
+        return self._worker
+
+
+    def get_real_steps_frequency(self):
+        '''get_real_steps_frequency() -> float
+        Get the number of simulation steps executed by the worker per second (measured
+        between the last two updates)
+        '''
+        return self._real_steps_frequency
+
+
+
+    ######## Event handlers ########
+
+    def _on_timer_tick(self, *args, **kwargs):
+        self._update()
+        return True
+
+
+
+    def _update(self):
+        worker = self._worker
+        alive = worker.is_alive()
+        if worker.update_system():
+            # Measure the rate of the worker
+            current_time, num_snapshots = perf_counter_ns(), worker.get_num_snapshots()
+            if self._last_update_time is not None and current_time > self._last_update_time:
+                self._real_steps_frequency = (num_snapshots - self._last_num_snapshots) * 1e9 / (current_time - self._last_update_time)
+            self._last_update_time, self._last_num_snapshots = current_time, num_snapshots
+            self.fire_event('background_simulation_step')
+
+        if not alive:
+            # The worker finished: a terminal event was detected or an exception was raised
+            # (it can be retrieved with get_worker().get_error())
+            self._timer.pause()
+            self.fire_event('background_simulation_paused')
@@ -0,0 +1,352 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: This file defines the class Playback
+'''
+
+######## Import statements ########
+
+# Standard imports
+from time import perf_counter_ns
+import numpy as np
+
+# Imports from other modules
+from ..utils.events import EventProducer
+from ..core.storage import TrajectoryReader
+from .timer import Timer
+
+
+
+######## class Playback ########
+
+class Playback(EventProducer):
+    '''
+    This class is responsible of replaying a trajectory stored in disk (see ``TrajectoryWriter``)
+    in the scene without simulating the system again.
+
+    On each update, the frame at the current playback time is read from the memory mapped
+    chunks of the trajectory (interpolating linearly between the two closest samples) and
+    its values are copied to the numeric values of the symbols of the system. Only the
+    drawings need to be updated.
+    The playback time can be changed at any moment (seeking & scrubbing) and the speed can
+    be modified (negative values replay the trajectory backwards).
+    If the trajectory is still being written, the playback waits at its last frame until new
+    samples are available (live follow).
+    '''
+
+    ######## Constructor ########
+
+    def __init__(self, scene, system):
+        super().__init__()
+
+        # Initialize internal fields
+        self._scene, self._system = scene, system
+        self._reader = None
+        self._time_values = np.zeros(0, dtype=np.float64)
+        self._num_chunks = 0
+        self._symbols_rows = []
+        self._time, self._speed = 0.0, 1.0
+        self._looped, self._interpolated = False, True
+        self._last_update_time, self._saved_time = None, 0.0
+
+        self._timer = Timer(1 / 30)
+        self.add_event_handler(self._on_timer_tick, 'tick')
+        self.add_child(self._timer)
+
+
+
+    ######## Playback controls ########
+
+    def start(self, trajectory, speed=None, looped=None, interpolated=None):
+        '''start(trajectory: str | TrajectoryReader[, speed: float, looped: bool, interpolated: bool])
+        Start replaying the given trajectory from its first sample
+
+        :param trajectory: The directory where the trajectory is stored or a TrajectoryReader instance
+        :raises RuntimeError: If the playback already started
+        :raises ValueError: If the trajectory doesnt store the values of the coordinates or
+            they dont match the coordinates of the system
+        '''
+        if not self.is_stopped():
+            raise RuntimeError('Playback already started')
+        if isinstance(trajectory, str):
+            trajectory = TrajectoryReader(trajectory)
+        elif not isinstance(trajectory, TrajectoryReader):
+            raise TypeError('trajectory must be a string or a TrajectoryReader instance')
+        if speed is not None:
+            self.set_speed(speed)
+        if looped is not None:
+            self.set_looped(looped)
+        if interpolated is not None:
+            self.set_interpolated(interpolated)
+
+        # Map the rows of the trajectory to the numeric values of the symbols of the system
+        symbols_values = self._system._symbols_values
+        if 'coordinate' not in trajectory.get_symbol_types():
+            raise ValueError('The trajectory doesnt store the values of the coordinates')
+        symbols_rows = []
+        for kind in trajectory.get_symbol_types():
+            if kind not in symbols_values or kind == 'parameter':
+                continue
+            names = trajectory.get_symbols_names(kind)
+            if set(names) != set(symbols_values[kind].keys()):
+                if kind == 'coordinate':
+                    raise ValueError('The coordinates of the trajectory dont match the coordinates of the system')
+                continue
+            rows = trajectory.get_symbols_rows(kind)
+            indices = np.array([symbols_values[kind].index(name) for name in names], dtype=np.int64)
+            symbols_rows.append((kind, rows, indices))
+
+        self._reader = trajectory
+        self._symbols_rows = symbols_rows
+        self._time_values = trajectory.get_time_values()
+        self._num_chunks = trajectory.get_num_chunks()
+        self._last_update_time = None
+
+        self._system.save_state()
+        self._saved_time = self._system._time_value
+        self._timer.start(resumed=True)
+        self.fire_event('playback_started')
+        self.seek(self.get_start_time())
+
+
+
+    def resume(self):
+        if not self.is_paused():
+            raise RuntimeError('Playback is not paused')
+
+        self._last_update_time = None
+        self._timer.resume()
+        self.fire_event('playback_resumed')
+
+
+
+    def pause(self):
+        if not self.is_running():
+            raise RuntimeError('Playback is not running')
+
+        self._timer.pause()
+        self.fire_event('playback_paused')
+
+
+
+    def stop(self):
+        if self.is_stopped():
+            raise RuntimeError('Playback has not started yet')
+
+        self._reader, self._symbols_rows = None, []
+        self._time_values = np.zeros(0, dtype=np.float64)
+        self._num_chunks = 0
+        self._last_update_time = None
+        self._system.restore_previous_state()
+        self._system._time_value = self._saved_time
+
+        self._timer.stop()
+        self.fire_event('playback_stopped')
+
+
+
+    def seek(self, t):
+        '''seek(t: float)
+        Change the current playback time (it is clamped to the time interval of the trajectory)
+        and update the numeric values of the symbols of the system. This method can be used
+        while the playback is paused to scrub through the trajectory.
+
+        :raises RuntimeError: If the playback is stopped
+        '''
+        if self.is_stopped():
+            raise RuntimeError('Playback has not started yet')
+        try:
+            t = float(t)
+        except (TypeError, ValueError):
+            raise TypeError('Input argument must be a number')
+        self._time = min(max(t, self.get_start_time()), self.get_end_time())
+        self._update_frame()
+
+
+
+    def seek_sample(self, index):
+        '''seek_sample(index: int)
+        Change the current playback time to the time of the sample with the given index
+
+        :raises RuntimeError: If the playback is stopped
+        :raises IndexError: If the index is out of range
+        '''
+        if self.is_stopped():
+            raise RuntimeError('Playback has not started yet')
+        self.seek(self._time_values[index])
+
+
+
+
+    ######## Getters ########
+
+    def is_running(self):
+        return self._timer.is_running()
+
+
+    def is_paused(self):
+        return self._timer.is_paused()
+
+
+    def is_stopped(self):
+        return self._timer.is_stopped()
+
+
+    def get_trajectory(self):
+        '''get_trajectory() -> TrajectoryReader | None
+        Get the trajectory being replayed (None if the playback is stopped)
+        '''
+        return self._reader
+
+
+    def get_time(self):
+        '''get_time() -> float
+        Get the current playback time
+        '''
+        return self._time
+
+
+    def get_start_time(self):
+        '''get_start_time() -> float
+        Get the time of the first sample of the trajectory being replayed
+        '''
+        return self._time_values[0].item() if self._time_values.shape[0] > 0 else 0.0
+
+
+    def get_end_time(self):
+        '''get_end_time() -> float
+        Get the time of the last sample of the trajectory being replayed
+        '''
+        return self._time_values[-1].item() if self._time_values.shape[0] > 0 else 0.0
+
+
+    def get_speed(self):
+        '''get_speed() -> float
+        Get the playback speed (the amount of simulated time replayed per second)
+        '''
+        return self._speed
+
+
+    def is_looped(self):
+        return self._looped
+
+
+    def is_interpolated(self):
+        return self._interpolated
+
+
+
+    ######## Setters ########
+
+    def set_speed(self, speed):
+        '''set_speed(speed: float)
+        Change the playback speed (the amount of simulated time replayed per second). Negative
+        values replay the trajectory backwards
+        '''
+        try:
+            speed = float(speed)
+        except (TypeError, ValueError):
+            raise TypeError('Input argument must be a number')
+        self._speed = speed
+        self.fire_event('playback_speed_changed')
+
+
+
+    def set_looped(self, looped=True):
+        '''set_looped(looped: bool)
+        If the argument is set to True, the playback restarts when reaching the end of the trajectory.
+        Otherwise, the playback is paused at the last frame (unless the trajectory is still being written)
+        '''
+        if not isinstance(looped, bool):
+            raise TypeError('Input argument must be bool')
+        self._looped = looped
+        self.fire_event('looped_mode_changed')
+
+
+
+    def set_interpolated(self, interpolated=True):
+        '''set_interpolated(interpolated: bool)
+        If the argument is set to True, the values between two samples are interpolated linearly.
+        Otherwise, the values of the closest previous sample are shown
+        '''
+        if not isinstance(interpolated, bool):
+            raise TypeError('Input argument must be bool')
+        self._interpolated = interpolated
+
+
+
+    ######## Event handlers ########
+
+    def _on_timer_tick(self, *args, **kwargs):
+        self._update()
+        return True
+
+
+
+    def _update(self, delta_t=None):
+        if delta_t is None:
+            # Compute real delta time (with a monotonic clock)
+            current_time = perf_counter_ns()
+            if self._last_update_time is None:
+                delta_t = 0
+            else:
+                delta_t = (current_time - self._last_update_time) / 1e9
+            self._last_update_time = current_time
+
+        t = self._time + delta_t * self._speed
+        t_start, t_end = self.get_start_time(), self.get_end_time()
+        if (t > t_end and self._speed > 0) and not self._reader.is_complete():
+            # The trajectory is still being written (load the new samples)
+            self._refresh()
+            t_end = self.get_end_time()
+            if t > t_end and not self._reader.is_complete():
+                # Wait at the last frame until more samples are written
+                self._time = t_end
+                self._update_frame()
+                return
+
+        if t_start <= t <= t_end:
+            self._time = t
+        elif self._looped and t_end > t_start:
+            self._time = t_start + (t - t_start) % (t_end - t_start)
+        else:
+            # Stop at the last (or first) frame
+            self._time = min(max(t, t_start), t_end)
+            self._update_frame()
+            self.pause()
+            return
+        self._update_frame()
+
+
+
+    def _refresh(self):
+        # Load the chunks written since the last refresh (only the time of their samples
+        # is appended to the time values)
+        reader = self._reader
+        reader.refresh()
+        num_chunks = reader.get_num_chunks()
+        if num_chunks > self._num_chunks:
+            chunks = [reader.get_chunk(k)[0] for k in range(self._num_chunks, num_chunks)]
+            self._time_values = np.concatenate([self._time_values] + chunks)
+            self._num_chunks = num_chunks
+
+
+
+    def _update_frame(self):
+        # Copy the values of the frame at the current playback time to the numeric values
+        # of the symbols of the system
+        time_values, t = self._time_values, self._time
+        num_samples = time_values.shape[0]
+        if num_samples == 0:
+            return
+        k = min(max(int(np.searchsorted(time_values, t, side='right')) - 1, 0), num_samples - 1)
+        reader = self._reader
+        sample = reader.get_sample(k)
+        if self._interpolated and k + 1 < num_samples and time_values[k + 1] > time_values[k]:
+            alpha = (t - time_values[k]) / (time_values[k + 1] - time_values[k])
+            sample = sample + alpha * (reader.get_sample(k + 1) - sample)
+
+        symbols_values = self._system._symbols_values
+        for kind, rows, indices in self._symbols_rows:
+            symbols_values[kind].as_array()[indices, 0] = sample[rows]
+        self._system._time_value = t
+        self.fire_event('playback_step')
@@ -17,6 +17,8 @@ import sys
 # imports from other modules
 from ..utils.events import EventProducer
 from .simulation import Simulation
+from .playback import Playback
+from .background import BackgroundSimulation
 from .color import Color
 from .transform import Transform
 from .vector import Vector2
@@ -76,10 +78,20 @@ class Scene(EventProducer):
         simulation = Simulation(self, system)
         self.add_child(simulation)
 
+        # Create playback manager (to replay trajectories stored in disk)
+        playback = Playback(self, system)
+        self.add_child(playback)
+
+        # Create the manager of the simulations executed by background workers
+        background_simulation = BackgroundSimulation(self, system)
+        self.add_child(background_simulation)
+
         # Initialize internal fields
         self._renderer = renderer
         self._system = system
         self._simulation = simulation
+        self._playback = playback
+        self._background_simulation = background_simulation
         self._background_color = Color('white')
         self._render_mode = 'solid'
         self._camera = Camera(renderer.GetActiveCamera())
@@ -99,6 +111,17 @@ class Scene(EventProducer):
         self._simulation.add_event_handler(self._on_simulation_resumed, 'simulation_resumed')
         self._simulation.add_event_handler(self._on_simulation_paused, 'simulation_paused')
 
+        # Listen for playback events
+        for event_type in ('playback_step', 'playback_started', 'playback_paused', 'playback_resumed', 'playback_speed_changed'):
+            self._playback.add_event_handler(self._on_playback_changed, event_type)
+        self._playback.add_event_handler(self._on_simulation_stopped, 'playback_stopped')
+
+        # Listen for background simulation events
+        for event_type in ('background_simulation_step', 'background_simulation_started',
+            'background_simulation_paused', 'background_simulation_resumed'):
+            self._background_simulation.add_event_handler(self._on_background_simulation_changed, event_type)
+        self._background_simulation.add_event_handler(self._on_simulation_stopped, 'background_simulation_stopped')
+
         # Listen for manual changes on the symbols values
         self.add_event_handler(self._on_symbol_value_changed, 'symbol_value_changed')
 
@@ -208,6 +231,16 @@ class Scene(EventProducer):
         self._update_simulation_display_info()
 
 
+    def _on_playback_changed(self, *args, **kwargs):
+        # This method is called when the playback time, state or speed changes
+        self._update_playback_display_info()
+
+
+    def _on_background_simulation_changed(self, *args, **kwargs):
+        # This method is called when a new snapshot of the background simulation is shown or its state changes
+        self._update_background_simulation_display_info()
+
+
     def _on_background_color_changed(self, *args, **kwargs):
         # This method is called whenever the background color is changed
         self._update_background_color()
@@ -227,7 +260,8 @@ class Scene(EventProducer):
 
 
     def _on_symbol_value_changed(self, event_type, source, symbol):
-        if not self.is_simulation_running():
+        if not self.is_simulation_running() and not self.is_playback_running() and\
+            not self.is_background_simulation_running():
             self._update_3D_drawings()
 
 
@@ -241,7 +275,38 @@ class Scene(EventProducer):
         lines = [
             f'simulation is {"paused" if self._simulation.is_paused() else "resumed"}',
             't = {:.3f} secs'.format(self._system.get_time().get_value()),
-            f'{int(self._simulation.get_real_update_frequency())} updates/sec'
+            f'{int(self._simulation.get_real_update_frequency())} updates/sec',
+            'x{:.2f} real time, {} overruns'.format(self._simulation.get_real_time_factor(),
+                self._simulation.get_scheduler().get_num_overruns())
+        ]
+        display.text = '\n'.join(lines)
+
+
+    def _update_playback_display_info(self):
+        display = self._simulation_display_info
+        playback = self._playback
+        lines = [
+            f'playback is {"paused" if playback.is_paused() else "resumed"}',
+            't = {:.3f} / {:.3f} secs'.format(playback.get_time(), playback.get_end_time()),
+            'speed = x{:.2f}'.format(playback.get_speed())
+        ]
+        display.text = '\n'.join(lines)
+
+
+    def _update_background_simulation_display_info(self):
+        display = self._simulation_display_info
+        background_simulation = self._background_simulation
+        worker = background_simulation.get_worker()
+        if worker.get_error() is not None:
+            state = 'failed'
+        elif not worker.is_alive():
+            state = 'finished'
+        else:
+            state = 'paused' if background_simulation.is_paused() else 'resumed'
+        lines = [
+            f'background simulation is {state} ({worker.get_mode()})',
+            't = {:.3f} secs'.format(self._system._time_value),
+            f'{int(background_simulation.get_real_steps_frequency())} steps/sec'
         ]
         display.text = '\n'.join(lines)
 
@@ -447,6 +512,137 @@ class Scene(EventProducer):
         return self._simulation.get_delta_time()
 
 
+    def get_simulation_max_substeps(self):
+        '''get_simulation_max_substeps() -> int
+        :return: The maximum number of integration substeps performed on each simulation update
+        :rtype: int
+        '''
+        return self._simulation.get_max_substeps()
+
+
+    def get_simulation_slowdown_policy(self):
+        '''get_simulation_slowdown_policy() -> str
+        :return: The policy applied when the simulation cannot keep up with the real time
+            ('slow_down', 'catch_up' or 'skip_frames')
+        :rtype: str
+        '''
+        return self._simulation.get_slowdown_policy()
+
+
+    def get_simulation_real_time_factor(self):
+        '''get_simulation_real_time_factor() -> float
+        :return: The ratio between the simulated time and the real time elapsed during the last second
+        :rtype: float
+        '''
+        return self._simulation.get_real_time_factor()
+
+
+    def get_simulation_statistics(self):
+        '''get_simulation_statistics() -> Dict[str, float]
+        :return: A summary of the timing statistics of the simulation updates: number of updates, overruns
+            and missed deadlines, real time factor, latencies and execution times (see ``RealTimeScheduler``)
+        :rtype: Dict[str, float]
+        '''
+        return self._simulation.get_statistics()
+
+
+
+    def is_playback_running(self):
+        '''is_playback_running() -> bool
+
+        :return: True if a trajectory is being replayed. False otherwise.
+        :rtype: bool
+
+        '''
+        return self._playback.is_running()
+
+
+
+    def is_playback_paused(self):
+        '''is_playback_paused() -> bool
+
+        :return: True if the playback is paused. False otherwise.
+        :rtype: bool
+
+        '''
+        return self._playback.is_paused()
+
+
+
+    def is_playback_stopped(self):
+        '''is_playback_stopped() -> bool
+
+        :return: True if the playback is stopped. False otherwise.
+        :rtype: bool
+
+        '''
+        return self._playback.is_stopped()
+
+
+
+    def get_playback_time(self):
+        '''get_playback_time() -> float
+        Get the current time of the trajectory being replayed
+
+        :rtype: float
+        '''
+        return self._playback.get_time()
+
+
+
+    def get_playback_speed(self):
+        '''get_playback_speed() -> float
+        Get the playback speed (the amount of simulated time replayed per second)
+
+        :rtype: float
+        '''
+        return self._playback.get_speed()
+
+
+
+    def is_background_simulation_running(self):
+        '''is_background_simulation_running() -> bool
+
+        :return: True if a simulation is being executed by a background worker and shown in the scene.
+            False otherwise.
+        :rtype: bool
+
+        '''
+        return self._background_simulation.is_running()
+
+
+
+    def is_background_simulation_paused(self):
+        '''is_background_simulation_paused() -> bool
+
+        :return: True if the background simulation is paused (or its worker finished). False otherwise.
+        :rtype: bool
+
+        '''
+        return self._background_simulation.is_paused()
+
+
+
+    def is_background_simulation_stopped(self):
+        '''is_background_simulation_stopped() -> bool
+
+        :return: True if the background simulation is stopped. False otherwise.
+        :rtype: bool
+
+        '''
+        return self._background_simulation.is_stopped()
+
+
+
+    def get_background_simulation_worker(self):
+        '''get_background_simulation_worker() -> SimulationWorker | None
+        Get the worker which executes the background simulation (None if it is stopped)
+
+        :rtype: SimulationWorker
+        '''
+        return self._background_simulation.get_worker()
+
+
 
 
     def get_drawings(self):
@@ -581,6 +777,42 @@ class Scene(EventProducer):
         self._simulation.set_delta_time(delta_t)
 
 
+    def set_simulation_update_frequency(self, frequency):
+        '''set_simulation_update_frequency(frequency: numeric)
+        Set the number of simulation updates per second (independent of the delta time)
+        '''
+        self._simulation.set_update_frequency(frequency)
+
+
+    def set_simulation_max_substeps(self, max_substeps):
+        '''set_simulation_max_substeps(max_substeps: int)
+        Set the maximum number of integration substeps performed on each simulation update
+        '''
+        self._simulation.set_max_substeps(max_substeps)
+
+
+    def set_simulation_slowdown_policy(self, policy):
+        '''set_simulation_slowdown_policy(policy: str)
+        Set the policy applied when the simulation cannot keep up with the real time
+        ('slow_down', 'catch_up' or 'skip_frames'). See ``Simulation.set_slowdown_policy``
+        '''
+        self._simulation.set_slowdown_policy(policy)
+
+
+    def set_playback_speed(self, speed):
+        '''set_playback_speed(speed: numeric)
+        Set the playback speed (negative values replay the trajectory backwards)
+        '''
+        self._playback.set_speed(speed)
+
+
+    def set_playback_looped(self, looped=True):
+        '''set_playback_looped(looped: bool)
+        Enable/Disable playback looping mode
+        '''
+        self._playback.set_looped(looped)
+
+
     def set_background_color(self, *args):
         '''set_background_color(...)
         Set the background color of the scene
@@ -632,9 +864,13 @@ class Scene(EventProducer):
         '''start_simulation()
         Starts the simulation.
 
-        :raises RuntimeError: If the simulation already started
+        :raises RuntimeError: If the simulation already started or a trajectory is being replayed
 
         '''
+        if not self._playback.is_stopped():
+            raise RuntimeError('The simulation cannot be started while a trajectory is being replayed')
+        if not self._background_simulation.is_stopped():
+            raise RuntimeError('The simulation cannot be started while a background simulation is running')
         self._simulation.start(*args, **kwargs)
 
 
@@ -673,6 +909,140 @@ class Scene(EventProducer):
 
 
 
+    ######## Playback controls ########
+
+
+    def play_trajectory(self, trajectory, speed=None, looped=None, interpolated=None):
+        '''play_trajectory(trajectory: str | TrajectoryReader[, speed: float, looped: bool, interpolated: bool])
+        Replay a trajectory stored in disk (see ``TrajectoryWriter``) without simulating the system again.
+        The frames are read from the memory mapped chunks of the trajectory and copied to the
+        numeric values of the symbols of the system (only the drawings are updated).
+        The values of the symbols are restored when the playback is stopped.
+
+            :Example:
+
+            >>> play_trajectory('results', speed=2)
+            >>> pause_playback()
+            >>> seek_playback(10.5)
+
+        :param trajectory: The directory where the trajectory is stored or a TrajectoryReader instance
+        :param speed: The amount of simulated time replayed per second (1 by default)
+        :param looped: If True, restart the playback when reaching the end of the trajectory
+        :param interpolated: If True (by default), the values between two samples are interpolated
+        :raises RuntimeError: If the simulation or the playback already started
+        '''
+        if not self._simulation.is_stopped() or not self._background_simulation.is_stopped():
+            raise RuntimeError('A trajectory cannot be replayed while the simulation is running')
+        self._playback.start(trajectory, speed, looped, interpolated)
+
+
+
+    def seek_playback(self, t):
+        '''seek_playback(t: float)
+        Change the current time of the trajectory being replayed (it can be used while the
+        playback is paused to scrub through the trajectory)
+
+        :raises RuntimeError: If the playback is stopped
+        '''
+        self._playback.seek(t)
+
+
+
+    def stop_playback(self):
+        '''stop_playback()
+        Stops replaying the trajectory
+
+        :raises RuntimeError: If the playback is already stopped
+        '''
+        self._playback.stop()
+
+
+
+    def resume_playback(self):
+        '''resume_playback()
+        Resumes the playback
+
+        :raises RuntimeError: If the playback is not paused
+        '''
+        self._playback.resume()
+
+
+
+    def pause_playback(self):
+        '''pause_playback()
+        Pauses the playback
+
+        :raises RuntimeError: If the playback is not running
+        '''
+        self._playback.pause()
+
+
+
+
+    ######## Background simulation controls ########
+
+
+    def start_background_simulation(self, model, delta_t=0.01, mode='process', real_time=True, speed=1.0):
+        '''start_background_simulation(model: Callable[, delta_t: float, mode: str, real_time: bool, speed: float])
+        Simulate a model in a background thread or process (see ``SimulationWorker``). The worker
+        publishes its latest state in a double buffer (shared memory in the process mode) and the scene
+        only copies it to the numeric values of the coordinates, velocities and time of the system to update
+        the drawings, so the viewer stays responsive even if the model is expensive.
+        The values of the symbols are restored when the background simulation is stopped.
+
+            :Example:
+
+            >>> def model(system):
+            ...     # Define the model on the given system
+            ...     return system.get_simulation_engine()
+            >>> start_background_simulation(model, delta_t=0.001, mode='process')
+            >>> stop_background_simulation()
+
+        :param model: A callable which receives a new system, defines the model (it must create the same
+            coordinates as this system) and returns its simulation engine. It must be picklable in the process mode
+        :param delta_t: The size of the simulation steps
+        :param mode: 'process' (default) or 'thread'
+        :param real_time: If True (by default), the simulation doesnt run faster than the real time
+        :param speed: The amount of simulated time per second of real time (only if real_time is True)
+        :raises RuntimeError: If the simulation, the playback or the background simulation already started
+        '''
+        if not self._simulation.is_stopped() or not self._playback.is_stopped():
+            raise RuntimeError('The background simulation cannot be started while the simulation or the playback is running')
+        self._background_simulation.start(model, delta_t, mode, real_time, speed)
+
+
+
+    def stop_background_simulation(self):
+        '''stop_background_simulation()
+        Stops the background simulation (the worker is terminated)
+
+        :raises RuntimeError: If the background simulation is already stopped
+        '''
+        self._background_simulation.stop()
+
+
+
+    def resume_background_simulation(self):
+        '''resume_background_simulation()
+        Resumes the background simulation
+
+        :raises RuntimeError: If the background simulation is not paused
+        '''
+        self._background_simulation.resume()
+
+
+
+    def pause_background_simulation(self):
+        '''pause_background_simulation()
+        Pauses the background simulation
+
+        :raises RuntimeError: If the background simulation is not running
+        '''
+        self._background_simulation.pause()
+
+
+
+
     ######## Add/Remove drawings ########
 
 
@@ -1120,7 +1490,7 @@ class Scene(EventProducer):
 
         simulation = self._simulation
 
-        simulation_stopped = simulation.is_stopped()
+        simulation_stopped = simulation.is_stopped() and self._playback.is_stopped()
         if simulation_stopped:
             simulation.start()
         self._update_drawings()
@@ -5,19 +5,10 @@ Description: This file defines the class Simulation
 
 ######## Import statements ########
 
-# Standard imports
-from time import time_ns
-from collections import deque
-from collections.abc import Mapping, Iterable
-from functools import partial
-
 # Imports from other modules
 from ..utils.events import EventProducer
 from .timer import Timer
-from ..config import runtime_config
-from ..core.integration import NumericIntegration
-from ..core.assembly import AssemblyProblemSolver
-from lib3d_mec_ginac_ext import Matrix, NumericFunction
+from ..core.scheduler import RealTimeScheduler
 
 
 
@@ -29,6 +20,15 @@ class Simulation(EventProducer):
     time symbol value periodically and perform temporal integration).
     Also it updates the scene (which recomputes the drawings affine transformations and
     redraws the vtk scene)
+
+    When the delta time has a fixed value, the simulation advances with a fixed timestep
+    decoupled from the update rate: the real time elapsed between two updates is accumulated
+    and as many integration substeps of size ``delta_t`` as needed are performed on each
+    update (at most ``max_substeps``). If the simulation cannot keep up with the real time,
+    the slowdown policy decides whether the time left is discarded ('slow_down'), integrated
+    on the next updates ('catch_up') or integrated at once skipping the frames ('skip_frames').
+    The updates are tracked against their deadlines with a monotonic clock (see ``RealTimeScheduler``)
+    to measure their latency, the overruns and the real time factor.
     '''
 
     ######## Constructor ########
@@ -40,12 +40,12 @@ class Simulation(EventProducer):
         self._scene, self._system = scene, system
         self._delta_t = 1 / 30
         self._timer = None
-        self._elapsed_time, self._last_update_time = 0.0, None
+        self._elapsed_time = 0.0
         self._looped, self._time_limit = False, None
-        self._diff_times = deque(maxlen=10)
-        self._assembly_problem_init = lambda *args, **kwargs: None
-        self._assembly_problem_step = lambda *args, **kwargs: None
-        self.set_integration_method('euler')
+        self._engine = system.get_simulation_engine()
+        self._update_interval = 1 / 30
+        self._scheduler = RealTimeScheduler(self._update_interval)
+        self._num_substeps = 0
 
         self._timer = Timer()
         self.add_event_handler(self._on_timer_tick, 'tick')
@@ -66,12 +66,16 @@ class Simulation(EventProducer):
         if not self.is_stopped():
             raise RuntimeError('Simulation already started')
 
-        self._timer.set_time_interval(self._delta_t)
+        self._timer.set_time_interval(self._update_interval)
         self._timer.start(resumed=True)
+        self._scheduler.start()
 
+        # The time is reset before the initialization (the input schedules and the kinematic
+        # problem are evaluated at the current time)
         self._system.save_state()
-        self._assembly_problem_init()
         self._system.get_time().value = 0
+        self._engine.init()
+        self._engine.record()
 
         self.fire_event('simulation_started')
 
@@ -81,7 +85,7 @@ class Simulation(EventProducer):
         if not self.is_paused():
             raise RuntimeError('Simulation is not paused')
 
-        self._last_update_time = None
+        self._scheduler.resume()
         self._timer.resume()
         self.fire_event('simulation_resumed')
 
@@ -101,8 +105,9 @@ class Simulation(EventProducer):
             raise RuntimeError('Simulation has not started yet')
 
         self._elapsed_time = 0.0
-        self._last_update_time = None
+        self._scheduler.reset()
         self._system.restore_previous_state()
+        self._engine.reset()
 
         self._timer.stop()
         self.fire_event('simulation_stopped')
@@ -129,16 +134,63 @@ class Simulation(EventProducer):
 
 
     def get_update_frequency(self):
-        return 1 / self._delta_t
+        return 1 / self._update_interval
+
+
+    def get_max_substeps(self):
+        '''get_max_substeps() -> int
+        Get the maximum number of integration substeps performed on each update
+        '''
+        return self._scheduler.get_max_substeps()
+
+
+    def get_slowdown_policy(self):
+        '''get_slowdown_policy() -> str
+        Get the policy applied when the simulation cannot keep up with the real time
+        ('slow_down', 'catch_up' or 'skip_frames')
+        '''
+        return self._scheduler.get_policy()
+
+
+    def get_accumulated_time(self):
+        '''get_accumulated_time() -> float
+        Get the real time elapsed which was not integrated yet (always lower than the delta time
+        unless the slowdown policy is 'catch_up')
+        '''
+        return self._scheduler.get_accumulated_time()
+
+
+    def get_num_substeps(self):
+        '''get_num_substeps() -> int
+        Get the number of integration substeps performed on the last update
+        '''
+        return self._num_substeps
 
 
     def get_real_update_frequency(self):
-        if not self._diff_times:
-            return 0
-        try:
-            return len(self._diff_times) / sum(self._diff_times)
-        except ZeroDivisionError:
-            return 0
+        return self._scheduler.get_update_frequency()
+
+
+    def get_real_time_factor(self):
+        '''get_real_time_factor() -> float
+        Get the ratio between the simulated time and the real time elapsed during the last second
+        '''
+        return self._scheduler.get_real_time_factor(1.0)
+
+
+    def get_scheduler(self):
+        '''get_scheduler() -> RealTimeScheduler
+        Get the scheduler which tracks the deadlines of the updates and their timing statistics
+        (latency histograms, overruns, real time factor, ...)
+        '''
+        return self._scheduler
+
+
+    def get_statistics(self):
+        '''get_statistics() -> Dict[str, float]
+        Get a summary of the timing statistics of the updates (see ``RealTimeScheduler.get_statistics``)
+        '''
+        return self._scheduler.get_statistics()
 
 
     def get_delta_time(self):
@@ -158,7 +210,7 @@ class Simulation(EventProducer):
         Get the current integration method to adjust system's symbol values while
         the simulation is running
         '''
-        return self._integration_method
+        return self._engine.get_integration_method()
 
 
     def get_integration_method_name(self):
@@ -166,10 +218,7 @@ class Simulation(EventProducer):
         Get the current integration method`s name to adjust system's symbol values
         while the simulation is running
         '''
-        method = self.get_integration_method()
-        if isinstance(method, partial):
-            return method.func.__name__
-        return method.__name__
+        return self._engine.get_integration_method_name()
 
 
 
@@ -225,30 +274,74 @@ class Simulation(EventProducer):
                 raise TypeError('Input argument must be a number greater than zero or None')
 
         self._delta_t = delta_t
-        self._timer.set_time_interval(delta_t)
+        self._scheduler.discard_accumulated_time()
         self.fire_event('delta_time_changed')
 
 
 
-    def set_integration_method(self, method):
-        '''set_integrator(method: IntegrationMethod)
-        Change integration method to adjust system's symbol values while the
-        simulation is running
-        :param method: Must be a callable for a custom integration method or
-            the name of a predefined integrator like 'euler', 'rk4'
+    def set_update_frequency(self, frequency):
+        '''set_update_frequency(frequency: numeric)
+        Change the number of updates per second (the rate at which the time is advanced and
+        the scene redrawn). It is independent of the delta time
+        '''
+        try:
+            frequency = float(frequency)
+            if frequency <= 0:
+                raise TypeError
+        except:
+            raise TypeError('Input argument must be a number greater than zero')
+
+        self._update_interval = 1 / frequency
+        self._timer.set_time_interval(self._update_interval)
+        self._scheduler.set_interval(self._update_interval)
+        self.fire_event('update_frequency_changed')
+
+
+
+    def set_max_substeps(self, max_substeps):
+        '''set_max_substeps(max_substeps: int)
+        Change the maximum number of integration substeps performed on each update (only
+        when the delta time has a fixed value)
         '''
-        if not isinstance(method, str) and not callable(method):
-            raise TypeError('Integration method must be a callable or a string')
+        if not isinstance(max_substeps, int) or max_substeps <= 0:
+            raise TypeError('Input argument must be an integer greater than zero')
+        self._scheduler.set_max_substeps(max_substeps)
+
 
-        if isinstance(method, str):
-            method = NumericIntegration.get_method(method)
 
-        system = self._system
-        q_values   = system.get_coords_values()
-        dq_values  = system.get_velocities_values()
-        ddq_values = system.get_accelerations_values()
+    def set_slowdown_policy(self, policy):
+        '''set_slowdown_policy(policy: str)
+        Change the policy applied when more than ``max_substeps`` substeps are needed to keep
+        up with the real time:
+
+        - 'slow_down' (default): The time left is discarded (the simulation runs slower than the
+          real time, but the updates are never delayed)
+
+        - 'catch_up': The time left is integrated on the next updates (the simulation time
+          catches up with the real time when the load decreases)
+
+        - 'skip_frames': All the substeps needed are performed in the same update (the simulation
+          time never lags behind the real time, but the frames of the deadlines missed are skipped)
+        '''
+        if policy not in ('slow_down', 'catch_up', 'skip_frames'):
+            raise ValueError('Input argument must be "slow_down", "catch_up" or "skip_frames"')
+        self._scheduler.set_policy(policy)
 
-        self._integration_method = partial(method, q_values, dq_values, ddq_values)
+
+
+    def set_integration_method(self, method, *args, **kwargs):
+        '''set_integrator(method: IntegrationMethod, ...)
+        Change integration method to adjust system's symbol values while the
+        simulation is running
+        :param method: Must be a callable for a custom integration method, an
+            Integrator instance (or subclass) or the name of a predefined integrator like
+            'euler', 'rk4', 'dopri5'
+        :param args: Additional positional arguments to create the integrator (only if
+            method is a name or an Integrator subclass)
+        :param kwargs: Additional keyword arguments to create the integrator (only if
+            method is a name or an Integrator subclass) e.g: ``set_integration_method('dopri5', rtol=1e-8)``
+        '''
+        self._engine.set_integration_method(method, *args, **kwargs)
         self.fire_event('integration_method_changed')
 
 
@@ -263,13 +356,40 @@ class Simulation(EventProducer):
         and then you can specify additional parameters (this is optional):
         geom_eq_tol, geom_eq_relax, geom_eq_init_tol, geom_eq_init_relax
         '''
-        solver = AssemblyProblemSolver(self._system, *args, **kwargs)
-        system = self._system
-        q_values   = system.get_coords_values()
-        dq_values  = system.get_velocities_values()
-        ddq_values = system.get_accelerations_values()
-        self._assembly_problem_init = partial(solver.init, q_values, dq_values, ddq_values)
-        self._assembly_problem_step = partial(solver.step, q_values, dq_values, ddq_values)
+        self._engine.assembly_problem(*args, **kwargs)
+
+
+
+    def dynamics(self, *args, **kwargs):
+        '''dynamics(...)
+        Setup the dynamic problem. When configured, the accelerations are computed on each
+        simulation step (before the numerical integration) solving the augmented system built
+        with the next matrices:
+
+        | M_qq   Phi_q^T | | ddq    |   | delta_q |
+        | Phi_q     0    | | lambda | = | gamma   |
+
+        You must pass first the matrices M_qq, delta_q and optionally Phi_q and gamma as
+        positional or keyword arguments. The additional parameters c_optimized and
+        refactorization_interval can also be specified.
+        If the number of joint unknowns of the system matches the number of constraints,
+        the lagrange multipliers are stored as their numeric values.
+        '''
+        self._engine.dynamics(*args, **kwargs)
+
+
+
+    def kinematics(self, *args, **kwargs):
+        '''kinematics(...)
+        Enable the kinematic mode: the coordinates passed in the mapping ``drivers`` are set
+        from functions of the time and the rest are computed on each simulation step solving the position,
+        velocity & acceleration problems (the dynamic problem and the numerical integration are skipped).
+
+        You must pass first the matrices Phi, Phi_q, beta, gamma and the mapping of driven coordinates
+        and time functions as positional or keyword arguments. The additional parameters tol, max_iterations
+        and c_optimized can also be specified. Pass None to disable the kinematic mode.
+        '''
+        self._engine.kinematics(*args, **kwargs)
 
 
 
@@ -282,41 +402,52 @@ class Simulation(EventProducer):
 
 
     def _update(self, delta_t=None):
-        if delta_t is None:
-            # Compute real delta time
-            current_time = time_ns()
-            if self._last_update_time is None:
-                delta_t = 0
-                self._last_update_time = current_time
-            else:
-                delta_t = (current_time - self._last_update_time) / 1e9
-                self._last_update_time = current_time
-        self._diff_times.appendleft(delta_t)
+        # Compute real delta time (and track the deadline of this update)
+        scheduler = self._scheduler
+        delta_t = scheduler.begin_update(delta_t)
 
         # Update elapsed time
         self._elapsed_time += delta_t
 
-        # Update time
         t = self._system.get_time()
-        t.value += delta_t
-
-        if self._delta_t is not None:
-            # Use the user delta_t to perform the numerical integration and solve
-            # the assembly problem
-            delta_t = self._delta_t
-
-        self._integration_method(delta_t)
-        self._assembly_problem_step(delta_t)
+        t_limit = self._time_limit
+        step = self._delta_t
+        if step is None:
+            # Integrate the real time elapsed in a single step
+            num_substeps, step = (1, delta_t) if delta_t > 0 else (0, 0.0)
+        else:
+            # Fixed timestep: integrate the real time accumulated in substeps of size delta_t
+            num_substeps = scheduler.get_num_substeps(step)
+
+        engine, system = self._engine, self._system
+        t_start = system._time_value
+        running = True
+        self._num_substeps = 0
+        for k in range(0, num_substeps):
+            running = engine.advance(system._time_value, step)
+            engine.record()
+            self._num_substeps += 1
+            if not running or (t_limit is not None and system._time_value >= t_limit):
+                break
+        # Update time (only once per update)
+        t.value = system._time_value
+        scheduler.end_update(system._time_value - t_start)
         self.fire_event('simulation_step')
 
-        t_limit = self._time_limit
+        if not running:
+            # A terminal event function crossed zero
+            self.pause()
+            return
+
         if t_limit is not None and t.value >= t_limit:
             if self._looped:
                 delta_t = t.value - t_limit
-                t.value -= t_limit
                 self._system.restore_previous_state()
-                self._assembly_problem_init()
-                self._integration_method(delta_t)
+                t.value = 0
+                self._engine.init()
+                self._engine.advance(0.0, delta_t)
+                t.value = delta_t
+                self._engine.record()
                 self.fire_event('simulation_step')
             else:
                 self.stop()
@@ -6,7 +6,7 @@ Description: This file defines the classes Timer and OneShotTimer
 
 ######## Import statements ########
 
-from time import time
+from time import perf_counter
 from ..utils.events import EventProducer
 from collections.abc import Iterable, Mapping
 import warnings
@@ -229,7 +229,7 @@ class Timer(EventProducer):
         # This is called internally to update the state of the timer
         if self._state != 'running':
             return
-        current_time = time()
+        current_time = perf_counter()
         if self._last_time is None:
             self._last_time = current_time
         else:
@@ -0,0 +1,103 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: Benchmark to measure the number of simulation steps per second when the
+accelerations are computed solving the dynamic problem.
+'''
+
+from lib3d_mec_ginac import *
+import timeit
+
+
+# The next code is used to define the mechanical system for the benchmark (four bar mechanism)
+
+theta1, dtheta1, ddtheta1 = new_coord('theta1', -pi/6, 0)
+theta2, dtheta2, ddtheta2 = new_coord('theta2', -2*pi/6, 0)
+theta3, dtheta3, ddtheta3 = new_coord('theta3', -3*pi/6, 0)
+l1, l2 = new_param('l1', 0.4), new_param('l2', 2.0)
+l3, l4 = new_param('l3', 1.2), new_param('l4', 1.6)
+new_base('Barm1', 'xyz', [0, 1, 0], theta1)
+new_base('Barm2', 'Barm1', 0, 1, 0, theta2)
+new_base('Barm3', 'Barm2', rotation_tupla=[0, 1, 0], rotation_angle=theta3)
+new_vector('OA', l1, 0, 0, 'Barm1')
+new_vector('AB', l2, 0, 0, 'Barm2')
+new_vector('BC', [l3, 0, 0], 'Barm3')
+new_vector('OO2', values=[l4, 0, 0], base='xyz')
+new_point('A',  'O', 'OA')
+new_point('B',  'A', 'AB')
+new_point('C',  'B', 'BC')
+new_point('O2', 'O', 'OO2')
+m1, m2, m3 = new_param('m1', 1), new_param('m2', 1), new_param('m3', 1)
+cg1x, cg1z = new_param('cg1x', 0.2), new_param('cg1z', 0.1)
+cg2x, cg2z = new_param('cg2x', 1),   new_param('cg2z', 0.1)
+cg3x, cg3z = new_param('cg3x', 0.6), new_param('cg3z', 0.1)
+new_vector('OArm1_GArm1', cg1x, 0, cg1z, 'Barm1')
+new_vector('OArm2_GArm2', cg2x, 0, cg2z, 'Barm2')
+new_vector('OArm3_GArm3', cg3x, 0, cg3z, 'Barm3')
+I1yy, I2yy, I3yy = [new_param(name, 1) for name in ('I1yy', 'I2yy', 'I3yy')]
+I_Arm1 = new_tensor('Iarm1', base='Barm1')
+I_Arm2 = new_tensor('Iarm2', base='Barm2')
+I_Arm3 = new_tensor('Iarm3', base='Barm3')
+I_Arm1[1, 1], I_Arm2[1, 1], I_Arm3[1, 1] = I1yy, I2yy, I3yy
+new_solid('Arm1', 'O', 'Barm1', 'm1', 'OArm1_GArm1', 'Iarm1')
+new_solid('Arm2', 'A', 'Barm2', 'm2', 'OArm2_GArm2', 'Iarm2')
+new_solid('Arm3', 'B', 'Barm3', 'm3', 'OArm3_GArm3', 'Iarm3')
+new_unknown('lambda1')
+new_unknown('lambda2')
+Sum_Wrenches_Arm1 = inertia_wrench('Arm1') + gravity_wrench('Arm1')
+Sum_Wrenches_Arm2 = inertia_wrench('Arm2') + gravity_wrench('Arm2')
+Sum_Wrenches_Arm3 = inertia_wrench('Arm3') + gravity_wrench('Arm3')
+Twist_Arm1, Twist_Arm2, Twist_Arm3 = twist('Arm1'), twist('Arm2'), twist('Arm3')
+q, dq, ddq = get_coords_matrix(), get_velocities_matrix(), get_accelerations_matrix()
+epsilon = get_unknowns_matrix()
+O2C = position_vector('O2', 'C')
+e_x = new_vector('e_x', 1, 0, 0, 'xyz')
+e_z = new_vector('e_z', 0, 0, 1, 'xyz')
+Phi = Matrix(shape=[2, 1])
+Phi[0] = O2C * e_x
+Phi[1] = O2C * e_z
+dPhi = derivative(Phi)
+ddPhi = derivative(dPhi)
+beta = subs(-dPhi, dq, 0)
+gamma = subs(-ddPhi, ddq, 0)
+Phi_q = jacobian(Phi.transpose(), q)
+dPhi_dq = jacobian(dPhi.transpose(), dq)
+Dyn_eq_VP = Matrix([
+    Sum_Wrenches_Arm1 * diff(Twist_Arm1, to_symbol(dq[k, 0])) + \
+    Sum_Wrenches_Arm2 * diff(Twist_Arm2, to_symbol(dq[k, 0])) + \
+    Sum_Wrenches_Arm3 * diff(Twist_Arm3, to_symbol(dq[k, 0]))   \
+    for k in range(0, 3)
+], shape=[3, 1])
+Dyn_eq_VP_open = subs(Dyn_eq_VP, epsilon, 0)
+M_qq = jacobian(Dyn_eq_VP_open.transpose(), ddq, 1)
+delta_q = subs(-Dyn_eq_VP_open, ddq, 0)
+
+
+
+# Now we create the dynamic & assembly problem solvers
+print("Generating numeric functions...")
+sys = get_default_system()
+dynamics = DynamicProblemSolver(sys, M_qq, delta_q, Phi_q, gamma)
+assembly = AssemblyProblemSolver(sys, Phi, Phi_q, beta, Phi, Phi_q, beta, dPhi_dq, dPhi_dq)
+
+q_values, dq_values = get_coords_values(), get_velocities_values()
+ddq_values, unknowns_values = get_accelerations_values(), get_unknowns_values()
+delta_t = 0.01
+
+def step():
+    dynamics.solve(ddq_values, unknowns_values)
+    NumericIntegration.euler(q_values, dq_values, ddq_values, delta_t)
+    assembly.step(q_values, dq_values, ddq_values, delta_t)
+
+assembly.init(q_values, dq_values, ddq_values)
+
+
+# Print atomization state on/off and python debug mode
+print(f"Atomization is {'enabled' if get_atomization_state() == 1 else 'disabled'}")
+print(f"Python debug mode is {'enabled' if __debug__ else 'disabled'}")
+print()
+
+# Start benchmark & print time metrics
+print("Starting benchmark...")
+n = 1000
+result = min(timeit.repeat(step, repeat=5, number=n)) / n
+print("Average simulation step time: {:5f} milliseconds ({:.0f} steps/sec)".format(result*1000, 1/result))
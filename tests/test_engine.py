@@ -0,0 +1,910 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: Unitary test for the headless simulation engine
+'''
+
+
+######## Imports ########
+
+from lib3d_mec_ginac import *
+import pytest
+import numpy as np
+from math import cos, sin
+
+
+
+######## Fixtures ########
+
+@pytest.fixture
+def oscillator():
+    '''
+    This fixture creates a system with one coordinate x and the matrices of the dynamic
+    problem of a harmonic oscillator ( ddx = -x ) with the initial state x = 1, dx = 0
+    '''
+    sys = System()
+    x, dx, ddx = sys.new_coordinate('x', 1, 0, 0)
+    M_qq, delta_q = Matrix([1], shape=[1, 1]), Matrix([-x], shape=[1, 1])
+    return sys, M_qq, delta_q
+
+
+
+######## Helper functions ########
+
+def oscillator_model(system):
+    # Model of a harmonic oscillator ( ddx = -k * x ) used by the parameter sweeps
+    x, dx, ddx = system.new_coordinate('x', 1, 0, 0)
+    k = system.new_parameter('k', 1)
+    engine = SimulationEngine(system)
+    engine.set_integration_method('rk4')
+    engine.dynamics(Matrix([1], shape=[1, 1]), Matrix([-k * x], shape=[1, 1]))
+    return engine
+
+
+def stopped_oscillator_model(system):
+    # Oscillator model whose simulation stops at t = 1 (used by the background workers)
+    engine = oscillator_model(system)
+    engine.add_event_function('end', system.get_time() - 1, terminal=True)
+    return engine
+
+
+def final_position(trajectory):
+    return trajectory.get_values('x')[-1]
+
+
+def positive_final_position(trajectory):
+    # Metric which raises an exception when the final position is negative
+    x = trajectory.get_values('x')[-1]
+    if x < 0:
+        raise ValueError('The final position is negative')
+    return x
+
+
+
+######## Tests ########
+
+
+def test_run_simulation_constant_accelerations():
+    '''
+    This test checks the function run_simulation when the dynamic problem is not configured
+    '''
+    sys = System()
+    sys.new_coordinate('x', 0, 1, 2)
+
+    trajectory = run_simulation(sys, 1, 0.1)
+    assert trajectory.get_num_samples() == 11
+    assert trajectory.q.shape == (11, 1)
+    assert trajectory.time == pytest.approx(np.linspace(0, 1, 11))
+    assert trajectory.get_values('x') == pytest.approx(trajectory.time + trajectory.time ** 2)
+    assert trajectory.get_values('dx') == pytest.approx(1 + 2 * trajectory.time)
+    assert sys.get_value('x') == pytest.approx(2)
+    assert sys.get_value(sys.get_time()) == pytest.approx(1)
+
+    # The last step is shortened to reach the final time
+    sys.set_value('x', 0)
+    trajectory = run_simulation(sys, 1, 0.3)
+    assert trajectory.time == pytest.approx([0, 0.3, 0.6, 0.9, 1])
+
+    with pytest.raises(TypeError):
+        run_simulation(sys, 1, 0)
+    with pytest.raises(IndexError):
+        trajectory.get_values('foo')
+
+
+
+def test_simulation_engine(oscillator):
+    '''
+    This test checks the class SimulationEngine solving the dynamic problem
+    '''
+    sys, M_qq, delta_q = oscillator
+    engine = SimulationEngine(sys)
+    engine.set_integration_method('rk4')
+    engine.dynamics(M_qq, delta_q)
+    assert engine.get_integration_method_name() == 'rk4'
+    assert isinstance(engine.get_dynamic_problem_solver(), DynamicProblemSolver)
+    assert engine.get_assembly_problem_solver() is None
+
+    engine.init()
+    trajectory = engine.run(10, 0.01)
+    assert trajectory.get_num_samples() == 1001
+    assert trajectory.get_values('x')[-1] == pytest.approx(cos(10), abs=1e-6)
+    assert trajectory.get_values('dx')[-1] == pytest.approx(-sin(10), abs=1e-6)
+
+    # The simulation continues from the current time reusing the preallocated trajectory
+    trajectory.clear()
+    engine.run(20, 0.01, trajectory)
+    assert trajectory.time[0] == pytest.approx(10)
+    assert trajectory.get_values('x')[-1] == pytest.approx(cos(20), abs=1e-6)
+    with pytest.raises(ValueError):
+        engine.run(30, 0.001, trajectory)
+
+
+
+def test_dynamic_problem_solver():
+    '''
+    This test checks the class DynamicProblemSolver with constraints
+    '''
+    sys = System()
+    x, dx, ddx = sys.new_coordinate('x', 0, 0, 0)
+    y, dy, ddy = sys.new_coordinate('y', 0, 0, 0)
+    M_qq = Matrix([2, 0, 0, 3], shape=[2, 2])
+    delta_q = Matrix([1, 1], shape=[2, 1])
+
+    # Constraint x - y = 0: ddx = ddy = 0.4, lambda = 0.2
+    solver = DynamicProblemSolver(sys, M_qq, delta_q, Matrix([1, -1], shape=[1, 2]), Matrix([0], shape=[1, 1]))
+    ddq_values = np.zeros((2, 1))
+    solver.solve(ddq_values)
+    assert ddq_values[:, 0] == pytest.approx([0.4, 0.4])
+    assert solver.get_lagrange_multipliers()[:, 0] == pytest.approx([0.2])
+    assert not solver.is_rank_deficient()
+
+    # Redundant constraints (the augmented matrix is singular)
+    solver = DynamicProblemSolver(sys, M_qq, delta_q, Matrix([1, -1, 2, -2], shape=[2, 2]), Matrix([0, 0], shape=[2, 1]))
+    solver.solve(ddq_values)
+    assert ddq_values[:, 0] == pytest.approx([0.4, 0.4])
+    assert solver.is_rank_deficient()
+
+    # The lagrange multipliers are stored in the joint unknowns created after the solver
+    engine = SimulationEngine(sys)
+    engine.set_integration_method('rk4')
+    engine.dynamics(M_qq, delta_q, Matrix([1, -1], shape=[1, 2]), Matrix([0], shape=[1, 1]))
+    sys.new_joint_unknown('lambda')
+    engine.init()
+    engine.run(1, 0.1)
+    assert sys.get_value('x') == pytest.approx(0.2) and sys.get_value('y') == pytest.approx(0.2)
+    assert sys.get_value('lambda') == pytest.approx(0.2)
+
+    # Reuse of the factorization
+    solver = DynamicProblemSolver(sys, M_qq, delta_q, refactorization_interval=10)
+    assert solver.get_refactorization_interval() == 10
+    solver.solve(ddq_values)
+    assert ddq_values[:, 0] == pytest.approx([0.5, 1 / 3])
+    with pytest.raises(TypeError):
+        DynamicProblemSolver(sys, M_qq, delta_q, refactorization_interval=0)
+
+
+
+def test_simulate_stream(oscillator):
+    '''
+    This test checks the method ``simulate_stream`` of the class System
+    '''
+    sys, M_qq, delta_q = oscillator
+    sys.get_simulation_engine().dynamics(M_qq, delta_q)
+    sys.get_simulation_engine().set_integration_method('rk4')
+    x = sys.get_coordinate('x')
+
+    chunks, num_samples, last_time = [], 0, None
+    for samples in sys.simulate_stream(10, 0.01, chunk=64, probes={'x2': x ** 2}):
+        # The same buffers are reused on each iteration
+        chunks.append(samples)
+        assert samples.get_capacity() == 64
+        assert samples.get_probe_values('x2') == pytest.approx(samples.q ** 2)
+        assert last_time is None or samples.time[0] > last_time
+        num_samples += samples.get_num_samples()
+        last_time = samples.time[-1]
+
+    assert all(chunk is chunks[0] for chunk in chunks)
+    assert len(chunks) == 16 and num_samples == 1001
+    assert last_time == pytest.approx(10)
+    assert sys.get_value('x') == pytest.approx(cos(10), abs=1e-6)
+
+    with pytest.raises(TypeError):
+        sys.simulate_stream(10, 0.01, chunk=0)
+
+
+
+def test_recorder(oscillator):
+    '''
+    This test checks the class Recorder attached to a simulation engine
+    '''
+    sys, M_qq, delta_q = oscillator
+    x, dx = sys.get_coordinate('x'), sys.get_velocity('dx')
+    engine = SimulationEngine(sys)
+    engine.set_integration_method('rk4')
+    engine.dynamics(M_qq, delta_q)
+
+    recorder = Recorder(sys, capacity=50, decimation=2)
+    recorder.add_probe('x', x)
+    recorder.add_probe('energy', Matrix([x ** 2 / 2 + dx ** 2 / 2, x * dx], shape=[2, 1]))
+    assert recorder.get_probes_names() == ('x', 'energy')
+    assert recorder.get_num_outputs() == 3
+    with pytest.raises(ValueError):
+        recorder.add_probe('x', dx)
+    with pytest.raises(TypeError):
+        recorder.add_probe('foo', 'bar')
+
+    engine.add_recorder(recorder)
+    assert engine.get_recorders() == [recorder]
+    engine.init()
+    engine.run(1, 0.01)
+
+    # Decimation & ring buffer (only the last samples are kept)
+    assert recorder.get_num_records() == 51 and recorder.get_num_samples() == 50
+    time = recorder.get_time_values()
+    assert time[0] == pytest.approx(0.02) and time[-1] == pytest.approx(1)
+    assert recorder.get_probe_values('x')[:, 0] == pytest.approx(np.cos(time), abs=1e-6)
+    assert recorder.get_probe_values('energy').shape == (50, 2)
+    assert recorder.get_probe_values('energy')[:, 0] == pytest.approx(0.5, abs=1e-6)
+
+    # Decimation by time interval
+    recorder.set_decimation(1, 0.05)
+    recorder.clear()
+    engine.run(2, 0.01)
+    assert recorder.get_num_records() == 21
+
+    engine.remove_recorder(recorder)
+    with pytest.raises(IndexError):
+        engine.remove_recorder(recorder)
+
+
+
+def test_trajectory_writer(oscillator, tmp_path):
+    '''
+    This test checks the classes TrajectoryWriter and TrajectoryReader
+    '''
+    sys, M_qq, delta_q = oscillator
+    x = sys.get_coordinate('x')
+    engine = SimulationEngine(sys)
+    engine.set_integration_method('rk4')
+    engine.dynamics(M_qq, delta_q)
+    path = str(tmp_path / 'trajectory')
+
+    for compressed in (False, True):
+        writer = TrajectoryWriter(sys, path, chunk=64, compressed=compressed,
+            symbol_types=('coordinate', 'velocity'), overwrite=compressed)
+        writer.add_probe('x2', x ** 2)
+        engine.add_recorder(writer)
+        sys.set_value('x', 1)
+        sys.set_value('dx', 0)
+        sys.set_value(sys.get_time(), 0)
+        engine.init()
+        engine.run(10, 0.01)
+        with pytest.raises(RuntimeError):
+            writer.add_probe('foo', x)
+        writer.close()
+        engine.remove_recorder(writer)
+        assert writer.is_closed()
+
+        reader = TrajectoryReader(path)
+        assert reader.is_complete()
+        assert reader.get_num_samples() == 1001 and reader.get_num_chunks() == 16
+        assert reader.get_symbol_types() == ('coordinate', 'velocity')
+        assert reader.get_symbols_names('coordinate') == ('x',)
+        time = reader.get_time_values()
+        assert time == pytest.approx(np.linspace(0, 10, 1001))
+        assert reader.get_values('x') == pytest.approx(np.cos(time), abs=1e-6)
+        assert reader.get_symbols_values('velocity').shape == (1001, 1)
+        assert reader.get_probe_values('x2')[:, 0] == pytest.approx(reader.get_values('x') ** 2)
+        assert reader.get_sample(100)[reader.get_symbols_rows('coordinate')] == pytest.approx(reader.get_values('x')[100])
+        with pytest.raises(IndexError):
+            reader.get_symbols_values('acceleration')
+
+    with pytest.raises(FileExistsError):
+        TrajectoryWriter(sys, path)
+
+
+
+def test_parameter_sweep(tmp_path):
+    '''
+    This test checks the class ParameterSweep
+    '''
+    parameters = parameter_grid({'k': [1, 4, 9], 'x': [1, 2]})
+    assert parameters['k'] == pytest.approx([1, 1, 4, 4, 9, 9])
+    assert parameters['x'] == pytest.approx([1, 2, 1, 2, 1, 2])
+    expected = parameters['x'] * np.cos(np.sqrt(parameters['k']))
+
+    progress = []
+    for num_workers in (0, 2):
+        sweep = ParameterSweep(oscillator_model, parameters, {'x': final_position}, 1, 0.001,
+            num_workers=num_workers)
+        results = sweep.run(progress=lambda done, total: progress.append((done, total)))
+        assert results.shape == (6, 1)
+        assert sweep.get_metric_values('x') == pytest.approx(expected, abs=1e-6)
+        assert sweep.get_num_completed() == 6 and sweep.get_num_failed() == 0
+        assert progress[-1] == (6, 6)
+
+    # Resumable results
+    path = str(tmp_path / 'sweep')
+    sweep = ParameterSweep(oscillator_model, parameters, {'x': final_position}, 1, 0.001, path=path)
+    sweep.run()
+    sweep = ParameterSweep(oscillator_model, parameters, {'x': final_position}, 1, 0.001, path=path)
+    assert sweep.get_num_completed() == 6
+    assert sweep.get_metric_values('x') == pytest.approx(expected, abs=1e-6)
+    with pytest.raises(ValueError):
+        ParameterSweep(oscillator_model, parameter_grid({'k': [1]}), {'x': final_position}, 1, 0.001, path=path)
+
+
+
+def test_parameter_sweep_errors(tmp_path):
+    '''
+    This test checks that the class ParameterSweep keeps the exceptions raised by the metrics
+    '''
+    parameters = parameter_grid({'k': [1, 4, 9], 'x': [1, 2]})
+    failed = np.flatnonzero(np.cos(np.sqrt(parameters['k'])) < 0)
+    for num_workers in (0, 2):
+        sweep = ParameterSweep(oscillator_model, parameters, {'x': positive_final_position}, 1, 0.001,
+            num_workers=num_workers)
+        sweep.run()
+        assert sweep.get_num_completed() == 2 and sweep.get_num_failed() == 4
+        assert np.isnan(sweep.get_metric_values('x')[failed]).all()
+        errors = sweep.get_errors()
+        assert sorted(errors.keys()) == failed.tolist()
+        assert all('ValueError: The final position is negative' in error for error in errors.values())
+
+    # The errors are stored with the results
+    path = str(tmp_path / 'sweep')
+    ParameterSweep(oscillator_model, parameters, {'x': positive_final_position}, 1, 0.001, path=path).run()
+    sweep = ParameterSweep(oscillator_model, parameters, {'x': positive_final_position}, 1, 0.001, path=path)
+    assert sorted(sweep.get_errors().keys()) == failed.tolist()
+
+
+
+def test_ensemble(oscillator):
+    '''
+    This test checks the class Ensemble
+    '''
+    sys, M_qq, delta_q = oscillator
+    x = sys.get_coordinate('x')
+    k = sys.new_parameter('k', 1)
+    ensemble = Ensemble(sys, 5)
+    ensemble.set_value('k', [1, 4, 9, 16, 1])
+    ensemble.set_value('x', [1, 1, 1, 1, 1e12])
+    ensemble.dynamics(M_qq, Matrix([-k * x], shape=[1, 1]))
+    assert ensemble.get_value('k') == pytest.approx([1, 4, 9, 16, 1])
+
+    # Batched evaluation of numeric functions
+    func = ensemble.compile_numeric_function(Matrix([k * x], shape=[1, 1]))
+    assert func.evaluate().shape == (1, 1, 5)
+    assert func.evaluate()[0, 0, :4] == pytest.approx([1, 4, 9, 16])
+
+    t, q, dq = ensemble.run(1, 0.001, sample_interval=0.01)
+    assert t.shape == (101,) and q.shape == (101, 5, 1)
+    assert q[-1, :4, 0] == pytest.approx(np.cos(np.sqrt([1, 4, 9, 16])), abs=1e-6)
+
+    # The last member diverged (its state is frozen)
+    assert list(ensemble.get_active_mask()) == [True] * 4 + [False]
+    assert ensemble.get_num_active() == 4
+    assert q[-1, 4, 0] == pytest.approx(1e12)
+
+    with pytest.raises(TypeError):
+        ensemble.set_integration_method('bdf2')
+
+
+
+def test_inverse_dynamics(oscillator):
+    '''
+    This test checks the class InverseDynamicsSolver
+    '''
+    sys, M_qq, delta_q = oscillator
+    x, ddx = sys.get_coordinate('x'), sys.get_acceleration('ddx')
+    k = sys.new_parameter('k', 2)
+    F, lambda1 = sys.new_input('F'), sys.new_joint_unknown('lambda1')
+    equations = Matrix([ddx + k * x - F, lambda1 - x * sys.get_time()], shape=[2, 1])
+
+    assert InverseDynamicsSolver(sys, equations).get_num_threads() == 1
+    solver = InverseDynamicsSolver(sys, equations, chunk=64, num_threads=4)
+    assert solver.get_unknowns_names() == ('F', 'lambda1')
+
+    # x = cos(t) requires F = cos(t) & lambda1 = t * cos(t)
+    t = np.linspace(0, 10, 1000)
+    q, ddq = np.cos(t).reshape(-1, 1), -np.cos(t).reshape(-1, 1)
+    u = solver.solve(q, -np.sin(t).reshape(-1, 1), ddq, t)
+    assert u.shape == (1000, 2)
+    assert u[:, 0] == pytest.approx(np.cos(t))
+    assert u[:, 1] == pytest.approx(t * np.cos(t))
+
+    # The current values of the parameters are used on each call
+    sys.set_value('k', 3)
+    u = solver.solve(q, -np.sin(t).reshape(-1, 1), ddq, t)
+    assert u[:, 0] == pytest.approx(2 * np.cos(t))
+    assert u[:, 1] == pytest.approx(t * np.cos(t))
+
+    with pytest.raises(ValueError):
+        solver.solve(q, q, ddq[:-1], t)
+
+
+
+def test_linearize(oscillator):
+    '''
+    This test checks the functions linearize and linearize_trajectory
+    '''
+    sys, M_qq, delta_q = oscillator
+    x, dx = sys.get_coordinate('x'), sys.get_velocity('dx')
+    k, F = sys.new_parameter('k', 4), sys.new_input('F', 0)
+    M_qq = Matrix([1 + x ** 2], shape=[1, 1])
+    delta_q = Matrix([-k * x - dx + F], shape=[1, 1])
+    outputs = Matrix([x * dx], shape=[1, 1])
+
+    # ddx = (-k * x - dx + F) / (1 + x ** 2)
+    A, B, C, D = linearize(sys, (M_qq, delta_q), at={'x': 0, 'dx': 2}, outputs=outputs)
+    assert A == pytest.approx(np.array([[0, 1], [-4, -1]]))
+    assert B == pytest.approx(np.array([[0], [1]]))
+    assert C == pytest.approx(np.array([[2, 0]]))
+    assert D == pytest.approx(np.array([[0]]))
+
+    # The mass matrix depends only on the coordinates
+    linearizer = Linearizer(sys, (M_qq, delta_q))
+    assert linearizer.get_numeric_columns() == ('coordinate',)
+
+    q = np.linspace(-1, 1, 500).reshape(-1, 1)
+    A, B = linearizer.linearize_trajectory(q, np.zeros_like(q))
+    assert A.shape == (500, 2, 2) and B.shape == (500, 2, 1)
+    x = q[:, 0]
+    assert A[:, 1, 0] == pytest.approx(-4 / (1 + x ** 2) + 8 * x ** 2 / (1 + x ** 2) ** 2, abs=1e-6)
+    assert B[:, 1, 0] == pytest.approx(1 / (1 + x ** 2))
+
+
+
+def test_equilibrium(oscillator):
+    '''
+    This test checks the class EquilibriumSolver and the function solve_equilibrium
+    '''
+    sys, M_qq, delta_q = oscillator
+    x, y = sys.get_coordinate('x'), sys.new_coordinate('y', 0)[0]
+    k, F = sys.new_parameter('k', 3), sys.new_input('F', 0.5)
+    sys.new_joint_unknown('lambda1')
+    delta_q = Matrix([-k * x, -y + F], shape=[2, 1])
+    Phi = Matrix([x + y - 1], shape=[1, 1])
+
+    # -k * x = lambda1, -y + F = lambda1, x + y = 1
+    solve_equilibrium(sys, delta_q, Phi)
+    assert sys.get_coords_values()[:, 0] == pytest.approx([0.125, 0.875])
+    assert sys.get_joint_unknowns_values()[:, 0] == pytest.approx([-0.375])
+
+    # The initial guess of the coordinates can be specified
+    sys.set_value('F', 1.5)
+    solve_equilibrium(sys, delta_q, Phi, q=[1, 0])
+    assert sys.get_coords_values()[:, 0] == pytest.approx([-0.125, 1.125])
+    sys.set_value('F', 0.5)
+
+    # Many load cases at once
+    solver = EquilibriumSolver(sys, Matrix([-k * x - x ** 3, -y + F], shape=[2, 1]), Phi)
+    forces = np.linspace(-1, 1, 50)
+    q, lambdas, converged = solver.solve_batch({'F': forces}, q=[0, 0])
+    assert q.shape == (50, 2) and lambdas.shape == (50, 1) and converged.all()
+    assert 3 * q[:, 0] + q[:, 0] ** 3 == pytest.approx(q[:, 1] - forces)
+    assert q.sum(axis=1) == pytest.approx(np.ones(50))
+
+    # The current values of the symbols of the system are used on each call
+    sys.set_value('k', 1)
+    q, lambdas, converged = solver.solve_batch({'F': forces}, q=[0, 0])
+    assert converged.all()
+    assert q[:, 0] + q[:, 0] ** 3 == pytest.approx(q[:, 1] - forces)
+
+
+
+def test_event_functions(oscillator):
+    '''
+    This test checks the zero crossings of the event functions of the simulation engine
+    '''
+    sys, M_qq, delta_q = oscillator
+    x, dx = sys.get_coordinate('x'), sys.get_velocity('dx')
+    engine = SimulationEngine(sys)
+    engine.set_integration_method('rk4')
+    engine.dynamics(M_qq, delta_q)
+
+    # x = cos(t) crosses zero at t = pi/2 (decreasing) and t = 3pi/2 (increasing)
+    events = []
+    engine.add_event_function('x', x, handler=events.append)
+    engine.add_event_function('dx', dx, direction=1)
+    engine.add_event_function('end', sys.get_time() - 5, terminal=True)
+    assert engine.get_event_functions_names() == ['x', 'dx', 'end']
+    with pytest.raises(ValueError):
+        engine.add_event_function('x', x)
+
+    engine.init()
+    trajectory = engine.run(10, 0.1)
+    assert [event.get_time() for event in events] == pytest.approx([np.pi / 2, 3 * np.pi / 2], abs=1e-6)
+    assert [event.get_direction() for event in events] == [-1, 1]
+    assert [event.get_name() for event in engine.get_events()] == ['x', 'dx', 'x', 'end']
+    assert engine.get_events()[1].get_time() == pytest.approx(np.pi, abs=1e-6)
+
+    # The terminal event stopped the simulation
+    assert trajectory.time[-1] == pytest.approx(5)
+    assert trajectory.get_num_samples() == 51
+
+    engine.remove_event_function('end')
+    with pytest.raises(IndexError):
+        engine.remove_event_function('end')
+
+
+
+def test_simulation_worker(oscillator):
+    '''
+    This test checks the class SimulationWorker
+    '''
+    sys = oscillator[0]
+    for mode in ('thread', 'process'):
+        sys.get_coords_values()[:] = 1
+        sys.get_velocities_values()[:] = 0
+        sys.get_time().set_value(0)
+        worker = SimulationWorker(sys, stopped_oscillator_model, 0.001, mode=mode, real_time=False)
+        worker.start()
+        with pytest.raises(RuntimeError):
+            worker.start()
+        assert worker.join(30)
+        assert not worker.is_alive() and worker.get_error() is None
+
+        # The last snapshot is the state at the terminal event
+        assert worker.update_system()
+        assert not worker.update_system()
+        assert sys.get_time().get_value() == pytest.approx(1)
+        assert sys.get_value('x') == pytest.approx(cos(1), abs=1e-6)
+        assert sys.get_value('dx') == pytest.approx(-sin(1), abs=1e-6)
+        assert worker.get_num_snapshots() == pytest.approx(1001, abs=1)
+        worker.stop()
+
+    # Errors raised by the model are reported
+    worker = SimulationWorker(sys, lambda system: None, 0.001, mode='thread')
+    worker.start()
+    assert worker.join(30)
+    assert 'SimulationEngine' in worker.get_error()
+    worker.stop()
+
+
+
+def test_real_time_scheduler():
+    '''
+    This test checks the class RealTimeScheduler
+    '''
+    times = iter(np.array([0, 0.001, 0.1005, 0.12, 0.35, 0.45]) * 1e9)
+    scheduler = RealTimeScheduler(0.1, policy='slow_down', max_substeps=8, clock=lambda: int(next(times)))
+    scheduler.start()
+
+    # The first update only sets the deadlines
+    assert scheduler.begin_update() == 0
+    assert scheduler.get_num_substeps(0.01) == 0
+    scheduler.end_update(0)
+
+    # The time left is discarded (slow down)
+    assert scheduler.begin_update() == pytest.approx(0.1005)
+    assert scheduler.get_num_substeps(0.01) == 8
+    assert scheduler.get_accumulated_time() == 0
+    scheduler.end_update(0.08)
+    assert scheduler.get_num_overruns() == 0 and scheduler.get_num_missed_deadlines() == 0
+
+    # One deadline missed and the update finishes after the next one
+    scheduler.set_policy('skip_frames')
+    assert scheduler.begin_update() == pytest.approx(0.2495)
+    assert scheduler.get_num_substeps(0.01) == 24
+    scheduler.end_update(0.24)
+    assert scheduler.get_num_missed_deadlines() == 1
+    assert scheduler.get_num_overruns() == 1
+    assert scheduler.get_num_updates() == 3
+
+    assert scheduler.get_real_time_factor() == pytest.approx(0.32 / 0.35)
+    counts, edges = scheduler.get_latency_histogram()
+    assert counts.sum() == 2 and edges.shape == (51,)
+    assert scheduler.get_statistics()['max_latency'] == pytest.approx(0.15)
+
+    with pytest.raises(ValueError):
+        scheduler.set_policy('wait')
+
+
+
+def test_checkpoints(tmp_path):
+    '''
+    This test checks the checkpoints of the simulation engine
+    '''
+    def create_engine():
+        sys = System()
+        engine = oscillator_model(sys)
+        engine.set_integration_method('dopri5')
+        recorder = Recorder(sys, capacity=1000)
+        recorder.add_probe('x', sys.get_coordinate('x'))
+        engine.add_recorder(recorder)
+        engine.add_event_function('x', sys.get_coordinate('x'))
+        engine.init()
+        return sys, engine, recorder
+
+    path = str(tmp_path / 'checkpoints')
+    sys, engine, recorder = create_engine()
+    engine.enable_checkpoints(path, 0.5, keep=2)
+    engine.run(3, 0.01)
+    filenames = engine.get_checkpointer().get_filenames()
+    assert len(filenames) == 2 and latest_checkpoint(path) == filenames[-1]
+
+    # Resume the simulation from the checkpoint at t = 2.5 in another system
+    other_sys, other_engine, other_recorder = create_engine()
+    assert other_engine.load_checkpoint(filenames[0]) == pytest.approx(2.5)
+    assert [event.get_name() for event in other_engine.get_events()] == ['x']
+    other_engine.run(3, 0.01)
+    assert other_sys.get_value('x') == pytest.approx(sys.get_value('x'), abs=1e-12)
+    assert other_sys.get_value('dx') == pytest.approx(sys.get_value('dx'), abs=1e-12)
+    assert other_recorder.get_num_samples() == recorder.get_num_samples()
+    assert other_recorder.get_probe_values('x') == pytest.approx(recorder.get_probe_values('x'))
+
+
+
+def test_checkpoints_trajectory_writer(tmp_path):
+    '''
+    This test checks that the simulations recorded with a trajectory writer can be resumed
+    from a checkpoint
+    '''
+    def create_engine(path, append=False):
+        sys = System()
+        engine = oscillator_model(sys)
+        writer = TrajectoryWriter(sys, path, chunk=64, symbol_types=('coordinate',), append=append)
+        engine.add_recorder(writer)
+        engine.init()
+        return sys, engine, writer
+
+    # Reference trajectory (without interruptions)
+    sys, engine, writer = create_engine(str(tmp_path / 'reference'))
+    engine.run(3, 0.01)
+    writer.close()
+    reader = TrajectoryReader(str(tmp_path / 'reference'), mmap=False)
+    expected_time, expected_x = reader.get_time_values(), reader.get_values('x')
+
+    # Rewind the simulation to a checkpoint in the same process
+    path, checkpoints = str(tmp_path / 'trajectory'), str(tmp_path / 'checkpoints')
+    sys, engine, writer = create_engine(path)
+    engine.enable_checkpoints(checkpoints, 0.5, keep=10)
+    engine.run(3, 0.01)
+    filenames = engine.get_checkpointer().get_filenames()
+    assert engine.load_checkpoint(filenames[2]) == pytest.approx(1.5)
+    assert TrajectoryReader(path).get_num_samples() == 150
+    engine.run(3, 0.01)
+    writer.close()
+
+    reader = TrajectoryReader(path, mmap=False)
+    assert reader.is_complete()
+    assert reader.get_time_values() == pytest.approx(expected_time)
+    assert reader.get_values('x') == pytest.approx(expected_x)
+
+    # Resume the simulation in another system (e.g. after a crash)
+    other_sys, other_engine, other_writer = create_engine(path, append=True)
+    assert other_engine.load_checkpoint(filenames[1]) == pytest.approx(1)
+    assert not TrajectoryReader(path).is_complete()
+    other_engine.run(3, 0.01)
+    other_writer.close()
+
+    reader = TrajectoryReader(path, mmap=False)
+    assert reader.is_complete()
+    assert reader.get_num_samples() == expected_time.shape[0]
+    assert (np.diff(reader.get_time_values()) > 0).all()
+    assert reader.get_time_values() == pytest.approx(expected_time)
+    assert reader.get_values('x') == pytest.approx(expected_x)
+
+
+
+def test_input_schedules(oscillator):
+    '''
+    This test checks the input schedules of the simulation engine
+    '''
+    sys, M_qq, delta_q = oscillator
+    x = sys.get_coordinate('x')
+    F = sys.new_input('F', 0)
+    engine = SimulationEngine(sys)
+    engine.set_integration_method('rk4')
+    engine.dynamics(M_qq, Matrix([-x + F], shape=[1, 1]))
+
+    # ddx = -x + t, x(0) = 1, dx(0) = 0  ->  x = t + cos(t) - sin(t)
+    events = []
+    sys.add_event_handler(lambda *args, **kwargs: events.append(args), 'symbol_value_changed')
+    engine.add_input_schedule('F', [0, 10], [0, 10])
+    assert engine.get_input_schedules_names() == ['F']
+    engine.init()
+    trajectory = engine.run(2, 0.01, probes={'F': F})
+    assert final_position(trajectory) == pytest.approx(2 + cos(2) - sin(2), abs=1e-8)
+    assert trajectory.get_values('F')[:, 0] == pytest.approx(trajectory.time)
+    assert not events
+
+    # The same force as a piecewise polynomial
+    sys.set_value(sys.get_time(), 0)
+    sys.set_value('x', 1)
+    sys.set_value('dx', 0)
+    engine.add_input_polynomial('F', [0, 10], [[1, 0]])
+    engine.init()
+    engine.run(2, 0.01)
+    assert sys.get_value('x') == pytest.approx(2 + cos(2) - sin(2), abs=1e-8)
+
+    # The values are held out of the time range of the series
+    schedules = InputSchedules(sys)
+    schedules.add_time_series('F', [0, 1, 2], [0, 2, 1], interpolation='previous')
+    assert [schedules.evaluate(t)[0] for t in (-1, 0.5, 1.5, 3)] == pytest.approx([0, 0, 2, 1])
+    schedules.add_time_series('F', [0, 1, 2], [0, 2, 1])
+    assert [schedules.evaluate(t)[0] for t in (-1, 0.5, 1.5, 3)] == pytest.approx([0, 1, 1.5, 1])
+    with pytest.raises(IndexError):
+        schedules.add_time_series('G', [0, 1], [0, 1])
+
+    engine.remove_input_schedule('F')
+    with pytest.raises(IndexError):
+        engine.remove_input_schedule('F')
+
+
+
+def test_cosimulation(oscillator):
+    '''
+    This test checks the classes CoSimulationServer and CoSimulationClient
+    '''
+    from threading import Thread
+    sys, M_qq, delta_q = oscillator
+    x, dx = sys.get_coordinate('x'), sys.get_velocity('dx')
+    F = sys.new_input('F', 0)
+    engine = SimulationEngine(sys)
+    engine.set_integration_method('rk4')
+    engine.dynamics(M_qq, Matrix([-x + F], shape=[1, 1]))
+    engine.init()
+
+    server = CoSimulationServer(engine, ['F'], {'x': x, 'dx': dx})
+    assert server.get_outputs() == pytest.approx([1, 0])
+    thread = Thread(target=server.serve, kwargs={'timeout': 30})
+    thread.start()
+    client = CoSimulationClient(server.get_name(), timeout=30)
+    inputs, outputs = client.get_inputs(), client.get_outputs()
+
+    # Damped oscillator: the damping force is computed by the client
+    t = 0.0
+    for k in range(0, 500):
+        inputs[0] = -2 * outputs[1]
+        assert client.do_step(t, 0.002)
+        t = client.get_time()
+    assert t == pytest.approx(1)
+    # ddx + 2 * dx + x = 0  ->  x = (1 + t) * exp(-t)
+    assert outputs[0] == pytest.approx(2 * np.exp(-1), abs=1e-5)
+    assert server.get_num_steps() == 500
+
+    # The communication point must match the time of the simulation (the invalid steps
+    # are rejected, but the server keeps serving)
+    with pytest.raises(ValueError):
+        client.do_step(5, 0.002)
+    with pytest.raises(ValueError):
+        client.do_step(t, 0)
+    assert thread.is_alive()
+    assert client.do_step(t, 0.002)
+    assert client.get_time() == pytest.approx(1.002)
+    assert server.get_num_steps() == 501
+
+    client.stop()
+    thread.join(30)
+    assert not thread.is_alive()
+    client.close()
+    server.close()
+
+
+
+def test_simulate_async(oscillator):
+    '''
+    This test checks the method simulate_async of the system and the class AsyncSimulation
+    '''
+    import asyncio
+    sys, M_qq, delta_q = oscillator
+    engine = sys.get_simulation_engine()
+    engine.set_integration_method('rk4')
+    engine.dynamics(M_qq, delta_q)
+
+    async def simulate():
+        # Other tasks keep running while the simulation is performed
+        ticks = []
+        async def ticker():
+            while True:
+                ticks.append(None)
+                await asyncio.sleep(0)
+        task = asyncio.create_task(ticker())
+
+        times = []
+        simulation = sys.simulate_async(10, 0.01, chunk=100)
+        async for samples in simulation:
+            times.append(samples.time[-1])
+        assert simulation.is_finished() and not simulation.is_cancelled()
+        assert simulation.get_num_chunks() == 11
+        assert times[-1] == pytest.approx(10)
+        assert sys.get_value('x') == pytest.approx(cos(10), abs=1e-6)
+        assert len(ticks) > 1
+
+        samples = await sys.simulate_async(1, 0.01)
+        assert final_position(samples) == pytest.approx(cos(1), abs=1e-6)
+
+        # Cancellation
+        simulation = sys.simulate_async(1000, 0.01, chunk=10)
+        async def consume():
+            async for samples in simulation:
+                await asyncio.sleep(0)
+        consumer = asyncio.create_task(consume())
+        await asyncio.sleep(0.01)
+        consumer.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await consumer
+        assert simulation.is_cancelled()
+        t = sys.get_time().get_value()
+        await asyncio.sleep(0.01)
+        assert sys.get_time().get_value() == t < 1000
+        task.cancel()
+
+    asyncio.run(simulate())
+
+
+
+def test_simulation_monitor(oscillator):
+    '''
+    This test checks the class SimulationMonitor
+    '''
+    # Energy of a solid rotating in the horizontal plane
+    sys = System()
+    theta, dtheta, ddtheta = sys.new_coordinate('theta', 0.3, 2)
+    l, m, Izz = sys.new_param('l', 2), sys.new_param('m', 3), sys.new_param('Izz', 0.5)
+    sys.new_base('B', 'xyz', 0, 0, 1, theta)
+    sys.new_vector('OG', l, 0, 0, 'B')
+    I = sys.new_tensor('I', base='B')
+    I[2, 2] = Izz
+    sys.new_solid('s', 'O', 'B', 'm', 'OG', 'I')
+    monitor = SimulationMonitor(sys, Phi=Matrix([theta - 0.3], shape=[1, 1]), dPhi=Matrix([dtheta], shape=[1, 1]))
+    assert monitor.get_names() == ['kinetic_energy', 'potential_energy', 'energy', 'energy_drift', 'Phi_norm', 'dPhi_norm']
+    monitor.update()
+    assert monitor.get_value('kinetic_energy') == pytest.approx(3 * 2 ** 2 * 2 ** 2 / 2 + 0.5 * 2 ** 2 / 2)
+    assert monitor.get_value('potential_energy') == pytest.approx(0, abs=1e-12)
+    assert monitor.get_value('Phi_norm') == pytest.approx(0)
+    assert monitor.get_value('dPhi_norm') == pytest.approx(2)
+
+    # Energy drift of the harmonic oscillator
+    sys, M_qq, delta_q = oscillator
+    x, dx = sys.get_coordinate('x'), sys.get_velocity('dx')
+    monitor = SimulationMonitor(sys, potential_energy=x ** 2 / 2 + dx ** 2 / 2)
+    violations = []
+    monitor.set_threshold('energy_drift', 1e-3, action=lambda monitor, name, value: violations.append(name))
+    engine = SimulationEngine(sys)
+    engine.dynamics(M_qq, delta_q)
+    engine.add_monitor(monitor)
+    for method, drift in (('rk4', 1e-9), ('euler', 1e-3)):
+        sys.get_coords_values()[:] = 1
+        sys.get_velocities_values()[:] = 0
+        sys.get_time().set_value(0)
+        engine.set_integration_method(method)
+        engine.init()
+        engine.run(10, 0.01)
+        statistics = monitor.get_statistics()['energy_drift']
+        assert monitor.get_num_updates() == 1001
+        assert monitor.get_initial_energy() == pytest.approx(0.5)
+        assert (statistics['max'] < drift) == (method == 'rk4')
+        assert (statistics['num_violations'] > 0) == (method == 'euler')
+    assert violations and set(violations) == {'energy_drift'}
+
+    monitor.set_threshold('energy_drift', 1e-6, action='raise')
+    with pytest.raises(RuntimeError):
+        engine.step(0.01)
+    with pytest.raises(IndexError):
+        monitor.set_threshold('foo', 1)
+
+
+
+def test_kinematics():
+    '''
+    This test checks the kinematic mode of the simulation engine
+    '''
+    from lib3d_mec_ginac import sin as sym_sin, cos as sym_cos
+    sys = System()
+    theta, dtheta, ddtheta = sys.new_coordinate('theta', 0)
+    x, dx, ddx = sys.new_coordinate('x', 1.5)
+    t = sys.get_time()
+
+    # x = 2 * cos(theta), theta = 3 * t
+    Phi = Matrix([x - 2 * sym_cos(theta)], shape=[1, 1])
+    Phi_q = Matrix([2 * sym_sin(theta), 1], shape=[1, 2])
+    beta = Matrix([0], shape=[1, 1])
+    gamma = Matrix([-2 * sym_cos(theta) * dtheta ** 2], shape=[1, 1])
+    engine = SimulationEngine(sys)
+    solver = engine.kinematics(Phi, Phi_q, beta, gamma, drivers={'theta': 3 * t})
+    assert engine.is_kinematic() and engine.get_kinematic_problem_solver() is solver
+    assert solver.get_driven_coordinates() == ['theta']
+    assert solver.get_dependent_coordinates() == ['x']
+
+    engine.init()
+    assert sys.get_value('x') == pytest.approx(2)
+    trajectory = engine.run(1, 0.01)
+    time = trajectory.time
+    assert trajectory.get_values('theta') == pytest.approx(3 * time)
+    assert trajectory.get_values('x') == pytest.approx(2 * np.cos(3 * time), abs=1e-9)
+    assert trajectory.get_values('dx') == pytest.approx(-6 * np.sin(3 * time), abs=1e-9)
+    assert trajectory.get_values('ddx') == pytest.approx(-18 * np.cos(3 * time), abs=1e-9)
+
+    # The event functions are located over the exact solution
+    sys.get_time().set_value(0)
+    engine.add_event_function('x', x, direction=-1, terminal=True)
+    engine.init()
+    engine.run(1, 0.1)
+    assert sys.get_time().get_value() == pytest.approx(np.pi / 6, abs=1e-9)
+
+    with pytest.raises(IndexError):
+        KinematicProblemSolver(sys, Phi, Phi_q, beta, gamma, drivers={'y': 3 * t})
+    engine.kinematics(None)
+    assert not engine.is_kinematic()
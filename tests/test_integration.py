@@ -0,0 +1,173 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: Unitary test for the integration methods
+'''
+
+
+######## Imports ########
+
+from lib3d_mec_ginac import *
+import pytest
+import numpy as np
+from math import cos, sin
+
+
+
+######## Helper functions ########
+
+def harmonic_oscillator(t, y, dy):
+    # Derivative of the state vector of the system ddq = -q
+    dy[0], dy[1] = y[1], -y[0]
+
+
+def integrate(integrator, delta_t, t_end=10):
+    # Integrate the harmonic oscillator with the initial state q = 1, dq = 0
+    # and return the absolute error at the end of the simulation
+    integrator.set_derivative(harmonic_oscillator)
+    y, t = np.array([[1.0], [0.0]]), 0.0
+    for i in range(0, round(t_end / delta_t)):
+        integrator.step(t, y, delta_t)
+        t += delta_t
+    return abs(y[0, 0] - cos(t_end)) + abs(y[1, 0] + sin(t_end))
+
+
+
+######## Tests ########
+
+
+def test_get_method():
+    '''
+    This test checks the method ``get_method`` of the class NumericIntegration
+    '''
+    assert NumericIntegration.get_method('euler') == NumericIntegration.euler
+    assert isinstance(NumericIntegration.get_method('rk4'), RungeKutta4)
+    assert isinstance(NumericIntegration.get_method('RK4'), Integrator)
+
+    with pytest.raises(IndexError):
+        NumericIntegration.get_method('foo')
+
+    with pytest.raises(TypeError):
+        NumericIntegration.get_method(1)
+
+
+
+def test_integrator_without_derivative():
+    '''
+    This test checks that integrators raise an exception if the derivative callback was not set
+    '''
+    with pytest.raises(RuntimeError):
+        RungeKutta4().step(0, np.zeros((2, 1)), 0.1)
+
+    with pytest.raises(TypeError):
+        RungeKutta4().set_derivative(1)
+
+
+
+def test_rk4():
+    '''
+    This test checks the order of accuracy of the Runge Kutta 4 integrator
+    '''
+    error1, error2 = integrate(RungeKutta4(), 0.1), integrate(RungeKutta4(), 0.05)
+    assert error1 < 1e-4
+    assert error1 / error2 == pytest.approx(2 ** 4, rel=0.2)
+
+
+
+def test_dopri5():
+    '''
+    This test checks the Dormand Prince integrator with adaptive step size
+    '''
+    assert isinstance(NumericIntegration.get_method('dopri5', rtol=1e-8), DormandPrince)
+    with pytest.raises(TypeError):
+        NumericIntegration.get_method('euler', rtol=1e-8)
+    with pytest.raises(TypeError):
+        DormandPrince(rtol=-1)
+
+    # The error decreases with the tolerances
+    errors = [integrate(DormandPrince(rtol=tol, atol=tol), 1 / 30) for tol in (1e-4, 1e-6, 1e-9)]
+    assert errors[0] > errors[1] > errors[2] and errors[2] < 1e-7
+
+    # Internal steps are larger than the output time interval on smooth problems
+    integrator = DormandPrince(rtol=1e-6, atol=1e-9)
+    integrate(integrator, 1 / 30)
+    assert integrator.get_num_steps() < 300
+    assert integrator.get_num_evaluations() < 4 * 300
+
+    # The dense output matches the state at the end of the last internal step
+    integrator = DormandPrince(harmonic_oscillator)
+    y = np.array([[1.0], [0.0]])
+    integrator.step(0, y, 0.5)
+    out = np.zeros((2, 1))
+    integrator.interpolate(0.5, out)
+    assert out == pytest.approx(y)
+    with pytest.raises(ValueError):
+        integrator.interpolate(100, out)
+
+
+
+def test_implicit_integrators():
+    '''
+    This test checks the order of accuracy of the implicit integrators BDF2 and
+    generalized-alpha and their stability on stiff problems
+    '''
+    assert isinstance(NumericIntegration.get_method('bdf2'), BDF2)
+    assert isinstance(NumericIntegration.get_method('generalized_alpha', rho_inf=0.8), GeneralizedAlpha)
+
+    def jacobian(t, y, J):
+        J[:] = [[0, 1], [-1, 0]]
+
+    for cls in (BDF2, GeneralizedAlpha):
+        # Second order of accuracy with and without the analytic jacobian
+        error1, error2 = integrate(cls(), 0.02), integrate(cls(), 0.01)
+        assert error1 / error2 == pytest.approx(2 ** 2, rel=0.2)
+        assert integrate(cls(jacobian=jacobian), 0.01) == pytest.approx(error2)
+
+        # The factorization is reused between steps when the convergence is good
+        integrator = cls(jacobian=jacobian)
+        integrate(integrator, 0.01)
+        assert integrator.get_num_jacobian_evaluations() == 1
+        assert integrator.get_num_factorizations() < 5
+
+        # Stiff problem: ddq = -k * (q - cos(t)) - c * dq with large k
+        def stiff(t, y, dy):
+            dy[0], dy[1] = y[1], -1e6 * (y[0] - cos(t)) - 10 * y[1]
+        integrator = cls(stiff)
+        y, t = np.array([[1.0], [0.0]]), 0.0
+        for i in range(0, 1000):
+            integrator.step(t, y, 0.01)
+            t += 0.01
+        assert y[0, 0] == pytest.approx(cos(t), abs=1e-3)
+
+
+
+def test_abm():
+    '''
+    This test checks the Adams-Bashforth-Moulton integrator and its history of derivatives
+    '''
+    assert isinstance(NumericIntegration.get_method('abm', max_order=3), AdamsBashforthMoulton)
+    with pytest.raises(TypeError):
+        AdamsBashforthMoulton(max_order=6)
+
+    # Order of accuracy & number of evaluations of the derivative per step
+    for max_order in (2, 4):
+        error1, error2 = integrate(AdamsBashforthMoulton(max_order=max_order), 0.02), \
+            integrate(AdamsBashforthMoulton(max_order=max_order), 0.01)
+        assert error1 / error2 == pytest.approx(2 ** max_order, rel=0.2)
+    integrator = AdamsBashforthMoulton()
+    integrate(integrator, 0.01)
+    assert integrator.get_order() == 4
+    assert integrator.get_num_evaluations() < 2 * 1000 + 10
+
+    # Small corrections of the state keep the history, large ones discard it
+    y = np.array([[1.0], [0.0]])
+    for i in range(0, 10):
+        integrator.step(i * 0.01, y, 0.01)
+    y[0, 0] += 1e-14
+    integrator.step(0.1, y, 0.01)
+    assert integrator.get_order() == 4
+    y[0, 0] += 0.1
+    integrator.step(0.11, y, 0.01)
+    assert integrator.get_order() == 0
+
+    integrator.reset()
+    assert integrator.get_order() == 0
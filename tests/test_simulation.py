@@ -0,0 +1,283 @@
+'''
+Author: Víctor Ruiz Gómez
+Description: Unitary test for the classes of the graphical environment which advance the
+time of the scene (driven manually, without opening the viewer)
+'''
+
+
+######## Imports ########
+
+from lib3d_mec_ginac import *
+import pytest
+import numpy as np
+from math import cos
+from time import perf_counter, sleep
+
+# These tests require the graphical environment to be installed
+pytest.importorskip('vtk')
+from lib3d_mec_ginac.drawing.playback import Playback
+from lib3d_mec_ginac.drawing.simulation import Simulation
+
+
+
+######## Fixtures ########
+
+@pytest.fixture
+def oscillator():
+    '''
+    This fixture creates a system with one coordinate x whose simulation engine solves the
+    dynamic problem of a harmonic oscillator ( ddx = -x ) with the initial state x = 1, dx = 0
+    '''
+    sys = System()
+    x, dx, ddx = sys.new_coordinate('x', 1, 0, 0)
+    engine = sys.get_simulation_engine()
+    engine.set_integration_method('rk4')
+    engine.dynamics(Matrix([1], shape=[1, 1]), Matrix([-x], shape=[1, 1]))
+    return sys, engine
+
+
+
+@pytest.fixture
+def simulation(oscillator):
+    '''
+    This fixture creates a simulation of the harmonic oscillator with a fixed delta time of 0.01
+    and at most 4 substeps per update (the updates are driven manually)
+    '''
+    sys, engine = oscillator
+    simulation = Simulation(None, sys)
+    simulation.set_delta_time(0.01)
+    simulation.set_max_substeps(4)
+    return simulation
+
+
+
+######## Helper functions ########
+
+def wait_samples(path, num_samples, timeout=10):
+    # Wait until the given number of samples of a trajectory is written to disk
+    deadline = perf_counter() + timeout
+    while TrajectoryReader(path).get_num_samples() < num_samples:
+        assert perf_counter() < deadline
+        sleep(0.01)
+
+
+
+######## Tests ########
+
+def test_simulation_fixed_step(oscillator, simulation):
+    '''
+    This test checks that the real time elapsed between the updates of the class Simulation
+    is accumulated and integrated in substeps of the delta time
+    '''
+    sys, engine = oscillator
+    simulation.start()
+    scheduler = simulation.get_scheduler()
+
+    # The time left is carried over to the next updates
+    simulation._update(0.035)
+    assert simulation.get_num_substeps() == 3
+    assert sys.get_value(sys.get_time()) == pytest.approx(0.03)
+    assert simulation.get_accumulated_time() == pytest.approx(0.005)
+    simulation._update(0.035)
+    assert simulation.get_num_substeps() == 4
+    assert sys.get_value(sys.get_time()) == pytest.approx(0.07)
+    assert simulation.get_accumulated_time() == pytest.approx(0, abs=1e-12)
+    simulation._update(0.004)
+    assert simulation.get_num_substeps() == 0
+    assert sys.get_value(sys.get_time()) == pytest.approx(0.07)
+    assert simulation.get_accumulated_time() == pytest.approx(0.004)
+
+    assert sys.get_value('x') == pytest.approx(cos(0.07), abs=1e-6)
+    assert scheduler.get_num_updates() == 3
+    assert scheduler.get_elapsed_time() == pytest.approx(0.074)
+    assert scheduler.get_simulated_time() == pytest.approx(0.07)
+    simulation.stop()
+
+
+
+def test_simulation_slowdown_policies(oscillator, simulation):
+    '''
+    This test checks the slowdown policies of the class Simulation when more than max_substeps
+    substeps are needed in a single update
+    '''
+    sys, engine = oscillator
+
+    # slow_down: The time left is discarded
+    simulation.set_slowdown_policy('slow_down')
+    simulation.start()
+    simulation._update(0.1)
+    assert simulation.get_num_substeps() == 4
+    assert sys.get_value(sys.get_time()) == pytest.approx(0.04)
+    assert simulation.get_accumulated_time() == 0
+    simulation._update(0.015)
+    assert simulation.get_num_substeps() == 1
+    assert sys.get_value(sys.get_time()) == pytest.approx(0.05)
+    assert simulation.get_accumulated_time() == pytest.approx(0.005)
+    assert simulation.get_scheduler().get_real_time_factor() == pytest.approx(0.05 / 0.115)
+    simulation.stop()
+    assert sys.get_value(sys.get_time()) == 0
+
+    # catch_up: The time left is integrated on the next updates
+    simulation.set_slowdown_policy('catch_up')
+    simulation.start()
+    simulation._update(0.1)
+    assert simulation.get_num_substeps() == 4
+    assert sys.get_value(sys.get_time()) == pytest.approx(0.04)
+    assert simulation.get_accumulated_time() == pytest.approx(0.06)
+    simulation._update(0)
+    assert simulation.get_num_substeps() == 4
+    assert simulation.get_accumulated_time() == pytest.approx(0.02)
+    simulation._update(0.005)
+    assert simulation.get_num_substeps() == 2
+    assert sys.get_value(sys.get_time()) == pytest.approx(0.1)
+    assert simulation.get_accumulated_time() == pytest.approx(0.005)
+    assert sys.get_value('x') == pytest.approx(cos(0.1), abs=1e-6)
+    simulation.stop()
+
+    # skip_frames: All the substeps are performed in the same update
+    simulation.set_slowdown_policy('skip_frames')
+    simulation.start()
+    simulation._update(0.1)
+    assert simulation.get_num_substeps() == 10
+    assert sys.get_value(sys.get_time()) == pytest.approx(0.1)
+    assert simulation.get_accumulated_time() == pytest.approx(0, abs=1e-12)
+    simulation.stop()
+
+
+
+def test_simulation_time_limit(oscillator, simulation):
+    '''
+    This test checks the time limit of the class Simulation (looped or not)
+    '''
+    sys, engine = oscillator
+
+    # The looped simulation starts again from the initial state
+    simulation.start(time_limit=0.05, looped=True)
+    simulation._update(0.04)
+    assert sys.get_value(sys.get_time()) == pytest.approx(0.04)
+    simulation._update(0.02)
+    assert simulation.get_num_substeps() == 1
+    assert sys.get_value(sys.get_time()) == pytest.approx(0)
+    assert sys.get_value('x') == pytest.approx(1)
+    assert simulation.is_running()
+
+    # Otherwise, it stops when reaching the time limit
+    simulation.set_looped(False)
+    num_updates = 0
+    while simulation.is_running():
+        simulation._update(0.01)
+        num_updates += 1
+    assert num_updates == 5
+    assert simulation.is_stopped()
+    assert sys.get_value('x') == pytest.approx(1)
+    assert sys.get_value(sys.get_time()) == 0
+
+
+
+def test_playback(oscillator, tmp_path):
+    '''
+    This test checks the class Playback (the updates are driven manually)
+    '''
+    sys, engine = oscillator
+    path = str(tmp_path / 'trajectory')
+    with TrajectoryWriter(sys, path, chunk=16) as writer:
+        engine.add_recorder(writer)
+        engine.init()
+        engine.run(1, 0.01)
+    engine.remove_recorder(writer)
+    sys.set_value('x', 2)
+
+    playback = Playback(None, sys)
+    playback.start(path)
+    assert playback.is_running()
+    assert playback.get_start_time() == 0 and playback.get_end_time() == pytest.approx(1)
+    assert sys.get_value('x') == pytest.approx(1)
+
+    # Interpolation between samples
+    playback._update(0.505)
+    assert playback.get_time() == pytest.approx(0.505)
+    assert sys.get_value('x') == pytest.approx(cos(0.505), abs=1e-4)
+    assert sys.get_value(sys.get_time()) == pytest.approx(0.505)
+    playback.set_interpolated(False)
+    playback._update(0)
+    assert sys.get_value('x') == pytest.approx(cos(0.5), abs=1e-6)
+    playback.set_interpolated(True)
+
+    # Speed (negative values replay the trajectory backwards)
+    playback.set_speed(2)
+    playback._update(0.1)
+    assert playback.get_time() == pytest.approx(0.705)
+    playback.set_speed(-1)
+    playback._update(0.2)
+    assert playback.get_time() == pytest.approx(0.505)
+
+    # Seeking
+    playback.seek(5)
+    assert playback.get_time() == pytest.approx(1)
+    playback.seek_sample(30)
+    assert playback.get_time() == pytest.approx(0.3)
+    assert sys.get_value('x') == pytest.approx(cos(0.3), abs=1e-6)
+
+    # Looping
+    playback.set_speed(1)
+    playback.set_looped(True)
+    playback.seek(0.9)
+    playback._update(0.25)
+    assert playback.get_time() == pytest.approx(0.15)
+    assert playback.is_running()
+
+    # The playback is paused at the end of the trajectory
+    playback.set_looped(False)
+    playback.seek(0.9)
+    playback._update(0.25)
+    assert playback.get_time() == pytest.approx(1)
+    assert sys.get_value('x') == pytest.approx(cos(1), abs=1e-6)
+    assert playback.is_paused()
+
+    # The numeric values are restored when the playback stops
+    playback.stop()
+    assert sys.get_value('x') == pytest.approx(2)
+    with pytest.raises(RuntimeError):
+        playback.seek(0)
+
+
+
+def test_playback_live_follow(oscillator, tmp_path):
+    '''
+    This test checks that the class Playback follows a trajectory which is still being written
+    '''
+    sys, engine = oscillator
+    path = str(tmp_path / 'trajectory')
+    writer = TrajectoryWriter(sys, path, chunk=16)
+    engine.add_recorder(writer)
+    engine.init()
+    engine.run(0.5, 0.01)
+    writer.flush()
+    wait_samples(path, 51)
+
+    playback = Playback(None, sys)
+    playback.start(path)
+    assert playback.get_end_time() == pytest.approx(0.5)
+
+    # When the playback catches up, it waits at the last frame (it is not paused)
+    playback._update(1)
+    assert playback.get_time() == pytest.approx(0.5)
+    assert playback.is_running()
+
+    # New samples are loaded as they are written
+    for k in range(0, 20):
+        engine.step(0.01)
+    writer.flush()
+    wait_samples(path, 71)
+    playback._update(0.1)
+    assert playback.get_time() == pytest.approx(0.6)
+    assert playback.get_end_time() == pytest.approx(0.7)
+    assert sys.get_value('x') == pytest.approx(cos(0.6), abs=1e-6)
+
+    # When the trajectory is complete, the playback is paused at the end
+    writer.close()
+    engine.remove_recorder(writer)
+    playback._update(1)
+    assert playback.get_time() == pytest.approx(0.7)
+    assert playback.is_paused()
+    playback.stop()